@@ -6,6 +6,7 @@ from app.engine.tools.file_writer import write_file
 from .analyst import create_analyst
 from .reporter import create_reporter
 from .researcher import create_researcher
+from app.services.cancellation import track_workflow
 from app.workflows.single import AgentRunEvent, AgentRunResult, FunctionCallingAgent
 from llama_index.core.chat_engine.types import ChatMessage
 from llama_index.core.prompts import PromptTemplate
@@ -186,7 +187,7 @@ class FinancialReportWorkflow(Workflow):
         input: str,
         streaming: bool = False,
     ) -> AgentRunResult | AsyncGenerator:
-        handler = agent.run(input=input, streaming=streaming)
+        handler = track_workflow(agent.name, agent.run(input=input, streaming=streaming))
         # bubble all events while running the executor to the planner
         async for event in handler.stream_events():
             # Don't write the StopEvent from sub task to the stream
@@ -1,11 +1,31 @@
+import asyncio
+import logging
+import os
+import time
 from textwrap import dedent
-from typing import AsyncGenerator, List, Optional
+from typing import Any, AsyncGenerator, Dict, List, Optional
 
 # Import our agent team
 from app.agents.stage_2_initial_research import create_competitor_analysis_workflow, create_customer_insights_workflow, create_online_trends_workflow, create_market_research_workflow
-from app.agents.stage_6_output_production import create_podcast_workflow, create_executive_summary_workflow
+from app.agents.stage_2_initial_research.competitor_analysis.competitor_searcher import CompetitorSearchResponse
+from app.agents.stage_2_initial_research.customer_insights.workflow import CustomerInsightsReport
+from app.agents.stage_2_initial_research.market_research.workflow import MarketAnalysis
+from app.agents.stage_2_initial_research.online_trends.workflow import WebTrendInsight
+from app.agents.stage_6_output_production import create_podcast_workflow, create_executive_summary_workflow, create_outline_drafter
 
-from app.workflows.single import AgentRunEvent, AgentRunResult
+from app.workflows.fan_in import fan_out, get_fan_in
+from app.workflows.single import AgentRunEvent, AgentRunResult, FunctionCallingAgent
+from app.workflows.stage_results import STRUCTURED_STAGE_RESULTS, file_url, stage_result, structure_output
+from app.services.budget import Budget, budget_scope, child_budget, sub_workflow_seconds
+from app.services.cancellation import track_workflow
+from app.services.checkpoints import checkpoint
+from app.services.deadline import FAST_MODE_SECONDS, RESEARCH_TIME_SHARE, Deadline, to_deadline
+from app.services.idea_cache import IDEA_CACHE_ENABLED, CachedResearch, get_idea_cache
+from app.services.process_pool import create_sub_workflow
+from app.agents.pipeline import create_pipeline_workflow
+from app.services.research_artifacts import STAGE_DEPENDENCIES, ResearchArtifacts, fingerprint, parse_refined_idea, render_idea
+from app.services.session_metrics import get_session_metrics
+from app.services.speculative_critic import SPECULATIVE_CRITIC_ENABLED
 from llama_index.core.llms import ChatMessage, ChatResponse
 from llama_index.core.workflow import (
     Context,
@@ -16,52 +36,122 @@ from llama_index.core.workflow import (
     step,
 )
 from app.settings import Settings
+from app.utils.paths import adopt_published_file, get_session_data_path
 from llama_index.core.prompts import PromptTemplate
 
+logger = logging.getLogger("uvicorn")
+
+# Run the research from a declarative pipeline spec instead (see `app.agents.pipeline`)
+RESEARCH_PIPELINE_SPEC = os.getenv("RESEARCH_PIPELINE_SPEC")
+
+# Draft the executive summary outline from each research stage as soon as it finishes, one more
+# LLM run per research stage, off by default
+PIPELINED_POST_PRODUCTION = os.getenv("PIPELINED_POST_PRODUCTION", "false").lower() == "true"
+
+# Reports written by the research stages, used to draft the outline sections
+STAGE_REPORT_FILES = {
+    "Competitor Analysis": "report.txt",
+    "Customer Insights": "customer_insights_report.txt",
+    "Online Trends": "trend_report.txt",
+    "Market Research": "market_report.txt",
+}
+
+# Report model of each research stage, streamed with its result (see app.workflows.stage_results)
+STAGE_OUTPUT_MODELS = {
+    "Competitor Analysis": CompetitorSearchResponse,
+    "Customer Insights": CustomerInsightsReport,
+    "Online Trends": WebTrendInsight,
+    "Market Research": MarketAnalysis,
+}
+
 class StartCompetitorAnalysisResearchEvent(Event):
     input: str
+    # Earlier research on a similar idea, see app.services.idea_cache
+    seed: Optional[str] = None
 
 class StartCustomerInsightsResearchEvent(Event):
     input: str
+    seed: Optional[str] = None
 
 class StartOnlineTrendsResearchEvent(Event):
     input: str
+    seed: Optional[str] = None
 
 class StartMarketResearchEvent(Event):
     input: str
+    seed: Optional[str] = None
 
 class CombineResearchResultsEvent(Event):
     input: str
+    stage: str = ""
+    # Reused from the last research run of the session
+    reused: bool = False
+
+class DraftOutlineSectionEvent(Event):
+    stage: str
+    input: str
     
 class CreatePodcastEvent(Event):
     input: str
 
 class CreateExecutiveSummaryEvent(Event):
     input: str
+    draft_outline: Optional[str] = None
 
 class CombinePostProductionResultsEvent(Event):
     pass
 
+# Start event and result key of each research stage
+RESEARCH_STAGES = {
+    "Competitor Analysis": (StartCompetitorAnalysisResearchEvent, "competitor_research_result"),
+    "Customer Insights": (StartCustomerInsightsResearchEvent, "customer_insights_result"),
+    "Online Trends": (StartOnlineTrendsResearchEvent, "online_trends_result"),
+    "Market Research": (StartMarketResearchEvent, "market_research_result"),
+}
+
 class IdeatorIncWorkflow(Workflow):
     def __init__(
         self,
         session_id: str,
         email: Optional[str] = None,
         timeout: int = 1800, 
-        initial_team_size: int = 4,
-        post_production_team_size: int = 2,
-        chat_history: Optional[List[ChatMessage]] = None
+        chat_history: Optional[List[ChatMessage]] = None,
+        pipelined: bool = False,
+        podcast: bool = True,
+        deadline: Optional[float] = None,
+        research_deadline: Optional[float] = None,
     ):
-        '''This is a very long running multi-step workflow, so we set a default timeout of 30 minutes'''
+        '''
+        This is a very long running multi-step workflow, so we set a default timeout of 30 minutes.
+        With `pipelined`, the executive summary outline is drafted from each research stage as it
+        finishes, so only the refinement of the draft waits for the slowest stage.
+        With a `deadline` (epoch seconds, see app.services.deadline), the research stages that
+        aren't done by `research_deadline` are given up, so the executive summary, which sizes its
+        own work to the deadline, gets the rest of the time.
+        Each run has a budget of the timeout, or the deadline if sooner, and the session's tokens,
+        shared by all the sub-workflows and agents it starts (see app.services.budget).
+        '''
         super().__init__(timeout=timeout)
+        self.timeout_seconds = timeout
+        self.budget: Optional[Budget] = None
         self.session_id = session_id
         self.email = email
         self.chat_history = chat_history or []
-        self.initial_team_size = initial_team_size
-        self.post_production_team_size = post_production_team_size
+        self.pipelined = pipelined
+        self.podcast = podcast
+        self.deadline = to_deadline(deadline)
+        self.research_deadline = to_deadline(research_deadline)
+        self._artifacts: Optional[ResearchArtifacts] = None
+
+    def run(self, *args: Any, **kwargs: Any) -> Any:
+        self.budget = Budget.for_run("Ideator Inc Workflow", self.session_id, seconds=self.timeout_seconds, deadline=self.deadline)
+        # The steps, and the sub-workflows they start, run in tasks created here
+        with budget_scope(self.budget):
+            return super().run(*args, **kwargs)
         
     @step()
-    async def start(self, ctx: Context, ev: StartEvent) -> StartMarketResearchEvent | StartCustomerInsightsResearchEvent | StartOnlineTrendsResearchEvent | StartCompetitorAnalysisResearchEvent:
+    @checkpoint
+    async def start(self, ctx: Context, ev: StartEvent) -> StartMarketResearchEvent | StartCustomerInsightsResearchEvent | StartOnlineTrendsResearchEvent | StartCompetitorAnalysisResearchEvent | CombineResearchResultsEvent:
         ctx.data["idea"] = ev.input
         
         ctx.write_event_to_stream(
@@ -72,18 +162,53 @@ class IdeatorIncWorkflow(Workflow):
             )
         )
         
-        ctx.send_event(StartCompetitorAnalysisResearchEvent(input=ev.input))
-        ctx.send_event(StartCustomerInsightsResearchEvent(input=ev.input))  
-        ctx.send_event(StartOnlineTrendsResearchEvent(input=ev.input))
-        ctx.send_event(StartMarketResearchEvent(input=ev.input))
+        # The research stages that failed are reported, post production goes on with the others
+        fan_out(ctx, "research stages", RESEARCH_STAGES, min_results=0)
+        refined_idea = parse_refined_idea(ev.input)
+        cached = await self.find_similar_research(ctx, render_idea(refined_idea) if refined_idea is not None else ev.input)
+        if refined_idea is None:
+            for stage, (start_event, _) in RESEARCH_STAGES.items():
+                ctx.send_event(start_event(input=ev.input, seed=cached.seed(stage) if cached is not None else None))
+            return None
+        
+        # Each stage researches the whole request, but its output is fingerprinted with only the
+        # idea fields it depends on, so editing one field recomputes the stages that depend on it
+        # and reuses the others from the last run
+        self._artifacts = ResearchArtifacts(self.session_id)
+        fingerprints: Dict[str, str] = {}
+        for stage, (start_event, result_key) in RESEARCH_STAGES.items():
+            fingerprints[stage] = fingerprint(stage, render_idea(refined_idea, STAGE_DEPENDENCIES[stage]))
+            output = self._artifacts.get(stage, fingerprints[stage])
+            if output is None:
+                ctx.send_event(start_event(input=ev.input, seed=cached.seed(stage) if cached is not None else None))
+                continue
+            ctx.data[result_key] = output
+            # The summarizer, podcaster and idea cache read the stage's report from the run's data
+            adopt_published_file(self.session_id, STAGE_REPORT_FILES[stage])
+            ctx.send_event(CombineResearchResultsEvent(input=output, stage=stage, reused=True))
+        ctx.data["artifact_fingerprints"] = fingerprints
+        ctx.data["post_production_idea"] = render_idea(refined_idea)
+        if not self._artifacts.recomputed:
+            # All the research is reused, so is its post production if the idea didn't change
+            self.set_post_production_fingerprint(ctx)
         
+        report = self._artifacts.report()
+        if report["reused"]:
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name="Ideator Inc Workflow",
+                    msg=f"Reusing {', '.join(report['reused'])} from the last run, the idea fields they depend on didn't change",
+                    workflow_name="Research Manager"
+                )
+            )
         return None
     
     ### Initial Research Analysts Team 1 ###
     @step()
+    @checkpoint
     async def competitor_research(self, ctx: Context, ev: StartCompetitorAnalysisResearchEvent, competitor_researcher: Workflow) -> CombineResearchResultsEvent:
         prompt = f"Conduct a competitor analysis session based on the following idea: {ev.input}"
-        res = await self.run_sub_workflow(ctx, competitor_researcher, prompt, workflow_name="Competitor Analysis Analyst")
+        res = await self.run_sub_workflow(ctx, competitor_researcher, prompt, workflow_name="Competitor Analysis Analyst", deadline=self.research_deadline, seed=ev.seed)
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -94,13 +219,16 @@ class IdeatorIncWorkflow(Workflow):
         )
         
         ctx.data["competitor_research_result"] = res.response.message.content
-        ctx.data["research_completed"] = ctx.data.get("research_completed", 0) + 1
-        return CombineResearchResultsEvent(input=res.response.message.content)
+        self.branch_completed(ctx, "research stages", "Competitor Analysis", res, workflow_name="Competitor Analysis Analyst")
+        self.save_artifact(ctx, "Competitor Analysis", res.response.message.content, workflow_name="Competitor Analysis Analyst")
+        await self.stream_research_result(ctx, "Competitor Analysis", res.response.message.content, workflow_name="Competitor Analysis Analyst")
+        return CombineResearchResultsEvent(input=res.response.message.content, stage="Competitor Analysis")
     
     @step()
+    @checkpoint
     async def customer_insights(self, ctx: Context, ev: StartCustomerInsightsResearchEvent, customer_insights_researcher: Workflow) -> CombineResearchResultsEvent:
         prompt = f"Conduct a customer insights session based on the following idea: {ev.input}"
-        res = await self.run_sub_workflow(ctx, customer_insights_researcher, prompt, workflow_name="Customer Insights Analyst")
+        res = await self.run_sub_workflow(ctx, customer_insights_researcher, prompt, workflow_name="Customer Insights Analyst", deadline=self.research_deadline, seed=ev.seed)
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -111,13 +239,16 @@ class IdeatorIncWorkflow(Workflow):
         )
         
         ctx.data["customer_insights_result"] = res.response.message.content
-        ctx.data["research_completed"] = ctx.data.get("research_completed", 0) + 1
-        return CombineResearchResultsEvent(input=res.response.message.content)
+        self.branch_completed(ctx, "research stages", "Customer Insights", res, workflow_name="Customer Insights Analyst")
+        self.save_artifact(ctx, "Customer Insights", res.response.message.content, workflow_name="Customer Insights Analyst")
+        await self.stream_research_result(ctx, "Customer Insights", res.response.message.content, workflow_name="Customer Insights Analyst")
+        return CombineResearchResultsEvent(input=res.response.message.content, stage="Customer Insights")
     
     @step()
+    @checkpoint
     async def online_trends(self, ctx: Context, ev: StartOnlineTrendsResearchEvent, online_trends_researcher: Workflow) -> CombineResearchResultsEvent:
         prompt = f"Conduct a online trends research session based on the following idea: {ev.input}"
-        res = await self.run_sub_workflow(ctx, online_trends_researcher, prompt, workflow_name="Online Trends Analyst")
+        res = await self.run_sub_workflow(ctx, online_trends_researcher, prompt, workflow_name="Online Trends Analyst", deadline=self.research_deadline, seed=ev.seed)
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -128,13 +259,16 @@ class IdeatorIncWorkflow(Workflow):
         )
         
         ctx.data["online_trends_result"] = res.response.message.content
-        ctx.data["research_completed"] = ctx.data.get("research_completed", 0) + 1
-        return CombineResearchResultsEvent(input=res.response.message.content)
+        self.branch_completed(ctx, "research stages", "Online Trends", res, workflow_name="Online Trends Analyst")
+        self.save_artifact(ctx, "Online Trends", res.response.message.content, workflow_name="Online Trends Analyst")
+        await self.stream_research_result(ctx, "Online Trends", res.response.message.content, workflow_name="Online Trends Analyst")
+        return CombineResearchResultsEvent(input=res.response.message.content, stage="Online Trends")
     
     @step()
+    @checkpoint
     async def market_research(self, ctx: Context, ev: StartMarketResearchEvent, market_research_researcher: Workflow) -> CombineResearchResultsEvent:
         prompt = f"Conduct a market research session based on the following idea: {ev.input}"
-        res = await self.run_sub_workflow(ctx, market_research_researcher, prompt, workflow_name="Market Research Analyst")
+        res = await self.run_sub_workflow(ctx, market_research_researcher, prompt, workflow_name="Market Research Analyst", deadline=self.research_deadline, seed=ev.seed)
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -145,22 +279,32 @@ class IdeatorIncWorkflow(Workflow):
         )
         
         ctx.data["market_research_result"] = res.response.message.content
-        ctx.data["research_completed"] = ctx.data.get("research_completed", 0) + 1
-        return CombineResearchResultsEvent(input=res.response.message.content)
+        self.branch_completed(ctx, "research stages", "Market Research", res, workflow_name="Market Research Analyst")
+        self.save_artifact(ctx, "Market Research", res.response.message.content, workflow_name="Market Research Analyst")
+        await self.stream_research_result(ctx, "Market Research", res.response.message.content, workflow_name="Market Research Analyst")
+        return CombineResearchResultsEvent(input=res.response.message.content, stage="Market Research")
 
     @step()
-    async def combine_research_results(self, ctx: Context, ev: CombineResearchResultsEvent) -> CreatePodcastEvent | CreateExecutiveSummaryEvent:
+    @checkpoint
+    async def combine_research_results(self, ctx: Context, ev: CombineResearchResultsEvent) -> CreatePodcastEvent | CreateExecutiveSummaryEvent | DraftOutlineSectionEvent | CombinePostProductionResultsEvent:
+        research = get_fan_in(ctx, "research stages")
+        if ev.reused:
+            research.arrive(ev.stage)
+            await self.stream_research_result(ctx, ev.stage, ev.input, workflow_name=f"{ev.stage} Analyst", status="reused")
     
         # Wait for all research to be completed before combining
-        research_completed = ctx.data.get("research_completed", 0)
-        if research_completed < self.initial_team_size:
+        if not research.settled:
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name="Ideator Inc Workflow",
-                    msg=f"Collected {research_completed} research results out of {self.initial_team_size}",
+                    msg=f"Collected {research.progress()}",
                     workflow_name="Research Manager"
                 )
             )
+            if self.pipelined and not self.is_artifact_current(ctx, "Executive Summary"):
+                # Start on the outline while the slower stages are still running
+                ctx.data["outline_drafts_pending"] = ctx.data.get("outline_drafts_pending", 0) + 1
+                ctx.send_event(DraftOutlineSectionEvent(stage=ev.stage, input=ev.input))
             return None
         
         ctx.write_event_to_stream(
@@ -170,12 +314,192 @@ class IdeatorIncWorkflow(Workflow):
                 workflow_name="Research Manager"
             )
         )
-        ctx.send_event(CreatePodcastEvent(input=ev.input))
-        ctx.send_event(CreateExecutiveSummaryEvent(input=ev.input))
+        metrics = get_session_metrics(self.session_id)
+        if metrics.get("fetch_requests"):
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name="Ideator Inc Workflow",
+                    msg=(
+                        f"Pages requested: {metrics.get('fetch_requests')}, fetched: {metrics.get('fetch_executed')}, "
+                        f"reused: {metrics.get('fetch_registry_hits') + metrics.get('fetch_inflight_joins')} "
+                        f"(~{metrics.get('fetch_seconds_saved'):.0f}s saved)"
+                    ),
+                    workflow_name="Research Manager"
+                )
+            )
+        await self.index_research(ctx)
+        self.set_post_production_fingerprint(ctx)
+        ctx.data["post_production_input"] = ev.input
+        self.start_post_production(ctx)
         return None
 
+    @step()
+    @checkpoint
+    async def draft_outline_section(self, ctx: Context, ev: DraftOutlineSectionEvent, outline_drafter: FunctionCallingAgent) -> CreatePodcastEvent | CreateExecutiveSummaryEvent:
+        # The drafter keeps the earlier drafts in its memory, so the sections are drafted one at a time
+        report_file = get_session_data_path(self.session_id) / STAGE_REPORT_FILES.get(ev.stage, "")
+        research = report_file.read_text() if report_file.is_file() else ev.input
+        prompt = dedent(f"""
+            The {ev.stage} research for the idea "{ctx.data["idea"]}" is done, the other research is still running.
+            Draft the outline sections this research supports and return the full draft outline,
+            including the sections from your previous drafts:
+            {research}
+        """)
+        # Under a name of its own, a failed draft doesn't fail the executive summary
+        failed_drafts = ctx.data.get("failed_workflows", []).count("Outline Drafter")
+        res = await self.run_sub_workflow(ctx, outline_drafter, prompt, workflow_name="Outline Drafter")
+
+        if ctx.data.get("failed_workflows", []).count("Outline Drafter") > failed_drafts:
+            # The summary refines the last draft that was written, or writes the outline itself
+            msg = f"Could not draft the executive summary outline from the {ev.stage} research, keeping the previous draft"
+        else:
+            ctx.data["draft_outline"] = res.response.message.content
+            msg = f"Drafted executive summary outline from the {ev.stage} research"
+        ctx.write_event_to_stream(
+            AgentRunEvent(
+                name="Ideator Inc Workflow",
+                msg=msg,
+                workflow_name="Research Manager"
+            )
+        )
+        ctx.data["outline_drafts_pending"] -= 1
+        self.start_post_production(ctx)
+        return None
+
+    def start_post_production(self, ctx: Context):
+        '''Start post production once all research is in and all outline drafts are written.'''
+        if (
+            "post_production_input" not in ctx.data
+            or ctx.data.get("outline_drafts_pending", 0) > 0
+            or ctx.data.get("post_production_started")
+        ):
+            return
+        ctx.data["post_production_started"] = True
+        input = ctx.data["post_production_input"]
+        outputs = [
+            ("Executive Summary", "executive_summary_result", CreateExecutiveSummaryEvent(input=input, draft_outline=ctx.data.get("draft_outline"))),
+        ]
+        if self.podcast:
+            outputs.insert(0, ("Podcast", "podcast_result", CreatePodcastEvent(input=input)))
+        else:
+            ctx.data["podcast_result"] = "Skipped to deliver the report by the deadline"
+        fan_out(ctx, "post production results", [name for name, _, _ in outputs], min_results=0)
+        for name, result_key, event in outputs:
+            output = self.reuse_artifact(ctx, name)
+            if output is None:
+                ctx.send_event(event)
+                continue
+            ctx.data[result_key] = output
+            get_fan_in(ctx, "post production results").arrive(name)
+            ctx.write_event_to_stream(stage_result(name, output, workflow_name="Research Manager", status="reused"))
+            ctx.send_event(CombinePostProductionResultsEvent())
+
+    def stage_status(self, ctx: Context, workflow_name: str) -> str:
+        return "failed" if workflow_name in ctx.data.get("failed_workflows", []) else "completed"
+
+    async def stream_research_result(self, ctx: Context, stage: str, output: str, workflow_name: str, status: Optional[str] = None):
+        '''Stream the result of a research stage to the client, with its report parsed into the stage's report model.'''
+        status = status or self.stage_status(ctx, workflow_name)
+        report_file = get_session_data_path(self.session_id) / STAGE_REPORT_FILES[stage]
+        structured = None
+        if STRUCTURED_STAGE_RESULTS and status != "failed":
+            try:
+                structured = await structure_output(STAGE_OUTPUT_MODELS[stage], report_file.read_text() if report_file.is_file() else output)
+            except Exception as e:
+                logger.warning(f"Could not parse the {stage} report: {e}")
+        ctx.write_event_to_stream(stage_result(stage, output, workflow_name=workflow_name, status=status, output=structured, files=[report_file]))
+
+    def branch_completed(self, ctx: Context, fan_in: str, branch: str, res: Any, workflow_name: str):
+        '''Record a research stage or post production output in its fan-in, as failed if its sub-workflow failed.'''
+        if workflow_name in ctx.data.get("failed_workflows", []):
+            get_fan_in(ctx, fan_in).fail(branch, res.response.message.content if isinstance(res, AgentRunResult) else str(res))
+        else:
+            get_fan_in(ctx, fan_in).arrive(branch)
+
+    async def find_similar_research(self, ctx: Context, idea: str) -> Optional[CachedResearch]:
+        '''Earlier research on a similar idea to seed the research stages with.'''
+        ctx.data["cache_idea"] = idea
+        if not IDEA_CACHE_ENABLED:
+            return None
+        cached = await get_idea_cache().find(idea, exclude_session_id=self.session_id)
+        if cached is None:
+            return None
+        days_ago = (time.time() - cached.created_at) / (24 * 60 * 60)
+        ctx.data["idea_cache_seed"] = f"{cached.idea} (similarity {cached.similarity:.2f}, researched {days_ago:.0f} days ago)"
+        ctx.write_event_to_stream(
+            AgentRunEvent(
+                name="Ideator Inc Workflow",
+                msg=(
+                    f"Found earlier research on a similar idea: {ctx.data['idea_cache_seed']}. "
+                    f"Reusing its searches, competitors and sources for {', '.join(cached.reports)}, "
+                    f"only researching what differs for this idea"
+                ),
+                workflow_name="Research Manager"
+            )
+        )
+        return cached
+
+    async def index_research(self, ctx: Context):
+        '''Add the research of this session to the idea cache, to seed the research of similar ideas.'''
+        if not IDEA_CACHE_ENABLED:
+            return
+        failed_workflows = ctx.data.get("failed_workflows", [])
+        reports = {}
+        for stage, file_name in STAGE_REPORT_FILES.items():
+            report_file = get_session_data_path(self.session_id) / file_name
+            if report_file.is_file() and f"{stage} Analyst" not in failed_workflows:
+                reports[stage] = report_file.read_text()
+        await get_idea_cache().add(self.session_id, ctx.data.get("cache_idea", ctx.data["idea"]), reports)
+
+    def get_artifacts(self) -> ResearchArtifacts:
+        # Not restored from checkpoints, a resumed run reports what it reuses from then on
+        if self._artifacts is None:
+            self._artifacts = ResearchArtifacts(self.session_id)
+        return self._artifacts
+
+    def set_post_production_fingerprint(self, ctx: Context):
+        '''
+        Post production is built from the whole idea and the output of every research stage, its
+        fingerprint is known once all the research is in.
+        '''
+        fingerprints = ctx.data.get("artifact_fingerprints")
+        if fingerprints is None:
+            return
+        failed_workflows = ctx.data.get("failed_workflows", [])
+        outputs = [
+            "failed" if f"{stage} Analyst" in failed_workflows else fingerprint(ctx.data.get(result_key))
+            for stage, (_, result_key) in RESEARCH_STAGES.items()
+        ]
+        fingerprints["Podcast"] = fingerprints["Executive Summary"] = fingerprint(ctx.data["post_production_idea"], outputs)
+
+    def is_artifact_current(self, ctx: Context, name: str) -> bool:
+        artifact_fingerprint = ctx.data.get("artifact_fingerprints", {}).get(name)
+        return artifact_fingerprint is not None and self.get_artifacts().is_current(name, artifact_fingerprint)
+
+    def reuse_artifact(self, ctx: Context, name: str) -> Optional[str]:
+        '''The output of `name` from the last run if its inputs didn't change.'''
+        fingerprints = ctx.data.get("artifact_fingerprints")
+        if fingerprints is None:
+            return None
+        return self.get_artifacts().get(name, fingerprints.get(name))
+
+    def save_artifact(self, ctx: Context, name: str, output: str, workflow_name: str):
+        '''
+        Keep the output of `name` for the next run, unless its sub-workflow failed. Post production
+        built while a research stage failed isn't kept, the next run redoes it with that stage.
+        '''
+        fingerprints = ctx.data.get("artifact_fingerprints")
+        failed_workflows = ctx.data.get("failed_workflows", [])
+        if fingerprints is None or name not in fingerprints or workflow_name in failed_workflows:
+            return
+        if name not in RESEARCH_STAGES and any(f"{stage} Analyst" in failed_workflows for stage in RESEARCH_STAGES):
+            return
+        depends_on = STAGE_DEPENDENCIES.get(name) or list(RESEARCH_STAGES)
+        self.get_artifacts().put(name, fingerprints[name], output, depends_on)
+
     ### Output Production ###
     @step()
+    @checkpoint
     async def podcast_generation(self, ctx: Context, ev: CreatePodcastEvent, podcast_generator: Workflow) -> CombinePostProductionResultsEvent:
         res = await self.run_sub_workflow(ctx, podcast_generator, ev.input, workflow_name="Podcaster")
         
@@ -188,12 +512,15 @@ class IdeatorIncWorkflow(Workflow):
         )
         
         ctx.data["podcast_result"] = res
-        ctx.data["post_production_completed"] = ctx.data.get("post_production_completed", 0) + 1
+        self.branch_completed(ctx, "post production results", "Podcast", res, workflow_name="Podcaster")
+        self.save_artifact(ctx, "Podcast", str(res), workflow_name="Podcaster")
+        ctx.write_event_to_stream(stage_result("Podcast", str(res), workflow_name="Podcaster", status=self.stage_status(ctx, "Podcaster")))
         return CombinePostProductionResultsEvent()
     
     @step()
+    @checkpoint
     async def executive_summary_generation(self, ctx: Context, ev: CreateExecutiveSummaryEvent, executive_summarizer: Workflow) -> CombinePostProductionResultsEvent:
-        res = await self.run_sub_workflow(ctx, executive_summarizer, ev.input, workflow_name="Executive Summarizer")
+        res = await self.run_sub_workflow(ctx, executive_summarizer, ev.input, workflow_name="Executive Summarizer", draft_outline=ev.draft_outline)
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -204,17 +531,20 @@ class IdeatorIncWorkflow(Workflow):
         )
         
         ctx.data["executive_summary_result"] = res
-        ctx.data["post_production_completed"] = ctx.data.get("post_production_completed", 0) + 1
+        self.branch_completed(ctx, "post production results", "Executive Summary", res, workflow_name="Executive Summarizer")
+        self.save_artifact(ctx, "Executive Summary", str(res), workflow_name="Executive Summarizer")
+        ctx.write_event_to_stream(stage_result("Executive Summary", str(res), workflow_name="Executive Summarizer", status=self.stage_status(ctx, "Executive Summarizer")))
         return CombinePostProductionResultsEvent()
     
     @step()
+    @checkpoint
     async def combine_post_production_results(self, ctx: Context, ev: CombinePostProductionResultsEvent) -> StopEvent:
-        post_production_completed = ctx.data.get("post_production_completed", 0)
-        if post_production_completed < self.post_production_team_size:
+        post_production = get_fan_in(ctx, "post production results")
+        if not post_production.settled:
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name="Ideator Inc Workflow",
-                    msg=f"Collected {post_production_completed} post production results out of {self.post_production_team_size}",
+                    msg=f"Collected {post_production.progress()}",
                     workflow_name="Research Manager"
                 )
             )
@@ -228,20 +558,51 @@ class IdeatorIncWorkflow(Workflow):
             )
         )
         
-        responses = f"""
-        Market Research Result: 
-        {ctx.data.get('market_research_result', "None")}
-        Customer Insights Result: 
-        {ctx.data.get('customer_insights_result', "None")}
-        Online Trends Result: 
-        {ctx.data.get('online_trends_result', "None")}
-        Competitor Analysis Result: 
-        {ctx.data.get('competitor_research_result', "None")}
+        # The research stages were streamed as they finished, their reports are repeated here
+        # with the links to their files for the clients that don't render stage results
+        data_dir = get_session_data_path(self.session_id)
+        reports = "".join(
+            f"""
+        {stage} Result: 
+        {ctx.data.get(result_key, "None")}
+        {stage} Report: {file_url(data_dir / STAGE_REPORT_FILES[stage]) if (data_dir / STAGE_REPORT_FILES[stage]).is_file() else "None"}"""
+            for stage, (_, result_key) in RESEARCH_STAGES.items()
+        )
+        responses = f"""{reports}
         Podcast Result: 
         {ctx.data.get('podcast_result', "None")}
         Executive Summary Result: 
         {ctx.data.get('executive_summary_result', "None")}
         """
+        failures = {**get_fan_in(ctx, "research stages").failures, **post_production.failures}
+        if failures:
+            responses += f"""
+        Failed: {', '.join(failures)}
+        """
+        if get_session_metrics(self.session_id).get("critic_rounds_skipped"):
+            responses += f"""
+        Critic rounds skipped for drafts scoring above the threshold: {get_session_metrics(self.session_id).get("critic_rounds_skipped"):.0f}
+        """
+        if ctx.data.get("artifact_fingerprints") is not None:
+            report = self.get_artifacts().report()
+            responses += f"""
+        Reused from the last run: {', '.join(report['reused']) or "None"}
+        Recomputed: {', '.join(report['recomputed']) or "None"}
+        """
+        if ctx.data.get("idea_cache_seed"):
+            responses += f"""
+        Seeded with the research on a similar idea: {ctx.data['idea_cache_seed']}
+        """
+        if self.deadline is not None:
+            seconds_left = self.deadline.at - time.time()
+            responses += f"""
+        Deadline: {f"met with {seconds_left:.0f}s to spare" if seconds_left >= 0 else f"missed by {-seconds_left:.0f}s"}
+        Stages given up at the deadline: {', '.join(ctx.data.get("timed_out_workflows", [])) or "None"}
+        """
+        if self.budget is not None and self.budget.max_tokens is not None:
+            responses += f"""
+        Tokens: {self.budget.used_tokens} of {self.budget.max_tokens} used
+        """
 
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -288,20 +649,43 @@ class IdeatorIncWorkflow(Workflow):
         workflow: Workflow,
         input: str,
         streaming: bool = False,
-        workflow_name: str = ""
+        workflow_name: str = "",
+        deadline: Optional[Deadline] = None,
+        **kwargs
     ) -> AgentRunResult | AsyncGenerator:
         try:
-            handler = workflow.run(input=input, streaming=streaming)
-            # bubble all events while running the executor to the planner
-            async for event in handler.stream_events():
-                # Don't write the StopEvent from sub task to the stream
-                if type(event) is not StopEvent:
-                    if isinstance(event, AgentRunEvent):
-                        event.workflow_name = workflow_name
-                    ctx.write_event_to_stream(event)
+            # The sub-workflow gets the earliest of its own timeout, its deadline and the end of the run's budget
+            with child_budget(workflow_name, seconds=sub_workflow_seconds(workflow), deadline=deadline) as budget:
+                # Sub-workflows of a resumed run continue from their own checkpoints
+                handler = track_workflow(workflow_name, workflow.run(input=input, streaming=streaming, resume=ctx.data.get("resume", False), **kwargs))
+            # The sub-workflow sizes its work to the deadline, past it the research goes on without it
+            await asyncio.wait_for(
+                self.bubble_events(ctx, handler, workflow_name),
+                timeout=budget.remaining_seconds() if budget is not None else None,
+            )
             return await handler
+        except asyncio.TimeoutError:
+            await handler.cancel_run()
+            ctx.data.setdefault("failed_workflows", []).append(workflow_name)
+            ctx.data.setdefault("timed_out_workflows", []).append(workflow_name)
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name="Ideator Inc Workflow",
+                    msg=f"{workflow_name} wasn't done by the deadline, going on without it",
+                    workflow_name=workflow_name
+                )
+            )
+            return AgentRunResult(
+                response=ChatResponse(
+                    message=ChatMessage(
+                        content=f"Failed to complete {workflow_name} before the deadline"
+                    )
+                ),
+                sources=[]
+            )
         except Exception as e:
             error_message = f"Error in {workflow_name}: {str(e)}"
+            ctx.data.setdefault("failed_workflows", []).append(workflow_name)
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name="Ideator Inc Workflow",
@@ -318,59 +702,81 @@ class IdeatorIncWorkflow(Workflow):
                 ),
                 sources=[]
             )
+
+    async def bubble_events(self, ctx: Context, handler: Any, workflow_name: str):
+        '''Bubble all events while running the executor to the planner.'''
+        async for event in handler.stream_events():
+            # Don't write the StopEvent from sub task to the stream
+            if type(event) is not StopEvent:
+                if isinstance(event, AgentRunEvent):
+                    event.workflow_name = workflow_name
+                ctx.write_event_to_stream(event)
+
+def get_deadline_seconds(params: Optional[Dict[str, Any]]) -> Optional[float]:
+    '''Time budget of the research from the chat data: `"deadline_seconds": 300` or `"fast": true`.'''
+    params = params or {}
+    if params.get("deadline_seconds"):
+        return float(params["deadline_seconds"])
+    if params.get("fast"):
+        return FAST_MODE_SECONDS
+    return None
     
 def create_idea_research_workflow(session_id: str, chat_history: Optional[List[ChatMessage]] = None, email: Optional[str] = None, **kwargs):
-    # Initial Research Team
+    if RESEARCH_PIPELINE_SPEC:
+        return create_pipeline_workflow(RESEARCH_PIPELINE_SPEC, session_id=session_id, chat_history=chat_history, email=email)
+
+    # Fast mode: the research gets a share of the time budget, the executive summary the rest
+    deadline_seconds = get_deadline_seconds(kwargs.get("params"))
+    deadline = Deadline.after(deadline_seconds) if deadline_seconds else None
+    research_deadline = deadline.split(RESEARCH_TIME_SHARE) if deadline is not None else None
+
+    # Initial Research Team, with the settings of each workflow (see app.agents.stage_2_initial_research.settings)
     timeout = 1200
-    competitor_researcher = create_competitor_analysis_workflow(
+    research_kwargs = dict(
         session_id=session_id, 
         chat_history=chat_history, 
         email=email, 
-        num_queries=2, 
-        max_critic_iterations=2, 
-        timeout=timeout
-    )
-    customer_insights_researcher = create_customer_insights_workflow(
-        session_id=session_id, 
-        chat_history=chat_history, 
-        email=email, 
-        num_queries=2, 
-        max_critic_iterations=2, 
-        timeout=timeout
-    )
-    online_trends_researcher = create_online_trends_workflow(
-        session_id=session_id, 
-        chat_history=chat_history, 
-        email=email, 
-        num_queries=2, 
-        max_critic_iterations=2, 
-        timeout=timeout
-    )
-    market_research_researcher = create_market_research_workflow(
-        session_id=session_id, 
-        chat_history=chat_history, 
-        email=email, 
-        num_queries=2, 
-        max_critic_iterations=2, 
-        timeout=timeout
+        timeout=timeout,
+        deadline=research_deadline.at if research_deadline is not None else None,
     )
+    competitor_researcher = create_sub_workflow(create_competitor_analysis_workflow, **research_kwargs)
+    customer_insights_researcher = create_sub_workflow(create_customer_insights_workflow, **research_kwargs)
+    online_trends_researcher = create_sub_workflow(create_online_trends_workflow, **research_kwargs)
+    market_research_researcher = create_sub_workflow(create_market_research_workflow, **research_kwargs)
     
     # Final Output
-    podcast_generator = create_podcast_workflow(
+    podcast_generator = create_sub_workflow(
+        create_podcast_workflow,
         session_id=session_id, 
         chat_history=chat_history, 
         timeout=1800,
-        max_iterations=1
+        max_iterations=1,
+        speculative_critic=SPECULATIVE_CRITIC_ENABLED,
     )
-    executive_summarizer = create_executive_summary_workflow(
+    executive_summarizer = create_sub_workflow(
+        create_executive_summary_workflow,
         session_id=session_id, 
         chat_history=chat_history, 
         email=email,
         timeout=1800,
-        max_iterations=1
+        max_iterations=1,
+        deadline=deadline.at if deadline is not None else None,
+        speculative_critic=SPECULATIVE_CRITIC_ENABLED,
     )
 
-    workflow = IdeatorIncWorkflow(session_id=session_id, timeout=3600, chat_history=chat_history, initial_team_size=4, post_production_team_size=2)
+    outline_drafter = create_outline_drafter(chat_history)
+
+    workflow = IdeatorIncWorkflow(
+        session_id=session_id,
+        timeout=3600,
+        chat_history=chat_history,
+        # Drafting the outline adds LLM calls the summary waits for
+        pipelined=PIPELINED_POST_PRODUCTION and deadline is None,
+        # The podcast audio takes longer than a whole fast mode session
+        podcast=deadline is None,
+        deadline=deadline.at if deadline is not None else None,
+        research_deadline=research_deadline.at if research_deadline is not None else None,
+    )
 
     workflow.add_workflows(
         competitor_researcher=competitor_researcher,
@@ -379,5 +785,6 @@ def create_idea_research_workflow(session_id: str, chat_history: Optional[List[C
         market_research_researcher=market_research_researcher,
         podcast_generator=podcast_generator,
         executive_summarizer=executive_summarizer,
+        outline_drafter=outline_drafter,
     )
     return workflow
@@ -0,0 +1,314 @@
+"""
+Declarative research pipelines.
+
+A pipeline spec (JSON, see `config/research_pipeline.json`) lists the stages of the
+research: the factory of each stage's workflow or agent, the stages it depends on, its
+time budget and the maximum number of stages running at once. `PipelineWorkflow` runs the
+spec: a stage starts as soon as the stages it depends on are done, with their results
+added to its input.
+
+When more stages are ready than may run at once, the stages on the estimated critical
+path go first: every stage is ranked by the longest chain of estimated durations from the
+stage to the end of the pipeline, using the historical durations of the stages
+(see `app.services.stage_durations`).
+"""
+
+import asyncio
+import importlib
+import inspect
+import json
+import time
+from pathlib import Path
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+
+from llama_index.core.llms import ChatMessage
+from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
+from pydantic import BaseModel, Field, model_validator
+
+from app.engine.tools.file_writer import write_file
+from app.services.budget import Budget, budget_scope, child_budget, sub_workflow_seconds
+from app.services.cancellation import track_workflow
+from app.services.checkpoints import checkpoint
+from app.services.process_pool import create_sub_workflow
+from app.services.stage_durations import get_stage_durations
+from app.workflows.single import AgentRunEvent, AgentRunResult
+from app.workflows.stage_results import stage_result
+
+# Upper bound of `max_concurrency`, the number of workers of the stage step
+MAX_PARALLEL_STAGES = 16
+
+
+class StageSpec(BaseModel):
+    name: str
+    # module:function building the stage's workflow or agent
+    factory: str
+    kwargs: Dict[str, Any] = Field(default_factory=dict)
+    # Prepended to the idea in the stage input
+    instruction: str
+    depends_on: List[str] = Field(default_factory=list)
+    # Time budget of the stage in seconds, the stage fails when it runs over
+    timeout: Optional[float] = None
+    # Duration estimate until the stage has run once
+    estimated_seconds: float = 300
+    # Session data file the result is written to, so the output production stages read it
+    report_file: Optional[str] = None
+
+
+class PipelineSpec(BaseModel):
+    name: str
+    stages: List[StageSpec]
+    max_concurrency: int = Field(default=4, ge=1, le=MAX_PARALLEL_STAGES)
+
+    @model_validator(mode="after")
+    def check_dependencies(self) -> "PipelineSpec":
+        names = [stage.name for stage in self.stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Pipeline {self.name} has duplicate stage names")
+        for stage in self.stages:
+            unknown = set(stage.depends_on) - set(names)
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages: {', '.join(sorted(unknown))}")
+        # Raises on cycles
+        self.topological_order()
+        return self
+
+    def stage(self, name: str) -> StageSpec:
+        return next(stage for stage in self.stages if stage.name == name)
+
+    def topological_order(self) -> List[str]:
+        order: List[str] = []
+        remaining = {stage.name: set(stage.depends_on) for stage in self.stages}
+        while remaining:
+            ready = [name for name, depends_on in remaining.items() if not depends_on - set(order)]
+            if not ready:
+                raise ValueError(f"Pipeline {self.name} has a dependency cycle between: {', '.join(sorted(remaining))}")
+            for name in ready:
+                order.append(name)
+                remaining.pop(name)
+        return order
+
+    def critical_path_ranks(self, estimate: Callable[[StageSpec], float]) -> Dict[str, float]:
+        """Estimated seconds from the start of each stage to the end of the pipeline."""
+        ranks: Dict[str, float] = {}
+        for name in reversed(self.topological_order()):
+            dependents = [stage.name for stage in self.stages if name in stage.depends_on]
+            ranks[name] = estimate(self.stage(name)) + max((ranks[dependent] for dependent in dependents), default=0)
+        return ranks
+
+
+def load_pipeline_spec(path: str) -> PipelineSpec:
+    with open(path, "r") as f:
+        return PipelineSpec.model_validate(json.load(f))
+
+
+class RunStageEvent(Event):
+    stage: str
+
+
+class StageCompletedEvent(Event):
+    stage: str
+    output: str
+    failed: bool = False
+
+
+class PipelineWorkflow(Workflow):
+    def __init__(
+        self,
+        spec: PipelineSpec,
+        stage_workflows: Dict[str, Workflow],
+        session_id: str,
+        timeout: int = 3600,
+    ):
+        super().__init__(timeout=timeout)
+        self.spec = spec
+        self.stage_workflows = stage_workflows
+        self.session_id = session_id
+        self.timeout_seconds = timeout
+        self.budget: Optional[Budget] = None
+        durations = get_stage_durations()
+        self.ranks = spec.critical_path_ranks(lambda stage: durations.estimate(stage.name, stage.estimated_seconds))
+
+    def run(self, *args: Any, **kwargs: Any) -> Any:
+        # The stages share the time and tokens of the run (see app.services.budget)
+        self.budget = Budget.for_run(self.spec.name, self.session_id, seconds=self.timeout_seconds)
+        with budget_scope(self.budget):
+            return super().run(*args, **kwargs)
+
+    @step()
+    @checkpoint
+    async def start(self, ctx: Context, ev: StartEvent) -> RunStageEvent:
+        ctx.data["idea"] = ev.input
+        ctx.data["outputs"] = {}
+        ctx.data["failed"] = []
+        ctx.data["running"] = []
+
+        critical_path = self.critical_path()
+        ctx.write_event_to_stream(
+            AgentRunEvent(
+                name=self.spec.name,
+                msg=(
+                    f"Starting {len(self.spec.stages)} stages, estimated critical path: "
+                    f"{' -> '.join(critical_path)} (~{self.ranks[critical_path[0]] / 60:.0f} min)"
+                ),
+                workflow_name="Research Manager"
+            )
+        )
+        self.dispatch(ctx)
+        return None
+
+    @step(num_workers=MAX_PARALLEL_STAGES)
+    @checkpoint
+    async def run_stage(self, ctx: Context, ev: RunStageEvent) -> StageCompletedEvent:
+        stage = self.spec.stage(ev.stage)
+        started_at = time.monotonic()
+        try:
+            res = await asyncio.wait_for(
+                self.run_sub_workflow(ctx, self.stage_workflows[stage.name], self.stage_input(ctx, stage), workflow_name=stage.name, timeout=stage.timeout),
+                timeout=stage.timeout,
+            )
+        except asyncio.TimeoutError:
+            return StageCompletedEvent(
+                stage=stage.name,
+                output=f"Failed to complete {stage.name}: it ran over its budget of {stage.timeout:.0f}s",
+                failed=True,
+            )
+        if res is None:
+            return StageCompletedEvent(stage=stage.name, output=f"Failed to complete {stage.name}", failed=True)
+
+        if not ctx.data.get("resume"):
+            # The stages of a resumed run skip what their checkpoints had done, their durations would
+            # bring the estimates down
+            get_stage_durations().record(stage.name, time.monotonic() - started_at)
+        output = res.response.message.content if isinstance(res, AgentRunResult) else str(res)
+        files = []
+        if stage.report_file:
+            files.append(Path(write_file(output, stage.report_file, self.session_id)))
+        # The client renders the stage's output while the other stages run
+        ctx.write_event_to_stream(stage_result(stage.name, output, workflow_name=stage.name, files=files))
+        return StageCompletedEvent(stage=stage.name, output=output)
+
+    @step()
+    @checkpoint
+    async def stage_completed(self, ctx: Context, ev: StageCompletedEvent) -> RunStageEvent | StopEvent:
+        ctx.data["outputs"][ev.stage] = ev.output
+        ctx.data["running"].remove(ev.stage)
+        if ev.failed:
+            ctx.data["failed"].append(ev.stage)
+            ctx.write_event_to_stream(stage_result(ev.stage, ev.output, workflow_name=ev.stage, status="failed"))
+
+        ctx.write_event_to_stream(
+            AgentRunEvent(
+                name=self.spec.name,
+                msg=(
+                    f"{ev.stage} {'failed' if ev.failed else 'completed'}, "
+                    f"{len(ctx.data['outputs'])} of {len(self.spec.stages)} stages done"
+                ),
+                workflow_name="Research Manager"
+            )
+        )
+        if len(ctx.data["outputs"]) == len(self.spec.stages):
+            return StopEvent(result=self.combine_results(ctx))
+        self.dispatch(ctx)
+        return None
+
+    def dispatch(self, ctx: Context):
+        '''Start the ready stages, the ones on the longest remaining path first.'''
+        outputs = ctx.data["outputs"]
+        running = ctx.data["running"]
+        ready = [
+            stage.name for stage in self.spec.stages
+            if stage.name not in outputs
+            and stage.name not in running
+            and all(dependency in outputs for dependency in stage.depends_on)
+        ]
+        ready.sort(key=lambda name: self.ranks[name], reverse=True)
+        for name in ready[:self.spec.max_concurrency - len(running)]:
+            running.append(name)
+            ctx.send_event(RunStageEvent(stage=name))
+
+    def critical_path(self) -> List[str]:
+        path = [max((stage for stage in self.spec.stages if not stage.depends_on), key=lambda stage: self.ranks[stage.name]).name]
+        while True:
+            dependents = [stage.name for stage in self.spec.stages if path[-1] in stage.depends_on]
+            if not dependents:
+                return path
+            path.append(max(dependents, key=lambda name: self.ranks[name]))
+
+    def stage_input(self, ctx: Context, stage: StageSpec) -> str:
+        results = "\n".join(
+            f"### {dependency} Result\n{ctx.data['outputs'][dependency]}\n" for dependency in stage.depends_on
+        )
+        return f"{stage.instruction}: {ctx.data['idea']}\n\n{results}"
+
+    def combine_results(self, ctx: Context) -> str:
+        '''
+        The outputs of the final stages, the ones no other stage depends on. The others were
+        streamed as stage results when they completed.
+        '''
+        dependencies = {dependency for stage in self.spec.stages for dependency in stage.depends_on}
+        results = "\n".join(
+            f"{stage.name} Result: \n{ctx.data['outputs'][stage.name]}" if stage.name not in dependencies
+            else f"{stage.name}: {'failed' if stage.name in ctx.data['failed'] else 'completed'}"
+            for stage in self.spec.stages
+        )
+        if ctx.data["failed"]:
+            results += f"\nFailed stages: {', '.join(ctx.data['failed'])}"
+        return results
+
+    async def run_sub_workflow(
+        self,
+        ctx: Context,
+        workflow: Workflow,
+        input: str,
+        workflow_name: str = "",
+        timeout: Optional[float] = None,
+    ) -> AgentRunResult | AsyncGenerator | str | None:
+        handler = None
+        try:
+            # The stage gets the earliest of its own budget, its workflow's timeout and the end of the pipeline's
+            with child_budget(workflow_name, seconds=sub_workflow_seconds(workflow, timeout)):
+                handler = track_workflow(workflow_name, workflow.run(input=input, streaming=False, resume=ctx.data.get("resume", False)))
+            # bubble all events while running the stage to the pipeline
+            async for event in handler.stream_events():
+                if type(event) is not StopEvent:
+                    if isinstance(event, AgentRunEvent):
+                        event.workflow_name = workflow_name
+                    ctx.write_event_to_stream(event)
+            return await handler
+        except asyncio.CancelledError:
+            # The stage ran over its budget
+            if handler is not None:
+                await handler.cancel_run()
+            raise
+        except Exception as e:
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name=self.spec.name,
+                    msg=f"Error in {workflow_name}: {str(e)}",
+                    workflow_name=workflow_name
+                )
+            )
+            return None
+
+
+def _create_stage_workflow(stage: StageSpec, session_id: str, chat_history: Optional[List[ChatMessage]], email: Optional[str]) -> Workflow:
+    module_name, name = stage.factory.split(":")
+    factory = getattr(importlib.import_module(module_name), name)
+    # Factories take the session arguments they need
+    session_kwargs = {"session_id": session_id, "chat_history": chat_history, "email": email}
+    parameters = inspect.signature(factory).parameters
+    kwargs = {key: value for key, value in session_kwargs.items() if key in parameters}
+    return create_sub_workflow(factory, **kwargs, **stage.kwargs)
+
+
+def create_pipeline_workflow(
+    spec_path: str,
+    session_id: str,
+    chat_history: Optional[List[ChatMessage]] = None,
+    email: Optional[str] = None,
+) -> PipelineWorkflow:
+    spec = load_pipeline_spec(spec_path)
+    stage_workflows = {
+        stage.name: _create_stage_workflow(stage, session_id, chat_history, email) for stage in spec.stages
+    }
+    return PipelineWorkflow(spec=spec, stage_workflows=stage_workflows, session_id=session_id)
@@ -39,7 +39,7 @@ class SearchCompetitorDetailsResponse(BaseModel):
     cons: List[str] = Field(description="Overall key negative points from all reviews")
     sources: List[str] = Field(description="List of URLs used for the analysis")
     
-def create_competitor_researcher(chat_history: List[ChatMessage]):
+def create_competitor_researcher(chat_history: List[ChatMessage], session_id: str | None = None):
     def search(query: str):
         return tavily_search(
             query=query,
@@ -59,21 +59,24 @@ def create_competitor_researcher(chat_history: List[ChatMessage]):
         return read_webpage(
             url=url,
             schema=ProductDetails.model_json_schema(),
-            instruction=f"Extract detailed product information for {product_name} from their official website."
+            instruction=f"Extract detailed product information for {product_name} from their official website.",
+            session_id=session_id,
         )
     
     def scrape_pricing(url: str, product_name: str):
         return read_webpage(
             url=url,
             schema=PricingInfo.model_json_schema(),
-            instruction=f"Extract detailed pricing information for {product_name}. Include all plans, features, and special offers."
+            instruction=f"Extract detailed pricing information for {product_name}. Include all plans, features, and special offers.",
+            session_id=session_id,
         )
     
     def scrape_reviews(url: str, product_name: str):
         return read_webpage(
             url=url,
             schema=ReviewSummary.model_json_schema(),
-            instruction=f"Analyze user reviews and feedback for {product_name}. Summarize key positive and negative points."
+            instruction=f"Analyze user reviews and feedback for {product_name}. Summarize key positive and negative points.",
+            session_id=session_id,
         )
 
 
@@ -5,7 +5,7 @@ from llama_index.core.chat_engine.types import ChatMessage
 from llama_index.core.tools import FunctionTool
 
 from app.engine.tools.tavily import tavily_search
-from app.engine.tools.web_reader import read_webpage
+from app.engine.tools.web_reader import read_webpage, read_webpages
 from pydantic import BaseModel, Field
 
 class CompetitorInfo(BaseModel):
@@ -20,14 +20,21 @@ class CompetitorSearchResponse(BaseModel):
     insights: List[str] = Field(description="Key insights from the competitor research")
     competitors: List[CompetitorInfo] = Field(description="Detailed information about each competitor found")
 
-def create_competitor_searcher(chat_history: List[ChatMessage]):
+def create_competitor_searcher(chat_history: List[ChatMessage], session_id: str | None = None):
     def curated_competitor_search(search_query: str):
         return tavily_search(query=search_query, max_results=10, include_domains=["ycombinator.com", "reddit.com", "tiktok.com", "producthunt.com", "news.ycombinator.com", "hackernews.com", "appsumo.com", "youtube.com" ])
     
+    async def read_page(url: str):
+        return await read_webpage(url, session_id=session_id)
+        
+    async def read_pages(urls: List[str]):
+        return await read_webpages(urls, session_id=session_id)
+    
     tools = [
         FunctionTool.from_defaults(tavily_search, name="search", description="Search the web for information, it returns a list of urls and content"),
         FunctionTool.from_defaults(curated_competitor_search, name="curated_competitor_search", description="Search a curated domain of websites for information, it returns a list of urls and content"),
-        FunctionTool.from_defaults(async_fn=read_webpage, name="read_webpage", description="Access a webpage and read it"),
+        FunctionTool.from_defaults(async_fn=read_page, name="read_webpage", description="Access a webpage and read it"),
+        FunctionTool.from_defaults(async_fn=read_pages, name="read_webpages", description="Access several webpages at once and read them, pass all the urls you want to read in a single call"),
     ]
 
     prompt_instructions = dedent("""
@@ -37,7 +44,7 @@ def create_competitor_searcher(chat_history: List[ChatMessage]):
         Follow these steps:
         1. You are given a search query, use it to find competitors using the `curated_competitor_search` tool for a curated search and the `search` tool for a general search for competitors. You must use both tools, you don't need to modify the query, just use it as is. For competitors, you should consider if they are competitors or complementary products, it could be that both apps are solving the same problem but when used together they are more powerful, and therefore they are not direct competitors.
 
-        2. After calling both tools, analyze the search results to identify competitors and extract interesting insights, you can read the page content using the `read_webpage` tool:
+        2. After calling both tools, analyze the search results to identify competitors and extract interesting insights, you can read the page content using the `read_webpage` tool, or read several pages in one go using the `read_webpages` tool:
            - Prioritize relevant competitors that are solving the same problem in a similar way
            - Maximum of the top 4 most relevant competitors
 
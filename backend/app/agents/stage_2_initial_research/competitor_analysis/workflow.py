@@ -5,13 +5,23 @@ from app.agents.stage_2_initial_research.competitor_analysis.competitor_searcher
 from app.agents.stage_2_initial_research.competitor_analysis.competitor_analyzer import create_competitor_analyzer
 from app.agents.stage_2_initial_research.competitor_analysis.report_critic import CompetitorReportCritique, create_report_critic
 from app.agents.stage_2_initial_research.competitor_analysis.competitor_researcher import SearchCompetitorDetailsResponse, create_competitor_researcher
+from app.agents.stage_2_initial_research.settings import ResearchSettings
 from app.agents.example.reporter import create_reporter
 from app.engine.tools.file_writer import write_file
 from app.utils.json_extractor import extract_code_block_from_response, extract_json_from_response
 from app.utils.json_validator import JsonValidationHelper
 from app.workflows.react import ReActAgentWithMemory
 from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
+from app.workflows.fan_in import fan_out, get_fan_in, run_branch
 from app.workflows.single import AgentRunEvent, FunctionCallingAgent, AgentRunResult
+from app.services.cancellation import track_workflow
+from app.services.checkpoints import checkpoint
+from app.services.deadline import CRITIC_ROUND_SECONDS, REPORT_SECONDS, SEARCH_SECONDS, deadline_scope, to_deadline
+from app.services.evidence_store import known_evidence, record_findings
+from app.services.idea_cache import delta_research_task
+from app.services.research_artifacts import reuse_search
+from app.services.scheduler import get_scheduler
+from app.services.speculative_critic import record_skipped_critic_round, score_draft, speculative_refinement_prompt
 from llama_index.core.chat_engine.types import ChatMessage
 import asyncio
 from llama_index.core.chat_engine.types import AgentChatResponse
@@ -42,6 +52,18 @@ class CritiqueCompetitorsEvent(Event):
 class ReportEvent(Event):
     input: str
 
+# Sections the analysis must cover, scored by the speculative critic
+COMPETITOR_REPORT_SECTIONS = (
+    "Overview",
+    "Competitor Landscape",
+    "Market Positioning",
+    "Competitive Assessment",
+    "Feature Comparison",
+    "SWOT",
+)
+
+COMPETITOR_ANALYSIS_SETTINGS = ResearchSettings.from_env("COMPETITOR_ANALYSIS")
+
 class CompetitorAnalysisWorkflow(Workflow):
     """
     A workflow that performs competitor analysis through multiple stages:
@@ -53,25 +75,27 @@ class CompetitorAnalysisWorkflow(Workflow):
     
     Args:
         chat_history: Previous chat messages for context
-        num_searches: Number of parallel searches to perform
-        num_competitors: Maximum number of competitors to analyze
         timeout: Maximum time in seconds for the workflow
+        deadline: Epoch seconds the research must be done by, the searches, competitors and
+            critic rounds are cut down to what fits before it
+        settings: Number of searches and competitors, critic iterations and search limits (the
+            `search_timeout` applies to the searches, and then to the competitor detail
+            searches), see app.agents.stage_2_initial_research.settings
     """
     def __init__(self, 
                  session_id: str,
                  chat_history: Optional[List[ChatMessage]] = None,
-                 num_queries: int = 2,
-                 num_competitors: int = 4,
                  timeout: int = 1800,
-                 max_critic_iterations: int = 3):
+                 deadline: Optional[float] = None,
+                 settings: Optional[ResearchSettings] = None):
         super().__init__(timeout=timeout)
         self.session_id = session_id
         self.chat_history = chat_history or []
-        self.num_queries = num_queries
-        self.num_competitors = num_competitors
-        self.max_critic_iterations = max_critic_iterations
+        self.settings = settings or COMPETITOR_ANALYSIS_SETTINGS
+        self.deadline = to_deadline(deadline)
         
     @step()
+    @checkpoint
     async def start(self, ctx: Context, ev: StartEvent) -> ExecuteSearchEvent:
         '''
         Start the workflow by setting the task and generating search queries
@@ -85,22 +109,38 @@ class CompetitorAnalysisWorkflow(Workflow):
             )
         )
         
+        num_queries = self.settings.num_queries
+        task = ev.input
+        seed = ev.get("seed")
+        if seed:
+            # Earlier research on a similar idea covers most of it, only search for the delta
+            ctx.data["seed"] = seed
+            num_queries = max(1, num_queries // 2)
+            task = delta_research_task(ev.input, seed)
+        if self.deadline is not None:
+            # Leave time for the competitor details, the analysis and the report
+            num_queries = self.deadline.fit(num_queries, SEARCH_SECONDS, parallel=self.settings.search_workers, reserve=SEARCH_SECONDS + 2 * REPORT_SECONDS)
+        
         # Generate search queries
-        queries = await self._generate_search_queries(ev.input, 
+        queries = await self._generate_search_queries(task, 
                                                       chat_history=[], 
-                                                      number_of_queries=self.num_queries)
+                                                      number_of_queries=num_queries)
         ctx.write_event_to_stream(
             AgentRunEvent(
                 name="Research starter",
                 msg=f"Generated {len(queries)} search queries\n{queries}",
             )
         )
-        for query in queries[:self.num_queries]:
+        searches = fan_out(ctx, "searches", queries[:num_queries], self.settings.search_timeout, self.settings.min_search_results)
+        if not searches:
+            ctx.send_event(CombineSearchesEvent())
+        for query in searches:
             ctx.send_event(ExecuteSearchEvent(query=query))
             
         return None
 
-    @step(num_workers=2)
+    @step(num_workers=COMPETITOR_ANALYSIS_SETTINGS.search_workers)
+    @checkpoint
     async def execute_search(self, ctx: Context, ev: ExecuteSearchEvent) -> CombineSearchesEvent:
         '''
         Execute a single search query and fires an event to search each competitor
@@ -109,8 +149,22 @@ class CompetitorAnalysisWorkflow(Workflow):
                 We are currently researching this task: {ctx.data["task"]}
                 Here is the search query you should use for your research: {ev.query}
             """
-        competitor_searcher = create_competitor_searcher(chat_history=[])
-        result = await self.run_agent(ctx, competitor_searcher, prompt)
+        known = known_evidence(self.session_id, exclude_stage="Competitor Analysis")
+        if known:
+            prompt += f"\nAlready found by the other research of this session, don't search for it again:\n{known}\n"
+        competitor_searcher = create_competitor_searcher(chat_history=[], session_id=self.session_id)
+        result = await run_branch(
+            ctx, "searches", ev.query,
+            reuse_search(self.session_id, "Competitor Analysis", ev.query, lambda: self.run_agent(ctx, competitor_searcher, prompt)),
+        )
+        if result is None:
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name=competitor_searcher.name,
+                    msg=f"Competitor search failed, going on without it: {get_fan_in(ctx, 'searches').failures.get(ev.query)}",
+                )
+            )
+            return CombineSearchesEvent()
         ctx.write_event_to_stream(
             AgentRunEvent(
                 name=competitor_searcher.name,
@@ -128,12 +182,12 @@ class CompetitorAnalysisWorkflow(Workflow):
                     msg=f"No valid JSON content found in the response",
                 )
             )
-            ctx.data["num_searches_completed"] = ctx.data.get("num_searches_completed", 0) + 1
             return CombineSearchesEvent()
         
         # This will be used by the analyzer agent
         ctx.data.setdefault("initial_search_results", []).append(result.response.message.content)
         ctx.data.setdefault("sources", []).extend(parsed_res.sources)
+        record_findings(self.session_id, "Competitor Analysis", parsed_res)
         ctx.write_event_to_stream(
                 AgentRunEvent(
                     name=competitor_searcher.name,
@@ -156,36 +210,41 @@ class CompetitorAnalysisWorkflow(Workflow):
                 )
             )
         
-        ctx.data["num_searches_completed"] = ctx.data.get("num_searches_completed", 0) + 1
         return CombineSearchesEvent()
     
     @step()
+    @checkpoint
     async def combine_searches(self, ctx: Context, ev: CombineSearchesEvent) -> GatherCompetitorDetailsEvent:
         '''
         Rerank and deduplicate competitors
         '''
         # If we haven't completed all searches, wait for more
-        num_searches_completed = ctx.data.get("num_searches_completed", 0)
-        if num_searches_completed < self.num_queries:
+        searches = get_fan_in(ctx, "searches")
+        if not searches.settled:
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name="Research combiner",
-                    msg=f"Completed {num_searches_completed} out of {self.num_queries} searches",
+                    msg=f"Completed {searches.progress()}",
                 )
             )
             return None
         
-        # Otherwise, we should have collected all competitor details, rerank and deduplicate them
-        ctx.collect_events(ev, [CombineSearchesEvent] * self.num_queries)
+        # Otherwise, we should have collected all competitors, rerank and deduplicate them
+        searches.check()
         ctx.write_event_to_stream(
             AgentRunEvent(
                 name="Research combiner",
-                msg=f"All competitor searches have been completed, here are the potential competitors we found:\n{ctx.data['competitor_names']}",
+                msg=f"All competitor searches have been completed, here are the potential competitors we found:\n{ctx.data.get('competitor_names', [])}",
             )
         )
         
-        reranked_competitors = await self._deduplicate_and_rank_competitors(ctx.data["competitors"], ctx.data["task"], self.num_competitors)
-        ctx.data["reranked_competitors"] = reranked_competitors[:self.num_competitors]
+        num_competitors = self.settings.num_competitors
+        if self.deadline is not None:
+            # Only the competitors there is time to research, leaving time for the analysis and the report
+            num_competitors = self.deadline.fit(self.settings.num_competitors, SEARCH_SECONDS, parallel=self.settings.search_workers, reserve=2 * REPORT_SECONDS)
+        reranked_competitors = await self._deduplicate_and_rank_competitors(ctx.data.get("competitors", []), ctx.data["task"], num_competitors)
+        reranked_competitors = reranked_competitors[:num_competitors]
+        ctx.data["reranked_competitors"] = reranked_competitors
         ctx.write_event_to_stream(
             AgentRunEvent(
                 name="Research combiner",
@@ -193,13 +252,17 @@ class CompetitorAnalysisWorkflow(Workflow):
             )
         )
         
+        if not fan_out(ctx, "competitor details", [competitor.name for competitor in reranked_competitors], self.settings.search_timeout, min_results=1):
+            # No competitor to gather details about, the fan-in is settled already
+            ctx.send_event(CombineCompetitorDetailsEvent())
         for competitor in reranked_competitors:
             ctx.send_event(GatherCompetitorDetailsEvent(input=competitor))
         
         return None
         
     
-    @step(num_workers=2)
+    @step(num_workers=COMPETITOR_ANALYSIS_SETTINGS.search_workers)
+    @checkpoint
     async def gather_competitor_details(self, ctx: Context, ev: GatherCompetitorDetailsEvent) -> CombineCompetitorDetailsEvent:
         '''
         Gather details about a single competitor, including pricing information, key features, target audience, and reviews
@@ -208,8 +271,20 @@ class CompetitorAnalysisWorkflow(Workflow):
                 We are currently researching this task: {ctx.data["task"]}
                 You are tasked with gathering details about this competitor: {ev.input}
             """
-        competitor_researcher = create_competitor_researcher([])
-        result = await self.run_agent(ctx, competitor_researcher, prompt)
+        # What the session already knows about the competitor, e.g. from the customer insights
+        known = known_evidence(self.session_id, entity=ev.input.name)
+        if known:
+            prompt += f"\nAlready known about this competitor, only search for what is missing:\n{known}\n"
+        competitor_researcher = create_competitor_researcher([], session_id=self.session_id)
+        result = await run_branch(ctx, "competitor details", ev.input.name, self.run_agent(ctx, competitor_researcher, prompt))
+        if result is None:
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name=competitor_researcher.name,
+                    msg=f"Gathering details about {ev.input.name} failed, going on without them: {get_fan_in(ctx, 'competitor details').failures.get(ev.input.name)}",
+                )
+            )
+            return CombineCompetitorDetailsEvent()
         ctx.data.setdefault("refined_search_results", []).append(result.response.message.content)
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -231,37 +306,38 @@ class CompetitorAnalysisWorkflow(Workflow):
             return CombineCompetitorDetailsEvent()
 
         ctx.data.setdefault("sources", []).extend(parsed_res.sources)
+        record_findings(self.session_id, "Competitor Analysis", parsed_res)
         return CombineCompetitorDetailsEvent()
     
     @step()
+    @checkpoint
     async def combine_competitor_details(self, ctx: Context, ev: CombineCompetitorDetailsEvent) -> AnalyzeCompetitorsEvent:
         '''
         Combine the details about all competitors
         '''
-        num_to_collect = len(ctx.data.get("reranked_competitors"))
-        num_completed = len(ctx.data.get("refined_search_results"))
-        
-        if num_completed < num_to_collect:
+        competitor_details = get_fan_in(ctx, "competitor details")
+        if not competitor_details.settled:
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name="Research combiner",
-                    msg=f"Collected {num_completed} out of {num_to_collect} competitor details",
+                    msg=f"Collected {competitor_details.progress()}",
                 )
             )
             return None
         
         # At this point, we should have collected all competitor details
-        ctx.collect_events(ev, [CombineCompetitorDetailsEvent] * num_to_collect)
+        competitor_details.check()
         ctx.write_event_to_stream(
             AgentRunEvent(
                 name="Research combiner",
-                msg=f"All competitor details have been collected, proceeding to analyze them",
+                msg=f"Collected {competitor_details.progress()}, proceeding to analyze them",
             )
         )
         
         return AnalyzeCompetitorsEvent(input="All competitor details have been collected")
     
     @step()
+    @checkpoint
     async def analyze(
         self, ctx: Context, ev: AnalyzeCompetitorsEvent, competitor_analyzer: FunctionCallingAgent
     ) -> CritiqueCompetitorsEvent | ReportEvent:
@@ -272,14 +348,16 @@ class CompetitorAnalysisWorkflow(Workflow):
                 ### Initial research
                 Junior analysts have gathered initial research on these competitors.
                 They have found the following competitors: 
-                {ctx.data["competitor_names"]}
+                {ctx.data.get('competitor_names', [])}
                 
                 Here are their findings and analysis: 
-                {ctx.data["initial_search_results"]}
+                {ctx.data.get('initial_search_results', [])}
                 
                 ### Refined research
                 Promising competitors have been reranked and deduplicated and further researched, here are their details: 
-                {ctx.data["refined_search_results"]}
+                {ctx.data.get('refined_search_results', [])}
+                
+                {ctx.data.get('seed') or ''}
                 
                 ### Report
                 Analyze the data and provide a detailed report with citations
@@ -296,7 +374,7 @@ class CompetitorAnalysisWorkflow(Workflow):
         ctx.data["competitor_analysis_result"] = result.response.message.content
         
         # If we've done this 3 times, we should just return the report
-        if ctx.data.get("critic_iteration", 0) >= self.max_critic_iterations:
+        if ctx.data.get("critic_iteration", 0) >= self.settings.max_critic_iterations:
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name=competitor_analyzer.name,
@@ -304,6 +382,27 @@ class CompetitorAnalysisWorkflow(Workflow):
                 )
             )
             return ReportEvent(input=ctx.data["competitor_analysis_result"])
+        if self.deadline is not None and not self.deadline.allows(CRITIC_ROUND_SECONDS + REPORT_SECONDS):
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name=competitor_analyzer.name,
+                    msg=f"No time left for a critic round, moving on to generate the final report",
+                )
+            )
+            return ReportEvent(input=ctx.data["competitor_analysis_result"])
+        if self.settings.speculative_critic:
+            score = score_draft(ctx.data["competitor_analysis_result"], COMPETITOR_REPORT_SECTIONS)
+            if score.passes:
+                record_skipped_critic_round(self.session_id)
+                ctx.write_event_to_stream(
+                    AgentRunEvent(
+                        name=competitor_analyzer.name,
+                        msg=f"Draft scored {score}, skipping the critic round",
+                    )
+                )
+                return ReportEvent(input=ctx.data["competitor_analysis_result"])
+            # Refined from the gaps the score found while the critic runs
+            ctx.data["draft_feedback"] = score.feedback()
         
         # Otherwise, we should critique the report
         ctx.data["critic_iteration"] = ctx.data.get("critic_iteration", 0) + 1
@@ -316,14 +415,23 @@ class CompetitorAnalysisWorkflow(Workflow):
         return CritiqueCompetitorsEvent(input=ctx.data["competitor_analysis_result"])
 
     @step()
+    @checkpoint
     async def critique(
-        self, ctx: Context, ev: CritiqueCompetitorsEvent, report_critic: FunctionCallingAgent
+        self, ctx: Context, ev: CritiqueCompetitorsEvent, report_critic: FunctionCallingAgent, competitor_analyzer: FunctionCallingAgent
     ) -> ReportEvent:
-        result = await self.run_agent(ctx, report_critic,
+        critique = self.run_agent(ctx, report_critic,
             f"""We are currently researching this task: {ctx.data['task']}
             We have researched and analyzed the competitors, and created this report draft: {ev.input}
             Please critique the report and provide actionable feedback for improvement."""
         )
+        draft_feedback = ctx.data.pop("draft_feedback", None)
+        if draft_feedback:
+            result, refined = await asyncio.gather(
+                critique, self.run_agent(ctx, competitor_analyzer, speculative_refinement_prompt(draft_feedback))
+            )
+            ctx.data["competitor_analysis_result"] = refined.response.message.content
+        else:
+            result = await critique
         ctx.write_event_to_stream(
             AgentRunEvent(
                 name=report_critic.name,
@@ -360,6 +468,7 @@ class CompetitorAnalysisWorkflow(Workflow):
         return AnalyzeCompetitorsEvent(input=result.response.message.content)
     
     @step()
+    @checkpoint
     async def report(
         self, ctx: Context, ev: ReportEvent, reporter: FunctionCallingAgent
     ) -> StopEvent:
@@ -391,7 +500,7 @@ class CompetitorAnalysisWorkflow(Workflow):
                     
                     ### Competitors
                     We found the following competitors:
-                    {ctx.data["competitor_names"]}
+                    {ctx.data.get('competitor_names', [])}
                     
                     ### Initial research
                     We reranked and deduplicated the competitors based on their relevance to the task, and did more research on them. Here are their details:
@@ -407,7 +516,7 @@ class CompetitorAnalysisWorkflow(Workflow):
                     
                     ### Sources
                     We used the following sources to compile the report:
-                    {ctx.data["sources"]}
+                    {ctx.data.get("sources", [])}
                 """),
                 file_name="report.txt",
                 session_id=self.session_id,
@@ -431,7 +540,9 @@ class CompetitorAnalysisWorkflow(Workflow):
     
     async def run_agent(self, ctx: Context, agent: FunctionCallingAgent, input: str) -> AgentRunResult:
         try:
-            handler = agent.run(input=input, streaming=False)
+            # The agent's tools read fewer pages as the deadline nears
+            with deadline_scope(self.deadline):
+                handler = track_workflow(agent.name, agent.run(input=input, streaming=False))
             async for event in handler.stream_events():
                 if type(event) is not StopEvent:
                     ctx.write_event_to_stream(event)
@@ -498,7 +609,8 @@ class CompetitorAnalysisWorkflow(Workflow):
         )
 
         prompt = prompt_template.format(task=task, chat_history=chat_history, number_of_queries=number_of_queries)
-        output = await Settings.llm.acomplete(prompt)
+        async with get_scheduler().slot():
+            output = await Settings.llm.acomplete(prompt)
         json_content = extract_json_from_response(output.text.strip())
         return json_content
 
@@ -542,20 +654,22 @@ class CompetitorAnalysisWorkflow(Workflow):
             n=n
         )
         
-        output = await Settings.llm.acomplete(prompt)
+        async with get_scheduler().slot():
+            output = await Settings.llm.acomplete(prompt)
         json_array = extract_json_from_response(output.text.strip())
         res = [CompetitorInfo.model_validate(comp) for comp in json_array]
         print(res)
         return res
 
 
-def create_competitor_analysis_workflow(session_id: str, chat_history: List[ChatMessage], email: str | None = None, timeout: int = 1800, num_queries: int = 5, max_critic_iterations: int = 3):
+def create_competitor_analysis_workflow(session_id: str, chat_history: List[ChatMessage], email: str | None = None, timeout: int = 1800, deadline: Optional[float] = None, settings: Optional[ResearchSettings] = None, **overrides):
+    """`overrides` are settings of this run, e.g. `num_queries`, on top of `settings` or the deployment's settings."""
     workflow = CompetitorAnalysisWorkflow(
         session_id=session_id,
         timeout=timeout,
         chat_history=chat_history,
-        num_queries=num_queries,
-        max_critic_iterations=max_critic_iterations,
+        deadline=deadline,
+        settings=(settings or COMPETITOR_ANALYSIS_SETTINGS).with_overrides(**overrides),
     )
     
     competitor_analyzer = create_competitor_analyzer(chat_history)
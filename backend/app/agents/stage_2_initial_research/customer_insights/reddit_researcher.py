@@ -1,13 +1,13 @@
 from textwrap import dedent
 from typing import List
-from app.engine.tools.web_reader import read_webpage
+from app.engine.tools.web_reader import read_webpage, read_webpages
 from app.workflows.single import FunctionCallingAgent
 from llama_index.core.chat_engine.types import ChatMessage
 from llama_index.core.tools import FunctionTool
 from app.engine.tools.tavily import tavily_search
 from app.engine.tools.mcp_server import create_mcp_tools
 
-def create_reddit_researcher(chat_history: List[ChatMessage]):
+def create_reddit_researcher(chat_history: List[ChatMessage], session_id: str | None = None):
     def reddit_search(search_query: str):
         return tavily_search(
             query=search_query,
@@ -18,7 +18,15 @@ def create_reddit_researcher(chat_history: List[ChatMessage]):
     async def read_reddit_post(url: str):
         return await read_webpage(
             url,
-            instruction="Extract the main content of the Reddit post, and the comments from the thread, ignore all other content"   
+            instruction="Extract the main content of the Reddit post, and the comments from the thread, ignore all other content",
+            session_id=session_id,
+        )
+        
+    async def read_reddit_posts(urls: List[str]):
+        return await read_webpages(
+            urls,
+            instruction="Extract the main content of the Reddit post, and the comments from the thread, ignore all other content",
+            session_id=session_id,
         )
     
     # Base tools
@@ -33,6 +41,11 @@ def create_reddit_researcher(chat_history: List[ChatMessage]):
             name="read_reddit_post",
             description="Read and extract content from a Reddit post"
         ),
+        FunctionTool.from_defaults(
+            async_fn=read_reddit_posts,
+            name="read_reddit_posts",
+            description="Read and extract content from several Reddit posts at once, pass all the urls you want to read in a single call"
+        ),
     ]
 
     # Add MCP tools for enhanced research
@@ -64,7 +77,7 @@ def create_reddit_researcher(chat_history: List[ChatMessage]):
         
         Use the tools available to:
         1. Search Reddit content with the `reddit_search` tool
-        2. Read and extract detailed content with the `read_reddit_post` tool
+        2. Read and extract detailed content with the `read_reddit_post` tool, or with the `read_reddit_posts` tool when you want to read several threads - pass all of their urls in a single call
         
         
         ### Output Format
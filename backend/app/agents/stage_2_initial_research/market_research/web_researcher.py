@@ -4,10 +4,10 @@ from app.workflows.single import FunctionCallingAgent
 from llama_index.core.chat_engine.types import ChatMessage
 from llama_index.core.tools import FunctionTool
 from app.engine.tools.tavily import tavily_search
-from app.engine.tools.web_reader import read_webpage
+from app.engine.tools.web_reader import read_webpage, read_webpages
 from app.engine.tools.mcp_server import create_mcp_tools
 
-def create_market_researcher(name_prefix: str, chat_history: List[ChatMessage], domains: List[str] | None = None):
+def create_market_researcher(name_prefix: str, chat_history: List[ChatMessage], domains: List[str] | None = None, session_id: str | None = None):
     def market_search(search_query: str):
         return tavily_search(
             query=search_query,
@@ -15,6 +15,12 @@ def create_market_researcher(name_prefix: str, chat_history: List[ChatMessage],
             include_domains=domains,
             search_depth="advanced"
         )
+        
+    async def read_page(url: str):
+        return await read_webpage(url, session_id=session_id)
+        
+    async def read_pages(urls: List[str]):
+        return await read_webpages(urls, session_id=session_id)
     
     # Base tools
     tools = [
@@ -24,10 +30,15 @@ def create_market_researcher(name_prefix: str, chat_history: List[ChatMessage],
             description="Search for market data and statistics"
         ),
         FunctionTool.from_defaults(
-            async_fn=read_webpage,
+            async_fn=read_page,
             name="read_webpage",
             description="Read and extract content from a webpage"
         ),
+        FunctionTool.from_defaults(
+            async_fn=read_pages,
+            name="read_webpages",
+            description="Read and extract content from several webpages at once, pass all the urls you want to read in a single call"
+        ),
     ]
 
     # Add MCP tools (Brave, Reddit, GitHub)
@@ -55,7 +66,7 @@ def create_market_researcher(name_prefix: str, chat_history: List[ChatMessage],
         
         Use the tools available to:
         1. Search for market data with the `market_search` tool
-        2. Read and extract detailed content with the `read_webpage` tool
+        2. Read and extract detailed content with the `read_webpage` tool, or with the `read_webpages` tool when you want to read several pages - pass all of their urls in a single call
         
         ### Output Format
         Return your findings in this format:
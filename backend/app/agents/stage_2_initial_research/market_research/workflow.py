@@ -1,12 +1,23 @@
+import asyncio
 from typing import List, Optional
 from textwrap import dedent
 from app.agents.example.reporter import create_reporter
 from app.agents.stage_2_initial_research.market_research.web_researcher import create_market_researcher
 from app.agents.stage_2_initial_research.market_research.market_analyzer import create_market_analyzer
 from app.agents.stage_2_initial_research.market_research.market_critic import MarketReportCritique, create_market_critic
+from app.agents.stage_2_initial_research.settings import ResearchSettings
 from app.engine.tools.file_writer import write_file
 from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
+from app.workflows.fan_in import fan_out, get_fan_in, run_branch
 from app.workflows.single import AgentRunEvent, AgentRunResult, FunctionCallingAgent
+from app.services.cancellation import track_workflow
+from app.services.checkpoints import checkpoint
+from app.services.deadline import CRITIC_ROUND_SECONDS, REPORT_SECONDS, SEARCH_SECONDS, deadline_scope, to_deadline
+from app.services.evidence_store import known_evidence, record_findings
+from app.services.idea_cache import delta_research_task
+from app.services.research_artifacts import reuse_search
+from app.services.scheduler import get_scheduler
+from app.services.speculative_critic import record_skipped_critic_round, score_draft, speculative_refinement_prompt
 from llama_index.core.chat_engine.types import ChatMessage
 from llama_index.core.prompts.base import PromptTemplate
 from app.settings import Settings
@@ -54,20 +65,36 @@ class CritiqueAnalysisEvent(Event):
 class ReportEvent(Event):
     input: str
 
+# Sections the analysis must cover, scored by the speculative critic
+MARKET_REPORT_SECTIONS = (
+    "Ideal Customer Profile",
+    "Potential Users",
+    "TAM",
+    "SAM",
+    "SOM",
+    "Market Segments",
+    "Recommendations",
+)
+
+MARKET_RESEARCH_SETTINGS = ResearchSettings.from_env("MARKET_RESEARCH")
+
 class MarketResearchWorkflow(Workflow):
     def __init__(self,
                 session_id: str,
                 chat_history: Optional[List[ChatMessage]] = None,
-                num_queries: int = 3,
                 timeout: int = 1000,
-                max_critic_iterations: int = 3):
+                deadline: Optional[float] = None,
+                settings: Optional[ResearchSettings] = None):
         super().__init__(timeout=timeout)
         self.session_id = session_id
         self.chat_history = chat_history or []
-        self.num_queries = num_queries
-        self.max_critic_iterations = max_critic_iterations
+        # Queries, critic iterations and search limits, see app.agents.stage_2_initial_research.settings
+        self.settings = settings or MARKET_RESEARCH_SETTINGS
+        # Epoch seconds the research must be done by, see app.services.deadline
+        self.deadline = to_deadline(deadline)
 
     @step()
+    @checkpoint
     async def start(self, ctx: Context, ev: StartEvent) -> ExecuteSearchEvent:
         ctx.data["task"] = ev.input
         ctx.write_event_to_stream(
@@ -77,11 +104,23 @@ class MarketResearchWorkflow(Workflow):
             )
         )
 
+        num_queries = self.settings.num_queries
+        task = ev.input
+        seed = ev.get("seed")
+        if seed:
+            # Earlier research on a similar idea covers most of it, only search for the delta
+            ctx.data["seed"] = seed
+            num_queries = max(1, num_queries // 2)
+            task = delta_research_task(ev.input, seed)
+        if self.deadline is not None:
+            # Only the searches there is time for, leaving time for the analysis and the report
+            num_queries = self.deadline.fit(num_queries, SEARCH_SECONDS, parallel=self.settings.search_workers, reserve=2 * REPORT_SECONDS)
+        
         # Generate search queries
         queries = await self._generate_search_queries(
-            task=ev.input,
+            task=task,
             chat_history=[],
-            num_queries=self.num_queries
+            num_queries=num_queries
         )
         
         ctx.write_event_to_stream(
@@ -92,17 +131,24 @@ class MarketResearchWorkflow(Workflow):
         )
         
         # Send events for each search
-        for query in queries.search_queries[:self.num_queries]:
+        searches = fan_out(ctx, "searches", queries.search_queries[:num_queries], self.settings.search_timeout, self.settings.min_search_results)
+        if not searches:
+            ctx.send_event(CombineSearchesEvent())
+        for query in searches:
             ctx.send_event(ExecuteSearchEvent(query=query))
             
         return None
 
-    @step(num_workers=5)
+    @step(num_workers=MARKET_RESEARCH_SETTINGS.search_workers)
+    @checkpoint
     async def execute_web_search(self, ctx: Context, ev: ExecuteSearchEvent) -> CombineSearchesEvent:
         prompt = f"""
             We are researching market size and segments for this task: {ctx.data["task"]}
             Please analyze market data using this query: {ev.query}
         """
+        known = known_evidence(self.session_id, exclude_stage="Market Research")
+        if known:
+            prompt += f"\nAlready found by the other research of this session, don't search for it again:\n{known}\n"
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -111,8 +157,19 @@ class MarketResearchWorkflow(Workflow):
             )
         )
         
-        web_researcher = create_market_researcher(name_prefix="general", chat_history=[])
-        result = await self.run_agent(ctx, web_researcher, prompt)
+        web_researcher = create_market_researcher(name_prefix="general", chat_history=[], session_id=self.session_id)
+        result = await run_branch(
+            ctx, "searches", ev.query,
+            reuse_search(self.session_id, "Market Research", ev.query, lambda: self.run_agent(ctx, web_researcher, prompt)),
+        )
+        if result is None:
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name="Market researcher",
+                    msg=f"Search failed, going on without it: {get_fan_in(ctx, 'searches').failures.get(ev.query)}",
+                )
+            )
+            return CombineSearchesEvent()
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -123,33 +180,35 @@ class MarketResearchWorkflow(Workflow):
         
         # Store results
         ctx.data.setdefault("market_search_results", []).append(result.response.message.content)
-        
-        # Track completed searches
-        ctx.data["num_completed"] = ctx.data.get("num_completed", 0) + 1
+        record_findings(self.session_id, "Market Research", result.response.message.content)
         
         return CombineSearchesEvent()
     
     @step()
+    @checkpoint
     async def combine_searches(self, ctx: Context, ev: CombineSearchesEvent) -> AnalyzeMarketEvent:
-        if ctx.data.get("num_completed", 0) < self.num_queries:
+        searches = get_fan_in(ctx, "searches")
+        if not searches.settled:
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name="Research combiner",
-                    msg=f"Completed {ctx.data.get('num_completed', 0)} out of {self.num_queries} searches",
+                    msg=f"Completed {searches.progress()}",
                 )
             )
             return None
         
+        searches.check()
         ctx.write_event_to_stream(
             AgentRunEvent(
                 name="Research combiner",
-                msg=f"All {self.num_queries} searches have been completed, asking analyzer to analyze",
+                msg=f"Completed {searches.progress()}, asking analyzer to analyze",
             )
         )
 
         return AnalyzeMarketEvent(input="All search results have been combined")
 
     @step()
+    @checkpoint
     async def analyze(
         self, ctx: Context, ev: AnalyzeMarketEvent, market_analyzer: FunctionCallingAgent
     ) -> CritiqueAnalysisEvent | ReportEvent:
@@ -160,6 +219,8 @@ class MarketResearchWorkflow(Workflow):
                 Here are the findings from market research:
                 {ctx.data.get('market_search_results', [])}
                 
+                {ctx.data.get('seed') or ''}
+                
                 Please analyze these findings and provide a comprehensive market analysis report.
             """)
         else:
@@ -181,7 +242,7 @@ class MarketResearchWorkflow(Workflow):
         ctx.data["market_analysis_result"] = result.response.message.content
         
         # If we have reached the max number of critic iterations, return the final analysis to the reporter
-        if ctx.data.get("critic_iteration", 0) >= self.max_critic_iterations:
+        if ctx.data.get("critic_iteration", 0) >= self.settings.max_critic_iterations:
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name="Market analyzer",
@@ -189,6 +250,27 @@ class MarketResearchWorkflow(Workflow):
                 )
             )
             return ReportEvent(input=ctx.data["market_analysis_result"])
+        if self.deadline is not None and not self.deadline.allows(CRITIC_ROUND_SECONDS + REPORT_SECONDS):
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name="Market analyzer",
+                    msg=f"No time left for a critic round, returning final analysis to reporter",
+                )
+            )
+            return ReportEvent(input=ctx.data["market_analysis_result"])
+        if self.settings.speculative_critic:
+            score = score_draft(ctx.data["market_analysis_result"], MARKET_REPORT_SECTIONS)
+            if score.passes:
+                record_skipped_critic_round(self.session_id)
+                ctx.write_event_to_stream(
+                    AgentRunEvent(
+                        name="Market analyzer",
+                        msg=f"Draft scored {score}, skipping the critic round",
+                    )
+                )
+                return ReportEvent(input=ctx.data["market_analysis_result"])
+            # Refined from the gaps the score found while the critic runs
+            ctx.data["draft_feedback"] = score.feedback()
         
         # Otherwise, return the analysis to the critic
         ctx.write_event_to_stream(
@@ -201,14 +283,23 @@ class MarketResearchWorkflow(Workflow):
         return CritiqueAnalysisEvent(input=ctx.data["market_analysis_result"])
 
     @step()
+    @checkpoint
     async def critique(
-        self, ctx: Context, ev: CritiqueAnalysisEvent, market_critic: FunctionCallingAgent
+        self, ctx: Context, ev: CritiqueAnalysisEvent, market_critic: FunctionCallingAgent, market_analyzer: FunctionCallingAgent
     ) -> AnalyzeMarketEvent | ReportEvent:
-        result = await self.run_agent(
+        critique = self.run_agent(
             ctx, market_critic,
             f"""We are researching market size and segments for this task: {ctx.data['task']}
             Please critique this market analysis and provide actionable feedback: {ev.input}"""
         )
+        draft_feedback = ctx.data.pop("draft_feedback", None)
+        if draft_feedback:
+            result, refined = await asyncio.gather(
+                critique, self.run_agent(ctx, market_analyzer, speculative_refinement_prompt(draft_feedback))
+            )
+            ctx.data["market_analysis_result"] = refined.response.message.content
+        else:
+            result = await critique
         
         parser = JsonValidationHelper(MarketReportCritique, Settings.llm)
         parsed_response = await parser.validate_and_fix(result.response.message.content)
@@ -231,6 +322,7 @@ class MarketResearchWorkflow(Workflow):
         return AnalyzeMarketEvent(input=result.response.message.content)
 
     @step()
+    @checkpoint
     async def report(
         self, ctx: Context, ev: ReportEvent, reporter: FunctionCallingAgent
     ) -> StopEvent:
@@ -276,7 +368,9 @@ class MarketResearchWorkflow(Workflow):
 
     async def run_agent(self, ctx: Context, agent: FunctionCallingAgent, input: str) -> AgentRunResult:
         try:
-            handler = agent.run(input=input, streaming=False)
+            # The agent's tools read fewer pages as the deadline nears
+            with deadline_scope(self.deadline):
+                handler = track_workflow(agent.name, agent.run(input=input, streaming=False))
             async for event in handler.stream_events():
                 if type(event) is not StopEvent:
                     ctx.write_event_to_stream(event)
@@ -332,7 +426,8 @@ class MarketResearchWorkflow(Workflow):
             num_queries=num_queries
         )
         
-        output = await Settings.llm.acomplete(prompt)
+        async with get_scheduler().slot():
+            output = await Settings.llm.acomplete(prompt)
         validator = JsonValidationHelper(MarketSearchQueries, Settings.llm)  
         json_content = await validator.validate_and_fix(output.text)
         return json_content
@@ -341,16 +436,18 @@ def create_market_research_workflow(
     session_id: str,
     chat_history: List[ChatMessage],
     email: str | None = None,
-    num_queries: int = 3,
-    max_critic_iterations: int = 3,
     timeout: int = 1800,
+    deadline: Optional[float] = None,
+    settings: Optional[ResearchSettings] = None,
+    **overrides,
 ):
+    """`overrides` are settings of this run, e.g. `num_queries`, on top of `settings` or the deployment's settings."""
     workflow = MarketResearchWorkflow(
         session_id=session_id,
         chat_history=chat_history,
         timeout=timeout,
-        num_queries=num_queries,
-        max_critic_iterations=max_critic_iterations,
+        deadline=deadline,
+        settings=(settings or MARKET_RESEARCH_SETTINGS).with_overrides(**overrides),
     )
     
     # Create report team
@@ -4,19 +4,26 @@ from app.workflows.single import FunctionCallingAgent
 from llama_index.core.chat_engine.types import ChatMessage
 from llama_index.core.tools import FunctionTool
 from app.engine.tools.tavily import tavily_search
-from app.engine.tools.web_reader import read_webpage
+from app.engine.tools.web_reader import read_webpage, read_webpages
 
-def create_web_researcher(name_prefix: str, chat_history: List[ChatMessage], domains: List[str] | None = None):
+def create_web_researcher(name_prefix: str, chat_history: List[ChatMessage], domains: List[str] | None = None, session_id: str | None = None):
     def trend_search(search_query: str):
         return tavily_search(
             query=search_query,
             max_results=5,
             include_domains=domains
         )
+        
+    async def read_page(url: str):
+        return await read_webpage(url, session_id=session_id)
+        
+    async def read_pages(urls: List[str]):
+        return await read_webpages(urls, session_id=session_id)
     
     tools = [
         FunctionTool.from_defaults(trend_search, name="trend_search", description="Search the web for information about trends"),
-        FunctionTool.from_defaults(async_fn=read_webpage, name="read_webpage", description="Read and extract content from a webpage"),
+        FunctionTool.from_defaults(async_fn=read_page, name="read_webpage", description="Read and extract content from a webpage"),
+        FunctionTool.from_defaults(async_fn=read_pages, name="read_webpages", description="Read and extract content from several webpages at once, pass all the urls you want to read in a single call"),
     ]
 
     prompt_instructions = dedent("""
@@ -33,7 +40,7 @@ def create_web_researcher(name_prefix: str, chat_history: List[ChatMessage], dom
         
         Use the tools available to:
         1. Search web content with the `trend_search` tool
-        2. Read and extract detailed content with the `read_webpage` tool
+        2. Read and extract detailed content with the `read_webpage` tool, or with the `read_webpages` tool when you want to read several pages - pass all of their urls in a single call
         3. If you are not satisfied with the results, you can search again with a different query one more time, otherwise accept the results, note your findings and terminate.
         
         ### Output Format
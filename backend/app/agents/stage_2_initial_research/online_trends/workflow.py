@@ -6,9 +6,19 @@ from app.agents.stage_2_initial_research.online_trends.domain_researcher import
 from app.agents.stage_2_initial_research.online_trends.trend_analyzer import create_trend_analyzer
 from app.agents.stage_2_initial_research.online_trends.trend_critic import create_trend_critic
 from app.agents.stage_2_initial_research.online_trends.web_researcher import create_web_researcher
+from app.agents.stage_2_initial_research.settings import ResearchSettings
 from app.engine.tools.file_writer import write_file
 from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
+from app.workflows.fan_in import fan_out, get_fan_in, run_branch
 from app.workflows.single import AgentRunEvent, AgentRunResult, FunctionCallingAgent
+from app.services.cancellation import track_workflow
+from app.services.checkpoints import checkpoint
+from app.services.deadline import CRITIC_ROUND_SECONDS, REPORT_SECONDS, SEARCH_SECONDS, deadline_scope, to_deadline
+from app.services.evidence_store import known_evidence, record_findings
+from app.services.idea_cache import delta_research_task
+from app.services.research_artifacts import reuse_search
+from app.services.scheduler import get_scheduler
+from app.services.speculative_critic import record_skipped_critic_round, score_draft, speculative_refinement_prompt
 from llama_index.core.chat_engine.types import ChatMessage
 from llama_index.core.prompts.base import PromptTemplate
 from app.settings import Settings
@@ -71,20 +81,36 @@ class CritiqueTrendsEvent(Event):
 class ReportEvent(Event):
     input: str
 
+# Sections the analysis must cover, scored by the speculative critic
+TREND_REPORT_SECTIONS = (
+    "Idea Overview",
+    "Supporting Trends",
+    "Conflicting Trends",
+    "Emerging Opportunities",
+    "SWOT",
+    "Platform Insights",
+    "Recommendations",
+)
+
+ONLINE_TRENDS_SETTINGS = ResearchSettings.from_env("ONLINE_TRENDS")
+
 class OnlineTrendsWorkflow(Workflow):
     def __init__(self,
                 session_id: str,
                 chat_history: Optional[List[ChatMessage]] = None,
-                num_queries: int = 3,
                 timeout: int = 1800,
-                max_critic_iterations: int = 3):
+                deadline: Optional[float] = None,
+                settings: Optional[ResearchSettings] = None):
         super().__init__(timeout=timeout)
         self.session_id = session_id
         self.chat_history = chat_history or []
-        self.num_queries = num_queries
-        self.max_critic_iterations = max_critic_iterations
+        # Queries, critic iterations and search limits, see app.agents.stage_2_initial_research.settings
+        self.settings = settings or ONLINE_TRENDS_SETTINGS
+        # Epoch seconds the research must be done by, see app.services.deadline
+        self.deadline = to_deadline(deadline)
 
     @step()
+    @checkpoint
     async def start(self, ctx: Context, ev: StartEvent) -> ExecuteSearchEvent:
         ctx.data["task"] = ev.input
         ctx.write_event_to_stream(
@@ -94,11 +120,23 @@ class OnlineTrendsWorkflow(Workflow):
             )
         )
         
+        num_queries = self.settings.num_queries
+        task = ev.input
+        seed = ev.get("seed")
+        if seed:
+            # Earlier research on a similar idea covers most of it, only search for the delta
+            ctx.data["seed"] = seed
+            num_queries = max(1, num_queries // 2)
+            task = delta_research_task(ev.input, seed)
+        if self.deadline is not None:
+            # Only the searches there is time for, leaving time for the analysis and the report
+            num_queries = self.deadline.fit(num_queries, SEARCH_SECONDS, parallel=self.settings.search_workers, reserve=2 * REPORT_SECONDS)
+        
         # Generate search queries
         queries = await self._generate_search_queries(
-            task=ev.input,
+            task=task,
             chat_history=[],
-            num_queries=self.num_queries
+            num_queries=num_queries
         )
         
         ctx.write_event_to_stream(
@@ -107,18 +145,32 @@ class OnlineTrendsWorkflow(Workflow):
                 msg=f"Generated {len(queries.search_queries)} search queries, which are: {queries.search_queries}",
             )
         )
-        # Send events for each search
-        for query in queries.search_queries[:self.num_queries]:
+        # Send events for each search, each query is searched on the web and on the content domains
+        search_queries = list(dict.fromkeys(queries.search_queries[:num_queries]))
+        searches = fan_out(
+            ctx,
+            "searches",
+            [f"{source}: {query}" for query in search_queries for source in ("web", "domain")],
+            self.settings.search_timeout,
+            self.settings.min_search_results,
+        )
+        if not searches:
+            ctx.send_event(CombineSearchesEvent())
+        for query in search_queries:
             ctx.send_event(ExecuteSearchEvent(query=query))
             
         return None
 
-    @step(num_workers=3)
+    @step(num_workers=ONLINE_TRENDS_SETTINGS.search_workers)
+    @checkpoint
     async def execute_web_search(self, ctx: Context, ev: ExecuteSearchEvent) -> CombineSearchesEvent:
         prompt = f"""
             We are researching trends for this task: {ctx.data["task"]}
             Please analyze online trends using this query: {ev.query}
         """
+        known = known_evidence(self.session_id, exclude_stage="Online Trends")
+        if known:
+            prompt += f"\nAlready found by the other research of this session, don't search for it again:\n{known}\n"
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -127,15 +179,11 @@ class OnlineTrendsWorkflow(Workflow):
             )
         )
         
-        general_web_researcher = create_web_researcher(name_prefix="general", chat_history=[])
-        trendhunter_web_researcher = create_web_researcher(name_prefix="trendhunter", chat_history=[], domains=["trendhunter.com"])
-        reddit_web_researcher = create_web_researcher(name_prefix="reddit", chat_history=[], domains=["reddit.com"])
+        general_web_researcher = create_web_researcher(name_prefix="general", chat_history=[], session_id=self.session_id)
+        trendhunter_web_researcher = create_web_researcher(name_prefix="trendhunter", chat_history=[], domains=["trendhunter.com"], session_id=self.session_id)
+        reddit_web_researcher = create_web_researcher(name_prefix="reddit", chat_history=[], domains=["reddit.com"], session_id=self.session_id)
     
-        web_researcher_tasks = [
-            self.run_agent(ctx, general_web_researcher, prompt),
-            self.run_agent(ctx, trendhunter_web_researcher, prompt),
-            self.run_agent(ctx, reddit_web_researcher, prompt),
-        ]
+        web_researchers = [general_web_researcher, trendhunter_web_researcher, reddit_web_researcher]
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -144,23 +192,39 @@ class OnlineTrendsWorkflow(Workflow):
             )
         )
         
-        results = await asyncio.gather(*web_researcher_tasks)
+        results = await run_branch(
+            ctx, "searches", f"web: {ev.query}",
+            reuse_search(
+                self.session_id, "Online Trends", f"web: {ev.query}",
+                lambda: asyncio.gather(*(self.run_agent(ctx, researcher, prompt) for researcher in web_researchers)),
+            ),
+        )
+        if results is None:
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name="Web researcher",
+                    msg=f"Search failed, going on without it: {get_fan_in(ctx, 'searches').failures.get(f'web: {ev.query}')}",
+                )
+            )
+            return CombineSearchesEvent()
         
         for result in results:  
             # Store results
             ctx.data.setdefault("web_search_results", []).append(result.response.message.content)
-        
-        # Track completed searches
-        ctx.data["num_completed"] = ctx.data.get("num_completed", 0) + 1
+            record_findings(self.session_id, "Online Trends", result.response.message.content)
         
         return CombineSearchesEvent()
 
-    @step(num_workers=3)
+    @step(num_workers=ONLINE_TRENDS_SETTINGS.search_workers)
+    @checkpoint
     async def execute_domain_search(self, ctx: Context, ev: ExecuteSearchEvent) -> CombineSearchesEvent:
         prompt = f"""
             We are researching trends for this task: {ctx.data["task"]}
             Please analyze online content for trends using this query: {ev.query}
         """
+        known = known_evidence(self.session_id, exclude_stage="Online Trends")
+        if known:
+            prompt += f"\nAlready found by the other research of this session, don't search for it again:\n{known}\n"
         
         youtube_domain_researcher = create_domain_researcher(name_prefix="youtube", chat_history=[], domain="youtube.com")
         tiktok_domain_researcher = create_domain_researcher(name_prefix="tiktok", chat_history=[], domain="tiktok.com")
@@ -172,12 +236,23 @@ class OnlineTrendsWorkflow(Workflow):
             )
         )
         
-        domain_researcher_tasks = [
-            self.run_agent(ctx, youtube_domain_researcher, prompt),
-            self.run_agent(ctx, tiktok_domain_researcher, prompt),
-        ]
+        domain_researchers = [youtube_domain_researcher, tiktok_domain_researcher]
         
-        results = await asyncio.gather(*domain_researcher_tasks)
+        results = await run_branch(
+            ctx, "searches", f"domain: {ev.query}",
+            reuse_search(
+                self.session_id, "Online Trends", f"domain: {ev.query}",
+                lambda: asyncio.gather(*(self.run_agent(ctx, researcher, prompt) for researcher in domain_researchers)),
+            ),
+        )
+        if results is None:
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name="Domain researcher",
+                    msg=f"Search failed, going on without it: {get_fan_in(ctx, 'searches').failures.get(f'domain: {ev.query}')}",
+                )
+            )
+            return CombineSearchesEvent()
 
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -189,35 +264,36 @@ class OnlineTrendsWorkflow(Workflow):
         for result in results:
             # Store results
             ctx.data.setdefault("domain_search_results", []).append(result.response.message.content)
-        
-        # Track completed searches
-        ctx.data["num_completed"] = ctx.data.get("num_completed", 0) + 1
+            record_findings(self.session_id, "Online Trends", result.response.message.content)
         
         return CombineSearchesEvent()
     
     @step()
+    @checkpoint
     async def combine_searches(self, ctx: Context, ev: CombineSearchesEvent) -> AnalyzeTrendsEvent:
-        # Check if all searches are complete, double events to collect as we are getting both web and domain searches
-        num_searches = self.num_queries * 2
-        if ctx.data.get("num_completed", 0) < num_searches:
+        # Check if all searches are complete, both the web and the domain search of each query
+        searches = get_fan_in(ctx, "searches")
+        if not searches.settled:
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name="Research combiner",
-                    msg=f"Completed {ctx.data.get('num_completed', 0)} out of {num_searches} searches",
+                    msg=f"Completed {searches.progress()}",
                 )
             )
             return None
         
+        searches.check()
         ctx.write_event_to_stream(
             AgentRunEvent(
                 name="Research combiner",
-                msg=f"All {num_searches} searches have been completed, asking analyzer to analyze",
+                msg=f"Completed {searches.progress()}, asking analyzer to analyze",
             )
         )
 
         return AnalyzeTrendsEvent(input="All search results have been combined")
 
     @step()
+    @checkpoint
     async def analyze(
         self, ctx: Context, ev: AnalyzeTrendsEvent, trend_analyzer: FunctionCallingAgent
     ) -> CritiqueTrendsEvent | ReportEvent:
@@ -231,6 +307,8 @@ class OnlineTrendsWorkflow(Workflow):
                 Here are the findings from content trends across domains like youtube and tiktok:
                 {ctx.data.get('domain_search_results', [])}
                 
+                {ctx.data.get('seed') or ''}
+                
                 Please analyze these findings and provide a comprehensive trend analysis report.
             """)
         else:
@@ -252,7 +330,7 @@ class OnlineTrendsWorkflow(Workflow):
         ctx.data["trend_analysis_result"] = result.response.message.content
         
         # If we have reached the max number of critic iterations, return the final analysis to the reporter
-        if ctx.data.get("critic_iteration", 0) >= self.max_critic_iterations:
+        if ctx.data.get("critic_iteration", 0) >= self.settings.max_critic_iterations:
             ctx.write_event_to_stream(
                 AgentRunEvent(
                     name="Trend analyzer",
@@ -260,6 +338,27 @@ class OnlineTrendsWorkflow(Workflow):
                 )
             )
             return ReportEvent(input=ctx.data["trend_analysis_result"])
+        if self.deadline is not None and not self.deadline.allows(CRITIC_ROUND_SECONDS + REPORT_SECONDS):
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name="Trend analyzer",
+                    msg=f"No time left for a critic round, returning final analysis to reporter",
+                )
+            )
+            return ReportEvent(input=ctx.data["trend_analysis_result"])
+        if self.settings.speculative_critic:
+            score = score_draft(ctx.data["trend_analysis_result"], TREND_REPORT_SECTIONS)
+            if score.passes:
+                record_skipped_critic_round(self.session_id)
+                ctx.write_event_to_stream(
+                    AgentRunEvent(
+                        name="Trend analyzer",
+                        msg=f"Draft scored {score}, skipping the critic round",
+                    )
+                )
+                return ReportEvent(input=ctx.data["trend_analysis_result"])
+            # Refined from the gaps the score found while the critic runs
+            ctx.data["draft_feedback"] = score.feedback()
         
         # Otherwise, return the analysis to the critic
         ctx.write_event_to_stream(
@@ -272,14 +371,23 @@ class OnlineTrendsWorkflow(Workflow):
         return CritiqueTrendsEvent(input=ctx.data["trend_analysis_result"])
 
     @step()
+    @checkpoint
     async def critique(
-        self, ctx: Context, ev: CritiqueTrendsEvent, trend_critic: FunctionCallingAgent
+        self, ctx: Context, ev: CritiqueTrendsEvent, trend_critic: FunctionCallingAgent, trend_analyzer: FunctionCallingAgent
     ) -> AnalyzeTrendsEvent | ReportEvent:
-        result = await self.run_agent(
+        critique = self.run_agent(
             ctx, trend_critic,
             f"""We are researching trends for this task: {ctx.data['task']}
             Please critique this trend analysis and provide actionable feedback: {ev.input}"""
         )
+        draft_feedback = ctx.data.pop("draft_feedback", None)
+        if draft_feedback:
+            result, refined = await asyncio.gather(
+                critique, self.run_agent(ctx, trend_analyzer, speculative_refinement_prompt(draft_feedback))
+            )
+            ctx.data["trend_analysis_result"] = refined.response.message.content
+        else:
+            result = await critique
         
         parser = JsonValidationHelper(TrendReportCritique, Settings.llm)
         parsed_response = await parser.validate_and_fix(result.response.message.content)
@@ -302,6 +410,7 @@ class OnlineTrendsWorkflow(Workflow):
         return AnalyzeTrendsEvent(input=result.response.message.content)
 
     @step()
+    @checkpoint
     async def report(
         self, ctx: Context, ev: ReportEvent, reporter: FunctionCallingAgent
     ) -> StopEvent:
@@ -352,7 +461,9 @@ class OnlineTrendsWorkflow(Workflow):
 
     async def run_agent(self, ctx: Context, agent: FunctionCallingAgent, input: str) -> AgentRunResult:
         try:
-            handler = agent.run(input=input, streaming=False)
+            # The agent's tools read fewer pages as the deadline nears
+            with deadline_scope(self.deadline):
+                handler = track_workflow(agent.name, agent.run(input=input, streaming=False))
             async for event in handler.stream_events():
                 if type(event) is not StopEvent:
                     ctx.write_event_to_stream(event)
@@ -423,7 +534,8 @@ class OnlineTrendsWorkflow(Workflow):
             num_queries=num_queries
         )
         
-        output = await Settings.llm.acomplete(prompt)
+        async with get_scheduler().slot():
+            output = await Settings.llm.acomplete(prompt)
         validator = JsonValidationHelper(TrendSearchQueries, Settings.llm)  
         json_content = await validator.validate_and_fix(output.text)
         return json_content
@@ -432,16 +544,18 @@ def create_online_trends_workflow(
     session_id: str,
     chat_history: List[ChatMessage],
     email: str | None = None,
-    num_queries: int = 3,
-    max_critic_iterations: int = 3,
     timeout: int = 1800,
+    deadline: Optional[float] = None,
+    settings: Optional[ResearchSettings] = None,
+    **overrides,
 ):
+    """`overrides` are settings of this run, e.g. `num_queries`, on top of `settings` or the deployment's settings."""
     workflow = OnlineTrendsWorkflow(
         session_id=session_id,
         timeout=timeout,
         chat_history=chat_history,
-        num_queries=num_queries,
-        max_critic_iterations=max_critic_iterations,
+        deadline=deadline,
+        settings=(settings or ONLINE_TRENDS_SETTINGS).with_overrides(**overrides),
     )
     
     # Create report team
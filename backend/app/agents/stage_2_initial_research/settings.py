@@ -0,0 +1,75 @@
+"""
+Settings of the research workflows of stage 2, one `ResearchSettings` per workflow.
+
+Each workflow reads its settings from the environment when its module is imported, with the
+workflow's prefix, e.g. `MARKET_RESEARCH_NUM_QUERIES=4` or `COMPETITOR_ANALYSIS_SEARCH_WORKERS=3`,
+and the factory of the workflow applies the overrides of a run (e.g. the kwargs of a pipeline
+stage) on top of them.
+
+`search_workers` is the `num_workers` of the search steps, fixed when the workflow class is
+defined, so it can only be set per deployment. By default it is the workflow's share of the
+global scheduler's capacity: a wider step only has its searches wait for a scheduler slot, a
+narrower one leaves slots unused while searches wait for a worker.
+"""
+
+import os
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+from app.services.scheduler import SCHEDULER_MAX_CONCURRENCY
+from app.services.speculative_critic import SPECULATIVE_CRITIC_ENABLED
+
+# Research stages running at once in a session, sharing the scheduler's slots
+RESEARCH_STAGES = 4
+
+# Seconds the searches of a research stage have, the analysis goes on without the ones still
+# running then (0 waits for all of them)
+RESEARCH_SEARCH_TIMEOUT = int(os.getenv("RESEARCH_SEARCH_TIMEOUT", "300"))
+
+
+def default_search_workers() -> int:
+    return max(1, SCHEDULER_MAX_CONCURRENCY // RESEARCH_STAGES)
+
+
+class ResearchSettings(BaseModel):
+    # Searches (and competitor detail searches) of a run executed at once
+    search_workers: int = Field(default_factory=default_search_workers, ge=1)
+    num_queries: int = Field(default=2, ge=1)
+    # Competitors researched in detail, competitor analysis only
+    num_competitors: int = Field(default=4, ge=1)
+    max_critic_iterations: int = Field(default=2, ge=0)
+    # The searches still running after `search_timeout` seconds are given up, the analysis
+    # goes on with the others if at least `min_search_results` succeeded
+    search_timeout: Optional[float] = RESEARCH_SEARCH_TIMEOUT or None
+    min_search_results: int = Field(default=1, ge=0)
+    # Score each draft first, skip the critic round for good drafts and refine the others while
+    # the critic runs (see app.services.speculative_critic)
+    speculative_critic: bool = SPECULATIVE_CRITIC_ENABLED
+
+    @field_validator("search_timeout")
+    @classmethod
+    def _wait_for_all(cls, value: Optional[float]) -> Optional[float]:
+        # 0 waits for all the searches, like RESEARCH_SEARCH_TIMEOUT
+        return value or None
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults: Any) -> "ResearchSettings":
+        """The settings with `defaults`, overridden by the `<PREFIX>_<SETTING>` environment variables set."""
+        values = dict(defaults)
+        for name in cls.model_fields:
+            value = os.getenv(f"{prefix}_{name.upper()}")
+            if value:
+                values[name] = value
+        return cls.model_validate(values)
+
+    def with_overrides(self, **overrides: Any) -> "ResearchSettings":
+        """A copy of the settings with the settings of a run, validated."""
+        if not overrides:
+            return self
+        unknown = set(overrides) - set(self.model_fields)
+        if unknown:
+            raise TypeError(f"Unknown research settings: {', '.join(sorted(unknown))}")
+        if overrides.get("search_workers", self.search_workers) != self.search_workers:
+            raise TypeError("search_workers can't be set per run, set it in the environment")
+        return self.model_validate({**self.model_dump(), **overrides})
@@ -1,9 +1,11 @@
 from .podcaster.workflow import create_podcast_workflow
 from .executive_summarizer.workflow import create_executive_summary_workflow
+from .executive_summarizer.outline_writer import create_outline_drafter
 from .qna_researcher.researcher import create_researcher
 
 __all__ = [
     "create_podcast_workflow",
     "create_executive_summary_workflow",
+    "create_outline_drafter",
     "create_researcher",
 ]
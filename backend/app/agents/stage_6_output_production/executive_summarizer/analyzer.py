@@ -4,15 +4,14 @@ from app.workflows.single import FunctionCallingAgent
 from llama_index.core.chat_engine.types import ChatMessage
 from llama_index.core.tools import BaseTool, QueryEngineTool, ToolMetadata
 from app.engine.index import IndexConfig, get_index
+from app.utils.paths import get_session_data_path
 from llama_index.indices.managed.llama_cloud import LlamaCloudIndex
 from llama_index.core import VectorStoreIndex, SimpleDirectoryReader
 import os
-from pathlib import Path
 
 def _create_query_tools(session_id: str) -> List[BaseTool]:
     """Create query tools for the session's research data"""
-    current_file = Path(__file__)
-    data_dir = current_file.parent.parent.parent.parent.parent / "data" / session_id
+    data_dir = get_session_data_path(session_id)
     if not data_dir.exists():
         data_dir.mkdir(parents=True, exist_ok=True)
     documents = SimpleDirectoryReader(
@@ -48,4 +48,44 @@ def create_outline_writer(chat_history: List[ChatMessage]) -> FunctionCallingAge
         description="Expert at creating executive summary outlines from research data",
         tools=[],
         chat_history=chat_history
-    ) 
\ No newline at end of file
+    ) 
+
+def create_outline_drafter(chat_history: List[ChatMessage]) -> FunctionCallingAgent:
+    system_prompt = dedent("""
+        ## Context
+        You are working in a company that takes in a client's startup idea and your company does all the research and analysis on the idea to ensure it has the best chance of success.
+        Your junior analysts are researching different parts of the idea (market research, customer insights, online trends and competitor analysis). Their research comes in one part at a time, and you draft the executive summary outline as it arrives so the final outline can be written as soon as the last part is done.
+        
+        ## Instructions
+        Given the research of one analyst and your drafts so far, extend the draft outline with the findings this research supports. Keep the findings from your previous drafts unless the new research contradicts them.
+
+        ## Guidelines
+        - Only draft the sections the research you have seen so far supports, the remaining sections are written later
+        - **Important**: Keep the key examples, statistics, quotes and sources of each finding, they are needed for the final outline
+        
+        ## Report Structure
+        The report structure is already fixed following the Sequoia pitchdeck template, which is:
+        - Problem, Solution, Why Now?, Unique Value Proposition, Market Size, Competition, Feasibility
+        
+        Return a JSON outline following this structure:
+        {
+            "title": "Clear, specific title for the executive summary",
+            "overview": "Brief overview of what the research covers",
+            "key_findings": [
+                {
+                    "finding": "Detailed finding with supporting evidence",
+                    "section": "Problem | Solution | Why Now? | Unique Value Proposition | Market Size | Competition | Feasibility",
+                    "supporting_data": "Relevant stories, facts, quotes, or case studies that support this finding in full detail and context",
+                    "sources": "List of sources that support this finding"
+                }
+            ]
+        }
+    """)
+
+    return FunctionCallingAgent(
+        name="Outline Drafter",
+        system_prompt=system_prompt,
+        description="Drafts the executive summary outline while the research is still coming in",
+        tools=[],
+        chat_history=chat_history
+    )
@@ -1,10 +1,16 @@
+import asyncio
 from textwrap import dedent
 from typing import List, Optional
-from pathlib import Path
+from app.utils.paths import get_session_data_path
 from app.agents.stage_6_output_production.executive_summarizer.analyzer import create_analyzer
 from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
 from llama_index.core.chat_engine.types import ChatMessage
 from app.workflows.single import AgentRunEvent, AgentRunResult, FunctionCallingAgent
+from app.services.cancellation import track_workflow
+from app.services.checkpoints import checkpoint
+from app.services.deadline import CRITIC_ROUND_SECONDS, REPORT_SECONDS, to_deadline
+from app.services.evidence_store import known_evidence
+from app.services.speculative_critic import record_skipped_critic_round, score_draft, speculative_refinement_prompt
 from app.settings import Settings
 from app.utils.json_validator import JsonValidationHelper
 from .models import ExecutiveSummaryOutline, ExecutiveCritique
@@ -28,26 +34,49 @@ class CritiqueAnalysisEvent(Event):
 class GenerateReportEvent(Event):
     analysis: str
 
+# Sections the analysis must cover, scored by the speculative critic
+EXECUTIVE_SUMMARY_SECTIONS = (
+    "Executive Summary",
+    "Problem Analysis",
+    "Solution Analysis",
+    "Why Now",
+    "Unique Value Proposition",
+    "Market Size",
+    "Competition",
+    "Feasibility",
+    "Key Recommendations",
+    "Risk Analysis",
+    "Next Steps",
+)
+
 class ExecutiveSummaryWorkflow(Workflow):
     def __init__(self, 
                  session_id: str,
                  chat_history: Optional[List[ChatMessage]] = None,
                  email: Optional[str] = None,
                  timeout: int = 1800,
-                 max_iterations: int = 3):
+                 max_iterations: int = 3,
+                 deadline: Optional[float] = None,
+                 speculative_critic: bool = False):
         super().__init__(timeout=timeout)
         self.chat_history = chat_history or []
         self.session_id = session_id
         self.email = email
         self.max_iterations = max_iterations
+        # Epoch seconds the summary must be done by, see app.services.deadline
+        self.deadline = to_deadline(deadline)
+        # Score each draft first, skip the critic round for good drafts and refine the others while the critic runs
+        self.speculative_critic = speculative_critic
         
     @step()
+    @checkpoint
     async def start(self, ctx: Context, ev: StartEvent) -> GenerateOutlineEvent:
         ctx.data["task"] = ev.input
+        # Outline drafted while the research was still running, see IdeatorIncWorkflow
+        ctx.data["draft_outline"] = ev.get("draft_outline")
         
-        # Read all research files from data/<session_id> directory
-        current_file = Path(__file__)
-        data_dir = current_file.parent.parent.parent.parent.parent / "data" / self.session_id
+        # Read all research files from data/<session_id> directory, the run's own within a research run
+        data_dir = get_session_data_path(self.session_id)
         research_files = list(data_dir.glob("**/*"))
         
         research_content = []
@@ -59,6 +88,8 @@ class ExecutiveSummaryWorkflow(Workflow):
         
         research = dedent("\n".join(research_content))
         ctx.data["research"] = research
+        # Quotes, stats and sources of the research stages, indexed as they were found
+        ctx.data["evidence"] = known_evidence(self.session_id, limit=100)
         
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -73,16 +104,27 @@ class ExecutiveSummaryWorkflow(Workflow):
         return GenerateOutlineEvent()
 
     @step()
+    @checkpoint
     async def generate_outline(self, ctx: Context, ev: GenerateOutlineEvent, outline_writer: FunctionCallingAgent) -> AnalyzeContentEvent:
-        prompt = dedent(f"""
-            Generate an executive summary outline based on the following research done by 4 other junior analysts:
-            {ctx.data["research"]}
-        """)
+        if ctx.data.get("draft_outline"):
+            prompt = dedent(f"""
+                Here is a draft of the executive summary outline, written while the research below was still coming in:
+                {ctx.data["draft_outline"]}
+                
+                Refine it into the final executive summary outline based on the following research done by 4 other junior analysts.
+                Keep the findings of the draft that still hold and add the ones from the research that wasn't drafted yet:
+                {ctx.data["research"]}
+            """)
+        else:
+            prompt = dedent(f"""
+                Generate an executive summary outline based on the following research done by 4 other junior analysts:
+                {ctx.data["research"]}
+            """)
         
         ctx.write_event_to_stream(
             AgentRunEvent(
                 name=outline_writer.name,
-                msg=f"Generating executive summary outline",
+                msg=f"Refining the draft executive summary outline" if ctx.data.get("draft_outline") else f"Generating executive summary outline",
             )
         )
         
@@ -100,6 +142,7 @@ class ExecutiveSummaryWorkflow(Workflow):
         return AnalyzeContentEvent(analysis=result.response.message.content)
 
     @step()
+    @checkpoint
     async def analyze(
         self, ctx: Context, ev: AnalyzeContentEvent, analyzer: FunctionCallingAgent
     ) -> CritiqueAnalysisEvent | GenerateReportEvent:
@@ -113,6 +156,9 @@ class ExecutiveSummaryWorkflow(Workflow):
                 Research:
                 {ctx.data["research"]}
                 
+                Evidence found by the research, cite its sources for the key numbers and claims:
+                {ctx.data.get("evidence") or "None"}
+                
                 Please analyze this data and provide a comprehensive executive summary analysis.
             """)
         else:
@@ -140,6 +186,27 @@ class ExecutiveSummaryWorkflow(Workflow):
                 )
             )
             return GenerateReportEvent(analysis=ctx.data["analysis_result"])
+        if self.deadline is not None and not self.deadline.allows(CRITIC_ROUND_SECONDS + REPORT_SECONDS):
+            ctx.write_event_to_stream(
+                AgentRunEvent(
+                    name="Executive analyzer",
+                    msg=f"No time left for a critic round, returning final analysis to reporter",
+                )
+            )
+            return GenerateReportEvent(analysis=ctx.data["analysis_result"])
+        if self.speculative_critic:
+            score = score_draft(ctx.data["analysis_result"], EXECUTIVE_SUMMARY_SECTIONS)
+            if score.passes:
+                record_skipped_critic_round(self.session_id)
+                ctx.write_event_to_stream(
+                    AgentRunEvent(
+                        name="Executive analyzer",
+                        msg=f"Draft scored {score}, skipping the critic round",
+                    )
+                )
+                return GenerateReportEvent(analysis=ctx.data["analysis_result"])
+            # Refined from the gaps the score found while the critic runs
+            ctx.data["draft_feedback"] = score.feedback()
         
         # Otherwise, return the analysis to the critic
         ctx.write_event_to_stream(
@@ -152,13 +219,22 @@ class ExecutiveSummaryWorkflow(Workflow):
         return CritiqueAnalysisEvent(analysis=ctx.data["analysis_result"])
 
     @step()
+    @checkpoint
     async def critique(
-        self, ctx: Context, ev: CritiqueAnalysisEvent, critic: FunctionCallingAgent
+        self, ctx: Context, ev: CritiqueAnalysisEvent, critic: FunctionCallingAgent, analyzer: FunctionCallingAgent
     ) -> AnalyzeContentEvent | GenerateReportEvent:
-        result = await self.run_agent(
+        critique = self.run_agent(
             ctx, critic,
             f"""Please critique this executive summary analysis and provide actionable feedback: {ev.analysis}"""
         )
+        draft_feedback = ctx.data.pop("draft_feedback", None)
+        if draft_feedback:
+            result, refined = await asyncio.gather(
+                critique, self.run_agent(ctx, analyzer, speculative_refinement_prompt(draft_feedback))
+            )
+            ctx.data["analysis_result"] = refined.response.message.content
+        else:
+            result = await critique
         
         parser = JsonValidationHelper(ExecutiveCritique, Settings.llm)
         parsed_response = await parser.validate_and_fix(result.response.message.content)
@@ -181,6 +257,7 @@ class ExecutiveSummaryWorkflow(Workflow):
         return AnalyzeContentEvent(analysis=result.response.message.content)
 
     @step()
+    @checkpoint
     async def generate_report(self, ctx: Context, ev: GenerateReportEvent, reporter: FunctionCallingAgent) -> StopEvent:
         prompt = dedent(f"""
             Generate a comprehensive executive summary report based on this analysis:
@@ -207,7 +284,7 @@ class ExecutiveSummaryWorkflow(Workflow):
 
     async def run_agent(self, ctx: Context, agent: FunctionCallingAgent, input: str) -> AgentRunResult:
         try:
-            handler = agent.run(input=input, streaming=False)
+            handler = track_workflow(agent.name, agent.run(input=input, streaming=False))
             async for event in handler.stream_events():
                 if type(event) is not StopEvent:
                     ctx.write_event_to_stream(event)
@@ -221,13 +298,15 @@ class ExecutiveSummaryWorkflow(Workflow):
             )
             raise
 
-def create_executive_summary_workflow(session_id: str, chat_history: List[ChatMessage], email: Optional[str] = None, timeout: int = 1800, max_iterations: int = 3):
+def create_executive_summary_workflow(session_id: str, chat_history: List[ChatMessage], email: Optional[str] = None, timeout: int = 1800, max_iterations: int = 3, deadline: Optional[float] = None, speculative_critic: bool = False):
     workflow = ExecutiveSummaryWorkflow(
         session_id=session_id,
         chat_history=chat_history,
         email=email,
         timeout=timeout,
-        max_iterations=max_iterations
+        max_iterations=max_iterations,
+        deadline=deadline,
+        speculative_critic=speculative_critic,
     )
     
     outline_writer = create_outline_writer(chat_history)
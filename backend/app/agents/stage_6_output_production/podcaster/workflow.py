@@ -1,13 +1,17 @@
+import asyncio
 from textwrap import dedent
 from typing import List, Optional, Dict, Any
 from app.engine.tools.podcast_generator import ElevenLabsGenerator
 from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
 from llama_index.core.chat_engine.types import ChatMessage
 from app.workflows.single import AgentRunEvent, AgentRunResult, FunctionCallingAgent
+from app.services.cancellation import cancellable, track_workflow
+from app.services.checkpoints import checkpoint
+from app.services.speculative_critic import record_skipped_critic_round, score_draft
 from app.settings import Settings
 from app.utils.json_validator import JsonValidationHelper
 from .models import PodcastOutline, PodcastScript, ScriptCritique
-from pathlib import Path
+from app.utils.paths import get_session_data_path
 import json
 import logging
 from .outline_writer import create_outline_writer
@@ -36,19 +40,22 @@ class PodcastWorkflow(Workflow):
                  session_id: str,
                  chat_history: Optional[List[ChatMessage]] = None,
                  timeout: int = 1800,
-                 max_iterations: int = 3):
+                 max_iterations: int = 3,
+                 speculative_critic: bool = False):
         super().__init__(timeout=timeout)
         self.chat_history = chat_history or []
         self.max_iterations = max_iterations
         self.session_id = session_id
+        # Skip the critic round for scripts covering all the outline topics
+        self.speculative_critic = speculative_critic
         
     @step()
+    @checkpoint
     async def start(self, ctx: Context, ev: StartEvent) -> GenerateOutlineEvent:
         ctx.data["task"] = ev.input
         
-        # Read all research files from data/<session_id> directory
-        current_file = Path(__file__)
-        data_dir = current_file.parent.parent.parent.parent.parent / "data" / self.session_id
+        # Read all research files from data/<session_id> directory, the run's own within a research run
+        data_dir = get_session_data_path(self.session_id)
         research_files = list(data_dir.glob("**/*"))
         
         research_content = []
@@ -80,6 +87,7 @@ class PodcastWorkflow(Workflow):
         return GenerateOutlineEvent()
 
     @step()
+    @checkpoint
     async def generate_outline(self, ctx: Context, ev: GenerateOutlineEvent, outline_writer: FunctionCallingAgent) -> WriteScriptEvent:
         result = await self.run_agent(ctx, outline_writer, ctx.data["research"])
         validator = JsonValidationHelper(PodcastOutline, Settings.llm)
@@ -91,10 +99,12 @@ class PodcastWorkflow(Workflow):
             )
         )
         ctx.data["podcast_title"] = outline.title
+        ctx.data["podcast_topics"] = [segment.topic for segment in outline.segments]
         
         return WriteScriptEvent(outline=outline)
 
     @step()
+    @checkpoint
     async def generate_script(self, ctx: Context, ev: WriteScriptEvent | ReviseScriptEvent, script_writer: FunctionCallingAgent) -> CritiqueScriptEvent:
         if isinstance(ev, WriteScriptEvent):
             prompt = dedent(f"""
@@ -124,6 +134,19 @@ class PodcastWorkflow(Workflow):
                 )
             )
             return GenerateAudioEvent(script=script)
+        if self.speculative_critic:
+            score = score_draft(
+                " ".join(segment.text for segment in script.segments), ctx.data.get("podcast_topics", []), cited=False
+            )
+            if score.passes:
+                record_skipped_critic_round(self.session_id)
+                ctx.write_event_to_stream(
+                    AgentRunEvent(
+                        name="Podcast Workflow",
+                        msg=f"Script scored {score}, skipping the critique and generating audio"
+                    )
+                )
+                return GenerateAudioEvent(script=script)
         
         ctx.data["critique_iteration"] = ctx.data.get("critique_iteration", 0) + 1
         ctx.write_event_to_stream(
@@ -135,6 +158,7 @@ class PodcastWorkflow(Workflow):
         return CritiqueScriptEvent(script=script)
 
     @step()
+    @checkpoint
     async def critique_script(self, ctx: Context, ev: CritiqueScriptEvent, script_critic: FunctionCallingAgent) -> ReviseScriptEvent | GenerateAudioEvent:
         prompt = dedent(f"""
             Here is the podcast script, critique it:
@@ -162,6 +186,7 @@ class PodcastWorkflow(Workflow):
         return ReviseScriptEvent(critique=critique)
 
     @step()
+    @checkpoint
     async def generate_audio(self, ctx: Context, ev: GenerateAudioEvent) -> StopEvent:
         try:
             segments = [(segment.speaker.strip(), segment.text.strip().strip('"')) for segment in ev.script.segments]
@@ -174,7 +199,11 @@ class PodcastWorkflow(Workflow):
                 )
             )
             
-            output_path = elevenlabs_generator.generate_podcast(segments, filename=ctx.data["podcast_title"], session_id=self.session_id)
+            # Off the event loop, the segments are generated one after the other
+            with cancellable("http", "ElevenLabs"):
+                output_path = await asyncio.to_thread(
+                    elevenlabs_generator.generate_podcast, segments, filename=ctx.data["podcast_title"], session_id=self.session_id
+                )
             
             ctx.write_event_to_stream(
                 AgentRunEvent(
@@ -191,7 +220,7 @@ class PodcastWorkflow(Workflow):
         
     async def run_agent(self, ctx: Context, agent: FunctionCallingAgent, input: str) -> AgentRunResult:
         try:
-            handler = agent.run(input=input, streaming=False)
+            handler = track_workflow(agent.name, agent.run(input=input, streaming=False))
             async for event in handler.stream_events():
                 if type(event) is not StopEvent:
                     if isinstance(event, AgentRunEvent):
@@ -207,12 +236,13 @@ class PodcastWorkflow(Workflow):
             )
             raise
 
-def create_podcast_workflow(session_id: str, chat_history: List[ChatMessage], timeout: int = 1800, max_iterations: int = 3):
+def create_podcast_workflow(session_id: str, chat_history: List[ChatMessage], timeout: int = 1800, max_iterations: int = 3, speculative_critic: bool = False):
     workflow = PodcastWorkflow(
         session_id=session_id,
         chat_history=chat_history,
         timeout=timeout,
-        max_iterations=max_iterations
+        max_iterations=max_iterations,
+        speculative_critic=speculative_critic,
     )
     
     outline_writer = create_outline_writer(chat_history)
@@ -4,6 +4,7 @@ from typing import AsyncGenerator, List, Optional
 from app.agents.example.analyst import create_analyst
 from app.agents.example.reporter import create_reporter
 from app.agents.example.researcher import create_researcher
+from app.services.cancellation import track_workflow
 from app.workflows.single import AgentRunEvent, AgentRunResult, FunctionCallingAgent
 from llama_index.core.chat_engine.types import ChatMessage
 from llama_index.core.prompts import PromptTemplate
@@ -186,7 +187,7 @@ class FinancialReportWorkflow(Workflow):
         input: str,
         streaming: bool = False,
     ) -> AgentRunResult | AsyncGenerator:
-        handler = agent.run(input=input, streaming=streaming)
+        handler = track_workflow(agent.name, agent.run(input=input, streaming=streaming))
         # bubble all events while running the executor to the planner
         async for event in handler.stream_events():
             # Don't write the StopEvent from sub task to the stream
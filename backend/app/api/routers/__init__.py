@@ -4,12 +4,18 @@ from .chat import chat_router  # noqa: F401
 from .chat_config import config_router  # noqa: F401
 from .upload import file_upload_router  # noqa: F401
 from .health import health_router  # noqa: F401
+from .sessions import sessions_router  # noqa: F401
+from .jobs import jobs_router  # noqa: F401
+from .batches import batches_router  # noqa: F401
 
 api_router = APIRouter()
 api_router.include_router(chat_router, prefix="/chat")
 api_router.include_router(config_router, prefix="/chat/config")
 api_router.include_router(file_upload_router, prefix="/chat/upload")
 api_router.include_router(health_router, prefix="/health")
+api_router.include_router(sessions_router, prefix="/sessions")
+api_router.include_router(jobs_router, prefix="/jobs")
+api_router.include_router(batches_router, prefix="/batches")
 
 # Dynamically adding additional routers if they exist
 try:
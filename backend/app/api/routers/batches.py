@@ -0,0 +1,67 @@
+import base64
+import logging
+from typing import Any, List, Optional
+
+from app.services.batch import get_batch_runner, parse_ideas
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+batches_router = r = APIRouter()
+
+logger = logging.getLogger("uvicorn")
+
+
+class BatchRequest(BaseModel):
+    # The ideas, or an ideas file (.txt, .csv or .jsonl) as base64
+    ideas: List[str] | None = None
+    base64: str | None = None
+    name: str | None = None
+    # Chat data of the research sessions, e.g. {"fast": true}
+    data: Any = None
+    email: str | None = None
+
+
+@r.post("")
+async def submit_batch(request: BatchRequest):
+    """Research a batch of ideas in the background, the summary is read from `/api/batches/{batch_id}`."""
+    ideas = request.ideas or []
+    if request.base64:
+        content = base64.b64decode(request.base64.split(",")[-1]).decode("utf-8")
+        ideas = ideas + parse_ideas(content, request.name or "ideas.txt")
+    try:
+        batch = await get_batch_runner().submit(ideas, params=request.data, email=request.email)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    logger.info(f"Submitted batch {batch.id} of {len(batch.ideas)} ideas")
+    return {
+        "batch_id": batch.id,
+        "ideas": len(batch.ideas),
+        "clusters": batch.clusters,
+        "summary_url": f"/api/batches/{batch.id}",
+    }
+
+
+@r.get("/{batch_id}")
+async def get_batch(batch_id: str, format: Optional[str] = None):
+    """The summary of a batch, as JSON or as a `csv` or `markdown` table."""
+    runner = get_batch_runner()
+    batch = runner.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch not found")
+    summary = runner.summary(batch)
+    if format == "csv":
+        return PlainTextResponse(summary.to_csv(), media_type="text/csv")
+    if format == "markdown":
+        return PlainTextResponse(summary.to_markdown(), media_type="text/markdown")
+    return summary
+
+
+@r.post("/{batch_id}/cancel")
+async def cancel_batch(batch_id: str):
+    """Cancel the ideas of a batch still queued or running."""
+    runner = get_batch_runner()
+    batch = await runner.cancel(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch not found")
+    return runner.summary(batch)
@@ -1,4 +1,5 @@
 import logging
+import time
 
 from app.api.routers.models import (
     ChatData,
@@ -6,7 +7,13 @@ from app.api.routers.models import (
 from app.api.routers.vercel_response import VercelStreamResponse
 from app.engine.engine import get_chat_engine
 from app.agents.stage_6_output_production import create_researcher
+from app.services.admission import ADMISSION_OVERLOAD_POLICY, get_admission_controller
+from app.services.cancellation import cancel_scope, track_workflow
+from app.services.jobs import get_job_runner
+from app.services.scheduler import Priority, scheduling
+from app.services.single_flight import get_single_flight
 from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, status
+from fastapi.responses import JSONResponse
 
 chat_router = r = APIRouter()
 
@@ -19,6 +26,30 @@ async def chat(
     data: ChatData,
     background_tasks: BackgroundTasks,
 ):
+    # The same idea submitted again while its research runs, e.g. from another tab, follows that run
+    single_flight = get_single_flight()
+    run = single_flight.attach(data.sessionId, data.get_last_message_content())
+    if run is not None:
+        return VercelStreamResponse(
+            request=request,
+            chat_data=data,
+            event_handler=run.handler,
+            events=run.subscribe(),
+            on_disconnect=run.unsubscribe,
+        )
+
+    admission = get_admission_controller()
+    decision = admission.check()
+    if not decision.admitted:
+        logger.warning(f"Research session {data.sessionId} not admitted: {decision.reason}")
+        if ADMISSION_OVERLOAD_POLICY == "queue":
+            return queue_research(data, decision.reason)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"The server is busy: {decision.reason}. Please retry later.",
+            headers={"Retry-After": str(decision.retry_after)},
+        )
+
     try:
         last_message_content = data.get_last_message_content()
         messages = data.get_history_messages(include_agent_messages=True)
@@ -30,14 +61,24 @@ async def chat(
         params = data.data or {}
         logger.info(f"Email: {data.email}")
         logger.info(f"Session ID: {data.sessionId}")
-        engine = get_chat_engine(session_id=data.sessionId, chat_history=messages, email=data.email, params=params, mode="prod")
 
-        event_handler = engine.run(input=last_message_content, streaming=True)
+        def start_research():
+            engine = get_chat_engine(session_id=data.sessionId, chat_history=messages, email=data.email, params=params, mode="prod")
+            # Pass `"resume": true` in the chat data to continue an interrupted session from its checkpoints
+            return track_workflow("Ideator Inc", engine.run(input=last_message_content, streaming=True, resume=bool(params.get("resume"))))
+
+        # The run writes its files to a data directory of its own, see app.services.single_flight
+        # The last client disconnecting cancels the whole workflow tree of the research, see app.services.cancellation
+        with scheduling(data.sessionId, Priority.BATCH), cancel_scope(data.sessionId):
+            run, started = single_flight.join_or_start(data.sessionId, last_message_content, start_research)
+        if started:
+            admission.track(run.handler, data.sessionId)
         return VercelStreamResponse(
             request=request,
             chat_data=data,
-            event_handler=event_handler,
-            events=engine.stream_events(),
+            event_handler=run.handler,
+            events=run.subscribe(),
+            on_disconnect=run.unsubscribe,
         )
     except Exception as e:
         logger.exception("Error in chat engine", exc_info=True)
@@ -46,6 +87,24 @@ async def chat(
             detail=f"Error in chat engine: {e}",
         ) from e
 
+def queue_research(data: ChatData, reason: str) -> JSONResponse:
+    """Start the research as a background job once there is room, see `/api/jobs`."""
+    runner = get_job_runner()
+    position = runner.queue_size()
+    job = runner.submit("research", data.model_dump(mode="json"), session_id=data.sessionId)
+    estimated_wait = get_admission_controller().estimate_wait(position)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "job_id": job.id,
+            "status": job.status,
+            "reason": reason,
+            "queue_position": position + 1,
+            "estimated_start_at": time.time() + estimated_wait,
+            "events_url": f"/api/jobs/{job.id}/events",
+        },
+    )
+
 @r.post("/qna")
 async def research_qna(
     request: Request,
@@ -54,16 +113,18 @@ async def research_qna(
     try:
         agent = create_researcher(session_id=data.sessionId, chat_history=data.get_history_messages(include_agent_messages=True), email=data.email)
         
-        event_handler = agent.run(
-            input=data.get_last_message_content(),
-            streaming=True
-        )
+        with scheduling(data.sessionId, Priority.INTERACTIVE), cancel_scope(data.sessionId, "research Q&A") as scope:
+            event_handler = track_workflow(agent.name, agent.run(
+                input=data.get_last_message_content(),
+                streaming=True
+            ))
         
         return VercelStreamResponse(
             request=request,
             chat_data=data,
             event_handler=event_handler,
             events=agent.stream_events(),
+            cancel_scope=scope,
         )
     except Exception as e:
         logger.exception("Error in research QA", exc_info=True)
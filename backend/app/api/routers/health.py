@@ -1,6 +1,10 @@
 from fastapi import APIRouter
 from datetime import datetime
 
+from app.services.admission import get_admission_controller
+from app.services.scheduler import get_scheduler
+from app.services.upstreams import get_upstreams_health
+
 health_router = APIRouter(prefix="/health", tags=["Health"])
 
 @health_router.get("")
@@ -9,5 +13,8 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
         "service": "ideabot",
-        "version": "1.0.0"  # You can make this dynamic based on your version
+        "version": "1.0.0",  # You can make this dynamic based on your version
+        "upstreams": get_upstreams_health(),
+        "scheduler": get_scheduler().snapshot(),
+        "admission": get_admission_controller().snapshot(),
     }
\ No newline at end of file
@@ -0,0 +1,67 @@
+import json
+import logging
+
+from app.api.routers.models import ChatData
+from app.services.jobs import get_job_runner
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+
+jobs_router = r = APIRouter()
+
+logger = logging.getLogger("uvicorn")
+
+
+@r.post("")
+async def submit_job(data: ChatData):
+    """Start a research session in the background, the events are read from `/api/jobs/{job_id}/events`."""
+    job = get_job_runner().submit("research", data.model_dump(mode="json"), session_id=data.sessionId)
+    logger.info(f"Submitted job {job.id} for session {data.sessionId}")
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "events_url": f"/api/jobs/{job.id}/events",
+    }
+
+
+@r.get("/{job_id}")
+async def get_job(job_id: str):
+    job = get_job_runner().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job.model_dump(exclude={"payload"})
+
+
+@r.get("/{job_id}/events")
+async def stream_job_events(job_id: str, offset: int = 0):
+    """
+    Stream the events of a job as JSON lines, starting at `offset`.
+    To re-attach after a disconnect, pass the offset of the last event received plus one.
+    """
+    runner = get_job_runner()
+    job = runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+    async def content_generator():
+        # Disconnecting only stops reading the log, the job keeps running
+        async for entry_offset, entry in runner.attach(job, offset):
+            yield json.dumps({"offset": entry_offset, **entry}) + "\n"
+
+    return StreamingResponse(content_generator(), media_type="application/x-ndjson")
+
+
+@r.post("/{job_id}/resume")
+async def resume_job(job_id: str):
+    """Run a failed or cancelled job again, skipping the steps it had completed."""
+    job = get_job_runner().resume(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job.model_dump(exclude={"payload"})
+
+
+@r.post("/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = await get_job_runner().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job.model_dump(exclude={"payload"})
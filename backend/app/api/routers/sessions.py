@@ -0,0 +1,76 @@
+from typing import Optional
+
+from fastapi import APIRouter
+
+from app.services.cancellation import cancel_session, cancellation_reports
+from app.services.checkpoints import get_session_checkpoints
+from app.services.evidence_store import get_evidence_store, get_session_run_ids
+from app.services.research_artifacts import count_session_pages, get_session_artifacts, get_session_searches
+from app.services.session_metrics import get_session_metrics
+
+sessions_router = r = APIRouter(tags=["Sessions"])
+
+
+@r.get("/{session_id}/metrics")
+async def session_metrics(session_id: str):
+    return {
+        "session_id": session_id,
+        "metrics": get_session_metrics(session_id).snapshot(),
+    }
+
+
+@r.get("/{session_id}/checkpoints")
+async def session_checkpoints(session_id: str):
+    return {
+        "session_id": session_id,
+        "checkpoints": get_session_checkpoints(session_id),
+    }
+
+
+@r.get("/{session_id}/artifacts")
+async def session_artifacts(session_id: str):
+    return {
+        "session_id": session_id,
+        "artifacts": get_session_artifacts(session_id),
+        "searches": get_session_searches(session_id),
+        "pages": count_session_pages(session_id),
+    }
+
+
+@r.get("/{session_id}/evidence")
+async def session_evidence(
+    session_id: str,
+    entity: Optional[str] = None,
+    url: Optional[str] = None,
+    stage: Optional[str] = None,
+    run_id: Optional[str] = None,
+):
+    # The evidence of the latest run of the session by default
+    run_ids = get_session_run_ids(session_id)
+    run_id = run_id or (run_ids[-1] if run_ids else None)
+    store = get_evidence_store(session_id, run_id)
+    return {
+        "session_id": session_id,
+        "run_id": run_id,
+        "run_ids": run_ids,
+        "summary": store.snapshot(),
+        "evidence": [record.model_dump() for record in store.query(entity=entity, url=url, stage=stage)],
+    }
+
+
+@r.post("/{session_id}/cancel")
+async def cancel_session_runs(session_id: str):
+    """Cancel the runs of the session with all their sub-workflows, tool calls and requests."""
+    reports = await cancel_session(session_id, "cancelled through the API")
+    return {
+        "session_id": session_id,
+        "cancelled": [report.model_dump() for report in reports],
+    }
+
+
+@r.get("/{session_id}/cancellation")
+async def session_cancellation(session_id: str):
+    return {
+        "session_id": session_id,
+        "reports": [report.model_dump() for report in cancellation_reports(session_id)],
+    }
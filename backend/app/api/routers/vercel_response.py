@@ -1,12 +1,14 @@
 import asyncio
 import json
 import logging
-from typing import AsyncGenerator, List
+from typing import Any, AsyncGenerator, Awaitable, Callable, List, Optional
 
 from aiostream import stream
 from app.api.routers.models import ChatData, Message
 from app.api.services.suggestion import NextQuestionSuggestion
+from app.services.cancellation import CancelScope
 from app.workflows.single import AgentRunEvent, AgentRunResult
+from app.workflows.stage_results import StageResultEvent
 from fastapi import Request
 from fastapi.responses import StreamingResponse
 
@@ -27,7 +29,13 @@ class VercelStreamResponse(StreamingResponse):
         content = self.content_generator(*args, **kwargs)
         super().__init__(content=content)
 
-    async def content_generator(self, event_handler, events):
+    async def content_generator(
+        self,
+        event_handler,
+        events,
+        cancel_scope: Optional[CancelScope] = None,
+        on_disconnect: Optional[Callable[[], Awaitable[Any]]] = None,
+    ):
         stream = self._create_stream(
             self.request, self.chat_data, event_handler, events
         )
@@ -43,7 +51,14 @@ class VercelStreamResponse(StreamingResponse):
                     yield output
         except asyncio.CancelledError:
             logger.info("Stopping workflow")
-            await event_handler.cancel_run()
+            if on_disconnect is not None:
+                # e.g. the run is shared with other clients, it decides whether to stop
+                await on_disconnect()
+            elif cancel_scope is not None:
+                # Also stops the sub-workflows, tool calls and requests started by the workflow
+                await cancel_scope.cancel("the client disconnected")
+            else:
+                await event_handler.cancel_run()
         except Exception as e:
             logger.error(
                 f"Unexpected error in content_generator: {str(e)}", exc_info=True
@@ -96,7 +111,10 @@ class VercelStreamResponse(StreamingResponse):
         return combine
 
     @staticmethod
-    def _event_to_response(event: AgentRunEvent) -> dict:
+    def _event_to_response(event: AgentRunEvent | StageResultEvent) -> dict:
+        if isinstance(event, StageResultEvent):
+            # The structured output of a stage, as soon as it finished
+            return event.to_response()
         return {
             "type": "agent",
             "data": {
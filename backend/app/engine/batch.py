@@ -0,0 +1,65 @@
+# flake8: noqa: E402
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from app.services.batch import BATCH_DIR, BatchRunner, parse_ideas
+from app.services.jobs import JOBS_MAX_WORKERS, JobRunner
+from app.services.process_pool import shutdown_process_pool
+from app.services.work_queue import start_local_workers, stop_work_queue
+from app.settings import init_settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger()
+
+# The batches and jobs of the command, apart from the server's so neither resumes the other's
+CLI_BATCH_DIR = os.path.join(BATCH_DIR, "cli")
+
+
+async def _run(files, params):
+    batch_runner = BatchRunner(
+        batch_dir=CLI_BATCH_DIR,
+        job_runner=JobRunner(jobs_dir=os.path.join(CLI_BATCH_DIR, "jobs"), max_workers=JOBS_MAX_WORKERS),
+    )
+    await batch_runner.job_runner.start()
+    await batch_runner.start()
+    await start_local_workers()
+    try:
+        batch_ids = batch_runner.unfinished()
+        for file in files:
+            batch = await batch_runner.submit(parse_ideas(Path(file).read_text(), file), params=params)
+            batch_ids.append(batch.id)
+        if not batch_ids:
+            logger.info("No ideas to research and no interrupted batch to continue")
+        for batch_id in batch_ids:
+            batch = await batch_runner.wait(batch_id)
+            print(batch_runner.summary(batch).to_markdown())
+            print(f"Summary tables in {os.path.join(CLI_BATCH_DIR, batch_id)}")
+    finally:
+        await stop_work_queue()
+        await batch_runner.stop()
+        await batch_runner.job_runner.stop()
+        shutdown_process_pool()
+
+
+def run_batch():
+    """
+    Research the ideas of one or more ideas files (one idea per line, .csv or .jsonl), see
+    `app.services.batch`. The batches interrupted by a previous run of the command are continued.
+    """
+    parser = argparse.ArgumentParser(description="Research a batch of ideas")
+    parser.add_argument("files", nargs="*", help="ideas files, one idea per line or .csv/.jsonl with an idea column")
+    parser.add_argument("--fast", action="store_true", help="research the ideas in fast mode")
+    args = parser.parse_args()
+    init_settings()
+    asyncio.run(_run(args.files, {"fast": True} if args.fast else {}))
+
+
+if __name__ == "__main__":
+    run_batch()
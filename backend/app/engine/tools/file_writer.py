@@ -3,6 +3,8 @@ import os
 from typing import Optional
 from llama_index.core.tools.function_tool import FunctionTool
 
+from app.utils.paths import get_data_run_id, get_session_data_path
+
 OUTPUT_DIR = "data"
 
 def write_file(
@@ -29,11 +31,15 @@ def write_file(
             raise ValueError("Invalid file name. Use only alphanumeric characters, dots, underscores, and hyphens.")
         
         # Construct the full path
-        path_components = [OUTPUT_DIR]
-        if subdirectory:
-            path_components.append(subdirectory)
-        path_components.append(session_id)
-        file_path = os.path.join(*path_components, file_name)
+        if subdirectory is None and get_data_run_id() is not None:
+            # Research runs write to a data directory of their own, see app.utils.paths.run_data_scope
+            file_path = str(get_session_data_path(session_id) / file_name)
+        else:
+            path_components = [OUTPUT_DIR]
+            if subdirectory:
+                path_components.append(subdirectory)
+            path_components.append(session_id)
+            file_path = os.path.join(*path_components, file_name)
         
         # Create directory and write file
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
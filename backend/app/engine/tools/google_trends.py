@@ -1,6 +1,7 @@
 from typing import Dict, List, Optional
 from serpapi import GoogleSearch
 from app.settings import Settings
+from app.services.upstreams import get_upstream
 import os
 
 async def google_trends_search(
@@ -37,8 +38,9 @@ async def google_trends_search(
     }
     
     try:
-        search = GoogleSearch(params)
-        results = search.get_dict()
+        async with get_upstream("serpapi").aguard():
+            search = GoogleSearch(params)
+            results = search.get_dict()
         return {
             "success": True,
             "data": results,
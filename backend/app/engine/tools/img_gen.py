@@ -7,6 +7,8 @@ import requests  # type: ignore
 from llama_index.core.tools import FunctionTool
 from pydantic import BaseModel, Field
 
+from app.services.upstreams import get_upstream
+
 logger = logging.getLogger(__name__)
 
 
@@ -69,13 +71,14 @@ class ImageGeneratorTool:
             "output_format": self._IMG_OUTPUT_FORMAT,
         }
 
-        response = requests.post(
-            self._IMG_GEN_API,
-            headers=headers,
-            files={"none": ""},
-            data=data,
-        )
-        response.raise_for_status()
+        with get_upstream("stability").guard():
+            response = requests.post(
+                self._IMG_GEN_API,
+                headers=headers,
+                files={"none": ""},
+                data=data,
+            )
+            response.raise_for_status()
 
         return response
 
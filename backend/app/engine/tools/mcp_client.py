@@ -8,12 +8,14 @@ import httpx
 from typing import Optional, Dict, Any, List
 from llama_index.core.tools import FunctionTool
 
+from app.services.upstreams import get_base_url
+
 
 class MCPClient:
     """Client for interacting with Docker MCP services."""
 
     def __init__(self, gateway_url: str = "http://localhost:8080"):
-        self.gateway_url = gateway_url
+        self.gateway_url = get_base_url("mcp", gateway_url)
         self.client = httpx.AsyncClient(timeout=60.0)
 
     async def search_web(self, query: str, num_results: int = 10) -> List[Dict[str, Any]]:
@@ -5,20 +5,90 @@ Provides MCP-like functionality using existing APIs
 
 import os
 import asyncio
+import logging
+import time
 from typing import Dict, List, Any, Optional
 import httpx
 from llama_index.core.tools import FunctionTool
 
+from app.services.upstreams import UpstreamUnavailableError, get_api_key, get_base_url, get_upstream
+
+logger = logging.getLogger("uvicorn")
+
+REDDIT_USER_AGENT = "StartupScout/1.0"
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    # httpx only speaks HTTP/2 with the `h2` package of its http2 extra, a pip install without it uses HTTP/1.1
+    HTTP2_AVAILABLE = False
+
+
+def _create_client(base_url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        timeout=30.0,
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+    )
+
+
+class RedditTokenCache:
+    """Caches the Reddit OAuth token and refreshes it shortly before it expires."""
+
+    def __init__(self, client: httpx.AsyncClient, client_id: str, secret: str, refresh_margin: float = 60.0):
+        self.client = client
+        self.client_id = client_id
+        self.secret = secret
+        self.refresh_margin = refresh_margin
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> str:
+        if self._token and time.monotonic() < self._expires_at:
+            return self._token
+        async with self._lock:
+            # Another search may have refreshed the token while we were waiting
+            if self._token and time.monotonic() < self._expires_at:
+                return self._token
+            response = await self.client.post(
+                "/api/v1/access_token",
+                auth=(self.client_id, self.secret),
+                data={"grant_type": "client_credentials"},
+                headers={"User-Agent": REDDIT_USER_AGENT}
+            )
+            response.raise_for_status()
+            data = response.json()
+            self._token = data["access_token"]
+            self._expires_at = time.monotonic() + float(data.get("expires_in", 3600)) - self.refresh_margin
+            return self._token
+
+    def invalidate(self):
+        self._token = None
+        self._expires_at = 0.0
+
 
 class SimpleMCPServer:
-    """Simple MCP server using existing APIs instead of Docker services."""
+    """
+    Simple MCP server using existing APIs instead of Docker services.
+
+    A single instance is shared by the whole process (see `get_mcp_server`), with one
+    HTTP client per upstream so connections are reused across agents.
+    """
 
     def __init__(self):
-        self.brave_api_key = os.getenv("BRAVE_API_KEY")
-        self.reddit_client_id = os.getenv("REDDIT_CLIENT_ID")
-        self.reddit_secret = os.getenv("REDDIT_CLIENT_SECRET")
-        self.github_token = os.getenv("GITHUB_TOKEN")
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.brave_api_key = get_api_key("BRAVE_API_KEY")
+        self.reddit_client_id = get_api_key("REDDIT_CLIENT_ID")
+        self.reddit_secret = get_api_key("REDDIT_CLIENT_SECRET")
+        self.github_token = get_api_key("GITHUB_TOKEN")
+        self.brave_client = _create_client(get_base_url("brave", "https://api.search.brave.com"))
+        self.reddit_auth_client = _create_client(get_base_url("reddit", "https://www.reddit.com"))
+        self.reddit_client = _create_client(get_base_url("reddit", "https://oauth.reddit.com"))
+        self.github_client = _create_client(get_base_url("github", "https://api.github.com"))
+        self.reddit_token = RedditTokenCache(self.reddit_auth_client, self.reddit_client_id, self.reddit_secret)
 
     async def brave_search(self, query: str, count: int = 10) -> List[Dict[str, Any]]:
         """Search web using Brave Search API."""
@@ -31,12 +101,13 @@ class SimpleMCPServer:
                 "Accept-Encoding": "gzip",
                 "X-Subscription-Token": self.brave_api_key
             }
-            response = await self.client.get(
-                "https://api.search.brave.com/res/v1/web/search",
-                params={"q": query, "count": count},
-                headers=headers
-            )
-            response.raise_for_status()
+            async with get_upstream("brave").aguard():
+                response = await self.brave_client.get(
+                    "/res/v1/web/search",
+                    params={"q": query, "count": count},
+                    headers=headers
+                )
+                response.raise_for_status()
             data = response.json()
 
             results = []
@@ -47,6 +118,9 @@ class SimpleMCPServer:
                     "url": item.get("url", "")
                 })
             return results
+        except UpstreamUnavailableError:
+            # Let the agent know the provider is down instead of reporting no results
+            raise
         except Exception as e:
             print(f"Brave search error: {e}")
             return []
@@ -57,27 +131,16 @@ class SimpleMCPServer:
             return []
 
         try:
-            # Get OAuth token
-            auth_response = await self.client.post(
-                "https://www.reddit.com/api/v1/access_token",
-                auth=(self.reddit_client_id, self.reddit_secret),
-                data={"grant_type": "client_credentials"},
-                headers={"User-Agent": "StartupScout/1.0"}
-            )
-            auth_response.raise_for_status()
-            token = auth_response.json()["access_token"]
-
-            # Search Reddit
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "User-Agent": "StartupScout/1.0"
-            }
-
-            search_url = f"https://oauth.reddit.com/r/{subreddit}/search" if subreddit else "https://oauth.reddit.com/search"
+            search_url = f"/r/{subreddit}/search" if subreddit else "/search"
             params = {"q": query, "limit": limit, "sort": "relevance"}
 
-            response = await self.client.get(search_url, headers=headers, params=params)
-            response.raise_for_status()
+            async with get_upstream("reddit").aguard():
+                response = await self._reddit_get(search_url, params)
+                if response.status_code == 401:
+                    # The cached token was revoked or expired early, refresh it once
+                    self.reddit_token.invalidate()
+                    response = await self._reddit_get(search_url, params)
+                response.raise_for_status()
             data = response.json()
 
             results = []
@@ -92,6 +155,9 @@ class SimpleMCPServer:
                     "selftext": post_data.get("selftext", "")[:200]  # First 200 chars
                 })
             return results
+        except UpstreamUnavailableError:
+            # Let the agent know the provider is down instead of reporting no results
+            raise
         except Exception as e:
             print(f"Reddit search error: {e}")
             return []
@@ -107,12 +173,13 @@ class SimpleMCPServer:
                 "Accept": "application/vnd.github.v3+json"
             }
 
-            response = await self.client.get(
-                f"https://api.github.com/search/{type}",
-                params={"q": query, "per_page": limit},
-                headers=headers
-            )
-            response.raise_for_status()
+            async with get_upstream("github").aguard():
+                response = await self.github_client.get(
+                    f"/search/{type}",
+                    params={"q": query, "per_page": limit},
+                    headers=headers
+                )
+                response.raise_for_status()
             data = response.json()
 
             results = []
@@ -126,18 +193,54 @@ class SimpleMCPServer:
                     "url": item.get("html_url", "")
                 })
             return results
+        except UpstreamUnavailableError:
+            # Let the agent know the provider is down instead of reporting no results
+            raise
         except Exception as e:
             print(f"GitHub search error: {e}")
             return []
 
+    async def _reddit_get(self, url: str, params: Dict[str, Any]) -> httpx.Response:
+        token = await self.reddit_token.get()
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "User-Agent": REDDIT_USER_AGENT
+        }
+        return await self.reddit_client.get(url, headers=headers, params=params)
+
     async def close(self):
-        """Close HTTP client."""
-        await self.client.aclose()
+        """Close HTTP clients."""
+        await asyncio.gather(
+            self.brave_client.aclose(),
+            self.reddit_auth_client.aclose(),
+            self.reddit_client.aclose(),
+            self.github_client.aclose(),
+        )
+
+
+_server: Optional[SimpleMCPServer] = None
+
+
+def get_mcp_server() -> SimpleMCPServer:
+    """Get the process-wide MCP server, creating it on first use."""
+    global _server
+    if _server is None:
+        _server = SimpleMCPServer()
+        logger.info(f"Started MCP server (HTTP/2 {'enabled' if HTTP2_AVAILABLE else 'disabled'})")
+    return _server
+
+
+async def close_mcp_server():
+    """Close the process-wide MCP server, called on application shutdown."""
+    global _server
+    if _server is not None:
+        await _server.close()
+        _server = None
 
 
 def create_mcp_tools() -> List[FunctionTool]:
-    """Create LlamaIndex tools from SimpleMCPServer."""
-    server = SimpleMCPServer()
+    """Create LlamaIndex tools from the shared SimpleMCPServer."""
+    server = get_mcp_server()
 
     async def web_search(query: str) -> str:
         """Search the web for current information. Returns top search results with titles, descriptions, and URLs."""
@@ -7,9 +7,14 @@ import os
 import re
 from llama_index.core.tools import FunctionTool
 
+from app.services.cancellation import raise_if_cancelled
+from app.services.upstreams import get_upstream
+
 logger = logging.getLogger(__name__)
 
 OUTPUT_DIR = "output/tools"
+# Seconds to wait for the audio of a segment
+TTS_REQUEST_TIMEOUT = 120
 
 class VoiceSettings(BaseModel):
     stability: float = Field(default=0.5, ge=0, le=1)
@@ -55,12 +60,15 @@ class ElevenLabsGenerator:
         request = TTSRequest(text=text)
         
         try:
-            response = requests.post(
-                url, 
-                headers=headers,
-                json=request.model_dump()
-            )
-            response.raise_for_status()
+            # Segments are generated one after the other, so wait for a slot instead of failing the whole podcast
+            with get_upstream("elevenlabs").guard(max_wait=30):
+                response = requests.post(
+                    url, 
+                    headers=headers,
+                    json=request.model_dump(),
+                    timeout=TTS_REQUEST_TIMEOUT,
+                )
+                response.raise_for_status()
             return response.content
             
         except Exception as e:
@@ -99,6 +107,9 @@ class ElevenLabsGenerator:
             final_audio = None
             
             for speaker, text in segments:
+                # Run in a thread, the request in flight can't be cancelled but no more segments are generated
+                raise_if_cancelled()
+                
                 # Generate audio bytes
                 audio_bytes = self.generate_audio_segment(text, speaker)
                 
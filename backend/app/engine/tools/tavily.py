@@ -2,6 +2,8 @@ from llama_index.core.tools.function_tool import FunctionTool
 from typing import Literal, Optional, List
 import os
 
+from app.services.upstreams import get_api_key, get_base_url, get_upstream
+
 MAX_RESULTS = 5
 
 def tavily_search(
@@ -28,24 +30,27 @@ def tavily_search(
             "Please install it by running: `poetry add tavily-python` or `pip install tavily-python`"
         )
 
-    api_key = api_key or os.getenv("TAVILY_API_KEY")
+    api_key = api_key or get_api_key("TAVILY_API_KEY")
     if not api_key:
         raise ValueError("Tavily API key is required. Please provide it or set TAVILY_API_KEY environment variable.")
 
     client = TavilyClient(api_key=api_key)
-    response = client.search(
-        query=query,
-        search_depth=search_depth,
-        max_results=max_results,
-        topic=topic,
-        include_domains=include_domains,
-    )
+    client.base_url = get_base_url("tavily", client.base_url)
+    with get_upstream("tavily").guard():
+        response = client.search(
+            query=query,
+            search_depth=search_depth,
+            max_results=max_results,
+            topic=topic,
+            include_domains=include_domains,
+        )
     
     return response
 
 
 def tavily_qna_search(
     query: str,
+    api_key: Optional[str] = None,
 ):
     """
     Use this function to get quick answers to questions using Tavily's API.
@@ -61,12 +66,14 @@ def tavily_qna_search(
             "Please install it by running: `poetry add tavily-python` or `pip install tavily-python`"
         )
 
-    api_key = api_key or os.getenv("TAVILY_API_KEY")
+    api_key = api_key or get_api_key("TAVILY_API_KEY")
     if not api_key:
         raise ValueError("Tavily API key is required. Please provide it or set TAVILY_API_KEY environment variable.")
 
     client = TavilyClient(api_key=api_key)
-    response = client.qna_search(query=query)
+    client.base_url = get_base_url("tavily", client.base_url)
+    with get_upstream("tavily").guard():
+        response = client.qna_search(query=query)
     
     return response
 
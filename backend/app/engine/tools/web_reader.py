@@ -1,6 +1,11 @@
+import asyncio
+import contextlib
+import hashlib
 import logging
 import os
-from typing import List, Optional, Dict, Any, Union
+import weakref
+from typing import List, Optional, Dict, Any, Tuple, Union
+from urllib.parse import urlparse
 import json
 
 from llama_index.core.tools import FunctionTool
@@ -8,8 +13,59 @@ from pydantic import BaseModel, Field
 from crawl4ai import AsyncWebCrawler
 from crawl4ai.extraction_strategy import LLMExtractionStrategy
 
+from app.services.deadline import PAGE_READ_SECONDS, get_deadline
+from app.services.fetch_registry import get_fetch_registry
+from app.services.research_artifacts import get_saved, save
+from app.services.session_metrics import get_session_metrics
+from app.services.scheduler import get_scheduling_context
+from app.services.work_queue import WORK_QUEUE_BACKEND, run_on_worker
+from app.utils.urls import canonicalize_url
+
 logger = logging.getLogger("uvicorn")
 
+# Limits of the page reads running at once in each event loop of the process
+MAX_CONCURRENT_READS = int(os.getenv("WEB_READER_MAX_CONCURRENCY", "8"))
+MAX_READS_PER_DOMAIN = int(os.getenv("WEB_READER_MAX_PER_DOMAIN", "2"))
+BATCH_READ_TIMEOUT = float(os.getenv("WEB_READER_BATCH_TIMEOUT", "120"))
+
+
+class _ReadPools:
+    """
+    The read limits of one event loop, asyncio semaphores can't be shared between loops (the
+    server's, the process pool workers' and the ones of `asyncio.run`).
+    """
+
+    def __init__(self):
+        self.reads = asyncio.Semaphore(MAX_CONCURRENT_READS)
+        # Semaphore of each domain being read and its number of reads, dropped after its last read
+        self.domains: Dict[str, Tuple[asyncio.Semaphore, int]] = {}
+
+    @contextlib.asynccontextmanager
+    async def slot(self, domain: str):
+        semaphore, reads = self.domains.get(domain) or (asyncio.Semaphore(MAX_READS_PER_DOMAIN), 0)
+        self.domains[domain] = (semaphore, reads + 1)
+        try:
+            async with semaphore, self.reads:
+                yield
+        finally:
+            semaphore, reads = self.domains[domain]
+            if reads == 1:
+                # Nothing holds or waits for the semaphore, the next read of the domain starts a new one
+                del self.domains[domain]
+            else:
+                self.domains[domain] = (semaphore, reads - 1)
+
+
+_read_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _ReadPools]" = weakref.WeakKeyDictionary()
+
+
+def _get_read_pools() -> _ReadPools:
+    loop = asyncio.get_running_loop()
+    pools = _read_pools.get(loop)
+    if pools is None:
+        pools = _read_pools[loop] = _ReadPools()
+    return pools
+
 
 class WebReaderResult(BaseModel):
     content: str | None = None
@@ -17,6 +73,10 @@ class WebReaderResult(BaseModel):
     is_error: bool
     error_message: Optional[str] = None
 
+class BatchWebReaderResult(BaseModel):
+    results: List[WebReaderResult]
+    timed_out: bool = False
+
 class DefaultSchema(BaseModel):
     content: str = Field(description="The main content of the page, filtering out all the noise, do not summarize the content, include all important details including statistics, quotes, examples, stories, etc")
 
@@ -26,6 +86,7 @@ async def read_webpage(
     provider: str = "openai/gpt-4o-mini",
     schema: Dict | None = DefaultSchema.model_json_schema(),
     openai_api_key: Optional[str] = None,
+    session_id: Optional[str] = None,
 ) -> WebReaderResult:
     """
     Read and extract structured content from a webpage using crawl4ai.
@@ -36,25 +97,220 @@ async def read_webpage(
         instruction (str): Instructions for the LLM on what to extract
         provider (str): LLM provider to use
         openai_api_key (Optional[str]): OpenAI API key. If not provided, will try to get from env
+        session_id (Optional[str]): Research session, pages already read in the session are not read again
+    """
+    api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY is required for LLM extraction")
+
+    cached = _get_cached(session_id, url, instruction, schema)
+    if cached is not None:
+        return cached
+
+    deadline = get_deadline()
+    if deadline is not None and not deadline.allows(PAGE_READ_SECONDS):
+        return _skipped_result(url)
+
+    try:
+        async with _crawler() as crawler:
+            return await _read(crawler, url, instruction, provider, schema, api_key, session_id)
+    except Exception as e:
+        return _error_result(url, e)
+
+
+async def read_webpages(
+    urls: List[str],
+    instruction: str = "Extract the main content of the page, do not summarize the content, include all important details including statistics, quotes, examples, stories, etc",
+    provider: str = "openai/gpt-4o-mini",
+    schema: Dict | None = DefaultSchema.model_json_schema(),
+    openai_api_key: Optional[str] = None,
+    timeout: float = BATCH_READ_TIMEOUT,
+    session_id: Optional[str] = None,
+) -> BatchWebReaderResult:
+    """
+    Read several webpages concurrently using a single crawler.
+    
+    Reads go through the process-wide read pool and are capped per domain. If the
+    deadline is reached, the pages read so far are returned and the remaining ones
+    are reported as timed out. Under a research deadline (see `app.services.deadline`),
+    only the pages that can be read in the time left are read, the others are skipped.
+    
+    Parameters:
+        urls (List[str]): The URLs to read content from
+        instruction (str): Instructions for the LLM on what to extract
+        provider (str): LLM provider to use
+        schema (Dict): Pydantic model schema defining the structure to extract
+        openai_api_key (Optional[str]): OpenAI API key. If not provided, will try to get from env
+        timeout (float): Overall deadline in seconds for the whole batch
+        session_id (Optional[str]): Research session, pages already read in the session are not read again
     """
     api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("OPENAI_API_KEY is required for LLM extraction")
 
+    # Keep the order of the urls but don't read the same page twice
+    urls = list(dict.fromkeys(urls))
+    cached = {url: _get_cached(session_id, url, instruction, schema) for url in urls}
+    to_read = [url for url in urls if cached[url] is None]
+    skipped: List[str] = []
+    deadline = get_deadline()
+    if deadline is not None and to_read:
+        max_pages = 0 if deadline.expired() else deadline.fit(len(to_read), PAGE_READ_SECONDS, parallel=MAX_CONCURRENT_READS)
+        to_read, skipped = to_read[:max_pages], to_read[max_pages:]
+        timeout = min(timeout, deadline.remaining())
+    if not to_read:
+        return BatchWebReaderResult(results=[cached[url] or _skipped_result(url) for url in urls])
+
     try:
-        async with AsyncWebCrawler(verbose=True) as crawler:
-            result = await crawler.arun(
+        async with _crawler() as crawler:
+            tasks = {
+                url: asyncio.create_task(_read(crawler, url, instruction, provider, schema, api_key, session_id))
+                for url in to_read
+            }
+            try:
+                _, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+            except asyncio.CancelledError:
+                # The tool call was cancelled, e.g. with its research run, stop the reads before closing the crawler
+                for task in tasks.values():
+                    task.cancel()
+                await asyncio.gather(*tasks.values(), return_exceptions=True)
+                raise
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+    except Exception as e:
+        return BatchWebReaderResult(results=[cached[url] or _error_result(url, e) for url in urls])
+
+    results = []
+    for url in urls:
+        task = tasks.get(url)
+        if url in skipped:
+            results.append(_skipped_result(url))
+        elif task is None:
+            results.append(cached[url])
+        elif task in pending:
+            results.append(WebReaderResult(
                 url=url,
-                remove_overlay_elements=True,
-                strategy=LLMExtractionStrategy(
-                    instruction=instruction,
-                    schema=schema,
-                    provider=provider,
-                    openai_api_key=api_key
-                ),
-                magic=True,
-                bypass_cache=True,
-            )
+                is_error=True,
+                error_message=f"Timed out after {timeout}s before the page could be read",
+            ))
+        else:
+            results.append(task.result())
+    if pending:
+        logger.warning(f"Batch read timed out, {len(pending)} out of {len(urls)} pages were not read")
+    if skipped:
+        logger.info(f"Research deadline near, skipped {len(skipped)} out of {len(urls)} pages")
+    return BatchWebReaderResult(results=results, timed_out=bool(pending))
+
+
+def _crawler():
+    # With a work queue the pages are crawled on the workers, there is no local browser to start
+    if WORK_QUEUE_BACKEND:
+        return contextlib.nullcontext()
+    return AsyncWebCrawler(verbose=True)
+
+
+async def crawl_webpage(url: str, instruction: str, provider: str, schema: Dict | None) -> WebReaderResult:
+    """Read one page with a crawler of its own, run by the work queue workers."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    async with AsyncWebCrawler(verbose=True) as crawler:
+        return await _pooled_read(crawler, url, instruction, provider, schema, api_key)
+
+
+async def _crawl_on_worker(url: str, instruction: str, provider: str, schema: Dict | None) -> WebReaderResult:
+    try:
+        return await run_on_worker(crawl_webpage, url=url, instruction=instruction, provider=provider, schema=schema)
+    except Exception as e:
+        return _error_result(url, e)
+
+
+def _fetch_key(url: str, instruction: str, schema: Dict | None) -> str:
+    # The extracted content depends on what we asked for, not only on the page
+    extraction = hashlib.sha1(f"{instruction}|{json.dumps(schema, sort_keys=True)}".encode()).hexdigest()[:12]
+    return f"{canonicalize_url(url)}#{extraction}"
+
+
+def _get_cached(session_id: Optional[str], url: str, instruction: str, schema: Dict | None) -> Optional[WebReaderResult]:
+    if session_id is None:
+        return None
+    result = get_fetch_registry(session_id).get(_fetch_key(url, instruction, schema))
+    return result.model_copy(update={"url": url}) if result is not None else None
+
+
+async def _read(
+    crawler: Optional[AsyncWebCrawler],
+    url: str,
+    instruction: str,
+    provider: str,
+    schema: Dict | None,
+    api_key: str,
+    session_id: Optional[str],
+) -> WebReaderResult:
+    if crawler is None:
+        # The workers use their own API key, it isn't sent over the queue
+        fetch = lambda: _crawl_on_worker(url, instruction, provider, schema)
+    else:
+        fetch = lambda: _pooled_read(crawler, url, instruction, provider, schema, api_key)
+    if session_id is None:
+        return await fetch()
+    key = _fetch_key(url, instruction, schema)
+    result = await get_fetch_registry(session_id).fetch(
+        key,
+        lambda: _read_saved_or_fetch(session_id, key, url, fetch),
+        is_error=lambda result: result.is_error,
+        size=lambda result: len(result.content or ""),
+    )
+    return result.model_copy(update={"url": url})
+
+
+async def _read_saved_or_fetch(session_id: str, key: str, url: str, fetch) -> WebReaderResult:
+    # The registry only keeps the pages of the running process, the pages read by the earlier
+    # runs of the session are kept with its research artifacts
+    content = await get_saved(session_id, "pages", key)
+    if content is not None:
+        get_session_metrics(session_id).incr("research_pages_reused")
+        return WebReaderResult(content=content, url=url, is_error=False)
+    result = await fetch()
+    if not result.is_error:
+        await save(session_id, "pages", key, result.content, url=url)
+    return result
+
+
+async def _pooled_read(
+    crawler: AsyncWebCrawler,
+    url: str,
+    instruction: str,
+    provider: str,
+    schema: Dict | None,
+    api_key: str,
+) -> WebReaderResult:
+    domain = urlparse(url).netloc.lower().removeprefix("www.")
+    async with _get_read_pools().slot(domain):
+        return await _read_with_crawler(crawler, url, instruction, provider, schema, api_key)
+
+
+async def _read_with_crawler(
+    crawler: AsyncWebCrawler,
+    url: str,
+    instruction: str,
+    provider: str,
+    schema: Dict | None,
+    api_key: str,
+) -> WebReaderResult:
+    try:
+        result = await crawler.arun(
+            url=url,
+            remove_overlay_elements=True,
+            strategy=LLMExtractionStrategy(
+                instruction=instruction,
+                schema=schema,
+                provider=provider,
+                openai_api_key=api_key
+            ),
+            magic=True,
+            bypass_cache=True,
+        )
         
         return WebReaderResult(
             content=result.extracted_content,
@@ -63,23 +319,53 @@ async def read_webpage(
         )
             
     except Exception as e:
-        error_message = f"Error reading webpage: {str(e)}"
-        logger.error(error_message)
-        return WebReaderResult(
-            content="Error reading webpage",
-            url=url,
-            is_error=True,
-            error_message=error_message
-        )
+        return _error_result(url, e)
+
+
+def _error_result(url: str, e: Exception) -> WebReaderResult:
+    error_message = f"Error reading webpage: {str(e)}"
+    logger.error(error_message)
+    return WebReaderResult(
+        content="Error reading webpage",
+        url=url,
+        is_error=True,
+        error_message=error_message
+    )
+
+def _skipped_result(url: str) -> WebReaderResult:
+    return WebReaderResult(
+        url=url,
+        is_error=True,
+        error_message="Skipped, the research is running out of time, continue with the pages read so far",
+    )
+
+def _calling_session_id() -> Optional[str]:
+    # The configured tools are shared by all sessions, a call runs in the scheduling context of its session
+    session_id = get_scheduling_context().session_id
+    return None if session_id == "default" else session_id
+
 
 def get_tools(**kwargs):
-    return [FunctionTool.from_defaults(
-        async_fn=lambda url, instruction, schema, provider="openai/gpt-4o-mini": read_webpage(
-            url=url,
-            # instruction=instruction,
-            # schema=schema,
-            provider=provider,
-            openai_api_key=kwargs.get('openai_api_key')
+    return [
+        FunctionTool.from_defaults(
+            async_fn=lambda url, instruction, schema, provider="openai/gpt-4o-mini": read_webpage(
+                url=url,
+                # instruction=instruction,
+                # schema=schema,
+                provider=provider,
+                openai_api_key=kwargs.get('openai_api_key'),
+                session_id=_calling_session_id(),
+            ),
+            description="Read and extract structured content from a webpage given specific instructions on what to extract. It requires detailed context, but it does not have access to your memory so you have to provide it yourself. For example, if you are using it to find competitors, you need to first provide the context of the product you are researching."
+        ),
+        FunctionTool.from_defaults(
+            async_fn=lambda urls, provider="openai/gpt-4o-mini": read_webpages(
+                urls=urls,
+                provider=provider,
+                openai_api_key=kwargs.get('openai_api_key'),
+                session_id=_calling_session_id(),
+            ),
+            name="read_webpages",
+            description="Read and extract content from several webpages at once, pass all the urls you want to read in a single call."
         ),
-        description="Read and extract structured content from a webpage given specific instructions on what to extract. It requires detailed context, but it does not have access to your memory so you have to provide it yourself. For example, if you are using it to find competitors, you need to first provide the context of the product you are researching."
-    )]
+    ]
@@ -0,0 +1,26 @@
+# flake8: noqa: E402
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import asyncio
+import logging
+
+from app.services.work_queue import WORK_QUEUE_BACKEND, get_work_queue, work
+from app.settings import init_settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger()
+
+
+def run_worker():
+    """Serve the research work queue from this node, see `app.services.work_queue`."""
+    if WORK_QUEUE_BACKEND in ("", "local"):
+        raise SystemExit("Set WORK_QUEUE_BACKEND to a shared backend, e.g. redis, to run a worker")
+    init_settings()
+    logger.info(f"Serving the {WORK_QUEUE_BACKEND} work queue")
+    asyncio.run(work(get_work_queue()))
+
+
+if __name__ == "__main__":
+    run_worker()
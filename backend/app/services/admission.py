@@ -0,0 +1,151 @@
+"""
+Admission control for research sessions.
+
+A research session runs dozens of agents for 30-60 minutes, so starting one more when the
+server is already saturated slows down every session running on it. Before a research
+session starts, the admission controller checks the sessions in flight, the LLM queue
+depth of the scheduler (see `app.services.scheduler`) and the token demand of the sessions in
+flight against their limits. Each session in flight counts for the tokens it has used so far,
+or for the average of the finished sessions while it used less. A request over the limits is either rejected with
+a `Retry-After` or queued as a background job with an estimated start time, depending on
+`ADMISSION_OVERLOAD_POLICY`.
+"""
+
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.scheduler import get_scheduler
+from app.services.session_metrics import get_session_metrics
+
+ADMISSION_MAX_SESSIONS = int(os.getenv("ADMISSION_MAX_SESSIONS", "8"))
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "64"))
+# Initial estimate of the LLM tokens used by one research session, replaced by the average of the
+# finished sessions, and how many can be in flight
+ADMISSION_TOKENS_PER_SESSION = int(os.getenv("ADMISSION_TOKENS_PER_SESSION", "400000"))
+ADMISSION_MAX_TOKENS = int(os.getenv("ADMISSION_MAX_TOKENS", "3200000"))
+# Initial estimate of a session duration, replaced by the average of the finished sessions
+ADMISSION_SESSION_SECONDS = float(os.getenv("ADMISSION_SESSION_SECONDS", "1800"))
+# "reject" answers 429 with a Retry-After, "queue" starts the session as a background job
+ADMISSION_OVERLOAD_POLICY = os.getenv("ADMISSION_OVERLOAD_POLICY", "reject")
+
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    reason: Optional[str] = None
+    # Seconds until a session is expected to finish and make room
+    retry_after: int = 0
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_sessions: int = ADMISSION_MAX_SESSIONS,
+        max_queue_depth: int = ADMISSION_MAX_QUEUE_DEPTH,
+        tokens_per_session: int = ADMISSION_TOKENS_PER_SESSION,
+        max_tokens: int = ADMISSION_MAX_TOKENS,
+    ):
+        self.max_sessions = max_sessions
+        self.max_queue_depth = max_queue_depth
+        self.tokens_per_session = tokens_per_session
+        self.max_tokens = max_tokens
+        # Start time of the sessions in flight, by workflow handler
+        self._in_flight: Dict[int, float] = {}
+        # Session and its token count when it started, by workflow handler
+        self._sessions: Dict[int, Tuple[Optional[str], float]] = {}
+        self._avg_session_seconds = ADMISSION_SESSION_SECONDS
+        self._avg_session_tokens = float(tokens_per_session)
+        self._finished = 0
+        self._rejected = 0
+
+    def check(self) -> AdmissionDecision:
+        """Whether one more research session can start now."""
+        reason = self.over_limit()
+        if reason is None:
+            return AdmissionDecision(admitted=True)
+        self._rejected += 1
+        # Limits reached with no session in flight, e.g. by the LLM queue, are retried shortly
+        return AdmissionDecision(admitted=False, reason=reason, retry_after=max(1, self.estimate_wait()))
+
+    def over_limit(self) -> Optional[str]:
+        """The limit one more session would exceed, None if there is room for it."""
+        queue_depth = get_scheduler().queue_depth()
+        if len(self._in_flight) >= self.max_sessions:
+            return f"{len(self._in_flight)} research sessions are already running"
+        if queue_depth >= self.max_queue_depth:
+            return f"{queue_depth} LLM and tool calls are waiting"
+        if self.tokens_in_flight() + self._avg_session_tokens > self.max_tokens:
+            return "The token demand of the running sessions is at its limit"
+        return None
+
+    def tokens_in_flight(self) -> float:
+        """Tokens of the sessions in flight, those that used less than a session on average count for the average."""
+        return sum(max(self._used_tokens(key), self._avg_session_tokens) for key in self._in_flight)
+
+    def _used_tokens(self, key: int) -> float:
+        session_id, baseline = self._sessions.get(key, (None, 0.0))
+        if session_id is None:
+            return 0.0
+        return get_session_metrics(session_id).get("llm_tokens") - baseline
+
+    def estimate_wait(self, position: int = 0) -> int:
+        """
+        Seconds until a session `position` places back in line can start, assuming sessions
+        take the average duration and start as soon as a running one finishes.
+        """
+        now = time.time()
+        remaining = sorted(
+            max(0.0, started_at + self._avg_session_seconds - now) for started_at in self._in_flight.values()
+        )
+        if not remaining:
+            return 0
+        # Each full round of the sessions in flight ahead in line adds one session duration
+        rounds, index = divmod(position, len(remaining))
+        return int(remaining[index] + rounds * self._avg_session_seconds) + 1
+
+    def track(self, handler: Any, session_id: Optional[str] = None):
+        """Count the research session `session_id` as in flight until its workflow handler is done."""
+        self._in_flight[id(handler)] = time.time()
+        # The session metrics count the tokens of all the runs of the session, only those of this one count
+        baseline = get_session_metrics(session_id).get("llm_tokens") if session_id is not None else 0.0
+        self._sessions[id(handler)] = (session_id, baseline)
+        handler.add_done_callback(self._finished_session)
+
+    def _finished_session(self, handler: Any):
+        used_tokens = self._used_tokens(id(handler))
+        session_id, _ = self._sessions.pop(id(handler), (None, 0.0))
+        started_at = self._in_flight.pop(id(handler), None)
+        if started_at is None:
+            return
+        # Moving averages of the session duration and tokens, for the Retry-After and start time
+        # estimates and the token demand of the sessions in flight
+        self._finished += 1
+        weight = 1 / min(self._finished, 10)
+        self._avg_session_seconds += weight * (time.time() - started_at - self._avg_session_seconds)
+        if session_id is not None:
+            self._avg_session_tokens += weight * (used_tokens - self._avg_session_tokens)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "sessions_in_flight": len(self._in_flight),
+            "max_sessions": self.max_sessions,
+            "tokens_in_flight": round(self.tokens_in_flight()),
+            "avg_session_tokens": round(self._avg_session_tokens),
+            "max_tokens": self.max_tokens,
+            "max_queue_depth": self.max_queue_depth,
+            "avg_session_seconds": round(self._avg_session_seconds),
+            "rejected": self._rejected,
+            "overload_policy": ADMISSION_OVERLOAD_POLICY,
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
@@ -0,0 +1,416 @@
+"""
+Batch research of many ideas, e.g. screening a few hundred ideas overnight.
+
+A batch is planned before it runs: the ideas are embedded and clustered by similarity, the
+first idea of each cluster leads it. The leaders are researched first and the other ideas
+of a cluster start once the research of their leader is in the idea cache (see
+`app.services.idea_cache`), so their research stages are seeded with its searches,
+competitors and sources and only search for what differs. All the ideas of a cluster read
+pages through one fetch registry (see `app.services.fetch_registry`).
+
+Each idea runs as a research job (see `app.services.jobs`), at most `BATCH_MAX_CONCURRENCY`
+ideas of a batch at a time, within the job workers, admission control and scheduler shared
+with the other sessions. The batch is saved to `BATCH_DIR/<batch_id>/batch.json` on every
+change: after a restart the jobs continue from their checkpoints and the batch from where it
+was. The summary table of a batch has the status, duration, tokens and cost of each idea,
+and the ideas per hour and cost per idea of the batch.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from app.services.fetch_registry import share_fetch_registry
+from app.services.idea_cache import IDEA_CACHE_ENABLED, IDEA_CACHE_SIMILARITY_THRESHOLD, cosine_similarity, embed_idea, get_idea_cache
+from app.services.jobs import JobRunner, JobStatus, get_job_runner
+from app.services.session_metrics import get_session_metrics
+
+logger = logging.getLogger("uvicorn")
+
+BATCH_DIR = os.getenv("BATCH_DIR", os.path.join("output", "batches"))
+# Ideas of a batch researched at the same time, the other sessions keep the rest of the job workers
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "2"))
+# Ideas at least this similar share a cluster, by default the similarity at which the idea
+# cache seeds the research of an idea with the research of another
+BATCH_CLUSTER_THRESHOLD = float(os.getenv("BATCH_CLUSTER_THRESHOLD", str(IDEA_CACHE_SIMILARITY_THRESHOLD)))
+# Price of 1000 LLM tokens, for the cost per idea in the summary
+LLM_COST_PER_1K_TOKENS = float(os.getenv("LLM_COST_PER_1K_TOKENS", "0"))
+# How often the batch checks on its jobs
+BATCH_POLL_SECONDS = 5.0
+
+
+class BatchIdea(BaseModel):
+    index: int
+    idea: str
+    session_id: str
+    cluster: int
+    # Index of the idea leading the cluster, None for the leaders
+    leader: Optional[int] = None
+    job_id: Optional[str] = None
+    # None until its job is submitted
+    status: Optional[JobStatus] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    tokens: int = 0
+    error: Optional[str] = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+class Batch(BaseModel):
+    id: str
+    ideas: List[BatchIdea]
+    # Chat data of the research sessions, e.g. {"fast": true}
+    params: Dict[str, Any] = Field(default_factory=dict)
+    email: Optional[str] = None
+    created_at: float = Field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    cancelled: bool = False
+    # Page fetches served from the registries shared by the clusters, counted by the session
+    # metrics of the registries in memory and kept here across restarts
+    pages_shared: int = 0
+
+    @property
+    def is_finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def clusters(self) -> int:
+        return len({idea.cluster for idea in self.ideas})
+
+    def fetch_group(self, idea: BatchIdea) -> str:
+        return f"batch-{self.id}-cluster-{idea.cluster}"
+
+
+class BatchSummary(BaseModel):
+    batch_id: str
+    status: str
+    ideas: int
+    succeeded: int
+    failed: int
+    pending: int
+    clusters: int
+    hours: float
+    ideas_per_hour: float
+    tokens: int
+    cost: float
+    cost_per_idea: float
+    # Page fetches served from the registries shared by the clusters
+    pages_shared: int
+    rows: List[Dict[str, Any]]
+
+    def to_csv(self) -> str:
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(self.rows[0].keys()) if self.rows else ["#"])
+        writer.writeheader()
+        writer.writerows(self.rows)
+        return output.getvalue()
+
+    def to_markdown(self) -> str:
+        lines = [
+            f"# Batch {self.batch_id} ({self.status})",
+            "",
+            f"{self.succeeded} of {self.ideas} ideas researched, {self.failed} failed, {self.pending} pending, "
+            f"in {self.clusters} clusters",
+            f"{self.ideas_per_hour:.1f} ideas per hour, {self.tokens} tokens, "
+            f"{self.cost:.2f} total, {self.cost_per_idea:.3f} per idea, {self.pages_shared} page fetches shared",
+            "",
+        ]
+        if self.rows:
+            columns = list(self.rows[0].keys())
+            lines.append("| " + " | ".join(columns) + " |")
+            lines.append("|" + "---|" * len(columns))
+            for row in self.rows:
+                lines.append("| " + " | ".join(str(row[column]).replace("|", "/") for column in columns) + " |")
+        return "\n".join(lines) + "\n"
+
+
+def parse_ideas(content: str, name: str = "ideas.txt") -> List[str]:
+    """
+    The ideas of an ideas file: one per line, or the `idea` field of each line of a .jsonl
+    file, or the `idea` column (else the first one) of a .csv file. Duplicates are dropped.
+    """
+    suffix = Path(name).suffix.lower()
+    if suffix == ".jsonl":
+        ideas = []
+        for line in content.splitlines():
+            if line.strip():
+                value = json.loads(line)
+                ideas.append(value["idea"] if isinstance(value, dict) else str(value))
+    elif suffix == ".csv":
+        rows = list(csv.reader(io.StringIO(content)))
+        column = rows[0].index("idea") if rows and "idea" in rows[0] else None
+        ideas = [row[column or 0] for row in (rows[1:] if column is not None else rows) if row]
+    else:
+        ideas = [line for line in content.splitlines() if not line.strip().startswith("#")]
+    unique: Dict[str, str] = {}
+    for idea in ideas:
+        idea = idea.strip()
+        if idea:
+            unique.setdefault(" ".join(idea.lower().split()), idea)
+    return list(unique.values())
+
+
+async def plan_batch(batch_id: str, ideas: List[str], threshold: float = BATCH_CLUSTER_THRESHOLD) -> List[BatchIdea]:
+    """Cluster the ideas, each idea joins the most similar leader within `threshold` or leads a cluster."""
+    embeddings = await asyncio.gather(*(embed_idea(idea) for idea in ideas))
+    leaders: List[int] = []
+    planned: List[BatchIdea] = []
+    clusters = 0
+    for index, (idea, embedding) in enumerate(zip(ideas, embeddings)):
+        leader = None
+        if embedding is not None:
+            similarities = [(cosine_similarity(embedding, embeddings[other]), other) for other in leaders]
+            best = max(similarities, default=None)
+            if best is not None and best[0] >= threshold:
+                leader = best[1]
+        if leader is None and embedding is not None:
+            leaders.append(index)
+        if leader is None:
+            clusters += 1
+        cluster = planned[leader].cluster if leader is not None else clusters - 1
+        planned.append(BatchIdea(index=index, idea=idea, session_id=f"batch-{batch_id}-{index:03d}", cluster=cluster, leader=leader))
+    return planned
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        batch_dir: str = BATCH_DIR,
+        job_runner: Optional[JobRunner] = None,
+        max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    ):
+        self.batch_dir = Path(batch_dir)
+        self.job_runner = job_runner
+        self.max_concurrency = max_concurrency
+        # Unfinished batches and the tasks running them, finished batches are read from disk
+        self._batches: Dict[str, Batch] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Shared page fetches of each fetch group already counted in its batch
+        self._pages_counted: Dict[str, int] = {}
+
+    @property
+    def jobs(self) -> JobRunner:
+        return self.job_runner or get_job_runner()
+
+    async def start(self):
+        """Continue the batches that were running when the server stopped."""
+        self.batch_dir.mkdir(parents=True, exist_ok=True)
+        for batch_file in self.batch_dir.glob("*/batch.json"):
+            batch = Batch.model_validate_json(batch_file.read_text())
+            if not batch.is_finished:
+                logger.info(f"Resuming batch {batch.id} after restart")
+                self._run(batch)
+
+    async def stop(self):
+        """Stop running the batches, they are continued on the next start."""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks = {}
+
+    async def submit(self, ideas: List[str], params: Optional[Dict[str, Any]] = None, email: Optional[str] = None) -> Batch:
+        if not ideas:
+            raise ValueError("The batch has no ideas")
+        batch_id = uuid.uuid4().hex[:12]
+        batch = Batch(id=batch_id, ideas=await plan_batch(batch_id, ideas), params=params or {}, email=email)
+        logger.info(f"Planned batch {batch.id}: {len(batch.ideas)} ideas in {batch.clusters} clusters")
+        self._run(batch)
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        batch = self._batches.get(batch_id)
+        if batch is not None:
+            return batch
+        batch_file = self.batch_dir / os.path.basename(batch_id) / "batch.json"
+        if not batch_file.exists():
+            return None
+        return Batch.model_validate_json(batch_file.read_text())
+
+    async def wait(self, batch_id: str) -> Optional[Batch]:
+        task = self._tasks.get(batch_id)
+        if task is not None:
+            await asyncio.shield(task)
+        return self.get(batch_id)
+
+    def unfinished(self) -> List[str]:
+        return list(self._batches)
+
+    async def cancel(self, batch_id: str) -> Optional[Batch]:
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return self.get(batch_id)
+        batch.cancelled = True
+        for idea in batch.ideas:
+            if idea.job_id is not None and not idea.is_finished:
+                await self.jobs.cancel(idea.job_id)
+        # The batch finishes on its next check
+        return batch
+
+    def summary(self, batch: Batch) -> BatchSummary:
+        rows = []
+        for idea in batch.ideas:
+            minutes = (idea.finished_at - idea.started_at) / 60 if idea.started_at and idea.finished_at else None
+            rows.append({
+                "#": idea.index + 1,
+                "idea": idea.idea,
+                "cluster": idea.cluster + 1,
+                "seeded_from": idea.leader + 1 if idea.leader is not None else "",
+                "status": idea.status.value if idea.status is not None else "pending",
+                "minutes": round(minutes, 1) if minutes is not None else "",
+                "tokens": idea.tokens,
+                "cost": round(idea.tokens / 1000 * LLM_COST_PER_1K_TOKENS, 4),
+                "session_id": idea.session_id,
+                "error": idea.error or "",
+            })
+        started = [idea.started_at for idea in batch.ideas if idea.started_at]
+        hours = ((batch.finished_at or time.time()) - min(started)) / 3600 if started else 0.0
+        done = [idea for idea in batch.ideas if idea.is_finished]
+        tokens = sum(idea.tokens for idea in batch.ideas)
+        cost = tokens / 1000 * LLM_COST_PER_1K_TOKENS
+        return BatchSummary(
+            batch_id=batch.id,
+            status="cancelled" if batch.cancelled else "finished" if batch.is_finished else "running",
+            ideas=len(batch.ideas),
+            succeeded=sum(1 for idea in batch.ideas if idea.status == JobStatus.SUCCEEDED),
+            failed=sum(1 for idea in batch.ideas if idea.status == JobStatus.FAILED),
+            pending=len(batch.ideas) - len(done),
+            clusters=batch.clusters,
+            hours=round(hours, 3),
+            ideas_per_hour=round(len(done) / hours, 2) if hours > 0 else 0.0,
+            tokens=tokens,
+            cost=round(cost, 4),
+            cost_per_idea=round(cost / len(done), 4) if done else 0.0,
+            pages_shared=batch.pages_shared,
+            rows=rows,
+        )
+
+    def _run(self, batch: Batch):
+        (self.batch_dir / batch.id).mkdir(parents=True, exist_ok=True)
+        self._batches[batch.id] = batch
+        self._save(batch)
+        self._tasks[batch.id] = asyncio.create_task(self._coordinate(batch))
+
+    async def _coordinate(self, batch: Batch):
+        # The shared registries aren't kept across restarts, nor for longer than a day
+        for idea in batch.ideas:
+            if idea.job_id is not None and not idea.is_finished:
+                share_fetch_registry(idea.session_id, batch.fetch_group(idea))
+        try:
+            while not self._check(batch):
+                await asyncio.sleep(BATCH_POLL_SECONDS)
+        finally:
+            self._tasks.pop(batch.id, None)
+
+    def _check(self, batch: Batch) -> bool:
+        """Record the jobs that finished and submit the ideas that can start. True once the batch is done."""
+        changed = False
+        for idea in batch.ideas:
+            if idea.job_id is None or idea.is_finished:
+                continue
+            job = self.jobs.get(idea.job_id)
+            if job is None:
+                idea.status, idea.error = JobStatus.FAILED, "The job was lost"
+            else:
+                idea.status, idea.started_at, idea.error = job.status, job.started_at, job.error
+                idea.tokens = job.tokens
+                if job.is_finished:
+                    idea.finished_at = job.finished_at or time.time()
+            changed = True
+        changed = self._count_pages_shared(batch) or changed
+
+        running = sum(1 for idea in batch.ideas if idea.job_id is not None and not idea.is_finished)
+        for idea in sorted(batch.ideas, key=lambda idea: (idea.leader is not None, idea.index)):
+            if batch.cancelled or running >= self.max_concurrency:
+                break
+            if idea.job_id is not None or not self._can_start(batch, idea):
+                continue
+            self._submit(batch, idea)
+            running += 1
+            changed = True
+
+        if batch.cancelled:
+            for idea in batch.ideas:
+                if idea.job_id is None and idea.status is None:
+                    idea.status = JobStatus.CANCELLED
+                    changed = True
+        if all(idea.is_finished for idea in batch.ideas):
+            batch.finished_at = time.time()
+            self._save(batch)
+            self._write_summary(batch)
+            self._batches.pop(batch.id, None)
+            return True
+        if changed:
+            self._save(batch)
+        return False
+
+    def _count_pages_shared(self, batch: Batch) -> bool:
+        """Add the page fetches shared since the last check to the batch. True if there were any."""
+        shared = 0
+        for group in {batch.fetch_group(idea) for idea in batch.ideas}:
+            metrics = get_session_metrics(group)
+            pages = int(metrics.get("fetch_registry_hits") + metrics.get("fetch_inflight_joins"))
+            # The metrics start over after a restart or once they expire
+            counted = self._pages_counted.get(group, 0)
+            shared += pages - counted if pages >= counted else pages
+            self._pages_counted[group] = pages
+        batch.pages_shared += shared
+        return shared > 0
+
+    def _can_start(self, batch: Batch, idea: BatchIdea) -> bool:
+        if idea.leader is None or not IDEA_CACHE_ENABLED:
+            return True
+        # Seeded with the research of the leader, once it is in the idea cache
+        leader = batch.ideas[idea.leader]
+        return leader.is_finished or get_idea_cache().has_session(leader.session_id)
+
+    def _submit(self, batch: Batch, idea: BatchIdea):
+        # The API routers import the batch runner
+        from app.api.routers.models import ChatData
+
+        share_fetch_registry(idea.session_id, batch.fetch_group(idea))
+        data = ChatData(
+            messages=[{"role": "user", "content": idea.idea}],
+            data=batch.params,
+            email=batch.email,
+            sessionId=idea.session_id,
+        )
+        job = self.jobs.submit("research", data.model_dump(mode="json"), session_id=idea.session_id)
+        idea.job_id, idea.status = job.id, job.status
+        logger.info(f"Batch {batch.id}: researching idea {idea.index + 1} of {len(batch.ideas)} in job {job.id}")
+
+    def _save(self, batch: Batch):
+        batch_file = self.batch_dir / batch.id / "batch.json"
+        tmp_file = batch_file.with_suffix(".tmp")
+        tmp_file.write_text(batch.model_dump_json())
+        os.replace(tmp_file, batch_file)
+
+    def _write_summary(self, batch: Batch):
+        summary = self.summary(batch)
+        (self.batch_dir / batch.id / "summary.csv").write_text(summary.to_csv())
+        (self.batch_dir / batch.id / "summary.md").write_text(summary.to_markdown())
+        logger.info(
+            f"Batch {batch.id} finished: {summary.succeeded} of {summary.ideas} ideas, "
+            f"{summary.ideas_per_hour} ideas per hour, {summary.cost_per_idea} per idea"
+        )
+
+
+_runner: Optional[BatchRunner] = None
+
+
+def get_batch_runner() -> BatchRunner:
+    global _runner
+    if _runner is None:
+        _runner = BatchRunner()
+    return _runner
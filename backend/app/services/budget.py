@@ -0,0 +1,308 @@
+"""
+Time and token budgets of a research run, shared by its whole workflow tree.
+
+The timeouts are set independently at each level: the research workflow has an hour, its
+sub-workflows 20 or 30 minutes and an agent 6 minutes, each from when it starts. A child
+started late can outlive the useful window of its parent, and its tokens aren't counted
+anywhere. A `Budget` is opened by the top workflow of a run and every task started from it
+sees it, like the `scheduling` context:
+
+- `child_budget` narrows it for a sub-workflow, with the minimum of the sub-workflow's own
+  timeout (see `sub_workflow_seconds`), deadline and token limit and what its parent has left,
+- `watch_budget` (called by `app.services.cancellation.track_workflow` for every
+  sub-workflow and agent run) cancels a run still going when its budget ran out,
+- `raise_if_over_budget` (called by the scheduler before every LLM and tool call) stops work
+  that would start without time or tokens left.
+
+The tokens of every LLM call are charged to the budget of the task that made it, and to all
+its parents, from the LLM end events of llama-index (see `init_budget_accounting`). The
+sub-workflows run in other processes return the tokens they used with their result, charged
+to the budget of their parent with `charge_tokens`.
+"""
+
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.llm import LLMChatEndEvent, LLMCompletionEndEvent
+
+from app.services.deadline import Deadline
+from app.services.session_metrics import get_session_metrics
+
+logger = logging.getLogger("uvicorn")
+
+# LLM tokens a research run can use, 0 for no limit
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "0"))
+# Seconds a run gets past the deadline of its budget before it is cancelled, so the parent's
+# own handling at the deadline (e.g. going on without a research stage) goes first
+BUDGET_GRACE_SECONDS = 1.0
+# Characters per token, to estimate the tokens of the LLM calls that don't report their usage
+CHARS_PER_TOKEN = 4
+
+
+class BudgetExhausted(Exception):
+    """Raised by work that would start without time or tokens left in its budget."""
+
+
+class Budget:
+    def __init__(
+        self,
+        name: str,
+        session_id: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        max_tokens: Optional[int] = None,
+        parent: Optional["Budget"] = None,
+    ):
+        self.name = name
+        self.session_id = session_id or (parent.session_id if parent is not None else "default")
+        self.deadline = deadline
+        self.max_tokens = max_tokens
+        self.parent = parent
+        self.used_tokens = 0
+
+    @classmethod
+    def for_run(
+        cls,
+        name: str,
+        session_id: Optional[str],
+        seconds: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+        max_tokens: Optional[int] = SESSION_TOKEN_BUDGET or None,
+    ) -> "Budget":
+        """
+        The budget of a run taking at most `seconds` or until `deadline`, within the budget of
+        the current task if there is one (e.g. a batch of runs).
+        """
+        if seconds is not None:
+            deadline = _earliest(deadline, Deadline.after(seconds))
+        parent = _budget.get()
+        if parent is not None:
+            return parent.child(name, deadline=deadline, max_tokens=max_tokens)
+        return cls(name, session_id=session_id, deadline=deadline, max_tokens=max_tokens)
+
+    def child(
+        self,
+        name: str,
+        seconds: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+        max_tokens: Optional[int] = None,
+    ) -> "Budget":
+        """The budget of a child with its own limits, within what is left of this one."""
+        if seconds is not None:
+            deadline = _earliest(deadline, Deadline.after(seconds))
+        remaining = self.remaining_tokens()
+        if max_tokens is None or (remaining is not None and remaining < max_tokens):
+            max_tokens = remaining
+        return Budget(name, deadline=_earliest(deadline, self.effective_deadline()), max_tokens=max_tokens, parent=self)
+
+    def effective_deadline(self) -> Optional[Deadline]:
+        """The earliest of the deadlines of the budget and its parents."""
+        parent = self.parent.effective_deadline() if self.parent is not None else None
+        return _earliest(self.deadline, parent)
+
+    def remaining_seconds(self) -> Optional[float]:
+        deadline = self.effective_deadline()
+        return deadline.remaining() if deadline is not None else None
+
+    def remaining_tokens(self) -> Optional[int]:
+        remaining = self.max_tokens - self.used_tokens if self.max_tokens is not None else None
+        if self.parent is not None:
+            parent = self.parent.remaining_tokens()
+            if parent is not None and (remaining is None or parent < remaining):
+                remaining = parent
+        return max(0, remaining) if remaining is not None else None
+
+    def charge(self, tokens: int):
+        budget = self
+        while budget is not None:
+            budget.used_tokens += tokens
+            budget = budget.parent
+
+    def exhausted(self) -> Optional[str]:
+        """Why no work can start in the budget anymore, None while it can."""
+        seconds = self.remaining_seconds()
+        if seconds is not None and seconds <= 0:
+            return "its deadline passed"
+        tokens = self.remaining_tokens()
+        if tokens is not None and tokens <= 0:
+            return "its tokens are used up"
+        return None
+
+    def limits(self) -> Dict[str, Any]:
+        """What is left of the budget, to open it again in another process with `from_limits`."""
+        deadline = self.effective_deadline()
+        return {
+            "name": self.name,
+            "session_id": self.session_id,
+            "deadline": deadline.at if deadline is not None else None,
+            "max_tokens": self.remaining_tokens(),
+        }
+
+    @classmethod
+    def from_limits(cls, limits: Optional[Dict[str, Any]]) -> Optional["Budget"]:
+        if not limits:
+            return None
+        deadline = limits.get("deadline")
+        return cls(
+            limits["name"],
+            session_id=limits.get("session_id"),
+            deadline=Deadline(deadline) if deadline else None,
+            max_tokens=limits.get("max_tokens"),
+        )
+
+
+def _earliest(first: Optional[Deadline], second: Optional[Deadline]) -> Optional[Deadline]:
+    if first is None or second is None:
+        return first or second
+    return first if first.at <= second.at else second
+
+
+_budget: ContextVar[Optional[Budget]] = ContextVar("budget", default=None)
+
+
+def get_budget() -> Optional[Budget]:
+    return _budget.get()
+
+
+def raise_if_over_budget(what: str = "work"):
+    budget = _budget.get()
+    if budget is None:
+        return
+    reason = budget.exhausted()
+    if reason is not None:
+        raise BudgetExhausted(f"No {what} started for {budget.name}: {reason}")
+
+
+@contextmanager
+def budget_scope(budget: Optional[Budget]) -> Iterator[Optional[Budget]]:
+    """The workflows started in this block, and all they start, run within `budget`."""
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+@contextmanager
+def child_budget(
+    name: str,
+    seconds: Optional[float] = None,
+    deadline: Optional[Deadline] = None,
+    max_tokens: Optional[int] = None,
+) -> Iterator[Optional[Budget]]:
+    """
+    Run the workflows started in this block within their own limits and what is left of the
+    current budget. Raises `BudgetExhausted` rather than starting them without anything left.
+    """
+    parent = _budget.get()
+    if parent is None:
+        yield None
+        return
+    budget = parent.child(name, seconds=seconds, deadline=deadline, max_tokens=max_tokens)
+    reason = budget.exhausted()
+    if reason is not None:
+        raise BudgetExhausted(f"{name} not started: the budget of {parent.name} is spent, {reason}")
+    with budget_scope(budget):
+        yield budget
+
+
+def charge_tokens(tokens: int, session_id: Optional[str] = None):
+    """
+    Charge LLM tokens to the current budget and its parents, and to the session's metrics, e.g.
+    the tokens a sub-workflow used in another process.
+    """
+    budget = _budget.get()
+    if budget is not None:
+        budget.charge(tokens)
+        session_id = budget.session_id
+    if session_id is not None:
+        get_session_metrics(session_id).incr("llm_tokens", tokens)
+
+
+def sub_workflow_seconds(workflow: Any, seconds: Optional[float] = None) -> Optional[float]:
+    """The earliest of `seconds` and the timeout the sub-workflow was created with."""
+    timeout = getattr(workflow, "_timeout", None)
+    if seconds is None or timeout is None:
+        return timeout if seconds is None else seconds
+    return min(seconds, timeout)
+
+
+def watch_budget(name: str, handler: asyncio.Future) -> asyncio.Future:
+    """Cancel the run of `handler` if it is still going when the current budget runs out."""
+    budget = _budget.get()
+    if budget is None:
+        return handler
+    reason = budget.exhausted()
+    if reason is not None:
+        asyncio.ensure_future(handler.cancel_run())
+        raise BudgetExhausted(f"{name} not started: the budget of {budget.name} is spent, {reason}")
+    seconds = budget.remaining_seconds()
+    if seconds is None:
+        return handler
+
+    def cancel():
+        if not handler.done():
+            logger.info(f"Cancelling {name}: the budget of {budget.name} ran out")
+            get_session_metrics(budget.session_id).incr("budget_cancelled_runs")
+            asyncio.ensure_future(handler.cancel_run())
+
+    timer = asyncio.get_running_loop().call_later(seconds + BUDGET_GRACE_SECONDS, cancel)
+    handler.add_done_callback(lambda _: timer.cancel())
+    return handler
+
+
+def _count_tokens(event: Any) -> int:
+    response = event.response
+    if response is None:
+        return 0
+    for usage in (response.additional_kwargs, _raw_usage(response.raw)):
+        if usage and usage.get("total_tokens"):
+            return int(usage["total_tokens"])
+        if usage and (usage.get("prompt_tokens") or usage.get("completion_tokens")):
+            return int(usage.get("prompt_tokens") or 0) + int(usage.get("completion_tokens") or 0)
+    # No usage reported, e.g. streamed responses, estimated from the text
+    if isinstance(event, LLMChatEndEvent):
+        prompt = "".join(str(message.content or "") for message in event.messages)
+        output = str(response.message.content or "")
+    else:
+        prompt = str(event.prompt)
+        output = response.text or ""
+    return (len(prompt) + len(output)) // CHARS_PER_TOKEN
+
+
+def _raw_usage(raw: Any) -> Optional[Dict[str, Any]]:
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None or isinstance(usage, dict):
+        return usage
+    return {key: getattr(usage, key, None) for key in ("total_tokens", "prompt_tokens", "completion_tokens")}
+
+
+class BudgetEventHandler(BaseEventHandler):
+    """Charges the tokens of every LLM call to the budget of the task that made it."""
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BudgetEventHandler"
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> Any:
+        if not isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+            return
+        if _budget.get() is None:
+            return
+        charge_tokens(_count_tokens(event))
+
+
+_accounting_initialized = False
+
+
+def init_budget_accounting():
+    global _accounting_initialized
+    if not _accounting_initialized:
+        get_dispatcher().add_event_handler(BudgetEventHandler())
+        _accounting_initialized = True
@@ -0,0 +1,229 @@
+"""
+Structured cancellation of the workflow tree of a research run.
+
+Cancelling the handler of the top workflow only stops its own steps: the sub-workflows and
+agents started from them run on handlers of their own, and the tool calls, browsers and
+HTTP requests they started keep going. A `CancelScope` is opened by the routes around
+`workflow.run()`, like the `scheduling` context, and every task started from it sees it:
+
+- `track_workflow` registers the handler of a sub-workflow or agent run,
+- `cancellable` registers the task running a block, e.g. a tool call or an HTTP request,
+- `raise_if_cancelled` stops work that would start after the scope was cancelled.
+
+`CancelScope.cancel` cancels everything registered at once, waits at most
+`CANCELLATION_TIMEOUT` seconds for it to stop and reports what was cancelled and what was
+still running at the timeout. The reports of the cancelled runs of a session are exposed
+through `/api/sessions/{session_id}/cancellation`.
+"""
+
+import asyncio
+import inspect
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from cachetools import TTLCache
+from pydantic import BaseModel, Field
+
+from app.services.budget import watch_budget
+from app.services.session_metrics import SESSION_METRICS_TTL, get_session_metrics
+
+logger = logging.getLogger("uvicorn")
+
+# Seconds the cancelled workflows, tool calls and requests have to stop
+CANCELLATION_TIMEOUT = float(os.getenv("CANCELLATION_TIMEOUT", "10"))
+
+
+class SessionCancelled(asyncio.CancelledError):
+    """Raised by work that would start in a cancelled scope."""
+
+
+class CancelledItem(BaseModel):
+    kind: str
+    name: str
+    # Seconds it ran before it was cancelled
+    running_seconds: float
+
+
+class CancellationReport(BaseModel):
+    session_id: str
+    scope: str
+    reason: str
+    requested_at: float = Field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    # Stopped within the timeout
+    cancelled: List[CancelledItem] = Field(default_factory=list)
+    # Still running at the timeout
+    timed_out: List[CancelledItem] = Field(default_factory=list)
+
+    def summary(self) -> str:
+        summary = f"Cancelled {len(self.cancelled)} workflows, tool calls and requests of {self.scope} ({self.reason})"
+        if self.timed_out:
+            summary += f", {len(self.timed_out)} still running: {', '.join(item.name for item in self.timed_out)}"
+        return summary
+
+
+class _Registered:
+    def __init__(self, kind: str, name: str, stop: Callable[[], Any], done: asyncio.Future):
+        self.kind = kind
+        self.name = name
+        self.stop = stop
+        self.done = done
+        self.started_at = time.monotonic()
+
+    def item(self) -> CancelledItem:
+        return CancelledItem(kind=self.kind, name=self.name, running_seconds=round(time.monotonic() - self.started_at, 3))
+
+
+class CancelScope:
+    def __init__(self, session_id: str, name: str):
+        self.session_id = session_id
+        self.name = name
+        self.report: Optional[CancellationReport] = None
+        self._registered: Dict[int, _Registered] = {}
+        self._ids = itertools.count()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.report is not None
+
+    @property
+    def running(self) -> int:
+        return len(self._registered)
+
+    def register(self, kind: str, name: str, stop: Callable[[], Any], done: asyncio.Future) -> int:
+        """
+        Register work to cancel with the scope: `stop` is called to cancel it, and it has
+        stopped once `done` is done. Returns the id to unregister it with.
+        """
+        if self.cancelled:
+            raise SessionCancelled(f"{self.name} was cancelled: {self.report.reason}")
+        registration_id = next(self._ids)
+        self._registered[registration_id] = _Registered(kind, name, stop, done)
+        return registration_id
+
+    def unregister(self, registration_id: int):
+        self._registered.pop(registration_id, None)
+
+    async def cancel(self, reason: str, timeout: float = CANCELLATION_TIMEOUT) -> CancellationReport:
+        """Cancel everything registered, waiting at most `timeout` seconds for it to stop."""
+        if self.report is not None:
+            return self.report
+        report = self.report = CancellationReport(session_id=self.session_id, scope=self.name, reason=reason)
+        current = asyncio.current_task()
+        registered = [entry for entry in self._registered.values() if entry.done is not current]
+        self._registered.clear()
+
+        stop_by = time.monotonic() + timeout
+        try:
+            await asyncio.wait_for(asyncio.gather(*(self._stop(entry) for entry in registered)), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        pending = {entry.done for entry in registered if not entry.done.done()}
+        if pending:
+            _, pending = await asyncio.wait(pending, timeout=max(0.0, stop_by - time.monotonic()))
+
+        for entry in registered:
+            (report.timed_out if entry.done in pending else report.cancelled).append(entry.item())
+        report.finished_at = time.time()
+        get_session_metrics(self.session_id).incr("cancelled_items", len(report.cancelled))
+        logger.info(report.summary())
+        return report
+
+    @staticmethod
+    async def _stop(entry: _Registered):
+        try:
+            stopping = entry.stop()
+            if inspect.isawaitable(stopping):
+                await stopping
+        except Exception as e:
+            logger.warning(f"Could not cancel {entry.kind} {entry.name!r}: {e}")
+
+
+_scope: ContextVar[Optional[CancelScope]] = ContextVar("cancel_scope", default=None)
+
+
+def get_cancel_scope() -> Optional[CancelScope]:
+    return _scope.get()
+
+
+def raise_if_cancelled():
+    scope = _scope.get()
+    if scope is not None and scope.cancelled:
+        raise SessionCancelled(f"{scope.name} was cancelled: {scope.report.reason}")
+
+
+@contextmanager
+def cancel_scope(session_id: Optional[str], name: str = "research") -> Iterator[CancelScope]:
+    """Cancel the workflows started in this block, and all they start, with the scope."""
+    scope = CancelScope(session_id or "default", name)
+    _add_session_scope(scope)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def track_workflow(name: str, handler: asyncio.Future, kind: str = "workflow") -> asyncio.Future:
+    """
+    Cancel the run of `handler` with the scope of the current task, until it is done, and
+    when the budget of the current task runs out (see `app.services.budget`).
+    """
+    watch_budget(name, handler)
+    scope = _scope.get()
+    if scope is None:
+        return handler
+    try:
+        registration_id = scope.register(kind, name, handler.cancel_run, handler)
+    except SessionCancelled:
+        asyncio.ensure_future(handler.cancel_run())
+        raise
+    handler.add_done_callback(lambda _: scope.unregister(registration_id))
+    return handler
+
+
+@contextmanager
+def cancellable(kind: str, name: str) -> Iterator[None]:
+    """Cancel the current task with the scope while it runs the block."""
+    scope = _scope.get()
+    task = asyncio.current_task()
+    if scope is None or task is None:
+        yield
+        return
+    registration_id = scope.register(kind, name, task.cancel, task)
+    try:
+        yield
+    finally:
+        scope.unregister(registration_id)
+
+
+_sessions: TTLCache = TTLCache(maxsize=1000, ttl=SESSION_METRICS_TTL)
+_sessions_lock = threading.Lock()
+
+
+def _add_session_scope(scope: CancelScope):
+    with _sessions_lock:
+        # Only the runs still running or cancelled are kept
+        scopes = [other for other in _sessions.get(scope.session_id, []) if other.running or other.cancelled]
+        _sessions[scope.session_id] = scopes + [scope]
+
+
+def get_session_scopes(session_id: str) -> List[CancelScope]:
+    with _sessions_lock:
+        return list(_sessions.get(session_id, []))
+
+
+async def cancel_session(session_id: str, reason: str) -> List[CancellationReport]:
+    """Cancel all the runs of the session, returns a report for each of them."""
+    scopes = [scope for scope in get_session_scopes(session_id) if not scope.cancelled]
+    return list(await asyncio.gather(*(scope.cancel(reason) for scope in scopes)))
+
+
+def cancellation_reports(session_id: str) -> List[CancellationReport]:
+    return [scope.report for scope in get_session_scopes(session_id) if scope.report is not None]
@@ -0,0 +1,233 @@
+"""
+Checkpoints of the research workflows, so a session interrupted late in the pipeline
+can be resumed instead of being researched again from scratch.
+
+Steps decorated with `@checkpoint` save the workflow state after they complete:
+`ctx.data` and the events that were emitted but not consumed yet. When a workflow is
+run with `resume=True`, its start step restores the state and re-sends the pending
+events instead of starting over, so completed steps are skipped. A workflow that had
+already finished returns its saved result right away, which is how completed
+sub-workflows are skipped when their parent resumes.
+
+Checkpoints are stored in `CHECKPOINTS_DIR/<session_id>/<run_id>/<workflow>.json`, by the
+research run of the workflow (see `app.utils.paths.run_data_scope`), so two runs of the same
+session keep their own checkpoints. The id of a run is the same for every submission of the
+same idea, so a resumed run finds the checkpoints of the interrupted one.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow
+from llama_index.core.workflow.utils import get_steps_from_instance
+
+from app.utils.paths import get_data_run_id
+from app.utils.serialization import decode_value, encode_value
+from app.workflows.single import AgentRunEvent
+
+logger = logging.getLogger("uvicorn")
+
+CHECKPOINTS_DIR = os.getenv("CHECKPOINTS_DIR", os.path.join("output", "checkpoints"))
+
+
+class WorkflowCheckpoint:
+    """State of one workflow run, saved after every completed step."""
+
+    def __init__(self, workflow: Workflow, session_id: str):
+        self.workflow_name = type(workflow).__name__
+        self.path = _checkpoints_dir(session_id, get_data_run_id()) / f"{self.workflow_name}.json"
+        self.status = "running"
+        self.completed_steps: List[str] = []
+        self.result: Any = None
+        # Events emitted by completed steps with the steps that still have to consume them, by object id
+        self._pending: Dict[int, Tuple[Event, Set[str]]] = {}
+        self._consumers: Dict[type, Set[str]] = {}
+        for name, step_func in get_steps_from_instance(workflow).items():
+            for event_type in getattr(step_func, "__step_config").accepted_events:
+                self._consumers.setdefault(event_type, set()).add(name)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Restore the saved run and return its ctx.data, None if there is nothing to resume."""
+        if not self.path.exists():
+            return None
+        try:
+            saved = json.loads(self.path.read_text())
+            self.status = saved["status"]
+            self.completed_steps = saved["completed_steps"]
+            self.result = decode_value(saved["result"])
+            self._pending = {}
+            for pending in saved["pending"]:
+                event = decode_value(pending["event"])
+                self._pending[id(event)] = (event, set(pending["steps"]))
+            return decode_value(saved["data"])
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+
+    def clear(self):
+        self.status = "running"
+        self.completed_steps = []
+        self.result = None
+        self._pending = {}
+        self.path.unlink(missing_ok=True)
+
+    @property
+    def pending_events(self) -> List[Tuple[Event, Set[str]]]:
+        return list(self._pending.values())
+
+    def step_completed(self, step_name: str, ctx: Context, consumed: Event, emitted: List[Event]):
+        pending = self._pending.get(id(consumed))
+        if pending is not None:
+            # Some events are consumed by more than one step
+            pending[1].discard(step_name)
+            if not pending[1]:
+                self._pending.pop(id(consumed))
+        for event in emitted:
+            if isinstance(event, StopEvent):
+                self.status = "finished"
+                self.result = event.result
+            elif event is not None:
+                self._pending[id(event)] = (event, set(self._consumers.get(type(event), set())))
+        self.completed_steps.append(step_name)
+        self.save(ctx)
+
+    def resend_pending_events(self, ctx: Context):
+        for event, steps in self.pending_events:
+            if steps == self._consumers.get(type(event)):
+                ctx.send_event(event)
+                continue
+            for step_name in steps:
+                ctx.send_event(event, step=step_name)
+
+    def save(self, ctx: Context):
+        data = {}
+        for key, value in ctx.data.items():
+            try:
+                data[key] = encode_value(value)
+            except TypeError as e:
+                logger.warning(f"Not checkpointing {self.workflow_name} ctx.data[{key!r}]: {e}")
+        try:
+            result = encode_value(self.result)
+        except TypeError:
+            result = str(self.result)
+        checkpoint = {
+            "workflow": self.workflow_name,
+            "status": self.status,
+            "completed_steps": self.completed_steps,
+            "result": result,
+            "pending": [{"event": encode_value(event), "steps": sorted(steps)} for event, steps in self.pending_events],
+            "data": data,
+            "updated_at": time.time(),
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(checkpoint))
+        os.replace(tmp_path, self.path)
+
+
+class _RecordingContext:
+    """Passes everything through to the workflow context and records the events sent by a step."""
+
+    def __init__(self, ctx: Context):
+        self._ctx = ctx
+        self.sent_events: List[Event] = []
+
+    def send_event(self, message: Event, step: Optional[str] = None):
+        self.sent_events.append(message)
+        self._ctx.send_event(message, step)
+
+    def __getattr__(self, name: str):
+        return getattr(self._ctx, name)
+
+
+def checkpoint(func: Callable) -> Callable:
+    """
+    Checkpoint a workflow step, use it under `@step()`. The workflow needs a `session_id`
+    attribute and its steps the usual `ctx` and `ev` parameters.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        arguments = signature.bind(self, *args, **kwargs).arguments
+        ctx: Context = arguments["ctx"]
+        ev: Event = arguments["ev"]
+
+        if isinstance(ev, StartEvent) and self.session_id:
+            self._checkpoint = WorkflowCheckpoint(self, self.session_id)
+            if ev.get("resume") and _resume(self._checkpoint, ctx):
+                if self._checkpoint.status == "finished":
+                    return StopEvent(result=self._checkpoint.result)
+                # The re-sent pending events continue the run
+                return None
+            self._checkpoint.clear()
+
+        recording_ctx = _RecordingContext(ctx)
+        arguments["ctx"] = recording_ctx
+        result = await func(**arguments)
+
+        workflow_checkpoint: Optional[WorkflowCheckpoint] = getattr(self, "_checkpoint", None)
+        if workflow_checkpoint is not None:
+            workflow_checkpoint.step_completed(func.__name__, ctx, ev, recording_ctx.sent_events + [result])
+        return result
+
+    return wrapper
+
+
+def _resume(workflow_checkpoint: WorkflowCheckpoint, ctx: Context) -> bool:
+    """Restore a checkpointed run into `ctx`, returns False if there is nothing to resume."""
+    data = workflow_checkpoint.load()
+    if data is None:
+        return False
+
+    name = workflow_checkpoint.workflow_name
+    if workflow_checkpoint.status == "finished":
+        ctx.write_event_to_stream(AgentRunEvent(name=name, msg="Already completed, reusing the checkpointed result"))
+        return True
+
+    if not workflow_checkpoint.pending_events:
+        # Interrupted before the first step completed, there is nothing to skip
+        return False
+
+    ctx.data.update(data)
+    # Sub-workflows started by the resumed steps resume too
+    ctx.data["resume"] = True
+    ctx.write_event_to_stream(
+        AgentRunEvent(
+            name=name,
+            msg=f"Resuming from checkpoint, skipping {len(workflow_checkpoint.completed_steps)} completed steps",
+        )
+    )
+    workflow_checkpoint.resend_pending_events(ctx)
+    return True
+
+
+def _checkpoints_dir(session_id: str, run_id: Optional[str]) -> Path:
+    session_dir = Path(CHECKPOINTS_DIR) / os.path.basename(session_id)
+    # Workflows run outside a research run (e.g. on their own) keep theirs in the session's directory
+    return session_dir / os.path.basename(run_id) if run_id is not None else session_dir
+
+
+def get_session_checkpoints(session_id: str) -> List[Dict[str, Any]]:
+    session_dir = Path(CHECKPOINTS_DIR) / os.path.basename(session_id)
+    checkpoints = []
+    for path in sorted(session_dir.rglob("*.json")):
+        try:
+            saved = json.loads(path.read_text())
+        except Exception:
+            continue
+        checkpoints.append({
+            "run_id": path.parent.name if path.parent != session_dir else None,
+            "workflow": saved["workflow"],
+            "status": saved["status"],
+            "completed_steps": len(saved["completed_steps"]),
+            "pending_events": len(saved["pending"]),
+            "updated_at": saved["updated_at"],
+        })
+    return checkpoints
@@ -0,0 +1,93 @@
+"""
+Wall-clock deadlines for research sessions ("fast mode").
+
+A research session started with a deadline (e.g. `"fast": true` in the chat data, see
+`FAST_MODE_SECONDS`) splits its time between the research stages and the executive summary.
+Each stage workflow sizes its work to the time it has left when it gets to it: fewer search
+queries and competitors, no critic round it can't afford and fewer pages read per batch, so
+a complete, if shallower, report is delivered by the deadline.
+
+Deadlines are passed to the workflow factories as epoch seconds, so they cross process and
+work queue boundaries, and to the tools of an agent run with `deadline_scope`.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# Time budget of a research session in fast mode
+FAST_MODE_SECONDS = int(os.getenv("FAST_MODE_SECONDS", "300"))
+# Share of the time budget for the research stages, the rest is for the executive summary
+RESEARCH_TIME_SHARE = 0.6
+
+# Estimated seconds of the units of work sized to a deadline
+SEARCH_SECONDS = 90
+CRITIC_ROUND_SECONDS = 60
+REPORT_SECONDS = 45
+PAGE_READ_SECONDS = 20
+
+
+class Deadline:
+    def __init__(self, at: float):
+        # Epoch seconds
+        self.at = at
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.time() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.time())
+
+    def expired(self) -> bool:
+        return self.remaining() == 0
+
+    def allows(self, seconds: float) -> bool:
+        return self.remaining() >= seconds
+
+    def split(self, share: float) -> "Deadline":
+        """A deadline `share` of the time left from now."""
+        return Deadline.after(self.remaining() * share)
+
+    def fit(self, count: int, seconds_each: float, parallel: int = 1, reserve: float = 0) -> int:
+        """
+        How many of `count` units of work taking `seconds_each`, `parallel` at a time, are
+        done before the deadline while leaving `reserve` seconds for the work after them.
+        At least one, so the work after them has something to go on.
+        """
+        rounds = int((self.remaining() - reserve) // seconds_each)
+        return max(1, min(count, rounds * parallel))
+
+
+def to_deadline(at: Optional[float]) -> Optional[Deadline]:
+    return Deadline(at) if at else None
+
+
+_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def get_deadline() -> Optional[Deadline]:
+    """The deadline of the scope, or the end of the run's budget if sooner (see app.services.budget)."""
+    from app.services.budget import get_budget
+
+    deadline = _deadline.get()
+    budget = get_budget()
+    end = budget.effective_deadline() if budget is not None else None
+    if deadline is None or end is None:
+        return deadline or end
+    return deadline if deadline.at <= end.at else end
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[None]:
+    """
+    Tasks started in the scope, e.g. the steps and tool calls of an agent run, see the
+    deadline with `get_deadline`.
+    """
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
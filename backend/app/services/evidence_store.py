@@ -0,0 +1,253 @@
+"""
+Store of the evidence found by the research stages of a research run.
+
+The researchers of every stage return their findings as JSON with sources, quotes,
+statistics and the entities (competitors, trends, market segments, pain points) they are
+about. Each finding is kept as an `EvidenceRecord`, deduplicated and indexed by entity and
+canonical URL, so a stage can look up what the other stages already know before searching,
+and the executive summary gets the evidence without re-reading every report.
+
+Records are appended to `EVIDENCE_STORE_DIR/<session_id>/<run_id>.jsonl`, by the research run
+of the workflow like the checkpoints (see `app.utils.paths.run_data_scope`), so another idea
+of the same session doesn't start from the evidence of the first one. Every process of the
+run (process pool and work queue workers on the same node) appends to the same file and picks
+up the records of the others when it is queried.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from cachetools import TTLCache
+from pydantic import BaseModel, Field
+
+from app.services.session_metrics import SESSION_METRICS_TTL
+from app.utils.json_extractor import extract_json_from_response
+from app.utils.paths import get_data_run_id
+from app.utils.urls import canonicalize_url
+
+EVIDENCE_STORE_DIR = os.getenv("EVIDENCE_STORE_DIR", os.path.join("output", "evidence"))
+
+# Fields of the researchers' JSON findings that name the entity a finding is about
+ENTITY_FIELDS = ("name", "trend", "title", "category")
+URL_FIELDS = ("source_url", "homepage_url", "url", "source")
+STAT_FIELDS = ("value", "pricing_summary", "rating")
+
+
+class EvidenceRecord(BaseModel):
+    url: Optional[str] = None
+    quote: Optional[str] = None
+    stat: Optional[str] = None
+    entity: Optional[str] = None
+    stage: str
+    timestamp: float = Field(default_factory=time.time)
+
+    def key(self) -> str:
+        parts = [
+            canonicalize_url(self.url) if self.url else "",
+            " ".join((self.quote or "").lower().split()),
+            (self.stat or "").strip().lower(),
+            (self.entity or "").strip().lower(),
+        ]
+        return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+    def render(self) -> str:
+        parts = [f"[{self.entity}]" if self.entity else "", self.stat or "", f"\"{self.quote}\"" if self.quote else ""]
+        text = " ".join(part for part in parts if part)
+        return f"- {text} ({self.url or 'no source'}, {self.stage})"
+
+
+def _url(value: Any) -> Optional[str]:
+    if isinstance(value, dict):
+        value = value.get("url")
+    if isinstance(value, str) and value.startswith(("http://", "https://")):
+        return value
+    return None
+
+
+def _first(finding: Dict[str, Any], fields: Iterable[str]) -> Optional[str]:
+    for field in fields:
+        value = finding.get(field)
+        if value not in (None, "", 0):
+            return str(value)
+    return None
+
+
+def records_from_findings(stage: str, findings: Any) -> List[EvidenceRecord]:
+    """
+    Evidence records from the JSON findings of a researcher, e.g. the market insights with
+    their value, source and evidence, or the competitors with their source url.
+    """
+    records: List[EvidenceRecord] = []
+    if isinstance(findings, list):
+        for finding in findings:
+            records.extend(records_from_findings(stage, finding))
+        return records
+    if not isinstance(findings, dict):
+        return records
+
+    entity = _first(findings, ENTITY_FIELDS)
+    url = next(filter(None, (_url(findings.get(field)) for field in URL_FIELDS)), None)
+    stat = _first(findings, STAT_FIELDS)
+    quotes = []
+    for key in ("evidence", "pros", "cons"):
+        for item in findings.get(key) or []:
+            if isinstance(item, dict):
+                records.append(EvidenceRecord(
+                    url=_url(item.get("source")) or url, quote=item.get("quote"), stat=stat, entity=entity, stage=stage
+                ))
+            elif isinstance(item, str):
+                quotes.append(item)
+    if entity is not None and not quotes:
+        quotes.append(findings.get("finding") or findings.get("summary") or findings.get("description"))
+    for quote in quotes:
+        if entity is not None or url is not None:
+            records.append(EvidenceRecord(url=url, quote=quote, stat=stat, entity=entity, stage=stage))
+
+    for source in findings.get("sources") or []:
+        if _url(source):
+            records.append(EvidenceRecord(url=_url(source), stage=stage))
+    # Nested findings, e.g. "market_insights", "competitors", "key_trend_insights"
+    for value in findings.values():
+        if isinstance(value, list) and any(isinstance(item, dict) and _first(item, ENTITY_FIELDS) for item in value):
+            records.extend(records_from_findings(stage, value))
+    return records
+
+
+class EvidenceStore:
+    def __init__(self, session_id: str, run_id: Optional[str] = None):
+        self.session_id = session_id
+        self.run_id = run_id
+        session_dir = Path(EVIDENCE_STORE_DIR) / os.path.basename(session_id)
+        # Workflows run outside a research run (e.g. on their own) keep theirs by the session
+        if run_id is not None:
+            self.path = session_dir / f"{os.path.basename(run_id)}.jsonl"
+        else:
+            self.path = session_dir.with_suffix(".jsonl")
+        self.records: List[EvidenceRecord] = []
+        self._keys: set = set()
+        self._by_entity: Dict[str, List[int]] = {}
+        self._by_url: Dict[str, List[int]] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def add(self, records: Iterable[EvidenceRecord]) -> int:
+        """Add the records not already in the store, returns how many were added."""
+        with self._lock:
+            self._load_new()
+            added = [record for record in records if self._index(record)]
+            if added:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # Read back as already known by the next `_load_new`
+                with open(self.path, "a") as f:
+                    f.write("".join(record.model_dump_json() + "\n" for record in added))
+            return len(added)
+
+    def by_entity(self, entity: str) -> List[EvidenceRecord]:
+        with self._lock:
+            self._load_new()
+            return [self.records[i] for i in self._by_entity.get(entity.strip().lower(), [])]
+
+    def by_url(self, url: str) -> List[EvidenceRecord]:
+        with self._lock:
+            self._load_new()
+            return [self.records[i] for i in self._by_url.get(canonicalize_url(url), [])]
+
+    def query(
+        self,
+        entity: Optional[str] = None,
+        url: Optional[str] = None,
+        stage: Optional[str] = None,
+        exclude_stage: Optional[str] = None,
+    ) -> List[EvidenceRecord]:
+        if entity is not None:
+            records = self.by_entity(entity)
+        elif url is not None:
+            records = self.by_url(url)
+        else:
+            with self._lock:
+                self._load_new()
+                records = list(self.records)
+        return [
+            record for record in records
+            if (stage is None or record.stage == stage) and (exclude_stage is None or record.stage != exclude_stage)
+        ]
+
+    def render(self, records: List[EvidenceRecord], limit: int = 50) -> str:
+        """The records as a list for a prompt, the ones with quotes or stats first."""
+        ranked = sorted(records, key=lambda record: (record.quote is None and record.stat is None, -record.timestamp))
+        return "\n".join(record.render() for record in ranked[:limit])
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._load_new()
+            stages: Dict[str, int] = {}
+            for record in self.records:
+                stages[record.stage] = stages.get(record.stage, 0) + 1
+            return {"records": len(self.records), "entities": len(self._by_entity), "urls": len(self._by_url), "stages": stages}
+
+    def _index(self, record: EvidenceRecord) -> bool:
+        key = record.key()
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        self.records.append(record)
+        if record.entity:
+            self._by_entity.setdefault(record.entity.strip().lower(), []).append(len(self.records) - 1)
+        if record.url:
+            self._by_url.setdefault(canonicalize_url(record.url), []).append(len(self.records) - 1)
+        return True
+
+    def _load_new(self):
+        """Index the records other processes appended since the last read."""
+        if not self.path.exists():
+            return
+        with open(self.path, "r") as f:
+            f.seek(self._offset)
+            for line in f:
+                if line.endswith("\n"):
+                    self._index(EvidenceRecord.model_validate_json(line))
+                    self._offset += len(line.encode())
+
+
+_stores: TTLCache = TTLCache(maxsize=1000, ttl=SESSION_METRICS_TTL)
+_stores_lock = threading.Lock()
+
+
+def get_evidence_store(session_id: str, run_id: Optional[str] = None) -> EvidenceStore:
+    """The store of the run `run_id` of the session, by default the research run of the current task."""
+    run_id = run_id or get_data_run_id()
+    with _stores_lock:
+        store = _stores.get((session_id, run_id))
+        if store is None:
+            store = _stores[(session_id, run_id)] = EvidenceStore(session_id, run_id)
+        return store
+
+
+def get_session_run_ids(session_id: str) -> List[str]:
+    """The runs of the session with evidence, the latest last."""
+    session_dir = Path(EVIDENCE_STORE_DIR) / os.path.basename(session_id)
+    return [path.stem for path in sorted(session_dir.glob("*.jsonl"), key=lambda path: path.stat().st_mtime)]
+
+
+def record_findings(session_id: str, stage: str, findings: Any) -> int:
+    """Add the evidence of a researcher's findings, its JSON response or a parsed model, to the run's store."""
+    if isinstance(findings, BaseModel):
+        findings = findings.model_dump()
+    elif isinstance(findings, str):
+        findings = extract_json_from_response(findings)
+    return get_evidence_store(session_id).add(records_from_findings(stage, findings))
+
+
+def known_evidence(
+    session_id: str,
+    entity: Optional[str] = None,
+    exclude_stage: Optional[str] = None,
+    limit: int = 20,
+) -> str:
+    """What the run already knows, for the prompt of a researcher about to search."""
+    store = get_evidence_store(session_id)
+    return store.render(store.query(entity=entity, exclude_stage=exclude_stage), limit=limit)
@@ -0,0 +1,434 @@
+"""
+Local stand-ins for the research search APIs (Tavily, Brave, Reddit, GitHub and the MCP gateway).
+
+Serves the same request/response shapes as the real APIs from a seeded corpus, with
+configurable latency and injected errors, so the research pipeline can be load tested
+without network access or API quota. Point the app at it with `FAKE_UPSTREAMS_URL`:
+
+    poetry run fake-upstreams                       # serves on http://localhost:8100
+    FAKE_UPSTREAMS_URL=http://localhost:8100 python main.py
+
+Every upstream is served under its own prefix (`/tavily`, `/brave`, `/reddit`, `/github`, `/mcp`),
+see `app.services.upstreams.get_base_url`. Corpus documents can be opened at `/pages/{doc_id}`,
+so the web reader also reads pages from the fake service.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from cachetools import LRUCache
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse
+from pydantic import BaseModel
+
+logger = logging.getLogger("uvicorn")
+
+FAKE_UPSTREAMS_SEED = int(os.getenv("FAKE_UPSTREAMS_SEED", "42"))
+# JSON file with a list of {"title", "url", "content"} documents served before the generated ones
+FAKE_UPSTREAMS_CORPUS = os.getenv("FAKE_UPSTREAMS_CORPUS")
+# Generated documents kept for their pages, the least recently used are dropped first
+FAKE_UPSTREAMS_MAX_DOCUMENTS = int(os.getenv("FAKE_UPSTREAMS_MAX_DOCUMENTS", "10000"))
+# How long a call hangs when a timeout is injected, longer than the clients wait
+FAKE_UPSTREAMS_TIMEOUT_SECONDS = float(os.getenv("FAKE_UPSTREAMS_TIMEOUT_SECONDS", "90"))
+
+UPSTREAMS = ["tavily", "brave", "reddit", "github", "mcp"]
+
+SOURCES = [
+    "techcrunch.com",
+    "forbes.com",
+    "statista.com",
+    "businessinsider.com",
+    "producthunt.com",
+    "medium.com",
+    "trendhunter.com",
+    "g2.com",
+]
+
+ANGLES = [
+    "market size and growth forecast",
+    "customer pain points and needs",
+    "top competitors and pricing",
+    "emerging trends to watch",
+    "funding and investment activity",
+    "regulation and risks",
+    "go-to-market strategies that work",
+    "user reviews and complaints",
+]
+
+SUBREDDITS = ["startups", "Entrepreneur", "SaaS", "smallbusiness", "technology", "productivity"]
+
+LANGUAGES = ["Python", "TypeScript", "Go", "Rust", "JavaScript"]
+
+SENTENCES = [
+    "The {topic} market was valued at ${value} billion in {year} and is expected to grow at a CAGR of {pct}% through {year_end}.",
+    "{pct}% of surveyed users said {topic} tools are too expensive or hard to set up.",
+    "Early adopters of {topic} report saving {hours} hours per week on manual work.",
+    "More than {count} startups raised funding for {topic} products in the last year.",
+    "Customers compare {topic} offerings mainly on price, integrations and support quality.",
+    "Search interest in {topic} grew {pct}% year over year according to recent trend data.",
+    "Analysts expect consolidation in {topic} as larger platforms add similar features.",
+    "Community discussions about {topic} focus on reliability, privacy and onboarding.",
+]
+
+
+class FakeDocument(BaseModel):
+    id: str
+    title: str
+    url: str
+    content: str
+
+
+class UpstreamProfile:
+    """Latency and error injection settings for one fake upstream."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latency_ms = self._get_env("LATENCY_MS", 300.0)
+        # Log-normal spread of the latency around the median, 0 for a constant latency
+        self.latency_sigma = self._get_env("LATENCY_SIGMA", 0.5)
+        self.error_rate = self._get_env("ERROR_RATE", 0.0)
+        self.rate_limit_rate = self._get_env("RATE_LIMIT_RATE", 0.0)
+        self.timeout_rate = self._get_env("TIMEOUT_RATE", 0.0)
+        self.requests = 0
+        self.injected_errors = 0
+
+    def _get_env(self, key: str, default: float) -> float:
+        value = os.getenv(f"FAKE_UPSTREAMS_{self.name.upper()}_{key}", os.getenv(f"FAKE_UPSTREAMS_{key}"))
+        return float(value) if value is not None else default
+
+    async def simulate(self, rng: random.Random):
+        """Wait for a sampled latency and raise an injected error if one is drawn."""
+        self.requests += 1
+        roll = rng.random()
+        latency = self.latency_ms / 1000.0
+        if self.latency_sigma > 0:
+            latency *= rng.lognormvariate(0, self.latency_sigma)
+
+        if roll < self.timeout_rate:
+            self.injected_errors += 1
+            await asyncio.sleep(FAKE_UPSTREAMS_TIMEOUT_SECONDS)
+            raise HTTPException(status_code=504, detail="Injected timeout")
+        await asyncio.sleep(latency)
+        if roll < self.timeout_rate + self.rate_limit_rate:
+            self.injected_errors += 1
+            raise HTTPException(status_code=429, detail="Injected rate limit", headers={"Retry-After": "1"})
+        if roll < self.timeout_rate + self.rate_limit_rate + self.error_rate:
+            self.injected_errors += 1
+            raise HTTPException(status_code=500, detail="Injected server error")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "injected_errors": self.injected_errors,
+            "latency_ms": self.latency_ms,
+            "latency_sigma": self.latency_sigma,
+            "error_rate": self.error_rate,
+            "rate_limit_rate": self.rate_limit_rate,
+            "timeout_rate": self.timeout_rate,
+        }
+
+
+class FakeCorpus:
+    """
+    Documents returned by the fake search APIs.
+
+    Results for a query are the best matching documents of the seed corpus (if any),
+    followed by documents generated from the query. The same query always returns the same
+    documents, so runs can be compared with each other. Only the last `max_documents`
+    generated documents can be opened as pages, the seed corpus always can.
+    """
+
+    def __init__(self, seed: int, corpus_path: Optional[str] = None, max_documents: int = FAKE_UPSTREAMS_MAX_DOCUMENTS):
+        self.seed = seed
+        self.seed_documents: List[FakeDocument] = []
+        self._seed_by_id: Dict[str, FakeDocument] = {}
+        self._generated: LRUCache = LRUCache(maxsize=max_documents)
+        if corpus_path:
+            self._load(corpus_path)
+
+    def _load(self, corpus_path: str):
+        with open(corpus_path) as f:
+            for item in json.load(f):
+                doc = FakeDocument(
+                    id=self._doc_id(item["url"]),
+                    title=item["title"],
+                    url=item["url"],
+                    content=item["content"],
+                )
+                self._seed_by_id[doc.id] = doc
+                self.seed_documents.append(doc)
+        logger.info(f"Loaded {len(self.seed_documents)} documents into the fake upstreams corpus")
+
+    def get(self, doc_id: str) -> Optional[FakeDocument]:
+        return self._seed_by_id.get(doc_id) or self._generated.get(doc_id)
+
+    def __len__(self) -> int:
+        return len(self._seed_by_id) + len(self._generated)
+
+    def _doc_id(self, key: str) -> str:
+        return hashlib.sha1(f"{self.seed}|{key}".encode()).hexdigest()[:12]
+
+    def _rng(self, key: str) -> random.Random:
+        return random.Random(self._doc_id(key))
+
+    def search(self, query: str, count: int, base_url: str) -> List[FakeDocument]:
+        terms = set(re.findall(r"\w+", query.lower()))
+        matches = sorted(
+            (doc for doc in self.seed_documents if terms & set(re.findall(r"\w+", doc.title.lower()))),
+            key=lambda doc: -len(terms & set(re.findall(r"\w+", f"{doc.title} {doc.content}".lower()))),
+        )
+        results = matches[:count]
+        for i in range(count - len(results)):
+            results.append(self._generate(query, i, base_url))
+        return results
+
+    def _generate(self, query: str, index: int, base_url: str) -> FakeDocument:
+        rng = self._rng(f"{query}|{index}")
+        topic = query.strip() or "startups"
+        angle = ANGLES[(index + rng.randrange(len(ANGLES))) % len(ANGLES)]
+        doc_id = self._doc_id(f"{query}|{index}")
+        year = rng.randint(2022, 2024)
+        content = " ".join(
+            sentence.format(
+                topic=topic,
+                value=round(rng.uniform(0.5, 80), 1),
+                year=year,
+                year_end=year + rng.randint(5, 8),
+                pct=rng.randint(5, 60),
+                hours=rng.randint(2, 12),
+                count=rng.randint(20, 400),
+            )
+            for sentence in rng.sample(SENTENCES, 4)
+        )
+        doc = FakeDocument(
+            id=doc_id,
+            title=f"{topic.title()}: {angle}",
+            # Pages are served by this service, the source only tells the documents apart
+            url=f"{base_url}/pages/{doc_id}?source={rng.choice(SOURCES)}",
+            content=content,
+        )
+        self._generated[doc_id] = doc
+        return doc
+
+    def score(self, doc: FakeDocument) -> float:
+        return round(self._rng(doc.id).uniform(0.5, 0.99), 3)
+
+    def add(self, title: str, content: str) -> FakeDocument:
+        """Keep a document written to a fake upstream, e.g. a Notion page, so it can be opened."""
+        doc = FakeDocument(id=uuid.uuid4().hex[:12], title=title, url="", content=content)
+        self._generated[doc.id] = doc
+        return doc
+
+    def page_url(self, doc: FakeDocument, base_url: str) -> str:
+        return f"{base_url}/pages/{doc.id}"
+
+    def reddit_post(self, doc: FakeDocument, subreddit: Optional[str], base_url: str) -> Dict[str, Any]:
+        rng = self._rng(doc.id)
+        subreddit = subreddit or rng.choice(SUBREDDITS)
+        return {
+            "id": doc.id,
+            "title": doc.title,
+            "subreddit": subreddit,
+            "score": rng.randint(1, 2500),
+            "num_comments": rng.randint(0, 400),
+            "permalink": f"/r/{subreddit}/comments/{doc.id}/",
+            "selftext": doc.content,
+            # The post is opened as a page of this service, not on reddit.com
+            "url": self.page_url(doc, base_url),
+        }
+
+    def github_repo(self, doc: FakeDocument, base_url: str) -> Dict[str, Any]:
+        rng = self._rng(doc.id)
+        name = re.sub(r"[^a-z0-9]+", "-", doc.title.lower()).strip("-")[:40]
+        owner = f"user{rng.randint(1, 9999)}"
+        return {
+            "id": rng.randint(1, 10**8),
+            "name": name,
+            "full_name": f"{owner}/{name}",
+            "description": doc.content[:160],
+            "stargazers_count": rng.randint(0, 50000),
+            "language": rng.choice(LANGUAGES),
+            "html_url": self.page_url(doc, base_url),
+        }
+
+
+_corpus = FakeCorpus(FAKE_UPSTREAMS_SEED, FAKE_UPSTREAMS_CORPUS)
+_profiles: Dict[str, UpstreamProfile] = {name: UpstreamProfile(name) for name in UPSTREAMS}
+_rng = random.Random(FAKE_UPSTREAMS_SEED)
+_collections: Dict[str, List[Dict[str, Any]]] = {}
+
+
+def _base_url(request: Request) -> str:
+    return str(request.base_url).rstrip("/")
+
+
+# Tavily (https://api.tavily.com)
+tavily_router = APIRouter()
+
+
+@tavily_router.post("/search")
+async def tavily_search(request: Request):
+    body = await request.json()
+    await _profiles["tavily"].simulate(_rng)
+    started_at = time.monotonic()
+    query = body.get("query", "")
+    docs = _corpus.search(query, int(body.get("max_results", 5)), _base_url(request))
+    return {
+        "query": query,
+        "follow_up_questions": None,
+        "answer": docs[0].content if body.get("include_answer") and docs else None,
+        "images": [],
+        "results": [
+            {
+                "title": doc.title,
+                "url": doc.url,
+                "content": doc.content,
+                "score": _corpus.score(doc),
+                "raw_content": doc.content if body.get("include_raw_content") else None,
+            }
+            for doc in docs
+        ],
+        "response_time": round(time.monotonic() - started_at, 3),
+    }
+
+
+# Brave Search (https://api.search.brave.com)
+brave_router = APIRouter()
+
+
+@brave_router.get("/res/v1/web/search")
+async def brave_search(request: Request, q: str, count: int = 10):
+    await _profiles["brave"].simulate(_rng)
+    docs = _corpus.search(q, count, _base_url(request))
+    return {
+        "type": "search",
+        "query": {"original": q},
+        "web": {
+            "type": "search",
+            "results": [{"title": doc.title, "description": doc.content, "url": doc.url} for doc in docs],
+        },
+    }
+
+
+# Reddit (https://www.reddit.com for auth, https://oauth.reddit.com for the API)
+reddit_router = APIRouter()
+
+
+@reddit_router.post("/api/v1/access_token")
+async def reddit_access_token():
+    await _profiles["reddit"].simulate(_rng)
+    return {"access_token": f"fake-{uuid.uuid4().hex}", "token_type": "bearer", "expires_in": 86400, "scope": "*"}
+
+
+@reddit_router.get("/search")
+@reddit_router.get("/r/{subreddit}/search")
+async def reddit_search(request: Request, q: str, limit: int = 25, subreddit: Optional[str] = None):
+    await _profiles["reddit"].simulate(_rng)
+    docs = _corpus.search(q, limit, _base_url(request))
+    return {
+        "kind": "Listing",
+        "data": {"children": [{"kind": "t3", "data": _corpus.reddit_post(doc, subreddit, _base_url(request))} for doc in docs]},
+    }
+
+
+# GitHub (https://api.github.com)
+github_router = APIRouter()
+
+
+@github_router.get("/search/{type}")
+async def github_search(request: Request, type: str, q: str, per_page: int = 10):
+    await _profiles["github"].simulate(_rng)
+    docs = _corpus.search(q, per_page, _base_url(request))
+    items = [_corpus.github_repo(doc, _base_url(request)) for doc in docs]
+    return {"total_count": len(items), "incomplete_results": False, "items": items}
+
+
+# Docker MCP gateway (used by MCPClient)
+mcp_router = APIRouter()
+
+
+@mcp_router.post("/brave-search")
+async def mcp_brave_search(request: Request):
+    body = await request.json()
+    await _profiles["mcp"].simulate(_rng)
+    docs = _corpus.search(body.get("query", ""), int(body.get("count", 10)), _base_url(request))
+    return {"results": [{"title": doc.title, "description": doc.content, "url": doc.url} for doc in docs]}
+
+
+@mcp_router.post("/reddit")
+async def mcp_reddit(request: Request):
+    body = await request.json()
+    await _profiles["mcp"].simulate(_rng)
+    docs = _corpus.search(body.get("query", ""), int(body.get("limit", 25)), _base_url(request))
+    return {"posts": [_corpus.reddit_post(doc, body.get("subreddit"), _base_url(request)) for doc in docs]}
+
+
+@mcp_router.post("/github")
+async def mcp_github(request: Request):
+    body = await request.json()
+    await _profiles["mcp"].simulate(_rng)
+    docs = _corpus.search(body.get("query", ""), int(body.get("limit", 10)), _base_url(request))
+    return {"items": [_corpus.github_repo(doc, _base_url(request)) for doc in docs]}
+
+
+@mcp_router.post("/notion")
+async def mcp_notion(request: Request):
+    body = await request.json()
+    await _profiles["mcp"].simulate(_rng)
+    doc = _corpus.add(body.get("title") or "Untitled", body.get("content") or "")
+    return {"id": doc.id, "url": _corpus.page_url(doc, _base_url(request))}
+
+
+@mcp_router.post("/mongodb")
+async def mcp_mongodb(request: Request):
+    body = await request.json()
+    await _profiles["mcp"].simulate(_rng)
+    collection = _collections.setdefault(body.get("collection", "default"), [])
+    if body.get("action") == "insert":
+        document = {"_id": uuid.uuid4().hex, **body.get("data", {})}
+        collection.append(document)
+        return {"inserted_id": document["_id"]}
+    query = body.get("query") or {}
+    return {"results": [doc for doc in collection if all(doc.get(k) == v for k, v in query.items())]}
+
+
+fake_upstreams_app = FastAPI(title="Fake research upstreams")
+fake_upstreams_app.include_router(tavily_router, prefix="/tavily")
+fake_upstreams_app.include_router(brave_router, prefix="/brave")
+fake_upstreams_app.include_router(reddit_router, prefix="/reddit")
+fake_upstreams_app.include_router(github_router, prefix="/github")
+fake_upstreams_app.include_router(mcp_router, prefix="/mcp")
+
+
+@fake_upstreams_app.get("/pages/{doc_id}", response_class=HTMLResponse)
+async def page(doc_id: str):
+    doc = _corpus.get(doc_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Page not found")
+    return f"<html><head><title>{doc.title}</title></head><body><h1>{doc.title}</h1><p>{doc.content}</p></body></html>"
+
+
+@fake_upstreams_app.get("/stats")
+async def stats():
+    return {
+        "seed": FAKE_UPSTREAMS_SEED,
+        "documents": len(_corpus),
+        "upstreams": {name: profile.stats() for name, profile in _profiles.items()},
+    }
+
+
+def run():
+    """Serve the fake upstreams, used by `poetry run fake-upstreams`."""
+    import uvicorn
+
+    host = os.getenv("FAKE_UPSTREAMS_HOST", "127.0.0.1")
+    port = int(os.getenv("FAKE_UPSTREAMS_PORT", "8100"))
+    uvicorn.run(fake_upstreams_app, host=host, port=port)
@@ -0,0 +1,164 @@
+"""
+Session-wide registry of fetched pages.
+
+Agents of the same research session often open the same pages. The registry keys every
+fetch by its canonical URL (plus whatever else changes the result, such as the extraction
+instruction), so concurrent requests join the fetch already in flight and later requests
+are served from the registry. Savings are recorded in the session metrics. The sessions of
+a group, e.g. the similar ideas of a research batch (see `app.services.batch`), share one
+registry and its metrics.
+
+A fetch belongs to the caller that started it, e.g. it reads with that caller's crawler:
+when the caller gives up (its batch timed out, its research run was cancelled) the fetch is
+cancelled and stopped before the caller goes on to close its crawler. The callers that
+joined it fetch the page again themselves. The results kept by all the registries of the
+process are capped at `FETCH_REGISTRY_MAX_MB`, the least recently used are dropped first.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from cachetools import TTLCache
+
+from app.services.session_metrics import SESSION_METRICS_TTL, get_session_metrics
+
+# Size of the results kept by the registries of this process
+FETCH_REGISTRY_MAX_MB = float(os.getenv("FETCH_REGISTRY_MAX_MB", "256"))
+
+
+class FetchRegistry:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.metrics = get_session_metrics(session_id)
+        self._fetches: Dict[str, asyncio.Future] = {}
+        self._durations: Dict[str, float] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the result of a completed fetch, or None if it has to be fetched."""
+        fetch = self._fetches.get(key)
+        if fetch is None or not fetch.done() or fetch.cancelled() or fetch.exception():
+            return None
+        self.metrics.incr("fetch_requests")
+        self._record_saved(key, "fetch_registry_hits")
+        _stored.touch(self, key)
+        return fetch.result()
+
+    async def fetch(
+        self,
+        key: str,
+        fetch_fn: Callable[[], Awaitable[Any]],
+        is_error: Callable[[Any], bool] = lambda result: False,
+        size: Callable[[Any], int] = lambda result: len(str(result)),
+    ) -> Any:
+        """
+        Fetch `key` with `fetch_fn` unless it is already fetched or being fetched.
+
+        Failed fetches (`is_error`) are handed to the callers waiting on them but are not
+        kept, so the next request fetches the page again. `size` is the size in bytes of a
+        result, for the cap on the results kept.
+        """
+        self.metrics.incr("fetch_requests")
+        while (fetch := self._fetches.get(key)) is not None:
+            if fetch.cancelled():
+                # Cancelled before it started
+                self._fetches.pop(key)
+                continue
+            self._record_saved(key, "fetch_registry_hits" if fetch.done() else "fetch_inflight_joins")
+            if fetch.done():
+                _stored.touch(self, key)
+            try:
+                # Giving up on a fetch joined doesn't cancel it for its owner
+                return await asyncio.shield(fetch)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling() or not fetch.cancelled():
+                    raise
+                # Its owner gave up on it, fetch the page ourselves
+
+        fetch = asyncio.ensure_future(self._run(key, fetch_fn, is_error, size))
+        self._fetches[key] = fetch
+        self.metrics.incr("fetch_executed")
+        # Not shielded: cancelling the owner cancels the fetch and waits for it to stop
+        return await fetch
+
+    async def _run(
+        self,
+        key: str,
+        fetch_fn: Callable[[], Awaitable[Any]],
+        is_error: Callable[[Any], bool],
+        size: Callable[[Any], int],
+    ) -> Any:
+        started_at = time.monotonic()
+        try:
+            result = await fetch_fn()
+        except BaseException:
+            self._fetches.pop(key, None)
+            raise
+        if is_error(result):
+            self._fetches.pop(key, None)
+            self.metrics.incr("fetch_errors")
+        else:
+            self._durations[key] = time.monotonic() - started_at
+            _stored.add(self, key, size(result))
+        return result
+
+    def _forget(self, key: str):
+        fetch = self._fetches.get(key)
+        if fetch is not None and fetch.done():
+            self._fetches.pop(key)
+            self._durations.pop(key, None)
+
+    def _record_saved(self, key: str, counter: str):
+        self.metrics.incr(counter)
+        # Only completed fetches have a known duration, joins are counted without the time saved
+        duration = self._durations.get(key)
+        if duration is not None:
+            self.metrics.incr("fetch_seconds_saved", round(duration, 2))
+
+
+class _StoredResults:
+    """The completed fetches of all the registries, least recently used first."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._sizes: "OrderedDict[Tuple[FetchRegistry, str], int]" = OrderedDict()
+
+    def add(self, registry: FetchRegistry, key: str, size: int):
+        entry = (registry, key)
+        self.bytes += size - self._sizes.pop(entry, 0)
+        self._sizes[entry] = size
+        while self.bytes > self.max_bytes and len(self._sizes) > 1:
+            (oldest, oldest_key), oldest_size = self._sizes.popitem(last=False)
+            self.bytes -= oldest_size
+            oldest._forget(oldest_key)
+
+    def touch(self, registry: FetchRegistry, key: str):
+        if (registry, key) in self._sizes:
+            self._sizes.move_to_end((registry, key))
+
+
+_stored = _StoredResults(int(FETCH_REGISTRY_MAX_MB * 1024 * 1024))
+_registries: TTLCache = TTLCache(maxsize=1000, ttl=SESSION_METRICS_TTL)
+# Sessions fetching through the registry of a group, e.g. the similar ideas of a batch
+_groups: TTLCache = TTLCache(maxsize=10000, ttl=SESSION_METRICS_TTL)
+
+
+def share_fetch_registry(session_id: str, group: str):
+    """Serve the fetches of the session from the registry shared by the sessions of `group`."""
+    _groups[session_id] = group
+
+
+def share_fetch_registry_limit(share: float):
+    """Keep `share` of `FETCH_REGISTRY_MAX_MB` in this process."""
+    _stored.max_bytes = int(FETCH_REGISTRY_MAX_MB * 1024 * 1024 * share)
+
+
+def get_fetch_registry(session_id: str) -> FetchRegistry:
+    session_id = _groups.get(session_id, session_id)
+    registry = _registries.get(session_id)
+    if registry is None:
+        registry = _registries[session_id] = FetchRegistry(session_id)
+    return registry
@@ -0,0 +1,163 @@
+"""
+Semantic cache of past research, keyed by the embedding of the researched idea.
+
+Many ideas are near-duplicates of earlier ones ("AI meal planner", "AI recipe planner").
+When a research session finishes, the idea and the reports of its research stages (with
+their searches, competitors and sources, see `data/<session_id>`) are added to the index.
+A new idea within `IDEA_CACHE_SIMILARITY_THRESHOLD` cosine similarity of an idea researched
+less than `IDEA_CACHE_MAX_AGE_SECONDS` ago is seeded with that research: the stages only
+search for what the earlier research doesn't cover.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.services.scheduler import get_scheduler
+from app.settings import Settings
+
+logger = logging.getLogger("uvicorn")
+
+IDEA_CACHE_ENABLED = os.getenv("IDEA_CACHE_ENABLED", "true").lower() == "true"
+IDEA_CACHE_FILE = os.getenv("IDEA_CACHE_FILE", os.path.join("output", "idea_cache.json"))
+IDEA_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("IDEA_CACHE_SIMILARITY_THRESHOLD", "0.9"))
+IDEA_CACHE_MAX_AGE_SECONDS = int(os.getenv("IDEA_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 60 * 60)))
+IDEA_CACHE_MAX_ENTRIES = int(os.getenv("IDEA_CACHE_MAX_ENTRIES", "1000"))
+# Reports are cut to this length, they are added to the prompts of the seeded stages
+IDEA_CACHE_MAX_REPORT_CHARS = 12000
+
+
+@dataclass
+class CachedResearch:
+    session_id: str
+    idea: str
+    similarity: float
+    created_at: float
+    # Report of each research stage
+    reports: Dict[str, str]
+
+    def seed(self, stage: str) -> Optional[str]:
+        report = self.reports.get(stage)
+        if not report:
+            return None
+        return f"Earlier research on the similar idea \"{self.idea}\":\n{report}"
+
+
+def delta_research_task(task: str, seed: str) -> str:
+    """The task to generate search queries for when the research is seeded with earlier research."""
+    return (
+        f"{task}\n\n"
+        f"{seed}\n\n"
+        "Only search for what this earlier research doesn't cover or what differs for this idea."
+    )
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+async def embed_idea(idea: str) -> Optional[List[float]]:
+    try:
+        async with get_scheduler().slot("embedding"):
+            return await Settings.embed_model.aget_text_embedding(idea)
+    except Exception as e:
+        logger.warning(f"Could not embed the idea: {e}")
+        return None
+
+
+class IdeaCache:
+    def __init__(
+        self,
+        path: str = IDEA_CACHE_FILE,
+        similarity_threshold: float = IDEA_CACHE_SIMILARITY_THRESHOLD,
+        max_age_seconds: int = IDEA_CACHE_MAX_AGE_SECONDS,
+    ):
+        self.path = Path(path)
+        self.similarity_threshold = similarity_threshold
+        self.max_age_seconds = max_age_seconds
+        self._entries: List[Dict] = []
+        self._lock = asyncio.Lock()
+        if self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except ValueError:
+                self._entries = []
+
+    async def _embed(self, idea: str) -> Optional[List[float]]:
+        return await embed_idea(idea)
+
+    def has_session(self, session_id: str) -> bool:
+        """Whether the research of the session is in the cache."""
+        return any(entry["session_id"] == session_id for entry in self._entries)
+
+    async def find(self, idea: str, exclude_session_id: Optional[str] = None) -> Optional[CachedResearch]:
+        """The most similar idea researched within the max age, if it is within the threshold."""
+        if not self._entries:
+            return None
+        embedding = await self._embed(idea)
+        if embedding is None:
+            return None
+        oldest = time.time() - self.max_age_seconds
+        best: Optional[CachedResearch] = None
+        for entry in self._entries:
+            if entry["created_at"] < oldest or entry["session_id"] == exclude_session_id:
+                continue
+            similarity = cosine_similarity(embedding, entry["embedding"])
+            if similarity >= self.similarity_threshold and (best is None or similarity > best.similarity):
+                best = CachedResearch(
+                    session_id=entry["session_id"],
+                    idea=entry["idea"],
+                    similarity=similarity,
+                    created_at=entry["created_at"],
+                    reports=entry["reports"],
+                )
+        return best
+
+    async def add(self, session_id: str, idea: str, reports: Dict[str, str]):
+        """Index the research of a session, replacing the earlier research of the session."""
+        if not reports:
+            return
+        embedding = await self._embed(idea)
+        if embedding is None:
+            return
+        async with self._lock:
+            oldest = time.time() - self.max_age_seconds
+            self._entries = [
+                entry for entry in self._entries
+                if entry["session_id"] != session_id and entry["created_at"] >= oldest
+            ]
+            self._entries.append({
+                "session_id": session_id,
+                "idea": idea,
+                "embedding": embedding,
+                "reports": {stage: report[:IDEA_CACHE_MAX_REPORT_CHARS] for stage, report in reports.items()},
+                "created_at": time.time(),
+            })
+            self._entries = self._entries[-IDEA_CACHE_MAX_ENTRIES:]
+            # Up to IDEA_CACHE_MAX_ENTRIES embeddings and reports, encoded and written off the event loop,
+            # the lock keeps the writes in order
+            await asyncio.to_thread(self._save, list(self._entries))
+
+    def _save(self, entries: List[Dict]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(entries))
+        os.replace(tmp_path, self.path)
+
+
+_cache: Optional[IdeaCache] = None
+
+
+def get_idea_cache() -> IdeaCache:
+    global _cache
+    if _cache is None:
+        _cache = IdeaCache()
+    return _cache
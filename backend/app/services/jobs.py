@@ -0,0 +1,358 @@
+"""
+Background jobs for long running research sessions.
+
+A research session runs for 30-60 minutes, so instead of running it inside the HTTP
+request, `/api/jobs` submits it as a job and returns its id right away. Jobs run in a
+bounded pool of workers, independent from the clients. Every event of a job is appended
+to its log on disk (`JOBS_DIR/<job_id>/events.jsonl`), clients attach to the log by job id
+and offset and can re-attach after a disconnect without losing events. Jobs that were
+queued or running when the server stopped are started again on the next start, and
+continue from their checkpoints (see `app.services.checkpoints`). A job for an idea already
+being researched in the session follows that run instead of starting a duplicate (see
+`app.services.single_flight`).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from enum import Enum
+from pathlib import Path
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from llama_index.core.workflow import StopEvent
+from pydantic import BaseModel, Field
+
+from app.engine.engine import get_chat_engine
+from app.services.admission import get_admission_controller
+from app.services.cancellation import cancel_scope, track_workflow
+from app.services.scheduler import Priority, scheduling
+from app.services.session_metrics import get_session_metrics
+from app.services.single_flight import InFlightRun, get_single_flight
+from app.workflows.single import AgentRunEvent, AgentRunResult
+from app.workflows.stage_results import StageResultEvent
+
+logger = logging.getLogger("uvicorn")
+
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join("output", "jobs"))
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+# Jobs interrupted by a restart more often than this are given up
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# How often a queued job checks whether admission control has room for it
+JOBS_ADMISSION_POLL_SECONDS = float(os.getenv("JOBS_ADMISSION_POLL_SECONDS", "5"))
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    session_id: Optional[str] = None
+    payload: Dict[str, Any] = Field(default_factory=dict)
+    status: JobStatus = JobStatus.QUEUED
+    created_at: float = Field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    attempts: int = 0
+    # Continue from the checkpoints of the last attempt instead of starting over
+    resume: bool = False
+    error: Optional[str] = None
+    result: Optional[str] = None
+    # LLM tokens of the session while the job ran, over all its attempts. The session metrics
+    # are kept in memory only, the job keeps the count across restarts
+    tokens: int = 0
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+class JobLog:
+    """Append-only event log of a job, readers wait for new entries until the log is closed."""
+
+    def __init__(self, path: Path, closed: bool = False):
+        self.path = path
+        self.entries: List[Dict[str, Any]] = []
+        if path.exists():
+            with open(path, "r") as f:
+                self.entries = [json.loads(line) for line in f if line.strip()]
+        self.closed = closed
+        self._appended = asyncio.Event()
+
+    def append(self, type: str, data: Any):
+        entry = {"type": type, "data": data, "ts": time.time()}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.entries.append(entry)
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        self._appended.set()
+        self._appended = asyncio.Event()
+
+    async def read(self, offset: int = 0) -> AsyncGenerator[Tuple[int, Dict[str, Any]], None]:
+        while True:
+            appended = self._appended
+            while offset < len(self.entries):
+                yield offset, self.entries[offset]
+                offset += 1
+            if self.closed:
+                return
+            await appended.wait()
+
+
+def _start_research(job: Job, resume: bool = False) -> Tuple[InFlightRun, bool]:
+    # The API routers import the job runner
+    from app.api.routers.models import ChatData
+
+    data = ChatData(**job.payload)
+    idea = data.get_last_message_content()
+
+    def start():
+        engine = get_chat_engine(
+            session_id=data.sessionId,
+            chat_history=data.get_history_messages(include_agent_messages=True),
+            email=data.email,
+            params=data.data or {},
+            mode="prod",
+        )
+        return track_workflow(job.kind, engine.run(input=idea, streaming=True, resume=resume))
+
+    # A job for an idea already being researched in the session, e.g. submitted from the chat, follows that run
+    with scheduling(data.sessionId, Priority.BATCH):
+        return get_single_flight().join_or_start(data.sessionId, idea, start)
+
+
+# Starts the run of a job, or attaches it to the same run in flight (see `app.services.single_flight`),
+# returns the run and whether it was started
+JOB_KINDS: Dict[str, Callable[[Job, bool], Tuple[InFlightRun, bool]]] = {
+    "research": _start_research,
+}
+
+
+class JobRunner:
+    def __init__(self, jobs_dir: str = JOBS_DIR, max_workers: int = JOBS_MAX_WORKERS):
+        self.jobs_dir = Path(jobs_dir)
+        self.max_workers = max_workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # Jobs and logs of unfinished jobs, finished jobs are read from disk
+        self._jobs: Dict[str, Job] = {}
+        self._logs: Dict[str, JobLog] = {}
+        # Runs followed by the running jobs, a job cancelled while no one else follows its run
+        # tears down the whole workflow tree of the run
+        self._runs: Dict[str, InFlightRun] = {}
+        # Tokens of the running jobs before their current attempt, and the session's token count
+        # when it started
+        self._token_baselines: Dict[str, Tuple[int, float]] = {}
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self):
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        for job_file in sorted(self.jobs_dir.glob("*/job.json"), key=lambda path: path.stat().st_mtime):
+            job = Job.model_validate_json(job_file.read_text())
+            if job.is_finished:
+                continue
+            logger.info(f"Resuming job {job.id} ({job.status.value}) after restart")
+            job.status = JobStatus.QUEUED
+            job.resume = True
+            self._jobs[job.id] = job
+            self._save(job)
+            self._queue.put_nowait(job.id)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    async def stop(self):
+        """Stop the workers, running jobs are left as running so they are resumed on the next start."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, kind: str, payload: Dict[str, Any], session_id: Optional[str] = None) -> Job:
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = Job(id=uuid.uuid4().hex, kind=kind, session_id=session_id, payload=payload)
+        (self.jobs_dir / job.id).mkdir(parents=True, exist_ok=True)
+        self._jobs[job.id] = job
+        self._save(job)
+        self._get_log(job).append("status", {"status": job.status.value, "queue_position": self._queue.qsize() + 1})
+        self._queue.put_nowait(job.id)
+        return job
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        job_file = self.jobs_dir / os.path.basename(job_id) / "job.json"
+        if not job_file.exists():
+            return None
+        return Job.model_validate_json(job_file.read_text())
+
+    def attach(self, job: Job, offset: int = 0) -> AsyncGenerator[Tuple[int, Dict[str, Any]], None]:
+        """Read the events of a job from `offset`, following the log until the job is finished."""
+        return self._get_log(job).read(offset)
+
+    def resume(self, job_id: str) -> Optional[Job]:
+        """Queue a failed or cancelled job again, it continues from its checkpoints."""
+        job = self.get(job_id)
+        if job is None or job.status not in (JobStatus.FAILED, JobStatus.CANCELLED):
+            return job
+        job.status = JobStatus.QUEUED
+        job.resume = True
+        job.attempts = 0
+        job.error = None
+        job.finished_at = None
+        self._jobs[job.id] = job
+        self._save(job)
+        self._get_log(job).append("status", {"status": job.status.value, "resume": True})
+        self._queue.put_nowait(job.id)
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return self.get(job_id)
+        self._finish(job, JobStatus.CANCELLED)
+        run = self._runs.pop(job_id, None)
+        if run is not None:
+            await run.unsubscribe()
+        return job
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            # Jobs cancelled while queued are skipped
+            if job is None or job.status != JobStatus.QUEUED:
+                continue
+            # Jobs start only when the research sessions in flight leave room for them
+            admission = get_admission_controller()
+            while admission.over_limit() is not None and job.status == JobStatus.QUEUED:
+                await asyncio.sleep(JOBS_ADMISSION_POLL_SECONDS)
+            if job.status == JobStatus.QUEUED:
+                await self._run(job)
+
+    async def _run(self, job: Job):
+        log = self._get_log(job)
+        job.attempts += 1
+        if job.attempts > JOBS_MAX_ATTEMPTS:
+            job.error = f"The job was interrupted {JOBS_MAX_ATTEMPTS} times"
+            self._finish(job, JobStatus.FAILED)
+            return
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        self._token_baselines[job.id] = (job.tokens, self._session_tokens(job))
+        self._save(job)
+        log.append("status", {"status": job.status.value, "attempt": job.attempts})
+
+        try:
+            with cancel_scope(job.session_id, f"job {job.id}"):
+                run, started = JOB_KINDS[job.kind](job, job.resume)
+            events = run.subscribe()
+            self._runs[job.id] = run
+            if started:
+                get_admission_controller().track(run.handler, job.session_id)
+            else:
+                log.append("status", {"status": job.status.value, "attached_to": run.run_id})
+            async for event in events:
+                if job.is_finished:
+                    # Cancelled by the user while others follow the run
+                    return
+                if isinstance(event, AgentRunEvent):
+                    log.append("agent", {"workflowName": event.workflow_name, "agent": event.name, "text": event.msg})
+                elif isinstance(event, StageResultEvent):
+                    log.append("stage_result", event.to_response()["data"])
+                    # Keep the tokens used so far if the server stops before the job is done
+                    self._save(job)
+            result = await run.handler
+            job.result = await self._result_to_text(result)
+            if job.result:
+                log.append("text", job.result)
+            self._finish(job, JobStatus.SUCCEEDED)
+        except asyncio.CancelledError:
+            if job.is_finished:
+                # Cancelled by the user
+                return
+            # The server is shutting down, leave the job to be resumed on the next start
+            raise
+        except Exception as e:
+            if job.is_finished:
+                return
+            logger.exception(f"Job {job.id} failed", exc_info=True)
+            job.error = str(e)
+            self._finish(job, JobStatus.FAILED)
+        finally:
+            run = self._runs.pop(job.id, None)
+            if run is not None:
+                await run.unsubscribe()
+            self._token_baselines.pop(job.id, None)
+
+    @staticmethod
+    async def _result_to_text(result: Any) -> Optional[str]:
+        if isinstance(result, StopEvent):
+            result = result.result
+        if isinstance(result, AgentRunResult):
+            return result.response.message.content
+        if isinstance(result, AsyncGenerator):
+            return "".join([token.delta async for token in result])
+        return str(result) if result is not None else None
+
+    def _finish(self, job: Job, status: JobStatus):
+        if job.is_finished:
+            return
+        job.status = status
+        job.finished_at = time.time()
+        self._save(job)
+        log = self._get_log(job)
+        log.append("status", {"status": status.value, "error": job.error})
+        log.close()
+        self._jobs.pop(job.id, None)
+        self._logs.pop(job.id, None)
+
+    def _get_log(self, job: Job) -> JobLog:
+        log = self._logs.get(job.id)
+        if log is None:
+            log = JobLog(self.jobs_dir / job.id / "events.jsonl", closed=job.is_finished)
+            if not job.is_finished:
+                self._logs[job.id] = log
+        return log
+
+    @staticmethod
+    def _session_tokens(job: Job) -> float:
+        return get_session_metrics(job.session_id).get("llm_tokens") if job.session_id else 0
+
+    def _save(self, job: Job):
+        baseline = self._token_baselines.get(job.id)
+        if baseline is not None:
+            tokens_before, session_tokens = baseline
+            # The session's count starts over after a restart or once its metrics expire
+            current = self._session_tokens(job)
+            job.tokens = tokens_before + int(current - session_tokens if current >= session_tokens else current)
+        job_file = self.jobs_dir / job.id / "job.json"
+        tmp_file = job_file.with_suffix(".tmp")
+        tmp_file.write_text(job.model_dump_json())
+        os.replace(tmp_file, job_file)
+
+
+_runner: Optional[JobRunner] = None
+
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        _runner = JobRunner()
+    return _runner
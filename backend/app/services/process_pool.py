@@ -0,0 +1,268 @@
+"""
+Process pool for the research sub-workflows.
+
+The whole research pipeline runs on the event loop of one uvicorn worker, so JSON parsing,
+prompt formatting, report rendering and audio processing of all sessions share one core.
+With `SUB_WORKFLOW_PROCESSES` set, the stage 2 and stage 6 sub-workflows of
+`IdeatorIncWorkflow` run in a pool of worker processes instead. A `ProcessWorkflow` stands
+in for the sub-workflow in the parent: it rebuilds the sub-workflow in a worker from its
+factory and arguments, streams the worker's events back over a queue and returns its result.
+The sub-workflows mostly wait on LLM and tool calls, so each worker runs up to
+`SUB_WORKFLOW_PROCESS_CONCURRENCY` of them on one long-lived event loop. The tokens a
+sub-workflow used are sent back with its result and charged to the budget of its parent.
+
+The server process and every worker process have their own scheduler, upstream limiters and
+fetch registry, so each of them gets an equal share of the configured limits: the processes
+together make no more calls than the server process alone would.
+"""
+
+import asyncio
+import importlib
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from llama_index.core.workflow import Context, StartEvent, StopEvent, Workflow, step
+
+from app.services.budget import Budget, budget_scope, charge_tokens, get_budget
+from app.services.cancellation import cancel_scope, track_workflow
+from app.services.fetch_registry import share_fetch_registry_limit
+from app.services.scheduler import SchedulingContext, get_scheduling_context, scheduling, share_scheduler_limits
+from app.services.upstreams import share_upstream_limits
+from app.utils.paths import get_data_run_id, run_data_scope
+from app.utils.serialization import decode_value, encode_value
+
+# Number of worker processes for the sub-workflows, 0 runs them on the event loop
+SUB_WORKFLOW_PROCESSES = int(os.getenv("SUB_WORKFLOW_PROCESSES", "0"))
+# Sub-workflows each worker process runs at the same time
+SUB_WORKFLOW_PROCESS_CONCURRENCY = int(os.getenv("SUB_WORKFLOW_PROCESS_CONCURRENCY", "8"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_manager: Optional[Any] = None
+# Threads reading the event queues of the sub-workflows, apart from the default executor of
+# the event loop so the sub-workflows in flight don't take up the threads of the other calls
+_event_readers: Optional[ThreadPoolExecutor] = None
+
+# In the worker processes: the event loop running the sub-workflows, and its free places
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+_worker_slots: Optional[threading.Semaphore] = None
+
+
+def _split_limits():
+    share = 1 / (SUB_WORKFLOW_PROCESSES + 1)
+    share_scheduler_limits(share)
+    share_upstream_limits(share)
+    share_fetch_registry_limit(share)
+
+
+def _init_worker():
+    from dotenv import load_dotenv
+
+    from app.settings import init_settings
+
+    global _worker_loop, _worker_slots
+    load_dotenv()
+    init_settings()
+    _split_limits()
+    _worker_loop = asyncio.new_event_loop()
+    _worker_slots = threading.Semaphore(SUB_WORKFLOW_PROCESS_CONCURRENCY)
+    threading.Thread(target=_worker_loop.run_forever, name="sub-workflows", daemon=True).start()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _pool, _manager, _event_readers
+    if _pool is None:
+        # Spawned workers don't inherit the event loop and clients of the server process
+        context = multiprocessing.get_context("spawn")
+        _manager = context.Manager()
+        _pool = ProcessPoolExecutor(max_workers=SUB_WORKFLOW_PROCESSES, mp_context=context, initializer=_init_worker)
+        _event_readers = ThreadPoolExecutor(
+            max_workers=SUB_WORKFLOW_PROCESSES * SUB_WORKFLOW_PROCESS_CONCURRENCY, thread_name_prefix="sub-workflow-events"
+        )
+        _split_limits()
+    return _pool
+
+
+def shutdown_process_pool():
+    global _pool, _manager, _event_readers
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+    if _event_readers is not None:
+        _event_readers.shutdown(wait=False, cancel_futures=True)
+        _event_readers = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+
+
+def create_sub_workflow(factory: Callable[..., Workflow], **kwargs: Any) -> Workflow:
+    """
+    Build the sub-workflow with `factory`, on the work queue workers if a work queue is
+    configured (see `app.services.work_queue`), in a worker process if the pool is enabled.
+    """
+    from app.services.work_queue import WORK_QUEUE_BACKEND, RemoteWorkflow
+
+    if WORK_QUEUE_BACKEND:
+        return RemoteWorkflow(factory, timeout=kwargs.get("timeout"), **kwargs)
+    if SUB_WORKFLOW_PROCESSES > 0:
+        return ProcessWorkflow(factory, timeout=kwargs.get("timeout"), **kwargs)
+    return factory(**kwargs)
+
+
+async def run_factory_workflow(
+    factory_path: str,
+    factory_kwargs: Dict[str, Any],
+    run_kwargs: Dict[str, Any],
+    scheduling_context: SchedulingContext,
+    on_event: Callable[[Any], Awaitable[None]],
+    data_run_id: Optional[str] = None,
+    budget: Optional[Budget] = None,
+) -> Any:
+    """
+    Build a workflow from its factory and run it, passing its encoded events to `on_event`.
+    Returns the encoded result, cancelling the call cancels the run. The workflow reads and
+    writes the data directory of the research run `data_run_id` of its parent, and runs
+    within `budget`, what was left of its parent's (see `worker_budget`).
+    """
+    module_name, name = factory_path.split(":")
+    factory = getattr(importlib.import_module(module_name), name)
+
+    # Workers have their own scheduler, the calls keep their session and priority in it, and
+    # their own cancel scope, cancelling the call tears down the whole workflow tree
+    with (
+        run_data_scope(data_run_id),
+        budget_scope(budget),
+        scheduling(scheduling_context.session_id, scheduling_context.priority, scheduling_context.weight),
+        cancel_scope(scheduling_context.session_id, name) as scope,
+    ):
+        workflow = factory(**factory_kwargs)
+        handler = track_workflow(name, workflow.run(**run_kwargs))
+    try:
+        async for event in handler.stream_events():
+            if isinstance(event, StopEvent):
+                continue
+            try:
+                encoded = encode_value(event)
+            except TypeError:
+                # Events that can't cross the process boundary are only dropped from the stream
+                continue
+            await on_event(encoded)
+        return encode_value(await handler)
+    except asyncio.CancelledError:
+        await scope.cancel("the run was cancelled by its parent")
+        raise
+
+
+def worker_budget(name: str, budget_limits: Optional[Dict[str, Any]], session_id: str) -> Budget:
+    """
+    The budget of a sub-workflow run for its parent in another process or on another node,
+    within what was left of the parent's budget, counting the tokens to send back to it.
+    """
+    return Budget.from_limits(budget_limits) or Budget(name, session_id=session_id)
+
+
+async def _run_in_worker(
+    factory_path: str,
+    factory_kwargs: Dict[str, Any],
+    run_kwargs: Dict[str, Any],
+    scheduling_context: SchedulingContext,
+    data_run_id: Optional[str],
+    budget_limits: Optional[Dict[str, Any]],
+    events: Any,
+    cancelled: Any,
+):
+    async def put_event(event: Any):
+        events.put({"type": "event", "event": event})
+
+    budget = worker_budget(factory_path, budget_limits, scheduling_context.session_id)
+    try:
+        run_task = asyncio.create_task(
+            run_factory_workflow(factory_path, factory_kwargs, run_kwargs, scheduling_context, put_event, data_run_id, budget)
+        )
+        while not run_task.done():
+            await asyncio.wait([run_task], timeout=1)
+            if not run_task.done() and await asyncio.to_thread(cancelled.is_set):
+                run_task.cancel()
+        result = await run_task
+        events.put({"type": "result", "result": result, "tokens": budget.used_tokens})
+    except BaseException as e:
+        try:
+            events.put({"type": "error", "error": e, "tokens": budget.used_tokens})
+        except Exception:
+            # Errors that can't cross the process boundary
+            events.put({"type": "error", "error": RuntimeError(str(e)), "tokens": budget.used_tokens})
+    finally:
+        _worker_slots.release()
+
+
+def _start_in_worker(*args: Any) -> int:
+    """
+    Start a sub-workflow on the event loop of this worker, once it has room for it, and return
+    the id of the worker process. Its events and result are sent back over its event queue.
+    """
+    # Waiting for room here leaves the next sub-workflows to the other workers
+    _worker_slots.acquire()
+    try:
+        asyncio.run_coroutine_threadsafe(_run_in_worker(*args), _worker_loop)
+    except BaseException:
+        _worker_slots.release()
+        raise
+    return os.getpid()
+
+
+def _worker_alive(pid: int) -> bool:
+    process = (getattr(_pool, "_processes", None) or {}).get(pid)
+    # Unknown to the pool, e.g. the pool was shut down
+    return process is None or process.is_alive()
+
+
+class ProcessWorkflow(Workflow):
+    """Runs the workflow built by `factory(**factory_kwargs)` in a process pool worker."""
+
+    def __init__(self, factory: Callable[..., Workflow], timeout: Optional[float] = None, **factory_kwargs: Any):
+        super().__init__(timeout=timeout)
+        self.factory_path = f"{factory.__module__}:{factory.__name__}"
+        self.factory_kwargs = factory_kwargs
+
+    @step()
+    async def run_in_process(self, ctx: Context, ev: StartEvent) -> StopEvent:
+        pool = get_process_pool()
+        budget = get_budget()
+        events = _manager.Queue()
+        cancelled = _manager.Event()
+        future = pool.submit(
+            _start_in_worker,
+            self.factory_path,
+            self.factory_kwargs,
+            dict(ev.items()),
+            get_scheduling_context(),
+            get_data_run_id(),
+            budget.limits() if budget is not None else None,
+            events,
+            cancelled,
+        )
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    message = await loop.run_in_executor(_event_readers, events.get, True, 1.0)
+                except queue.Empty:
+                    # The sub-workflow couldn't be started, or its worker died
+                    if future.done() and (future.exception() is not None or not _worker_alive(future.result())):
+                        raise future.exception() or RuntimeError(f"The worker process of {self.factory_path} died")
+                    continue
+                if message["type"] == "event":
+                    ctx.write_event_to_stream(decode_value(message["event"]))
+                    continue
+                # The tokens of the sub-workflow count against the budget of its parent
+                charge_tokens(message["tokens"], get_scheduling_context().session_id)
+                if message["type"] == "error":
+                    raise message["error"]
+                return StopEvent(result=decode_value(message["result"]))
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
@@ -0,0 +1,191 @@
+"""
+Artifacts of the last research run of a session and the refined idea fields they depend on.
+
+When the user edits their refined idea and runs the research again, only the artifacts
+whose fields changed are recomputed, the others are reused from the last run. Each
+artifact is stored with a fingerprint of its inputs: the idea fields it depends on and
+the fingerprints of the artifacts it is built from.
+
+Below the stages, the searches of the research stages and the pages they read are kept
+too, one file per search or page, so a recomputed stage doesn't search or read again what
+an earlier run of the session already did (see `reuse_search` and `get_saved`).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse
+
+from app.services.session_metrics import get_session_metrics
+from app.workflows.single import AgentRunResult
+
+RESEARCH_ARTIFACTS_DIR = os.getenv("RESEARCH_ARTIFACTS_DIR", os.path.join("output", "research_artifacts"))
+# Searches and pages older than this are done again, the web changes
+RESEARCH_REUSE_MAX_AGE_HOURS = float(os.getenv("RESEARCH_REUSE_MAX_AGE_HOURS", "72"))
+
+T = TypeVar("T")
+
+# Refined idea fields (see `RefinedIdea`) each research stage is based on
+STAGE_DEPENDENCIES: Dict[str, List[str]] = {
+    "Market Research": ["problem_statement", "product_idea", "target_users"],
+    "Customer Insights": ["problem_statement", "target_users", "user_story"],
+    "Online Trends": ["problem_statement", "product_idea", "how_it_works"],
+    "Competitor Analysis": ["product_idea", "unique_value_proposition", "how_it_works", "target_users"],
+}
+
+
+def parse_refined_idea(text: str) -> Optional[Dict[str, Any]]:
+    """The refined idea of a research request, the frontend sends it as JSON after the instruction."""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        refined_idea = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(refined_idea, dict):
+        return None
+    fields = {field for fields in STAGE_DEPENDENCIES.values() for field in fields}
+    return refined_idea if fields & refined_idea.keys() else None
+
+
+def render_idea(refined_idea: Dict[str, Any], fields: Optional[List[str]] = None) -> str:
+    """Render the given fields of a refined idea (all by default) as the research input."""
+    fields = fields or list(refined_idea.keys())
+    return "\n".join(
+        f"{field.replace('_', ' ').capitalize()}: {refined_idea.get(field) or 'Not provided'}"
+        for field in fields
+    )
+
+
+def fingerprint(*parts: Any) -> str:
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class ResearchArtifacts:
+    def __init__(self, session_id: str):
+        self.path = Path(RESEARCH_ARTIFACTS_DIR) / os.path.basename(session_id) / "artifacts.json"
+        self.artifacts: Dict[str, Dict[str, Any]] = {}
+        if self.path.exists():
+            self.artifacts = json.loads(self.path.read_text())
+        self.reused: List[str] = []
+        self.recomputed: List[str] = []
+
+    def is_current(self, name: str, artifact_fingerprint: str) -> bool:
+        artifact = self.artifacts.get(name)
+        return artifact is not None and artifact["fingerprint"] == artifact_fingerprint
+
+    def get(self, name: str, artifact_fingerprint: str) -> Optional[str]:
+        """
+        The output of the artifact if its inputs didn't change since it was computed, otherwise
+        None and the artifact is reported as recomputed.
+        """
+        if not self.is_current(name, artifact_fingerprint):
+            self.recomputed.append(name)
+            return None
+        self.reused.append(name)
+        return self.artifacts[name]["output"]
+
+    def put(self, name: str, artifact_fingerprint: str, output: str, depends_on: List[str]):
+        self.artifacts[name] = {
+            "fingerprint": artifact_fingerprint,
+            "output": output,
+            "depends_on": depends_on,
+            "computed_at": time.time(),
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.artifacts))
+        os.replace(tmp_path, self.path)
+
+    def report(self) -> Dict[str, List[str]]:
+        return {"reused": self.reused, "recomputed": self.recomputed}
+
+
+def get_session_artifacts(session_id: str) -> Dict[str, Any]:
+    artifacts = ResearchArtifacts(session_id).artifacts
+    return {
+        name: {key: value for key, value in artifact.items() if key != "output"}
+        for name, artifact in artifacts.items()
+    }
+
+
+def _saved_path(session_id: str, kind: str, key: str) -> Path:
+    return Path(RESEARCH_ARTIFACTS_DIR) / os.path.basename(session_id) / kind / f"{fingerprint(key)}.json"
+
+
+def _load_saved(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        saved = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+    if time.time() - saved["computed_at"] > RESEARCH_REUSE_MAX_AGE_HOURS * 3600:
+        return None
+    return saved
+
+
+def _save(path: Path, saved: Dict[str, Any]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(saved))
+    os.replace(tmp_path, path)
+
+
+async def get_saved(session_id: str, kind: str, key: str) -> Optional[Any]:
+    """The output saved under `key` by an earlier run of the session, None if there is none or it is too old."""
+    saved = await asyncio.to_thread(_load_saved, _saved_path(session_id, kind, key))
+    return saved["output"] if saved is not None else None
+
+
+async def save(session_id: str, kind: str, key: str, output: Any, **details: Any):
+    saved = {"key": key, "output": output, "computed_at": time.time(), **details}
+    await asyncio.to_thread(_save, _saved_path(session_id, kind, key), saved)
+
+
+async def reuse_search(session_id: Optional[str], stage: str, query: str, search: Callable[[], Awaitable[T]]) -> T:
+    """
+    The result of a search of a research stage: the agent run(s) of `search`, or their
+    responses from an earlier run of the session that made the same search. Failed searches
+    raise and aren't kept.
+    """
+    if session_id is None:
+        return await search()
+    key = f"{stage}: {' '.join(query.lower().split())}"
+    output = await get_saved(session_id, "searches", key)
+    if output is not None:
+        get_session_metrics(session_id).incr("research_searches_reused")
+        if isinstance(output, list):
+            return [_search_result(content) for content in output]
+        return _search_result(output)
+
+    result = await search()
+    get_session_metrics(session_id).incr("research_searches_recomputed")
+    if isinstance(result, list):
+        output = [item.response.message.content for item in result]
+    else:
+        output = result.response.message.content
+    await save(session_id, "searches", key, output, stage=stage, query=query)
+    return result
+
+
+def _search_result(content: str) -> AgentRunResult:
+    return AgentRunResult(response=ChatResponse(message=ChatMessage(role="assistant", content=content)), sources=[])
+
+
+def get_session_searches(session_id: str) -> List[Dict[str, Any]]:
+    searches_dir = Path(RESEARCH_ARTIFACTS_DIR) / os.path.basename(session_id) / "searches"
+    searches = [json.loads(path.read_text()) for path in searches_dir.glob("*.json")] if searches_dir.exists() else []
+    return sorted(
+        ({key: value for key, value in search.items() if key not in ("key", "output")} for search in searches),
+        key=lambda search: search["computed_at"],
+    )
+
+
+def count_session_pages(session_id: str) -> int:
+    pages_dir = Path(RESEARCH_ARTIFACTS_DIR) / os.path.basename(session_id) / "pages"
+    return sum(1 for _ in pages_dir.glob("*.json")) if pages_dir.exists() else 0
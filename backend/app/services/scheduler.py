@@ -0,0 +1,247 @@
+"""
+Process-wide scheduler for LLM and tool calls.
+
+Every session fans out into dozens of concurrent agents, so without a global bound a
+handful of research sessions saturate the LLM and search upstreams and every session
+slows down. Agent LLM calls and tool calls acquire a slot from the scheduler first, at
+most `SCHEDULER_MAX_CONCURRENCY` LLM (and embedding) calls run at a time and the rest wait
+in line. Tool calls, e.g. page reads of up to two minutes, have a pool of their own of
+`SCHEDULER_MAX_TOOL_CONCURRENCY` slots, so slow tools never hold up the LLM calls.
+
+Waiting calls are served by priority first, interactive requests (`/qna`, `/validate`)
+before batch research, then by weighted fair queuing between sessions: every session gets
+its share of the slots whatever the number of agents it runs.
+
+The session and priority of a call come from the `scheduling` context, set by the routes
+around `workflow.run()`: the workflow steps and sub-workflows run in tasks created from
+that context and inherit it.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional, Tuple
+
+from app.services.budget import raise_if_over_budget
+from app.services.cancellation import raise_if_cancelled
+from app.services.session_metrics import get_session_metrics
+
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "16"))
+SCHEDULER_MAX_TOOL_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_TOOL_CONCURRENCY", "16"))
+# Kinds of calls with a pool of their own, the others share the LLM pool
+TOOL_KINDS = ("tool",)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+@dataclass(frozen=True)
+class SchedulingContext:
+    session_id: str
+    priority: Priority = Priority.BATCH
+    weight: float = 1.0
+
+
+# Calls made outside of a request, e.g. from scripts, share one batch session
+_DEFAULT_CONTEXT = SchedulingContext(session_id="default")
+_scheduling: ContextVar[SchedulingContext] = ContextVar("scheduling", default=_DEFAULT_CONTEXT)
+
+
+def get_scheduling_context() -> SchedulingContext:
+    return _scheduling.get()
+
+
+@contextmanager
+def scheduling(session_id: Optional[str], priority: Priority = Priority.BATCH, weight: float = 1.0) -> Iterator[None]:
+    """Schedule the calls of the workflows started in this block for `session_id`."""
+    token = _scheduling.set(SchedulingContext(session_id=session_id or "default", priority=priority, weight=weight))
+    try:
+        yield
+    finally:
+        _scheduling.reset(token)
+
+
+class Scheduler:
+    def __init__(
+        self,
+        max_concurrency: int = SCHEDULER_MAX_CONCURRENCY,
+        max_tool_concurrency: int = SCHEDULER_MAX_TOOL_CONCURRENCY,
+    ):
+        self.llm = SlotPool(max_concurrency)
+        self.tools = SlotPool(max_tool_concurrency)
+
+    def pool(self, kind: str) -> "SlotPool":
+        return self.tools if kind in TOOL_KINDS else self.llm
+
+    @asynccontextmanager
+    async def slot(self, kind: str = "llm") -> AsyncIterator[None]:
+        """Run the block in a slot of the pool of `kind`, also used for the session metrics."""
+        # No new calls for a cancelled run
+        raise_if_cancelled()
+        # Nor for a run out of time or tokens
+        raise_if_over_budget(f"{kind} call")
+        pool = self.pool(kind)
+        context = _scheduling.get()
+        queued_at = time.monotonic()
+        await pool._acquire(context)
+        waited = time.monotonic() - queued_at
+        metrics = get_session_metrics(context.session_id)
+        metrics.incr(f"scheduler_{kind}_calls")
+        metrics.incr("scheduler_wait_seconds", round(waited, 3))
+        try:
+            yield
+        finally:
+            pool._release(context)
+
+    def queue_depth(self, priority: Optional[Priority] = None) -> int:
+        return self.llm.queue_depth(priority) + self.tools.queue_depth(priority)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"llm": self.llm.snapshot(), "tool": self.tools.snapshot()}
+
+
+class SlotPool:
+    """Slots of one kind of calls, shared fairly between the sessions."""
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self._running = 0
+        # Waiting calls by priority and session, with their context and the time they were queued
+        self._waiting: Dict[Priority, Dict[str, Deque[Tuple[asyncio.Future, SchedulingContext, float]]]] = {
+            priority: {} for priority in Priority
+        }
+        # Virtual time of each session with waiting or running calls: the slots it got
+        # divided by its weight. The session furthest behind is served next.
+        self._virtual_time: Dict[str, float] = {}
+        self._session_running: Dict[str, int] = {}
+        self._system_virtual_time = 0.0
+        self._granted: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._wait_seconds: Dict[Priority, float] = {priority: 0.0 for priority in Priority}
+
+    async def _acquire(self, context: SchedulingContext):
+        self._virtual_time.setdefault(context.session_id, self._system_virtual_time)
+        if self._running < self.max_concurrency and not self.queue_depth():
+            self._grant(context, time.monotonic())
+            return
+        future = asyncio.get_running_loop().create_future()
+        queue = self._waiting[context.priority].setdefault(context.session_id, deque())
+        queue.append((future, context, time.monotonic()))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted right before the caller was cancelled
+                self._release(context)
+            else:
+                self._remove_waiting(context, future)
+            raise
+
+    def _grant(self, context: SchedulingContext, queued_at: float):
+        self._running += 1
+        self._session_running[context.session_id] = self._session_running.get(context.session_id, 0) + 1
+        start = max(self._virtual_time.get(context.session_id, 0.0), self._system_virtual_time)
+        self._system_virtual_time = start
+        self._virtual_time[context.session_id] = start + 1 / context.weight
+        self._granted[context.priority] += 1
+        self._wait_seconds[context.priority] += time.monotonic() - queued_at
+
+    def _release(self, context: SchedulingContext):
+        self._running -= 1
+        self._session_running[context.session_id] -= 1
+        if not self._session_running[context.session_id]:
+            self._session_running.pop(context.session_id)
+            if not self._is_waiting(context.session_id):
+                # Idle sessions start again from the system virtual time
+                self._virtual_time.pop(context.session_id, None)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._running < self.max_concurrency:
+            next_call = self._next_waiting()
+            if next_call is None:
+                return
+            context, future, queued_at = next_call
+            self._grant(context, queued_at)
+            future.set_result(None)
+
+    def _next_waiting(self) -> Optional[Tuple[SchedulingContext, asyncio.Future, float]]:
+        for priority in Priority:
+            sessions = self._waiting[priority]
+            while sessions:
+                session_id = min(sessions, key=lambda session_id: self._virtual_time.get(session_id, 0.0))
+                queue = sessions[session_id]
+                future, context, queued_at = queue.popleft()
+                if not queue:
+                    sessions.pop(session_id)
+                if future.cancelled():
+                    continue
+                return context, future, queued_at
+        return None
+
+    def _remove_waiting(self, context: SchedulingContext, future: asyncio.Future):
+        queue = self._waiting[context.priority].get(context.session_id)
+        if queue is None:
+            return
+        for item in queue:
+            if item[0] is future:
+                queue.remove(item)
+                break
+        if not queue:
+            self._waiting[context.priority].pop(context.session_id)
+        if context.session_id not in self._session_running and not self._is_waiting(context.session_id):
+            self._virtual_time.pop(context.session_id, None)
+
+    def _is_waiting(self, session_id: str) -> bool:
+        return any(session_id in sessions for sessions in self._waiting.values())
+
+    def queue_depth(self, priority: Optional[Priority] = None) -> int:
+        priorities = [priority] if priority is not None else list(Priority)
+        return sum(len(queue) for p in priorities for queue in self._waiting[p].values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "queue_depth": self.queue_depth(),
+            "priorities": {
+                priority.name.lower(): {
+                    "queue_depth": self.queue_depth(priority),
+                    "sessions_waiting": len(self._waiting[priority]),
+                    "granted": self._granted[priority],
+                    "avg_wait_seconds": round(self._wait_seconds[priority] / self._granted[priority], 3)
+                    if self._granted[priority] else 0.0,
+                }
+                for priority in Priority
+            },
+            "sessions": {
+                session_id: {
+                    "running": self._session_running.get(session_id, 0),
+                    "waiting": sum(len(self._waiting[p].get(session_id, ())) for p in Priority),
+                }
+                for session_id in self._virtual_time
+            },
+        }
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
+
+
+def share_scheduler_limits(share: float):
+    """Limit the scheduler of this process to `share` of the configured slots of each pool."""
+    scheduler = get_scheduler()
+    scheduler.llm.max_concurrency = max(1, int(SCHEDULER_MAX_CONCURRENCY * share))
+    scheduler.tools.max_concurrency = max(1, int(SCHEDULER_MAX_TOOL_CONCURRENCY * share))
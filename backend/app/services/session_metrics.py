@@ -0,0 +1,41 @@
+"""
+Counters collected while a research session runs, e.g. how many page fetches were saved
+by the session fetch registry. They are kept in memory for a day and exposed through `/api/sessions/{session_id}/metrics`.
+"""
+
+import threading
+from typing import Dict
+
+from cachetools import TTLCache
+
+SESSION_METRICS_TTL = 24 * 60 * 60
+
+
+class SessionMetrics:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def get(self, name: str) -> float:
+        return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._counters)
+
+
+_metrics: TTLCache = TTLCache(maxsize=1000, ttl=SESSION_METRICS_TTL)
+_metrics_lock = threading.Lock()
+
+
+def get_session_metrics(session_id: str) -> SessionMetrics:
+    with _metrics_lock:
+        metrics = _metrics.get(session_id)
+        if metrics is None:
+            metrics = _metrics[session_id] = SessionMetrics(session_id)
+        return metrics
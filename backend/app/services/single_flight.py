@@ -0,0 +1,153 @@
+"""
+Single-flight of the research runs of a session.
+
+Users double-click or reopen the tab and submit the same idea again while its research is
+still running. The first submission starts the run, the ones for the same session and idea
+while it runs attach to it instead of starting a duplicate: the events of the run are kept
+for the run's lifetime and every client gets them from the start, then follows the run.
+
+Every entry point starting research goes through `join_or_start`: the chat route, and the
+background jobs of `/api/jobs`, of the admission queue and of the research batches (see
+`app.services.jobs`). The run is cancelled once its last client disconnects. Each run writes
+its files to a data directory of its own (see `app.utils.paths.run_data_scope`), published to
+the session's data directory when the run finishes, so runs of the same session never write
+the same files.
+"""
+
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from app.services.cancellation import CancelScope, get_cancel_scope
+from app.services.session_metrics import get_session_metrics
+from app.utils.paths import publish_run_data, run_data_scope
+
+logger = logging.getLogger("uvicorn")
+
+
+def run_id_for(session_id: str, idea: str) -> str:
+    """The id of the run of `idea` in the session, the same for every submission of the idea."""
+    normalized = " ".join(idea.lower().split())
+    return hashlib.sha1(f"{session_id}\n{normalized}".encode()).hexdigest()[:16]
+
+
+class InFlightRun:
+    def __init__(self, session_id: str, run_id: str, handler: asyncio.Future, cancel_scope: Optional[CancelScope] = None):
+        self.session_id = session_id
+        self.run_id = run_id
+        self.handler = handler
+        self.cancel_scope = cancel_scope
+        self.subscribers = 0
+        self._events: List[Any] = []
+        self._closed = False
+        self._appended = asyncio.Event()
+        self._pump = asyncio.create_task(self._read_events())
+
+    @property
+    def done(self) -> bool:
+        return self.handler.done()
+
+    async def _read_events(self):
+        try:
+            async for event in self.handler.stream_events():
+                self._events.append(event)
+                self._notify()
+        except Exception as e:
+            logger.warning(f"Event stream of the research run {self.run_id} failed: {e}")
+        finally:
+            self._closed = True
+            self._notify()
+
+    def _notify(self):
+        self._appended.set()
+        self._appended = asyncio.Event()
+
+    def subscribe(self) -> AsyncGenerator[Any, None]:
+        """The events of the run from the start for one more client, call `unsubscribe` when it disconnects."""
+        self.subscribers += 1
+        return self._follow()
+
+    async def _follow(self) -> AsyncGenerator[Any, None]:
+        offset = 0
+        while True:
+            appended = self._appended
+            while offset < len(self._events):
+                yield self._events[offset]
+                offset += 1
+            if self._closed:
+                return
+            await appended.wait()
+
+    async def unsubscribe(self):
+        """A client disconnected, the run is cancelled when it was the last one."""
+        self.subscribers -= 1
+        if self.subscribers > 0 or self.done:
+            return
+        if self.cancel_scope is not None:
+            await self.cancel_scope.cancel("all the clients disconnected")
+        else:
+            await self.handler.cancel_run()
+
+
+class SingleFlight:
+    def __init__(self):
+        # Runs in flight by session and run id
+        self._runs: Dict[str, Dict[str, InFlightRun]] = {}
+
+    def get(self, session_id: str, idea: str) -> Optional[InFlightRun]:
+        """The run of `idea` in flight in the session, if any."""
+        run = self._runs.get(session_id, {}).get(run_id_for(session_id, idea))
+        return run if run is not None and not run.done else None
+
+    def attach(self, session_id: str, idea: str) -> Optional[InFlightRun]:
+        run = self.get(session_id, idea)
+        if run is not None:
+            get_session_metrics(session_id).incr("duplicate_submissions")
+            logger.info(f"Attaching a duplicate submission to the research run {run.run_id} of session {session_id}")
+        return run
+
+    def add(self, session_id: str, run_id: str, handler: asyncio.Future, cancel_scope: Optional[CancelScope] = None) -> InFlightRun:
+        """
+        Track the run just started for `run_id`. Nothing is awaited between `attach` and
+        `add`, so two submissions can't both start a run.
+        """
+        run = InFlightRun(session_id, run_id, handler, cancel_scope)
+        self._runs.setdefault(session_id, {})[run_id] = run
+        handler.add_done_callback(lambda _: self._finish(run))
+        return run
+
+    def join_or_start(self, session_id: str, idea: str, start: Callable[[], asyncio.Future]) -> Tuple[InFlightRun, bool]:
+        """
+        Attach to the run of `idea` in flight in the session, or start it with `start` in the
+        data directory of the run, cancelled with the cancel scope of the caller. Returns the
+        run and whether it was started.
+        """
+        run = self.attach(session_id, idea)
+        if run is not None:
+            return run, False
+        run_id = run_id_for(session_id, idea)
+        with run_data_scope(run_id):
+            handler = start()
+        return self.add(session_id, run_id, handler, get_cancel_scope()), True
+
+    def _finish(self, run: InFlightRun):
+        runs = self._runs.get(run.session_id, {})
+        if runs.get(run.run_id) is run:
+            runs.pop(run.run_id)
+            if not runs:
+                self._runs.pop(run.session_id, None)
+        try:
+            publish_run_data(run.session_id, run.run_id)
+        except OSError as e:
+            logger.error(f"Could not publish the files of the research run {run.run_id}: {e}")
+
+
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,90 @@
+"""
+Speculative critic for the analyze -> critique loops of the research and output workflows.
+
+Every critic round costs two agent runs, the critic's and the refinement of the draft. With
+`SPECULATIVE_CRITIC_ENABLED`, each draft first gets a cheap heuristic score: how many of the
+sections the report must have it covers, and how many of its claims with numbers cite a
+source. A draft scoring at least `SPECULATIVE_CRITIC_THRESHOLD` goes to the report without
+the critic round. Below it, the full critic runs while the analyzer already refines the draft
+from the gaps the score found, and the critic's feedback is applied to that refinement.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Sequence
+
+from app.services.session_metrics import get_session_metrics
+
+SPECULATIVE_CRITIC_ENABLED = os.getenv("SPECULATIVE_CRITIC_ENABLED", "false").lower() == "true"
+SPECULATIVE_CRITIC_THRESHOLD = float(os.getenv("SPECULATIVE_CRITIC_THRESHOLD", "0.85"))
+
+# Weight of the section coverage in the score, the rest is the citation coverage
+SECTION_WEIGHT = 0.6
+
+_CITATION = re.compile(r"https?://|\[\d+\]|\(source|source:", re.IGNORECASE)
+_CLAIM = re.compile(r"\d")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+@dataclass
+class DraftScore:
+    score: float
+    citation_coverage: float
+    missing_sections: List[str] = field(default_factory=list)
+
+    @property
+    def passes(self) -> bool:
+        return self.score >= SPECULATIVE_CRITIC_THRESHOLD
+
+    def feedback(self) -> str:
+        feedback = []
+        if self.missing_sections:
+            feedback.append(f"- Add the missing sections: {', '.join(self.missing_sections)}")
+        if self.citation_coverage < 1:
+            feedback.append(
+                f"- Only {self.citation_coverage:.0%} of the claims with numbers cite their source, "
+                "cite the source of each of them"
+            )
+        return "\n".join(feedback)
+
+    def __str__(self) -> str:
+        return f"{self.score:.2f} (citations {self.citation_coverage:.0%}, missing sections: {', '.join(self.missing_sections) or 'none'})"
+
+
+def _covers(words: set, section: str) -> bool:
+    section_words = [word for word in _WORD.findall(section.lower()) if len(word) > 2]
+    if not section_words:
+        return True
+    return sum(word in words for word in section_words) / len(section_words) >= 0.5
+
+
+def score_draft(draft: str, sections: Sequence[str], cited: bool = True) -> DraftScore:
+    """
+    Score a draft between 0 and 1 on the `sections` it must cover, by their words, and,
+    if it must be `cited`, on the share of its lines with numbers that cite a source.
+    """
+    words = set(_WORD.findall(draft.lower()))
+    missing_sections = [section for section in sections if not _covers(words, section)]
+    section_coverage = 1 - len(missing_sections) / len(sections) if sections else 1.0
+
+    citation_coverage = 1.0
+    if cited:
+        claims = [line for line in draft.splitlines() if _CLAIM.search(line) and len(line.split()) > 4]
+        if claims:
+            citation_coverage = sum(bool(_CITATION.search(claim)) for claim in claims) / len(claims)
+        score = SECTION_WEIGHT * section_coverage + (1 - SECTION_WEIGHT) * citation_coverage
+    else:
+        score = section_coverage
+    return DraftScore(score=score, citation_coverage=citation_coverage, missing_sections=missing_sections)
+
+
+def speculative_refinement_prompt(feedback: str) -> str:
+    return (
+        "While the critic reviews your draft, fix these gaps found in it and return the full "
+        f"refined version:\n{feedback}"
+    )
+
+
+def record_skipped_critic_round(session_id: str):
+    get_session_metrics(session_id).incr("critic_rounds_skipped")
@@ -0,0 +1,54 @@
+"""
+Historical durations of the research pipeline stages, used to estimate the critical path
+of a pipeline (see `app.agents.pipeline`). Each stage keeps a moving average of the
+durations of its successful runs in `STAGE_DURATIONS_FILE`.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+STAGE_DURATIONS_FILE = os.getenv("STAGE_DURATIONS_FILE", os.path.join("output", "stage_durations.json"))
+# Weight of the latest run in the moving average
+STAGE_DURATIONS_SMOOTHING = 0.3
+
+
+class StageDurations:
+    def __init__(self, path: str = STAGE_DURATIONS_FILE):
+        self.path = Path(path)
+        self._durations: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            try:
+                self._durations = json.loads(self.path.read_text())
+            except ValueError:
+                self._durations = {}
+
+    def estimate(self, stage: str, default: float) -> float:
+        duration = self._durations.get(stage)
+        return duration["seconds"] if duration is not None else default
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            duration = self._durations.get(stage)
+            if duration is None:
+                self._durations[stage] = {"seconds": seconds, "runs": 1}
+            else:
+                duration["seconds"] += STAGE_DURATIONS_SMOOTHING * (seconds - duration["seconds"])
+                duration["runs"] += 1
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(self._durations))
+            os.replace(tmp_path, self.path)
+
+
+_durations: Optional[StageDurations] = None
+
+
+def get_stage_durations() -> StageDurations:
+    global _durations
+    if _durations is None:
+        _durations = StageDurations()
+    return _durations
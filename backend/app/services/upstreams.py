@@ -0,0 +1,278 @@
+"""
+Shared registry of the external APIs used by the research tools.
+
+Every upstream has its own token bucket (calls per minute), a cap on concurrent calls
+and a circuit breaker. Tool wrappers run their calls inside `guard()` / `aguard()` so
+agents get a fast, explicit "provider unavailable" error instead of waiting on a provider
+that is rate limited or down. The agent that gets it tells the model which of its other
+tools to use instead (see `app.workflows.single.FunctionCallingAgent`).
+
+Only the failures that are the provider's fault (5xx, timeouts, connection errors) count
+towards opening the circuit, a bad query or a 4xx is raised to the caller as it is.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+
+logger = logging.getLogger("uvicorn")
+
+# Send all upstream calls to the local fake upstreams (see `app.services.fake_upstreams`)
+FAKE_UPSTREAMS_URL = os.getenv("FAKE_UPSTREAMS_URL")
+# Seconds a call waits for a token or a free slot before the upstream is reported unavailable
+UPSTREAM_MAX_WAIT = float(os.getenv("UPSTREAM_MAX_WAIT", "10"))
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised when an upstream API can't serve a call right now."""
+
+    def __init__(self, upstream: str, message: str):
+        super().__init__(message)
+        self.upstream = upstream
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Whether `error` is the provider's fault, rather than the call's (e.g. a bad query or key)."""
+    if isinstance(
+        error,
+        (
+            TimeoutError,
+            ConnectionError,
+            httpx.TransportError,
+            requests.exceptions.Timeout,
+            requests.exceptions.ConnectionError,
+        ),
+    ):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None) or getattr(error, "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+
+class Upstream:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        display_name: str,
+        rate_per_minute: float,
+        max_concurrency: int,
+        burst: Optional[int] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 60.0,
+        fallback: Optional[str] = None,
+    ):
+        self.name = name
+        self.display_name = display_name
+        self.rate_per_minute = rate_per_minute
+        self.max_concurrency = max_concurrency
+        self.burst = burst or max(1, int(rate_per_minute / 10))
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.fallback = fallback
+        self._configured_limits = (rate_per_minute, max_concurrency, self.burst)
+
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._last_error: Optional[str] = None
+        self._num_calls = 0
+        self._num_failures = 0
+        self._num_rejected = 0
+
+    def limit_to_share(self, share: float):
+        """Keep `share` of the configured limits, for a process that calls the upstream alongside others."""
+        rate_per_minute, max_concurrency, burst = self._configured_limits
+        with self._lock:
+            self.rate_per_minute = rate_per_minute * share
+            self.max_concurrency = max(1, int(max_concurrency * share))
+            self.burst = max(1, int(burst * share))
+            self._tokens = min(self._tokens, float(self.burst))
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled_at
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate_per_minute / 60.0)
+        self._refilled_at = now
+
+    def _try_acquire(self) -> Optional[str]:
+        """
+        Try to take a slot for one call. Returns None when the call may go ahead,
+        otherwise the reason it was rejected.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN:
+                retry_in = self._opened_at + self.reset_timeout - now
+                if retry_in > 0:
+                    return f"too many recent failures, retrying in {int(retry_in) + 1}s"
+                # Let a single probe call through to check if the provider recovered
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN and self._in_flight > 0:
+                return "recovering from recent failures"
+            if self._in_flight >= self.max_concurrency:
+                return f"all {self.max_concurrency} concurrent call slots are in use"
+            self._refill(now)
+            if self._tokens < 1:
+                return f"rate limit of {self.rate_per_minute:g} calls per minute reached"
+            self._tokens -= 1
+            self._in_flight += 1
+            self._num_calls += 1
+            return None
+
+    def _release(self, error: Optional[BaseException] = None):
+        with self._lock:
+            self._in_flight -= 1
+            if error is None:
+                self._consecutive_failures = 0
+                self._state = self.CLOSED
+                return
+            self._num_failures += 1
+            self._consecutive_failures += 1
+            self._last_error = str(error)
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"Opening circuit for {self.display_name} after error: {error}")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def _is_circuit_open(self) -> bool:
+        with self._lock:
+            return self._state == self.OPEN and time.monotonic() < self._opened_at + self.reset_timeout
+
+    def unavailable(self, reason: str) -> UpstreamUnavailableError:
+        with self._lock:
+            self._num_rejected += 1
+        message = f"{self.display_name} is unavailable: {reason}."
+        if self.fallback:
+            message += f" Use {self.fallback} instead."
+        return UpstreamUnavailableError(self.name, message)
+
+    def _failed(self, error: Exception) -> Exception:
+        """Release the slot of a failed call, returns the error to raise to the caller."""
+        if not is_upstream_failure(error):
+            # The provider answered, the call itself was wrong
+            self._release()
+            return error
+        self._release(error)
+        return self.unavailable(f"the call failed ({error})")
+
+    @contextmanager
+    def guard(self, max_wait: float = UPSTREAM_MAX_WAIT):
+        """Run a blocking call against this upstream, waiting up to `max_wait` seconds for a slot."""
+        deadline = time.monotonic() + max_wait
+        while (reason := self._try_acquire()) is not None:
+            if self._is_circuit_open() or time.monotonic() >= deadline:
+                raise self.unavailable(reason)
+            time.sleep(0.1)
+        try:
+            yield
+        except Exception as e:
+            error = self._failed(e)
+            if error is e:
+                raise
+            raise error from e
+        except BaseException as e:
+            # Cancellation is not the provider's fault
+            self._release()
+            raise e
+        self._release()
+
+    @asynccontextmanager
+    async def aguard(self, max_wait: float = UPSTREAM_MAX_WAIT):
+        """Run an async call against this upstream, waiting up to `max_wait` seconds for a slot."""
+        deadline = time.monotonic() + max_wait
+        while (reason := self._try_acquire()) is not None:
+            if self._is_circuit_open() or time.monotonic() >= deadline:
+                raise self.unavailable(reason)
+            await asyncio.sleep(0.1)
+        try:
+            yield
+        except Exception as e:
+            error = self._failed(e)
+            if error is e:
+                raise
+            raise error from e
+        except BaseException as e:
+            self._release()
+            raise e
+        self._release()
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "state": self._state,
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "tokens_available": int(self._tokens),
+                "rate_per_minute": self.rate_per_minute,
+                "calls": self._num_calls,
+                "failures": self._num_failures,
+                "rejected": self._num_rejected,
+                "last_error": self._last_error,
+            }
+
+
+def _create_upstream(name: str, display_name: str, rate_per_minute: float, max_concurrency: int, **kwargs) -> Upstream:
+    prefix = f"UPSTREAM_{name.upper()}"
+    return Upstream(
+        name=name,
+        display_name=display_name,
+        rate_per_minute=float(os.getenv(f"{prefix}_RATE_PER_MINUTE", rate_per_minute)),
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", max_concurrency)),
+        **kwargs,
+    )
+
+
+_upstreams: Dict[str, Upstream] = {
+    upstream.name: upstream
+    for upstream in [
+        # The search tools have no fixed fallback, the agent suggests its own other tools
+        _create_upstream("tavily", "Tavily search", 100, 8),
+        _create_upstream("brave", "Brave Search", 60, 2),
+        _create_upstream("reddit", "Reddit search", 60, 4),
+        _create_upstream("github", "GitHub search", 30, 4),
+        _create_upstream("serpapi", "Google Trends (SerpAPI)", 30, 2),
+        _create_upstream("elevenlabs", "ElevenLabs text to speech", 60, 2, fallback="the written script"),
+        _create_upstream("stability", "Stability image generation", 60, 2),
+    ]
+}
+
+
+def get_upstream(name: str) -> Upstream:
+    return _upstreams[name]
+
+
+def share_upstream_limits(share: float):
+    """Limit the calls of this process to `share` of the limits of every upstream."""
+    for upstream in _upstreams.values():
+        upstream.limit_to_share(share)
+
+
+def get_upstreams_health() -> Dict[str, Dict[str, Any]]:
+    return {name: upstream.health() for name, upstream in _upstreams.items()}
+
+
+def get_base_url(name: str, default: str) -> str:
+    """Base URL of an upstream API, the fake upstreams are used when FAKE_UPSTREAMS_URL is set."""
+    if FAKE_UPSTREAMS_URL:
+        return f"{FAKE_UPSTREAMS_URL.rstrip('/')}/{name}"
+    return default
+
+
+def get_api_key(env_var: str) -> Optional[str]:
+    """API key from the environment, the fake upstreams accept any key so one isn't required."""
+    return os.getenv(env_var) or ("fake" if FAKE_UPSTREAMS_URL else None)
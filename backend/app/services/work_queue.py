@@ -0,0 +1,361 @@
+"""
+Work queue that ships research sub-workflows and heavy tool calls to workers, so research
+capacity scales out to other nodes behind one API tier.
+
+The API process puts tasks on the queue and reads their messages back: the events of a
+task are re-emitted to the session's workflow (and so to its event log) and its result
+or error ends the task. A worker announces the tasks it takes and sends heartbeats while it
+runs them, a task the API hears nothing of for `WORK_QUEUE_LEASE_SECONDS` once it was taken
+fails, e.g. when its worker died. Workers started with `work-queue-worker` (`app.engine.worker`)
+take tasks from the queue and run them. Backends, selected with `WORK_QUEUE_BACKEND`:
+- `local`: an in-process queue served by workers on the API's own event loop, for
+  development and tests.
+- `redis`: lists on a Redis-protocol server at `WORK_QUEUE_URL`, served by workers on
+  any node. Any server speaking the Redis protocol works, e.g. a local stand-in in tests.
+
+Task arguments, events and results are encoded with `app.utils.serialization`.
+"""
+
+import asyncio
+import importlib
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from llama_index.core.workflow import Context, StartEvent, StopEvent, Workflow, step
+from pydantic import BaseModel, Field
+
+from app.services.budget import budget_scope, charge_tokens, get_budget
+from app.services.process_pool import run_factory_workflow, worker_budget
+from app.services.scheduler import Priority, SchedulingContext, get_scheduling_context, scheduling
+from app.utils.paths import get_data_run_id
+from app.utils.serialization import decode_value, encode_value
+
+logger = logging.getLogger("uvicorn")
+
+# "local" or "redis", empty runs everything in the API process
+WORK_QUEUE_BACKEND = os.getenv("WORK_QUEUE_BACKEND", "")
+WORK_QUEUE_URL = os.getenv("WORK_QUEUE_URL", "redis://localhost:6379/0")
+WORK_QUEUE_NAME = os.getenv("WORK_QUEUE_NAME", "ideator")
+# Tasks a worker runs at the same time
+WORK_QUEUE_WORKER_CONCURRENCY = int(os.getenv("WORK_QUEUE_WORKER_CONCURRENCY", "4"))
+# Messages of tasks nobody reads anymore expire after this many seconds
+WORK_QUEUE_MESSAGE_TTL = int(os.getenv("WORK_QUEUE_MESSAGE_TTL", str(24 * 60 * 60)))
+# Seconds a task taken by a worker can go without a message before it fails, the workers
+# send a heartbeat every WORK_QUEUE_HEARTBEAT_SECONDS
+WORK_QUEUE_LEASE_SECONDS = float(os.getenv("WORK_QUEUE_LEASE_SECONDS", "60"))
+WORK_QUEUE_HEARTBEAT_SECONDS = float(os.getenv("WORK_QUEUE_HEARTBEAT_SECONDS", "10"))
+
+
+class WorkTask(BaseModel):
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    # "workflow" runs the workflow built by `target`, "function" awaits `target`
+    kind: str
+    # module:name of the workflow factory or the async function
+    target: str
+    kwargs: Dict[str, Any] = Field(default_factory=dict)
+    run_kwargs: Dict[str, Any] = Field(default_factory=dict)
+    scheduling: Dict[str, Any] = Field(default_factory=dict)
+    # Research run whose data directory the workflow uses, see app.utils.paths.run_data_scope
+    data_run_id: Optional[str] = None
+    # What was left of the budget of the parent run, see app.services.budget.Budget.limits
+    budget: Optional[Dict[str, Any]] = None
+
+
+class WorkQueue(ABC):
+    @abstractmethod
+    async def put_task(self, task: WorkTask):
+        ...
+
+    @abstractmethod
+    async def get_task(self, timeout: float) -> Optional[WorkTask]:
+        """The next task, None if there was none within `timeout` seconds."""
+
+    @abstractmethod
+    async def publish(self, task_id: str, message: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def next_message(self, task_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """The next message of a task, None if there was none within `timeout` seconds."""
+
+    @abstractmethod
+    async def cancel(self, task_id: str):
+        ...
+
+    @abstractmethod
+    async def is_cancelled(self, task_id: str) -> bool:
+        ...
+
+    async def close(self):
+        pass
+
+
+class LocalWorkQueue(WorkQueue):
+    def __init__(self):
+        self._tasks: asyncio.Queue = asyncio.Queue()
+        self._messages: Dict[str, asyncio.Queue] = {}
+        self._cancelled: Set[str] = set()
+
+    async def put_task(self, task: WorkTask):
+        await self._tasks.put(task)
+
+    async def get_task(self, timeout: float) -> Optional[WorkTask]:
+        try:
+            return await asyncio.wait_for(self._tasks.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def publish(self, task_id: str, message: Dict[str, Any]):
+        if task_id in self._cancelled:
+            # Nobody reads the messages of a cancelled task, it is forgotten once its worker is done
+            if message["type"] in ("result", "error"):
+                self._cancelled.discard(task_id)
+            return
+        self._messages.setdefault(task_id, asyncio.Queue()).put_nowait(message)
+
+    async def next_message(self, task_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        messages = self._messages.setdefault(task_id, asyncio.Queue())
+        try:
+            message = await asyncio.wait_for(messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if message["type"] in ("result", "error"):
+            self._messages.pop(task_id, None)
+            self._cancelled.discard(task_id)
+        return message
+
+    async def cancel(self, task_id: str):
+        self._cancelled.add(task_id)
+        self._messages.pop(task_id, None)
+
+    async def is_cancelled(self, task_id: str) -> bool:
+        return task_id in self._cancelled
+
+
+class RedisWorkQueue(WorkQueue):
+    """Tasks and messages are Redis lists: `<name>:tasks` and `<name>:task:<id>:messages`."""
+
+    def __init__(self, url: str = WORK_QUEUE_URL, name: str = WORK_QUEUE_NAME):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ImportError("The redis work queue backend needs the redis package: pip install redis, or poetry install --extras redis") from e
+        self._redis = redis.from_url(url, decode_responses=True)
+        self.name = name
+
+    async def put_task(self, task: WorkTask):
+        await self._redis.rpush(f"{self.name}:tasks", task.model_dump_json())
+
+    async def get_task(self, timeout: float) -> Optional[WorkTask]:
+        item = await self._redis.blpop([f"{self.name}:tasks"], timeout=max(1, int(timeout)))
+        if item is None:
+            return None
+        return WorkTask.model_validate_json(item[1])
+
+    async def publish(self, task_id: str, message: Dict[str, Any]):
+        key = f"{self.name}:task:{task_id}:messages"
+        await self._redis.rpush(key, json.dumps(message))
+        await self._redis.expire(key, WORK_QUEUE_MESSAGE_TTL)
+
+    async def next_message(self, task_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        item = await self._redis.blpop([f"{self.name}:task:{task_id}:messages"], timeout=max(1, int(timeout)))
+        if item is None:
+            return None
+        return json.loads(item[1])
+
+    async def cancel(self, task_id: str):
+        await self._redis.set(f"{self.name}:task:{task_id}:cancelled", 1, ex=WORK_QUEUE_MESSAGE_TTL)
+
+    async def is_cancelled(self, task_id: str) -> bool:
+        return bool(await self._redis.exists(f"{self.name}:task:{task_id}:cancelled"))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+WORK_QUEUE_BACKENDS: Dict[str, Callable[[], WorkQueue]] = {
+    "local": LocalWorkQueue,
+    "redis": RedisWorkQueue,
+}
+
+_queue: Optional[WorkQueue] = None
+
+
+def get_work_queue() -> WorkQueue:
+    global _queue
+    if _queue is None:
+        if WORK_QUEUE_BACKEND not in WORK_QUEUE_BACKENDS:
+            raise ValueError(f"Invalid work queue backend: {WORK_QUEUE_BACKEND}")
+        _queue = WORK_QUEUE_BACKENDS[WORK_QUEUE_BACKEND]()
+    return _queue
+
+
+async def run_task(task: WorkTask, on_event: Optional[Callable[[Any], None]] = None) -> Any:
+    """
+    Put a task on the queue and wait for its result, passing its events to `on_event`. Fails
+    when the worker that took the task stops sending heartbeats for `WORK_QUEUE_LEASE_SECONDS`.
+    """
+    queue = get_work_queue()
+    await queue.put_task(task)
+    # Set once a worker took the task, tasks wait in the queue as long as the workers are busy
+    lease_expires: Optional[float] = None
+    try:
+        while True:
+            timeout = min(5, lease_expires - time.monotonic()) if lease_expires is not None else 5
+            message = await queue.next_message(task.id, timeout=max(0, timeout))
+            if message is None:
+                if lease_expires is not None and time.monotonic() >= lease_expires:
+                    await queue.cancel(task.id)
+                    raise RuntimeError(f"Task {task.target} failed: its worker sent nothing for {WORK_QUEUE_LEASE_SECONDS:.0f}s")
+                continue
+            lease_expires = time.monotonic() + WORK_QUEUE_LEASE_SECONDS
+            if message["type"] in ("started", "heartbeat"):
+                continue
+            if message["type"] == "event":
+                if on_event is not None:
+                    on_event(decode_value(message["event"]))
+            else:
+                # The tokens used on the worker count against the budget the task was started in
+                charge_tokens(message.get("tokens", 0), task.scheduling.get("session_id"))
+                if message["type"] == "result":
+                    return decode_value(message["result"])
+                raise RuntimeError(f"Task {task.target} failed on the worker: {message['error']}")
+    except asyncio.CancelledError:
+        await queue.cancel(task.id)
+        raise
+
+
+async def run_on_worker(function: Callable, **kwargs: Any) -> Any:
+    """Await `function(**kwargs)` on a worker, the function must be importable by module and name."""
+    budget = get_budget()
+    task = WorkTask(
+        kind="function",
+        target=f"{function.__module__}:{function.__qualname__}",
+        kwargs=encode_value(kwargs),
+        scheduling=asdict(get_scheduling_context()),
+        budget=budget.limits() if budget is not None else None,
+    )
+    return await run_task(task)
+
+
+class RemoteWorkflow(Workflow):
+    """Runs the workflow built by `factory(**factory_kwargs)` on a work queue worker."""
+
+    def __init__(self, factory: Callable[..., Workflow], timeout: Optional[float] = None, **factory_kwargs: Any):
+        super().__init__(timeout=timeout)
+        self.factory_path = f"{factory.__module__}:{factory.__name__}"
+        self.factory_kwargs = factory_kwargs
+
+    @step()
+    async def run_on_worker(self, ctx: Context, ev: StartEvent) -> StopEvent:
+        budget = get_budget()
+        task = WorkTask(
+            kind="workflow",
+            target=self.factory_path,
+            kwargs=encode_value(self.factory_kwargs),
+            run_kwargs=encode_value(dict(ev.items())),
+            scheduling=asdict(get_scheduling_context()),
+            data_run_id=get_data_run_id(),
+            budget=budget.limits() if budget is not None else None,
+        )
+        result = await run_task(task, on_event=ctx.write_event_to_stream)
+        return StopEvent(result=result)
+
+
+async def execute_task(queue: WorkQueue, task: WorkTask):
+    """Run a task on this worker and publish its events and result."""
+    scheduling_context = SchedulingContext(
+        session_id=task.scheduling.get("session_id", "default"),
+        priority=Priority(task.scheduling.get("priority", Priority.BATCH)),
+        weight=task.scheduling.get("weight", 1.0),
+    )
+
+    # Counts the tokens the task uses, sent back with its result
+    budget = worker_budget(task.target, task.budget, scheduling_context.session_id)
+
+    async def publish_event(event: Any):
+        await queue.publish(task.id, {"type": "event", "event": event})
+
+    async def run() -> Any:
+        kwargs = decode_value(task.kwargs)
+        if task.kind == "workflow":
+            return await run_factory_workflow(
+                task.target, kwargs, decode_value(task.run_kwargs), scheduling_context, publish_event, task.data_run_id, budget
+            )
+        module_name, name = task.target.split(":")
+        function: Any = importlib.import_module(module_name)
+        for attribute in name.split("."):
+            function = getattr(function, attribute)
+        with scheduling(scheduling_context.session_id, scheduling_context.priority, scheduling_context.weight), budget_scope(budget):
+            return encode_value(await function(**kwargs))
+
+    if await queue.is_cancelled(task.id):
+        # Cancelled while it was waiting in the queue
+        await queue.publish(task.id, {"type": "error", "error": "Cancelled"})
+        return
+    await queue.publish(task.id, {"type": "started"})
+    running = asyncio.create_task(run())
+    try:
+        heartbeat_at = time.monotonic() + WORK_QUEUE_HEARTBEAT_SECONDS
+        while not running.done():
+            await asyncio.wait([running], timeout=1)
+            if not running.done() and await queue.is_cancelled(task.id):
+                running.cancel()
+            if not running.done() and time.monotonic() >= heartbeat_at:
+                await queue.publish(task.id, {"type": "heartbeat"})
+                heartbeat_at = time.monotonic() + WORK_QUEUE_HEARTBEAT_SECONDS
+        result = await running
+        await queue.publish(task.id, {"type": "result", "result": result, "tokens": budget.used_tokens})
+    except asyncio.CancelledError:
+        if not running.done():
+            # The worker is shutting down
+            running.cancel()
+            raise
+        await queue.publish(task.id, {"type": "error", "error": "Cancelled", "tokens": budget.used_tokens})
+    except Exception as e:
+        logger.exception(f"Task {task.id} ({task.target}) failed", exc_info=True)
+        await queue.publish(task.id, {"type": "error", "error": str(e), "tokens": budget.used_tokens})
+
+
+async def work(queue: WorkQueue, concurrency: int = WORK_QUEUE_WORKER_CONCURRENCY):
+    """Take tasks from the queue and run up to `concurrency` of them at a time, until cancelled."""
+    running: Set[asyncio.Task] = set()
+    try:
+        while True:
+            if len(running) >= concurrency:
+                _, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            task = await queue.get_task(timeout=5)
+            if task is None:
+                continue
+            logger.info(f"Running task {task.id} ({task.target})")
+            running.add(asyncio.create_task(execute_task(queue, task)))
+    finally:
+        for running_task in running:
+            running_task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+_local_workers: List[asyncio.Task] = []
+
+
+async def start_local_workers():
+    """Serve the local work queue from the API process."""
+    if WORK_QUEUE_BACKEND == "local" and not _local_workers:
+        _local_workers.append(asyncio.create_task(work(get_work_queue())))
+
+
+async def stop_work_queue():
+    for worker in _local_workers:
+        worker.cancel()
+    await asyncio.gather(*_local_workers, return_exceptions=True)
+    _local_workers.clear()
+    if _queue is not None:
+        await _queue.close()
+
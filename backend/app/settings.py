@@ -3,6 +3,8 @@ from typing import Dict
 
 from llama_index.core.settings import Settings
 
+from app.services.budget import init_budget_accounting
+
 
 def init_settings():
     model_provider = os.getenv("MODEL_PROVIDER")
@@ -34,6 +36,8 @@ def init_settings():
 
     Settings.chunk_size = int(os.getenv("CHUNK_SIZE", "1024"))
     Settings.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "20"))
+    # Charge the tokens of the LLM calls to the budget of the run making them
+    init_budget_accounting()
 
 
 def init_cerebras():
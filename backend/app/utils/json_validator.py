@@ -3,6 +3,7 @@ from app.utils.json_extractor import extract_json_from_response
 from pydantic import BaseModel
 from textwrap import dedent
 from llama_index.core.llms.function_calling import FunctionCallingLLM
+from app.services.scheduler import get_scheduler
 
 T = TypeVar('T', bound=BaseModel)
 
@@ -40,7 +41,8 @@ class JsonValidationHelper(Generic[T]):
                 print(prompt)
                 
                 # Get corrected JSON from LLM
-                response = await self.llm.acomplete(prompt)
+                async with get_scheduler().slot():
+                    response = await self.llm.acomplete(prompt)
                 print(response)
                 current_content = extract_json_from_response(response.text.strip())
                 retries += 1
@@ -1,5 +1,14 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
+from typing import Iterator, Optional
 import os
+import shutil
+
+# Data directories of the runs in flight, under data/, see `run_data_scope`
+RUNS_DIR = "_runs"
+
+_data_run_id: ContextVar[Optional[str]] = ContextVar("data_run_id", default=None)
 
 def get_project_root() -> Path:
     """
@@ -9,18 +18,87 @@ def get_project_root() -> Path:
     current_file = Path(__file__)  # Gets path to this file
     return current_file.parent.parent.parent
 
+def get_data_run_id() -> Optional[str]:
+    return _data_run_id.get()
+
+@contextmanager
+def run_data_scope(run_id: Optional[str]) -> Iterator[None]:
+    """
+    The workflows started in the scope read and write the session data of the run `run_id`,
+    in a directory of its own until `publish_run_data` moves it to the session's.
+    """
+    token = _data_run_id.set(run_id)
+    try:
+        yield
+    finally:
+        _data_run_id.reset(token)
+
 def get_session_data_path(session_id: str) -> Path:
     """
     Resolves the absolute path for session-specific data storage.
-    
+
     Args:
         session_id (str): The unique session identifier
-        
+
     Returns:
-        Path: The absolute path for the session data
+        Path: The absolute path for the session data, the run's own data directory within a `run_data_scope`
+    """
+    root_path = get_project_root()
+    run_id = _data_run_id.get()
+    if run_id is not None:
+        return (root_path / "data" / RUNS_DIR / session_id / run_id).resolve()
+    return (root_path / "data" / session_id).resolve()
+
+def adopt_published_file(session_id: str, file_name: str) -> bool:
+    """
+    Copy a file published by an earlier run of the session into the data directory of the
+    current run, for the runs that reuse it instead of writing it again, so the run reads
+    the session data from its own directory only. Returns whether the run has the file.
+    """
+    run_path = get_session_data_path(session_id) / file_name
+    if run_path.exists():
+        return True
+    published_path = (get_project_root() / "data" / session_id / file_name).resolve()
+    if not published_path.is_file():
+        return False
+    run_path.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(published_path, run_path)
+    return True
+
+def published_data_path(path: Path) -> Path:
+    """
+    Where a file written in the data directory of a run will be once `publish_run_data` moved
+    it to the session's, for the links to it that outlive the run. Other paths are unchanged.
+    """
+    path = Path(path).resolve()
+    runs_path = (get_project_root() / "data" / RUNS_DIR).resolve()
+    if not path.is_relative_to(runs_path):
+        return path
+    parts = path.relative_to(runs_path).parts
+    if len(parts) < 3:
+        return path
+    session_id, _run_id, *file_parts = parts
+    return (get_project_root() / "data" / session_id).resolve().joinpath(*file_parts)
+
+def publish_run_data(session_id: str, run_id: str) -> int:
+    """
+    Move the files written by the run `run_id` to the session's data directory, replacing
+    the files of earlier runs with the same name. Returns the number of files moved.
     """
     root_path = get_project_root()
-    return (root_path / "data" / session_id).resolve() 
+    run_path = (root_path / "data" / RUNS_DIR / session_id / run_id).resolve()
+    if not run_path.exists():
+        return 0
+    session_path = (root_path / "data" / session_id).resolve()
+    moved = 0
+    for file in run_path.rglob("*"):
+        if file.is_file():
+            target = session_path / file.relative_to(run_path)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(file, target)
+            moved += 1
+    shutil.rmtree(run_path, ignore_errors=True)
+    return moved
 
 if __name__ == "__main__":
-    print(get_session_data_path("123"))
\ No newline at end of file
+    print(get_session_data_path("123"))
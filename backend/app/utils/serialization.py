@@ -0,0 +1,51 @@
+"""
+JSON-compatible encoding of workflow state and events, used to save checkpoints and to
+pass events between processes. Pydantic models are encoded with their class path so they
+are decoded back to the same class.
+"""
+
+import importlib
+from typing import Any
+
+from llama_index.core.llms import ChatMessage, ChatResponse
+from pydantic import BaseModel
+
+from app.workflows.single import AgentRunResult
+
+
+def encode_value(value: Any) -> Any:
+    if isinstance(value, AgentRunResult):
+        # Only the message is needed downstream, the raw LLM response isn't serializable
+        message = value.response.message
+        value = AgentRunResult(
+            response=ChatResponse(message=ChatMessage(role=message.role, content=message.content)),
+            sources=[],
+        )
+    if isinstance(value, BaseModel):
+        cls = type(value)
+        return {"__model__": f"{cls.__module__}:{cls.__qualname__}", "data": value.model_dump(mode="json")}
+    if isinstance(value, set):
+        return {"__set__": [encode_value(item) for item in value]}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): encode_value(item) for key, item in value.items()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Can't serialize a value of type {type(value).__name__}")
+
+
+def decode_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "__model__" in value:
+        module_name, qualname = value["__model__"].split(":")
+        cls: Any = importlib.import_module(module_name)
+        for name in qualname.split("."):
+            cls = getattr(cls, name)
+        return cls(**value["data"])
+    if "__set__" in value:
+        return set(decode_value(item) for item in value["__set__"])
+    return {key: decode_value(item) for key, item in value.items()}
@@ -0,0 +1,63 @@
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a visitor came from and never change the page content.
+# Not `ref` or `context`, they do on some sites (e.g. the branch of a GitHub file, a Reddit comment thread)
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+    "ref_src", "ref_url", "referrer", "share_id", "si",
+    "_ga", "_gl", "spm", "cmpid", "rdt",
+}
+
+# Hosts that serve the same content under a different name
+HOST_ALIASES = {
+    "old.reddit.com": "reddit.com",
+    "new.reddit.com": "reddit.com",
+    "np.reddit.com": "reddit.com",
+    "m.reddit.com": "reddit.com",
+    "i.reddit.com": "reddit.com",
+    "m.youtube.com": "youtube.com",
+    "mobile.twitter.com": "twitter.com",
+    "x.com": "twitter.com",
+    "m.facebook.com": "facebook.com",
+    "en.m.wikipedia.org": "en.wikipedia.org",
+}
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a URL so that links to the same page compare equal.
+    
+    Lowercases the scheme and host, drops `www.`, default ports, fragments and tracking
+    parameters, sorts the remaining query parameters and maps known host aliases
+    (e.g. `old.reddit.com`) to their main host.
+    
+    Example:
+        >>> canonicalize_url("http://old.reddit.com/r/SaaS/comments/abc/?utm_source=share#top")
+        'https://reddit.com/r/SaaS/comments/abc'
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = f"https://{url}"
+    parts = urlsplit(url)
+
+    host = (parts.hostname or "").lower().removeprefix("www.")
+    host = HOST_ALIASES.get(host, host)
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    path = parts.path or "/"
+    if path != "/":
+        path = path.rstrip("/")
+
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    ]
+
+    # youtu.be/<id> is a short link for youtube.com/watch?v=<id>
+    if host == "youtu.be" and path != "/":
+        query.append(("v", path.lstrip("/")))
+        host, path = "youtube.com", "/watch"
+
+    return urlunsplit(("https", host, path, urlencode(sorted(query)), ""))
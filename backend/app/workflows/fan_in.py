@@ -0,0 +1,121 @@
+"""
+Fan-in of the parallel branches of a workflow, e.g. the searches of a research stage.
+
+The step fanning out records the branches it sends events for with `fan_out`, with a
+timeout and the number of branches that must succeed. Each branch runs its work with
+`run_branch`, which records that it succeeded, or its failure when it raises or is still
+running at the timeout, so the fan-in always settles. The step collecting the branches waits
+until `settled` and goes on with the results the branches stored, `check` raises `FanInError`
+when fewer branches than required succeeded.
+
+The fan-in is kept in `ctx.data`, so it is checkpointed with the workflow, and branches are
+counted by name, so a branch event delivered again after resuming isn't counted twice.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Dict, Iterable, List, Optional, TypeVar
+
+from llama_index.core.workflow import Context
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger("uvicorn")
+
+T = TypeVar("T")
+
+
+class FanInError(Exception):
+    pass
+
+
+class FanIn(BaseModel):
+    name: str
+    branches: List[str]
+    started_at: float = Field(default_factory=time.time)
+    # Seconds from the fan-out the branches have, the ones still running then are given up
+    timeout: Optional[float] = None
+    # Branches that must succeed to go on, all of them by default
+    min_results: Optional[int] = None
+    succeeded: List[str] = Field(default_factory=list)
+    failures: Dict[str, str] = Field(default_factory=dict)
+
+    def remaining(self) -> Optional[float]:
+        if self.timeout is None:
+            return None
+        return max(0.0, self.started_at + self.timeout - time.time())
+
+    def arrive(self, branch: str):
+        if branch not in self.succeeded and branch not in self.failures:
+            self.succeeded.append(branch)
+
+    def fail(self, branch: str, error: str):
+        if branch not in self.succeeded:
+            self.failures.setdefault(branch, error)
+
+    @property
+    def settled(self) -> bool:
+        return all(branch in self.succeeded or branch in self.failures for branch in self.branches)
+
+    @property
+    def required(self) -> int:
+        return len(self.branches) if self.min_results is None else min(self.min_results, len(self.branches))
+
+    def progress(self) -> str:
+        progress = f"{len(self.succeeded)} out of {len(self.branches)} {self.name}"
+        if self.failures:
+            progress += f" ({len(self.failures)} failed)"
+        return progress
+
+    def failure_summary(self) -> str:
+        return "; ".join(f"{branch}: {error}" for branch, error in self.failures.items())
+
+    def check(self):
+        """Raise when fewer branches than required succeeded."""
+        if len(self.succeeded) < self.required:
+            raise FanInError(
+                f"Only {len(self.succeeded)} of {len(self.branches)} {self.name} succeeded, "
+                f"{self.required} required. Failed: {self.failure_summary()}"
+            )
+
+
+def fan_out(
+    ctx: Context,
+    name: str,
+    branches: Iterable[str],
+    timeout: Optional[float] = None,
+    min_results: Optional[int] = None,
+) -> List[str]:
+    """
+    Start the fan-in `name` of `branches`, returns the branches without duplicates to send events for.
+    A fan-in without branches is settled right away, and as no branch will trigger the step
+    collecting them, the caller sends that step's event itself.
+    """
+    branches = list(dict.fromkeys(branches))
+    ctx.data.setdefault("fan_ins", {})[name] = FanIn(
+        name=name, branches=branches, timeout=timeout, min_results=min_results
+    )
+    return branches
+
+
+def get_fan_in(ctx: Context, name: str) -> FanIn:
+    return ctx.data["fan_ins"][name]
+
+
+async def run_branch(ctx: Context, name: str, branch: str, work: Awaitable[T]) -> Optional[T]:
+    """
+    Run the work of a branch of the fan-in `name` and record how it went, returns its result
+    or None when it failed or ran past the timeout of the fan-in.
+    """
+    fan_in = get_fan_in(ctx, name)
+    try:
+        result = await asyncio.wait_for(work, timeout=fan_in.remaining())
+    except asyncio.TimeoutError:
+        fan_in.fail(branch, f"still running after {fan_in.timeout:.0f}s")
+        return None
+    except Exception as e:
+        logger.warning(f"Branch {branch!r} of the {name} fan-in failed: {e}")
+        fan_in.fail(branch, str(e) or type(e).__name__)
+        return None
+    fan_in.arrive(branch)
+    return result
@@ -1,5 +1,6 @@
 from typing import Any, List
 
+from app.services.cancellation import track_workflow
 from app.workflows.planner import StructuredPlannerAgent
 from app.workflows.single import (
     AgentRunResult,
@@ -36,7 +37,7 @@ class AgentCallTool(ContextAwareTool):
 
     # overload the acall function with the ctx argument as it's needed for bubbling the events
     async def acall(self, ctx: Context, input: str) -> ToolOutput:
-        handler = self.agent.run(input=input)
+        handler = track_workflow(self.agent.name, self.agent.run(input=input))
         # bubble all events while running the agent to the calling agent
         async for ev in handler.stream_events():
             if type(ev) is not StopEvent:
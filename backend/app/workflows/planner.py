@@ -2,6 +2,7 @@ import uuid
 from enum import Enum
 from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple, Union
 
+from app.services.cancellation import track_workflow
 from app.workflows.single import AgentRunEvent, AgentRunResult, FunctionCallingAgent
 from llama_index.core.agent.runner.planner import (
     DEFAULT_INITIAL_PLAN_PROMPT,
@@ -154,10 +155,10 @@ class StructuredPlannerAgent(Workflow):
         is_last_tasks = self.get_remaining_subtasks(ctx) == 1
         # TODO: streaming only works without plan refining
         streaming = is_last_tasks and ctx.data["streaming"] and not self.refine_plan
-        handler = self.executor.run(
+        handler = track_workflow(ev.sub_task.name, self.executor.run(
             input=ev.sub_task.input,
             streaming=streaming,
-        )
+        ))
         # bubble all events while running the executor to the planner
         async for event in handler.stream_events():
             # Don't write the StopEvent from sub task to the stream
@@ -18,6 +18,10 @@ from llama_index.core.workflow import (
 )
 from pydantic import BaseModel, Field
 
+from app.services.cancellation import cancellable
+from app.services.scheduler import get_scheduler
+from app.services.upstreams import UpstreamUnavailableError
+
 
 class InputEvent(Event):
     input: list[ChatMessage]
@@ -117,9 +121,10 @@ class FunctionCallingAgent(Workflow):
 
         chat_history = ev.input
 
-        response = await self.llm.achat_with_tools(
-            self.tools, chat_history=chat_history
-        )
+        async with get_scheduler().slot("llm"):
+            response = await self.llm.achat_with_tools(
+                self.tools, chat_history=chat_history
+            )
         self.memory.put(response.message)
         ctx.write_event_to_stream(
             AgentRunEvent(name=self.name, msg="Got response: \n" + str(response.message), workflow_name=self.name if self.use_name_as_workflow_name else None)
@@ -148,9 +153,11 @@ class FunctionCallingAgent(Workflow):
         chat_history = ev.input
 
         async def response_generator() -> AsyncGenerator:
-            response_stream = await self.llm.astream_chat_with_tools(
-                self.tools, chat_history=chat_history
-            )
+            # Only opening the stream takes a slot, the stream is read at the client's pace
+            async with get_scheduler().slot("llm"):
+                response_stream = await self.llm.astream_chat_with_tools(
+                    self.tools, chat_history=chat_history
+                )
 
             full_response = None
             yielded_indicator = False
@@ -226,11 +233,15 @@ class FunctionCallingAgent(Workflow):
                 AgentRunEvent(name=self.name, msg="Calling tool: " + str(tool_call.tool_name), workflow_name=self.name if self.use_name_as_workflow_name else None)
             )
             try:
-                if isinstance(tool, ContextAwareTool):
-                    # inject context for calling an context aware tool
-                    tool_output = await tool.acall(ctx=ctx, **tool_call.tool_kwargs)
-                else:
-                    tool_output = await tool.acall(**tool_call.tool_kwargs)
+                # Cancelling the run cancels the tool call in flight
+                with cancellable("tool", tool_call.tool_name):
+                    if isinstance(tool, ContextAwareTool):
+                        # inject context for calling an context aware tool
+                        # no slot, these tools run other agents that take their own slots
+                        tool_output = await tool.acall(ctx=ctx, **tool_call.tool_kwargs)
+                    else:
+                        async with get_scheduler().slot("tool"):
+                            tool_output = await tool.acall(**tool_call.tool_kwargs)
                 self.sources.append(tool_output)
                 tool_msgs.append(
                     ChatMessage(
@@ -239,6 +250,18 @@ class FunctionCallingAgent(Workflow):
                         additional_kwargs=additional_kwargs,
                     )
                 )
+            except UpstreamUnavailableError as e:
+                message = f"{e} {self.fallback_hint(ctx, tool_call.tool_name)}"
+                ctx.write_event_to_stream(
+                    AgentRunEvent(name=self.name, msg="Encountered error in tool call: " + message, workflow_name=self.name if self.use_name_as_workflow_name else None)
+                )
+                tool_msgs.append(
+                    ChatMessage(
+                        role="tool",
+                        content=f"Encountered error in tool call: {message}",
+                        additional_kwargs=additional_kwargs,
+                    )
+                )
             except Exception as e:
                 ctx.write_event_to_stream(
                     AgentRunEvent(name=self.name, msg="Encountered error in tool call: " + str(e), workflow_name=self.name if self.use_name_as_workflow_name else None)
@@ -259,3 +282,13 @@ class FunctionCallingAgent(Workflow):
             
         chat_history = self.memory.get()
         return InputEvent(input=chat_history)
+
+    def fallback_hint(self, ctx: Context, unavailable_tool: str) -> str:
+        """What the agent can use instead of a tool whose provider is unavailable, from its own tools."""
+        unavailable = ctx.data.setdefault("unavailable_tools", [])
+        if unavailable_tool not in unavailable:
+            unavailable.append(unavailable_tool)
+        others = [tool.metadata.get_name() for tool in self.tools if tool.metadata.get_name() not in unavailable]
+        if not others:
+            return "No other tool can replace it, go on with what you have found so far."
+        return "Use your other tools instead: " + ", ".join(f"`{name}`" for name in others) + "."
@@ -0,0 +1,122 @@
+"""
+Structured results of the stages of a research run, streamed as soon as each stage finishes.
+
+Until the final `StopEvent`, the client only gets the free-text `AgentRunEvent` messages of
+the agents. A `StageResultEvent` carries the output of one stage: its text, its structured
+output when the stage has a report model (e.g. `MarketAnalysis`, parsed from the report by
+`structure_output`) and the URLs of the files it wrote. It is sent to the client as a
+`"stage_result"` data part (see `app.api.routers.vercel_response`), so partial reports are
+rendered while the other stages are still running.
+"""
+
+import os
+from pathlib import Path
+from textwrap import dedent
+from typing import Any, Dict, List, Optional, Type, TypeVar
+
+from llama_index.core.settings import Settings
+from llama_index.core.workflow import Event
+from pydantic import BaseModel, Field
+
+from app.config import DATA_DIR
+from app.services.scheduler import get_scheduler
+from app.utils.json_validator import JsonValidationHelper
+from app.utils.paths import get_project_root, published_data_path
+
+T = TypeVar("T", bound=BaseModel)
+
+# Parse the report of each research stage into its report model, one more LLM call per stage,
+# off by default: the stage results carry the report text and files without it
+STRUCTURED_STAGE_RESULTS = os.getenv("STRUCTURED_STAGE_RESULTS", "false").lower() == "true"
+
+# Directories served under /api/files, see main.py
+SERVED_DIRS = (DATA_DIR, "output")
+
+
+class StageArtifact(BaseModel):
+    name: str
+    url: str
+
+
+class StageResultEvent(Event):
+    stage: str
+    workflow_name: str | None = Field(default=None)
+    # "completed", "failed" or "reused" from the last run
+    status: str = Field(default="completed")
+    text: str = Field(default="")
+    # Name of the report model and the stage's output validated against it, None if the stage
+    # has no report model or its output couldn't be parsed
+    output_type: str | None = Field(default=None)
+    output: Dict[str, Any] | None = Field(default=None)
+    artifacts: List[StageArtifact] = Field(default_factory=list)
+
+    def to_response(self) -> dict:
+        return {
+            "type": "stage_result",
+            "data": {
+                "stage": self.stage,
+                "workflowName": self.workflow_name,
+                "status": self.status,
+                "text": self.text,
+                "outputType": self.output_type,
+                "output": self.output,
+                "artifacts": [artifact.model_dump() for artifact in self.artifacts],
+            },
+        }
+
+
+def stage_result(
+    stage: str,
+    text: str,
+    workflow_name: Optional[str] = None,
+    status: str = "completed",
+    output: Optional[BaseModel] = None,
+    files: Optional[List[Path]] = None,
+) -> StageResultEvent:
+    """The result event of `stage`, with the URLs of those of `files` that exist and are served."""
+    artifacts = []
+    for file in files or []:
+        url = file_url(file)
+        if url is not None and file.is_file():
+            artifacts.append(StageArtifact(name=file.name, url=url))
+    return StageResultEvent(
+        stage=stage,
+        workflow_name=workflow_name,
+        status=status,
+        text=text,
+        output_type=type(output).__name__ if output is not None else None,
+        output=output.model_dump(mode="json") if output is not None else None,
+        artifacts=artifacts,
+    )
+
+
+def file_url(path: Path) -> Optional[str]:
+    """
+    The URL of a file under the directories served by the backend, None for the others. Files
+    of a run in flight get the URL they are served at once the run is published.
+    """
+    root = get_project_root()
+    path = published_data_path(path)
+    for directory in SERVED_DIRS:
+        served = (root / directory).resolve()
+        if path.is_relative_to(served):
+            prefix = os.getenv("FILESERVER_URL_PREFIX", "http://localhost:8000/api/files")
+            return f"{prefix}/{directory}/{path.relative_to(served).as_posix()}"
+    return None
+
+
+async def structure_output(model: Type[T], content: str) -> Optional[T]:
+    """The report `content` as a `model`, None if it couldn't be parsed."""
+    prompt = dedent(f"""
+        Extract the following report into a JSON object following this schema:
+        {model.model_json_schema()}
+
+        Keep the findings, numbers, quotes and sources of the report as they are, do not summarize
+        or add anything. Return ONLY the JSON object.
+
+        ### Report
+        {content}
+    """).strip()
+    async with get_scheduler().slot():
+        response = await Settings.llm.acomplete(prompt)
+    return await JsonValidationHelper(model, Settings.llm).validate_and_fix(response.text)
@@ -6,17 +6,40 @@ load_dotenv()
 
 import logging
 import os
+from contextlib import asynccontextmanager
 
 import uvicorn
 from app.api.routers import api_router
+from app.engine.tools.mcp_server import close_mcp_server, get_mcp_server
 from app.observability import init_observability
+from app.services.batch import get_batch_runner
+from app.services.jobs import get_job_runner
+from app.services.process_pool import shutdown_process_pool
+from app.services.work_queue import start_local_workers, stop_work_queue
 from app.settings import init_settings
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared clients for the research upstreams, reused by all sessions
+    get_mcp_server()
+    # Resume the research jobs interrupted by the last shutdown
+    await get_job_runner().start()
+    await get_batch_runner().start()
+    await start_local_workers()
+    yield
+    await stop_work_queue()
+    await get_batch_runner().stop()
+    await get_job_runner().stop()
+    shutdown_process_pool()
+    await close_mcp_server()
+
+
+app = FastAPI(lifespan=lifespan)
 
 init_settings()
 init_observability()
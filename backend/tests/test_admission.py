@@ -0,0 +1,96 @@
+import asyncio
+
+from app.services import admission
+from app.services.admission import AdmissionController
+from app.services.scheduler import Scheduler, scheduling
+from app.services.session_metrics import get_session_metrics
+
+
+class Handler:
+    """Stands in for a workflow handler, done when `finish()` is called."""
+
+    def __init__(self):
+        self._callbacks = []
+
+    def add_done_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def finish(self):
+        for callback in self._callbacks:
+            callback(self)
+
+
+def test_sessions_are_admitted_up_to_the_limit():
+    controller = AdmissionController(max_sessions=2, max_tokens=10**9)
+    handlers = [Handler(), Handler()]
+    for handler in handlers:
+        assert controller.check().admitted
+        controller.track(handler)
+
+    decision = controller.check()
+    assert not decision.admitted
+    assert "2 research sessions" in decision.reason
+    assert decision.retry_after > 0
+
+    handlers[0].finish()
+    assert controller.check().admitted
+    assert controller.snapshot()["rejected"] == 1
+
+
+def test_token_demand_follows_the_tokens_used():
+    controller = AdmissionController(max_sessions=10, tokens_per_session=100, max_tokens=350)
+    # Tokens of an earlier run of the session don't count
+    get_session_metrics("test-admission-a").incr("llm_tokens", 1000)
+    handlers = [Handler(), Handler()]
+    controller.track(handlers[0], "test-admission-a")
+    controller.track(handlers[1], "test-admission-b")
+    # Sessions that used less than the estimate count for the estimate
+    assert controller.tokens_in_flight() == 200
+    assert controller.check().admitted
+
+    get_session_metrics("test-admission-b").incr("llm_tokens", 200)
+    assert controller.tokens_in_flight() == 300
+    assert "token demand" in controller.check().reason
+
+    # The finished sessions used more than estimated, so will the next ones
+    get_session_metrics("test-admission-a").incr("llm_tokens", 300)
+    for handler in handlers:
+        handler.finish()
+    assert controller.snapshot()["avg_session_tokens"] == 250
+    controller.track(Handler(), "test-admission-c")
+    assert controller.tokens_in_flight() == 250
+    assert "token demand" in controller.check().reason
+
+
+def test_a_long_llm_queue_holds_sessions_back(monkeypatch):
+    scheduler = Scheduler(max_concurrency=1)
+    monkeypatch.setattr(admission, "get_scheduler", lambda: scheduler)
+    controller = AdmissionController(max_queue_depth=2)
+
+    async def run():
+        async def call():
+            with scheduling("busy"):
+                async with scheduler.slot():
+                    await asyncio.sleep(0.05)
+
+        calls = [asyncio.create_task(call()) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert "2 LLM and tool calls are waiting" in controller.over_limit()
+        # No session in flight to wait for, the client retries shortly
+        assert controller.check().retry_after == 1
+        await asyncio.gather(*calls)
+        assert controller.over_limit() is None
+
+    asyncio.run(run())
+
+
+def test_wait_estimate_follows_the_sessions_in_flight():
+    controller = AdmissionController(max_sessions=2)
+    assert controller.estimate_wait() == 0
+    controller._avg_session_seconds = 100
+    handlers = [Handler(), Handler()]
+    for handler in handlers:
+        controller.track(handler)
+    # The next in line waits for the first session to finish, the third one for a full round more
+    assert 90 < controller.estimate_wait(0) <= 101
+    assert 190 < controller.estimate_wait(2) <= 201
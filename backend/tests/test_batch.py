@@ -0,0 +1,107 @@
+import asyncio
+
+from llama_index.core.workflow import StartEvent, StopEvent, Workflow, step
+
+from app.services import batch as batch_module
+from app.services import jobs
+from app.services.batch import Batch, BatchIdea, BatchRunner, parse_ideas, plan_batch
+from app.services.jobs import JobRunner, JobStatus
+from app.services.session_metrics import get_session_metrics
+from app.services.single_flight import get_single_flight
+
+EMBEDDINGS = {
+    "An invoice tracker for freelancers": [1.0, 0.0],
+    "Invoice reminders for freelancers": [0.99, 0.1],
+    "A meal planner": [0.0, 1.0],
+    "Not embedded": None,
+}
+
+
+async def embed_idea(idea: str):
+    return EMBEDDINGS[idea]
+
+
+def test_ideas_files_are_parsed():
+    assert parse_ideas("# ideas\nA meal planner\n\na  meal PLANNER\nAn invoice tracker\n") == ["A meal planner", "An invoice tracker"]
+    assert parse_ideas('{"idea": "A meal planner"}\n"An invoice tracker"\n', "ideas.jsonl") == ["A meal planner", "An invoice tracker"]
+    assert parse_ideas("name,idea\nmeals,A meal planner\n", "ideas.csv") == ["A meal planner"]
+
+
+def test_similar_ideas_are_clustered_behind_a_leader(monkeypatch):
+    monkeypatch.setattr(batch_module, "embed_idea", embed_idea)
+    planned = asyncio.run(plan_batch("batch", list(EMBEDDINGS), threshold=0.9))
+
+    assert [idea.cluster for idea in planned] == [0, 0, 1, 2]
+    assert [idea.leader for idea in planned] == [None, 0, None, None]
+    assert planned[1].session_id == "batch-batch-001"
+
+
+class TokensWorkflow(Workflow):
+    """Charges `tokens` LLM tokens to the session and returns the idea."""
+
+    @step()
+    async def research(self, ev: StartEvent) -> StopEvent:
+        get_session_metrics(ev.get("session_id")).incr("llm_tokens", ev.get("tokens"))
+        await asyncio.sleep(0.01)
+        return StopEvent(result=ev.get("input"))
+
+
+def start_research(started: list):
+    def start(job, resume: bool = False):
+        idea = job.payload["messages"][0]["content"]
+        started.append(idea)
+        return get_single_flight().join_or_start(
+            job.session_id, idea, lambda: TokensWorkflow(timeout=5).run(input=idea, session_id=job.session_id, tokens=100)
+        )
+
+    return start
+
+
+def test_leaders_are_researched_before_their_cluster(tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr(batch_module, "embed_idea", embed_idea)
+    monkeypatch.setattr(batch_module, "BATCH_CLUSTER_THRESHOLD", 0.9)
+    monkeypatch.setattr(batch_module, "BATCH_POLL_SECONDS", 0.01)
+    monkeypatch.setitem(jobs.JOB_KINDS, "research", start_research(started))
+
+    async def run():
+        job_runner = JobRunner(jobs_dir=str(tmp_path / "jobs"), max_workers=2)
+        await job_runner.start()
+        runner = BatchRunner(batch_dir=str(tmp_path / "batches"), job_runner=job_runner, max_concurrency=2)
+        try:
+            batch = await runner.submit(["Invoice reminders for freelancers", "An invoice tracker for freelancers", "A meal planner"])
+            # Planned in order of the file, the second idea is the closest to the first
+            assert [idea.leader for idea in batch.ideas] == [None, 0, None]
+            batch = await asyncio.wait_for(runner.wait(batch.id), timeout=5)
+        finally:
+            await job_runner.stop()
+        return batch
+
+    batch = asyncio.run(run())
+    assert all(idea.status == JobStatus.SUCCEEDED for idea in batch.ideas)
+    # The follower starts after the leaders, once its leader is done
+    assert started.index("An invoice tracker for freelancers") == 2
+    assert [idea.tokens for idea in batch.ideas] == [100, 100, 100]
+    # The batch is read back from disk once it is finished
+    runner = BatchRunner(batch_dir=str(tmp_path / "batches"))
+    summary = runner.summary(runner.get(batch.id))
+    assert summary.tokens == 300 and summary.succeeded == 3
+    assert (tmp_path / "batches" / batch.id / "summary.md").exists()
+
+
+def test_shared_pages_are_counted_across_restarts(tmp_path):
+    # 5 pages were shared before the restart
+    batch = Batch(id="restarted", ideas=[BatchIdea(index=0, idea="A meal planner", session_id="batch-restarted-000", cluster=0)], pages_shared=5)
+    (tmp_path / batch.id).mkdir()
+    (tmp_path / batch.id / "batch.json").write_text(batch.model_dump_json())
+    group = batch.fetch_group(batch.ideas[0])
+
+    runner = BatchRunner(batch_dir=str(tmp_path))
+    batch = runner.get(batch.id)
+    # The pages shared after it are added to them
+    get_session_metrics(group).incr("fetch_registry_hits", 2)
+    assert runner._count_pages_shared(batch)
+    get_session_metrics(group).incr("fetch_inflight_joins", 1)
+    runner._count_pages_shared(batch)
+    assert not runner._count_pages_shared(batch)
+    assert runner.summary(batch).pages_shared == 8
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from llama_index.core.workflow import StartEvent, StopEvent, Workflow, step
+
+from app.services import budget as budget_module
+from app.services.budget import Budget, BudgetExhausted, budget_scope, child_budget, get_budget, sub_workflow_seconds
+from app.services.cancellation import track_workflow
+from app.services.deadline import Deadline
+from app.services.session_metrics import get_session_metrics
+
+
+class SleepWorkflow(Workflow):
+    """Sleeps `seconds`, and returns the name of the budget its step ran in."""
+
+    @step()
+    async def sleep(self, ev: StartEvent) -> StopEvent:
+        await asyncio.sleep(ev.get("seconds", 0))
+        budget = get_budget()
+        return StopEvent(result=budget.name if budget is not None else None)
+
+
+def test_children_get_the_earliest_of_their_limits_and_their_parents():
+    run = Budget("run", session_id="test-budget", deadline=Deadline.after(100), max_tokens=1000)
+    run.charge(400)
+
+    stage = run.child("stage", seconds=10, max_tokens=5000)
+    assert 9 < stage.remaining_seconds() <= 10
+    assert stage.remaining_tokens() == 600
+    # A child asking for more time than its parent has left gets what is left
+    assert 99 < run.child("long stage", seconds=1000).remaining_seconds() <= 100
+
+    # Tokens used by the child count against its parents
+    stage.charge(100)
+    assert run.used_tokens == 500
+    assert run.remaining_tokens() == 500 and stage.remaining_tokens() == 500
+
+
+def test_sub_workflows_are_limited_by_their_own_timeout():
+    workflow = SleepWorkflow(timeout=30)
+    assert sub_workflow_seconds(workflow) == 30
+    assert sub_workflow_seconds(workflow, 10) == 10
+    assert sub_workflow_seconds(workflow, 60) == 30
+    assert sub_workflow_seconds(SleepWorkflow(timeout=None), 60) == 60
+
+    async def run():
+        with budget_scope(Budget("run", deadline=Deadline.after(3600))):
+            with child_budget("stage", seconds=sub_workflow_seconds(workflow), deadline=Deadline.after(600)) as stage:
+                assert 29 < stage.remaining_seconds() <= 30
+
+    asyncio.run(run())
+
+
+def test_workflows_run_within_the_budget_they_were_started_in():
+    async def run():
+        with budget_scope(Budget("run", deadline=Deadline.after(60))):
+            with child_budget("stage"):
+                handler = track_workflow("stage", SleepWorkflow(timeout=5).run())
+        assert await handler == "stage"
+        assert get_budget() is None
+
+    asyncio.run(run())
+
+
+def test_spent_budgets_start_nothing_and_cancel_what_runs(monkeypatch):
+    monkeypatch.setattr(budget_module, "BUDGET_GRACE_SECONDS", 0)
+
+    async def run():
+        spent = Budget("run", max_tokens=100)
+        spent.charge(100)
+        with budget_scope(spent):
+            with pytest.raises(BudgetExhausted):
+                with child_budget("stage"):
+                    pass
+
+        with budget_scope(Budget("run", session_id="test-budget-cancel", deadline=Deadline.after(0.05))):
+            handler = track_workflow("stage", SleepWorkflow(timeout=5).run(seconds=1))
+        # Cancelled at the end of the budget, long before the workflow is done
+        await asyncio.sleep(0.2)
+        assert handler.done()
+        assert get_session_metrics("test-budget-cancel").get("budget_cancelled_runs") == 1
+
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
+
+from app.services import checkpoints
+from app.services.checkpoints import WorkflowCheckpoint, checkpoint, get_session_checkpoints
+from app.utils.paths import run_data_scope
+
+
+class OneStepWorkflow(Workflow):
+    @step()
+    async def start(self, ctx: Context, ev: StartEvent) -> StopEvent:
+        return StopEvent(result="done")
+
+
+def test_runs_of_a_session_keep_their_own_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoints, "CHECKPOINTS_DIR", str(tmp_path))
+    workflow = OneStepWorkflow()
+    with run_data_scope("run-a"):
+        first = WorkflowCheckpoint(workflow, "session")
+    with run_data_scope("run-b"):
+        second = WorkflowCheckpoint(workflow, "session")
+    assert first.path != second.path
+    assert first.path == tmp_path / "session" / "run-a" / "OneStepWorkflow.json"
+
+    for workflow_checkpoint in (first, second):
+        workflow_checkpoint.path.parent.mkdir(parents=True)
+        workflow_checkpoint.path.write_text(
+            '{"workflow": "OneStepWorkflow", "status": "finished", "completed_steps": ["start"], "pending": [], "updated_at": 0}'
+        )
+    assert sorted(saved["run_id"] for saved in get_session_checkpoints("session")) == ["run-a", "run-b"]
+
+
+def test_checkpoints_outside_a_run_are_kept_by_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoints, "CHECKPOINTS_DIR", str(tmp_path))
+    assert WorkflowCheckpoint(OneStepWorkflow(), "session").path == tmp_path / "session" / "OneStepWorkflow.json"
+
+
+class SearchEvent(Event):
+    query: str
+
+
+class SearchWorkflow(Workflow):
+    """Plans two searches and runs them one at a time, failing on the queries in `failing`."""
+
+    def __init__(self, log: list, failing=(), **kwargs):
+        super().__init__(timeout=5, **kwargs)
+        self.session_id = "session"
+        self.log = log
+        self.failing = failing
+
+    @step()
+    @checkpoint
+    async def plan(self, ctx: Context, ev: StartEvent) -> SearchEvent:
+        self.log.append("plan")
+        ctx.data["found"] = []
+        for query in ("a", "b"):
+            ctx.send_event(SearchEvent(query=query))
+        return None
+
+    @step(num_workers=1)
+    @checkpoint
+    async def search(self, ctx: Context, ev: SearchEvent) -> StopEvent:
+        self.log.append(f"search {ev.query}")
+        if ev.query in self.failing:
+            raise RuntimeError("interrupted")
+        ctx.data["found"].append(ev.query)
+        if len(ctx.data["found"]) < 2:
+            return None
+        return StopEvent(result=sorted(ctx.data["found"]))
+
+
+def run(workflow: Workflow, **kwargs):
+    async def run_workflow():
+        return await workflow.run(**kwargs)
+
+    return asyncio.run(run_workflow())
+
+
+def test_resumed_runs_skip_their_completed_steps(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoints, "CHECKPOINTS_DIR", str(tmp_path))
+    log = []
+    with pytest.raises(RuntimeError, match="interrupted"):
+        run(SearchWorkflow(log, failing=["b"]))
+    assert log == ["plan", "search a", "search b"]
+    [saved] = get_session_checkpoints("session")
+    assert saved["status"] == "running" and saved["pending_events"] == 1
+
+    # Only the search that didn't complete is sent again, with the state the others left
+    log.clear()
+    assert run(SearchWorkflow(log), resume=True) == ["a", "b"]
+    assert log == ["search b"]
+
+    # A finished run returns its saved result, as a finished sub-workflow of a resumed run does
+    log.clear()
+    assert run(SearchWorkflow(log), resume=True) == ["a", "b"]
+    assert log == []
+
+    # Without resume the run starts over
+    assert run(SearchWorkflow(log)) == ["a", "b"]
+    assert log == ["plan", "search a", "search b"]
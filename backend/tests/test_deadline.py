@@ -0,0 +1,45 @@
+from app.services import deadline as deadline_module
+from app.services.budget import Budget, budget_scope
+from app.services.deadline import Deadline, deadline_scope, get_deadline, to_deadline
+
+
+def freeze_time(monkeypatch, now: float = 1000.0):
+    monkeypatch.setattr(deadline_module.time, "time", lambda: now)
+
+
+def test_work_is_fitted_to_the_time_left(monkeypatch):
+    freeze_time(monkeypatch)
+    deadline = Deadline(1100)
+
+    # 100s left, 20s each: 5 rounds
+    assert deadline.fit(10, 20) == 5
+    assert deadline.fit(3, 20) == 3
+    assert deadline.fit(20, 20, parallel=3) == 15
+    # 40s of them are kept for the work after
+    assert deadline.fit(10, 20, reserve=40) == 3
+    # Something is always done, even with no time left
+    assert deadline.fit(10, 200) == 1
+    assert Deadline(900).fit(10, 20) == 1
+    assert Deadline(900).expired() and Deadline(900).remaining() == 0
+
+
+def test_deadlines_are_split_by_the_time_left(monkeypatch):
+    freeze_time(monkeypatch)
+    research = Deadline(1100).split(0.6)
+    assert research.at == 1060
+    assert research.allows(60) and not research.allows(61)
+    assert Deadline(900).split(0.5).at == 1000
+    assert to_deadline(None) is None and to_deadline(1100).at == 1100
+
+
+def test_the_scope_deadline_is_cut_short_by_the_budget(monkeypatch):
+    freeze_time(monkeypatch)
+    assert get_deadline() is None
+    with deadline_scope(Deadline(1100)):
+        assert get_deadline().at == 1100
+        with budget_scope(Budget("run", deadline=Deadline(1050))):
+            assert get_deadline().at == 1050
+        with budget_scope(Budget("run", deadline=Deadline(1200))):
+            assert get_deadline().at == 1100
+    with budget_scope(Budget("run", deadline=Deadline(1050))):
+        assert get_deadline().at == 1050
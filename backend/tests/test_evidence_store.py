@@ -0,0 +1,66 @@
+from app.services import evidence_store
+from app.services.evidence_store import EvidenceRecord, EvidenceStore, get_evidence_store, known_evidence, record_findings, records_from_findings
+from app.utils.paths import run_data_scope
+
+FINDINGS = {
+    "market_insights": [
+        {
+            "title": "Freelance market size",
+            "value": "$1.5T",
+            "source": {"url": "https://example.com/report?utm_source=x"},
+            "evidence": [{"quote": "Freelancers earned $1.5T", "source": "https://example.com/report"}],
+        },
+    ],
+    "competitors": [
+        {"name": "InvoiceCo", "source_url": "https://invoice.co", "pros": ["Cheap"], "cons": ["No reminders"]},
+    ],
+    "sources": ["https://example.org/survey", "not a url"],
+}
+
+
+def test_findings_become_records():
+    records = records_from_findings("Market Research", FINDINGS)
+    rendered = {(record.entity, record.quote, record.stat, record.url) for record in records}
+
+    assert ("Freelance market size", "Freelancers earned $1.5T", "$1.5T", "https://example.com/report") in rendered
+    assert ("InvoiceCo", "Cheap", None, "https://invoice.co") in rendered
+    assert ("InvoiceCo", "No reminders", None, "https://invoice.co") in rendered
+    assert (None, None, None, "https://example.org/survey") in rendered
+    assert all(record.stage == "Market Research" for record in records)
+    assert records_from_findings("Market Research", "no JSON") == []
+
+
+def test_records_are_deduplicated(tmp_path, monkeypatch):
+    monkeypatch.setattr(evidence_store, "EVIDENCE_STORE_DIR", str(tmp_path))
+    store = EvidenceStore("session")
+    record = EvidenceRecord(url="https://example.com/report", quote="Freelancers  earned $1.5T", entity="Market", stage="Market Research")
+    # The same evidence under another url of the page, with other spacing, from another stage
+    same = EvidenceRecord(url="https://example.com/report?utm_source=x", quote="freelancers earned $1.5T", entity="Market", stage="Online Trends")
+
+    assert store.add([record, same]) == 1
+    assert store.add([record]) == 0
+    assert len(store.by_url("https://example.com/report/")) == 1
+    assert len(store.by_entity(" market ")) == 1
+
+
+def test_records_appended_by_other_processes_are_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(evidence_store, "EVIDENCE_STORE_DIR", str(tmp_path))
+    store = EvidenceStore("session", "run")
+    # Another process of the run, e.g. a process pool worker, has a store of its own on the same file
+    other = EvidenceStore("session", "run")
+    other.add(records_from_findings("Competitor Analysis", FINDINGS["competitors"]))
+
+    assert {record.quote for record in store.query(entity="InvoiceCo")} == {"Cheap", "No reminders"}
+    assert store.add(records_from_findings("Customer Insights", FINDINGS["competitors"])) == 0
+    assert store.snapshot()["stages"] == {"Competitor Analysis": 2}
+
+
+def test_runs_of_a_session_keep_their_own_evidence(tmp_path, monkeypatch):
+    monkeypatch.setattr(evidence_store, "EVIDENCE_STORE_DIR", str(tmp_path))
+    with run_data_scope("first-idea"):
+        record_findings("test-evidence-runs", "Competitor Analysis", FINDINGS["competitors"])
+        assert "InvoiceCo" in known_evidence("test-evidence-runs")
+    with run_data_scope("second-idea"):
+        assert known_evidence("test-evidence-runs") == ""
+    assert get_evidence_store("test-evidence-runs", "first-idea").path == tmp_path / "test-evidence-runs" / "first-idea.jsonl"
+    assert evidence_store.get_session_run_ids("test-evidence-runs") == ["first-idea"]
@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.services import fake_upstreams
+from app.services.fake_upstreams import FakeCorpus, fake_upstreams_app
+
+
+@pytest.fixture(autouse=True)
+def no_latency(monkeypatch):
+    for profile in fake_upstreams._profiles.values():
+        monkeypatch.setattr(profile, "latency_ms", 0)
+
+
+def serve(requests):
+    """Run `requests(client)` against the fake upstreams."""
+
+    async def run():
+        transport = httpx.ASGITransport(app=fake_upstreams_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await requests(client)
+
+    return asyncio.run(run())
+
+
+def test_searches_are_reproducible_and_link_to_served_pages():
+    async def requests(client):
+        results = (await client.post("/tavily/search", json={"query": "invoice tools", "max_results": 3})).json()["results"]
+        again = (await client.post("/tavily/search", json={"query": "invoice tools", "max_results": 3})).json()["results"]
+        assert len(results) == 3 and results == again
+
+        repos = (await client.get("/github/search/repositories", params={"q": "invoice tools"})).json()["items"]
+        posts = (await client.post("/mcp/reddit", json={"query": "invoice tools", "limit": 2})).json()["posts"]
+        notion = (await client.post("/mcp/notion", json={"title": "Report", "content": "Invoice tools are growing"})).json()
+        urls = [results[0]["url"], repos[0]["html_url"], posts[0]["url"], notion["url"]]
+        # Every link opens a page of the fake service, nothing points at the real sites
+        assert all(url.startswith("http://testserver/pages/") for url in urls)
+        for url in urls:
+            assert (await client.get(url)).status_code == 200
+        assert "Invoice tools are growing" in (await client.get(notion["url"])).text
+
+    serve(requests)
+
+
+def test_injected_errors(monkeypatch):
+    monkeypatch.setattr(fake_upstreams._profiles["brave"], "rate_limit_rate", 1.0)
+    monkeypatch.setattr(fake_upstreams._profiles["reddit"], "error_rate", 1.0)
+
+    async def requests(client):
+        rate_limited = await client.get("/brave/res/v1/web/search", params={"q": "invoices"})
+        assert rate_limited.status_code == 429 and rate_limited.headers["Retry-After"] == "1"
+        assert (await client.get("/reddit/search", params={"q": "invoices"})).status_code == 500
+        assert (await client.get("/stats")).json()["upstreams"]["brave"]["injected_errors"] >= 1
+
+    serve(requests)
+
+
+def test_generated_documents_are_bounded(tmp_path):
+    corpus_path = tmp_path / "corpus.json"
+    corpus_path.write_text(json.dumps([{"title": "Invoice market", "url": "https://example.com/invoices", "content": "Big"}]))
+    corpus = FakeCorpus(seed=1, corpus_path=str(corpus_path), max_documents=3)
+
+    first = corpus.search("meal planner", 2, "http://fake")
+    corpus.search("invoice tools", 3, "http://fake")
+    # The seed document and the last generated ones are kept
+    assert len(corpus) == 4
+    assert corpus.get(corpus.seed_documents[0].id) is not None
+    assert corpus.get(first[0].id) is None
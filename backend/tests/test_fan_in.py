@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.workflows.fan_in import FanInError, fan_out, get_fan_in, run_branch
+
+
+async def fail():
+    raise ValueError("no results")
+
+
+async def succeed():
+    return "result"
+
+
+def test_branches_settle_on_success_and_failure():
+    async def run():
+        ctx = SimpleNamespace(data={})
+        assert fan_out(ctx, "searches", ["a", "b", "a"], min_results=1) == ["a", "b"]
+        assert await run_branch(ctx, "searches", "a", succeed()) == "result"
+        assert not get_fan_in(ctx, "searches").settled
+        assert await run_branch(ctx, "searches", "b", fail()) is None
+        fan_in = get_fan_in(ctx, "searches")
+        assert fan_in.settled
+        assert fan_in.failures == {"b": "no results"}
+        fan_in.check()
+
+    asyncio.run(run())
+
+
+def test_too_few_successes_fail_the_fan_in():
+    async def run():
+        ctx = SimpleNamespace(data={})
+        fan_out(ctx, "searches", ["a", "b"])
+        await run_branch(ctx, "searches", "a", succeed())
+        await run_branch(ctx, "searches", "b", fail())
+        with pytest.raises(FanInError, match="Only 1 of 2 searches succeeded"):
+            get_fan_in(ctx, "searches").check()
+
+    asyncio.run(run())
+
+
+def test_a_fan_in_without_branches_is_settled():
+    ctx = SimpleNamespace(data={})
+    assert fan_out(ctx, "competitor details", [], min_results=1) == []
+    fan_in = get_fan_in(ctx, "competitor details")
+    assert fan_in.settled
+    fan_in.check()
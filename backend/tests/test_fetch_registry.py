@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from app.services import fetch_registry
+from app.services.fetch_registry import FetchRegistry, _StoredResults
+
+
+class Page:
+    """A fetch that takes `seconds`, counting how often it runs and how often it is cancelled."""
+
+    def __init__(self, content: str = "page", seconds: float = 0.05):
+        self.content = content
+        self.seconds = seconds
+        self.runs = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.runs += 1
+        try:
+            await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.content
+
+
+def test_concurrent_fetches_are_deduplicated():
+    async def run():
+        registry = FetchRegistry("test-dedup")
+        page = Page()
+        results = await asyncio.gather(*(registry.fetch("url", page) for _ in range(5)))
+        assert results == ["page"] * 5
+        assert page.runs == 1
+        assert registry.get("url") == "page"
+        assert registry.metrics.get("fetch_inflight_joins") == 4
+        assert registry.metrics.get("fetch_registry_hits") == 1
+
+    asyncio.run(run())
+
+
+def test_failed_fetches_are_not_kept():
+    async def run():
+        registry = FetchRegistry("test-errors")
+        page = Page(content="error")
+        assert await registry.fetch("url", page, is_error=lambda result: result == "error") == "error"
+        assert registry.get("url") is None
+        await registry.fetch("url", page, is_error=lambda result: result == "error")
+        assert page.runs == 2
+
+    asyncio.run(run())
+
+
+def test_cancelling_the_owner_stops_the_fetch():
+    async def run():
+        registry = FetchRegistry("test-cancel-owner")
+        page = Page(seconds=10)
+        owner = asyncio.create_task(registry.fetch("url", page))
+        await asyncio.sleep(0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(owner, timeout=0.01)
+        # Stopped by the time the owner is done, e.g. before its crawler is closed
+        assert page.cancelled == 1
+        assert registry.get("url") is None
+
+    asyncio.run(run())
+
+
+def test_joiners_fetch_again_when_the_owner_gives_up():
+    async def run():
+        registry = FetchRegistry("test-owner-gives-up")
+        owner_page = Page(content="owner", seconds=10)
+        joiner_page = Page(content="joiner")
+        owner = asyncio.create_task(registry.fetch("url", owner_page))
+        await asyncio.sleep(0.01)
+        joiner = asyncio.create_task(registry.fetch("url", joiner_page))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        assert await joiner == "joiner"
+        assert owner.cancelled()
+        assert owner_page.cancelled == 1
+        assert joiner_page.runs == 1
+
+    asyncio.run(run())
+
+
+def test_cancelling_a_joiner_keeps_the_fetch():
+    async def run():
+        registry = FetchRegistry("test-cancel-joiner")
+        page = Page(seconds=0.1)
+        owner = asyncio.create_task(registry.fetch("url", page))
+        await asyncio.sleep(0.01)
+        joiner = asyncio.create_task(registry.fetch("url", page))
+        await asyncio.sleep(0.01)
+        joiner.cancel()
+        assert await owner == "page"
+        assert joiner.cancelled()
+        assert page.runs == 1 and page.cancelled == 0
+
+    asyncio.run(run())
+
+
+def test_stored_results_are_capped(monkeypatch):
+    monkeypatch.setattr(fetch_registry, "_stored", _StoredResults(max_bytes=10))
+
+    async def run():
+        registry = FetchRegistry("test-cap")
+        await registry.fetch("first", Page(content="a" * 6))
+        await registry.fetch("second", Page(content="b" * 6))
+        assert registry.get("first") is None
+        assert registry.get("second") == "b" * 6
+        # Reading a result keeps it
+        registry.get("second")
+        await registry.fetch("third", Page(content="c" * 4))
+        assert registry.get("second") == "b" * 6
+        assert registry.get("third") == "c" * 4
+
+    asyncio.run(run())
+
+
+def test_groups_share_a_registry():
+    fetch_registry.share_fetch_registry("test-group-a", "test-group")
+    fetch_registry.share_fetch_registry("test-group-b", "test-group")
+    assert fetch_registry.get_fetch_registry("test-group-a") is fetch_registry.get_fetch_registry("test-group-b")
+    assert fetch_registry.get_fetch_registry("test-group-c") is not fetch_registry.get_fetch_registry("test-group-a")
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+from app.services.idea_cache import IdeaCache
+
+EMBEDDINGS = {
+    "AI meal planner": [1.0, 0.0],
+    "AI recipe planner": [0.95, 0.1],
+    "Invoice tracker": [0.0, 1.0],
+}
+
+
+class FakeEmbeddingsCache(IdeaCache):
+    async def _embed(self, idea):
+        return EMBEDDINGS.get(idea)
+
+
+def test_similar_ideas_find_the_earlier_research(tmp_path):
+    path = str(tmp_path / "idea_cache.json")
+    cache = FakeEmbeddingsCache(path, similarity_threshold=0.9)
+
+    async def run():
+        await cache.add("meals", "AI meal planner", {"Market Research": "Meal planning is a big market"})
+        await cache.add("invoices", "Invoice tracker", {"Market Research": "Freelancers need invoices"})
+        # Nothing to index without reports or an embedding
+        await cache.add("empty", "AI recipe planner", {})
+        await cache.add("unknown", "Not embedded", {"Market Research": "report"})
+
+        found = await cache.find("AI recipe planner")
+        assert found.session_id == "meals" and found.similarity > 0.99
+        assert found.seed("Market Research").endswith("Meal planning is a big market")
+        assert found.seed("Online Trends") is None
+        # The session's own research doesn't seed it
+        assert await cache.find("AI meal planner", exclude_session_id="meals") is None
+        assert await cache.find("Not embedded") is None
+
+    asyncio.run(run())
+    # The index is read back from disk
+    assert FakeEmbeddingsCache(path).has_session("invoices")
+    assert not FakeEmbeddingsCache(path).has_session("empty")
+
+
+def test_research_is_replaced_and_expires(tmp_path):
+    cache = FakeEmbeddingsCache(str(tmp_path / "idea_cache.json"), max_age_seconds=60)
+
+    async def run():
+        await cache.add("meals", "AI meal planner", {"Market Research": "first report"})
+        await cache.add("meals", "AI meal planner", {"Market Research": "second report"})
+        assert len(cache._entries) == 1
+        assert (await cache.find("AI meal planner")).reports == {"Market Research": "second report"}
+
+        cache._entries[0]["created_at"] = time.time() - 120
+        assert await cache.find("AI meal planner") is None
+        # Expired research is dropped when the next one is added
+        await cache.add("invoices", "Invoice tracker", {"Market Research": "report"})
+        assert [entry["session_id"] for entry in cache._entries] == ["invoices"]
+
+    asyncio.run(run())
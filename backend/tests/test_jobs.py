@@ -0,0 +1,139 @@
+import asyncio
+
+from llama_index.core.workflow import StartEvent, StopEvent, Workflow, step
+
+from app.services import jobs
+from app.services.jobs import Job, JobRunner, JobStatus
+from app.services.session_metrics import get_session_metrics
+from app.services.single_flight import get_single_flight
+
+
+class EchoWorkflow(Workflow):
+    @step()
+    async def echo(self, ev: StartEvent) -> StopEvent:
+        if ev.get("session_id"):
+            get_session_metrics(ev.get("session_id")).incr("llm_tokens", ev.get("tokens", 0))
+        await asyncio.sleep(ev.get("seconds", 0))
+        return StopEvent(result=ev.get("input"))
+
+
+def start_echo(runs: list):
+    def start(job: Job, resume: bool = False):
+        def run():
+            runs.append(resume)
+            return EchoWorkflow(timeout=5).run(input=f"resumed: {resume}", session_id=job.session_id, tokens=100)
+
+        return get_single_flight().join_or_start(job.session_id or "test-jobs", job.payload.get("idea", job.id), run)
+
+    return start
+
+
+async def wait_until_finished(runner: JobRunner, job_id: str) -> Job:
+    for _ in range(100):
+        job = runner.get(job_id)
+        if job.is_finished:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_interrupted_jobs_resume_on_start(tmp_path, monkeypatch):
+    runs = []
+    monkeypatch.setitem(jobs.JOB_KINDS, "echo", start_echo(runs))
+
+    async def run():
+        # A job left running by the last shutdown, after using 50 tokens
+        job = Job(id="interrupted", kind="echo", session_id="test-jobs-resume", status=JobStatus.RUNNING, attempts=1, tokens=50)
+        (tmp_path / job.id).mkdir()
+        (tmp_path / job.id / "job.json").write_text(job.model_dump_json())
+
+        runner = JobRunner(jobs_dir=str(tmp_path), max_workers=1)
+        await runner.start()
+        try:
+            job = await wait_until_finished(runner, "interrupted")
+        finally:
+            await runner.stop()
+        assert job.status == JobStatus.SUCCEEDED
+        assert job.resume and job.attempts == 2
+        assert job.result == "resumed: True"
+        assert runs == [True]
+        # The tokens of the attempts before the restart are kept
+        assert job.tokens == 150
+
+    asyncio.run(run())
+
+
+def test_jobs_interrupted_too_often_are_given_up(tmp_path, monkeypatch):
+    runs = []
+    monkeypatch.setitem(jobs.JOB_KINDS, "echo", start_echo(runs))
+
+    async def run():
+        job = Job(id="flaky", kind="echo", status=JobStatus.RUNNING, attempts=jobs.JOBS_MAX_ATTEMPTS)
+        (tmp_path / job.id).mkdir()
+        (tmp_path / job.id / "job.json").write_text(job.model_dump_json())
+
+        runner = JobRunner(jobs_dir=str(tmp_path), max_workers=1)
+        await runner.start()
+        try:
+            job = await wait_until_finished(runner, "flaky")
+        finally:
+            await runner.stop()
+        assert job.status == JobStatus.FAILED
+        assert runs == []
+
+    asyncio.run(run())
+
+
+def test_failed_jobs_can_be_resumed(tmp_path, monkeypatch):
+    runs = []
+    monkeypatch.setitem(jobs.JOB_KINDS, "echo", start_echo(runs))
+
+    async def run():
+        runner = JobRunner(jobs_dir=str(tmp_path), max_workers=1)
+        await runner.start()
+        try:
+            job = runner.submit("echo", {})
+            job = await wait_until_finished(runner, job.id)
+            assert job.status == JobStatus.SUCCEEDED and runs == [False]
+            # Only failed or cancelled jobs are resumed
+            assert runner.resume(job.id).status == JobStatus.SUCCEEDED
+
+            job.status = JobStatus.FAILED
+            runner._save(job)
+            assert runner.resume(job.id).status == JobStatus.QUEUED
+            job = await wait_until_finished(runner, job.id)
+        finally:
+            await runner.stop()
+        assert job.status == JobStatus.SUCCEEDED
+        assert runs == [False, True]
+        # Re-attaching replays the whole log of both runs
+        statuses = [entry["data"]["status"] async for _, entry in runner.attach(job) if entry["type"] == "status"]
+        assert statuses.count("succeeded") == 2
+
+    asyncio.run(run())
+
+
+def test_jobs_follow_the_run_of_their_idea_in_flight(tmp_path, monkeypatch):
+    runs = []
+    monkeypatch.setitem(jobs.JOB_KINDS, "echo", start_echo(runs))
+
+    async def run():
+        # The idea is already being researched, e.g. it was submitted from the chat
+        chat_run, _ = get_single_flight().join_or_start(
+            "test-jobs-attach", "idea", lambda: EchoWorkflow(timeout=5).run(input="from the chat", seconds=0.1)
+        )
+        chat_run.subscribe()
+        runner = JobRunner(jobs_dir=str(tmp_path), max_workers=1)
+        await runner.start()
+        try:
+            job = runner.submit("echo", {"idea": "idea"}, session_id="test-jobs-attach")
+            job = await wait_until_finished(runner, job.id)
+        finally:
+            await runner.stop()
+        assert job.status == JobStatus.SUCCEEDED
+        assert job.result == "from the chat"
+        assert runs == []
+        entries = [entry async for _, entry in runner.attach(job)]
+        assert {"status": "running", "attached_to": chat_run.run_id} in [entry["data"] for entry in entries]
+
+    asyncio.run(run())
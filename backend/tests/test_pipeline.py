@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse
+from pydantic import ValidationError
+
+from app.agents import pipeline
+from app.agents.pipeline import PipelineSpec, PipelineWorkflow, RunStageEvent, StageSpec
+from app.services.stage_durations import StageDurations
+from app.workflows.single import AgentRunResult
+
+
+def stage(name: str, *depends_on: str, seconds: float = 300) -> StageSpec:
+    return StageSpec(name=name, factory="module:factory", instruction=f"Do {name}", depends_on=list(depends_on), estimated_seconds=seconds)
+
+
+def spec(*stages: StageSpec, max_concurrency: int = 4) -> PipelineSpec:
+    return PipelineSpec(name="pipeline", stages=list(stages), max_concurrency=max_concurrency)
+
+
+def test_specs_with_unknown_duplicate_or_cyclic_dependencies_are_rejected():
+    with pytest.raises(ValidationError, match="duplicate stage names"):
+        spec(stage("market"), stage("market"))
+    with pytest.raises(ValidationError, match="unknown stages: trends"):
+        spec(stage("market", "trends"))
+    with pytest.raises(ValidationError, match="dependency cycle between: a, b"):
+        spec(stage("start"), stage("a", "start", "b"), stage("b", "a"))
+    assert spec(stage("market"), stage("summary", "market")).topological_order() == ["market", "summary"]
+
+
+def test_stages_are_ranked_by_their_longest_path_to_the_end():
+    pipeline_spec = spec(
+        stage("market", seconds=100),
+        stage("trends", seconds=50),
+        stage("competitors", "market", seconds=300),
+        stage("summary", "competitors", "trends", seconds=10),
+    )
+    ranks = pipeline_spec.critical_path_ranks(lambda stage: stage.estimated_seconds)
+    assert ranks == {"summary": 10, "competitors": 310, "trends": 60, "market": 410}
+
+
+class SendContext(SimpleNamespace):
+    def send_event(self, event):
+        self.sent.append(event.stage)
+
+    def write_event_to_stream(self, event):
+        pass
+
+
+def use_durations(monkeypatch, tmp_path) -> StageDurations:
+    durations = StageDurations(str(tmp_path / "durations.json"))
+    monkeypatch.setattr(pipeline, "get_stage_durations", lambda: durations)
+    return durations
+
+
+def test_ready_stages_on_the_critical_path_start_first(tmp_path, monkeypatch):
+    use_durations(monkeypatch, tmp_path)
+    workflow = PipelineWorkflow(
+        spec(
+            stage("trends", seconds=50),
+            stage("market", seconds=100),
+            stage("customers", seconds=200),
+            stage("summary", "market", "trends", "customers"),
+            max_concurrency=2,
+        ),
+        stage_workflows={},
+        session_id="session",
+    )
+    ctx = SendContext(sent=[], data={"outputs": {}, "running": []})
+    workflow.dispatch(ctx)
+    assert ctx.sent == ["customers", "market"]
+
+    # A finished stage makes room for the next one, the summary waits for all of them
+    ctx.data["running"].remove("customers")
+    ctx.data["outputs"]["customers"] = "done"
+    workflow.dispatch(ctx)
+    assert ctx.sent == ["customers", "market", "trends"]
+    assert workflow.critical_path() == ["customers", "summary"]
+
+
+def test_durations_of_resumed_stages_are_not_recorded(tmp_path, monkeypatch):
+    durations = use_durations(monkeypatch, tmp_path)
+    workflow = PipelineWorkflow(spec(stage("market")), stage_workflows={"market": None}, session_id="session")
+
+    async def run_sub_workflow(ctx, workflow, input, workflow_name="", timeout=None):
+        return AgentRunResult(response=ChatResponse(message=ChatMessage(content="report")), sources=[])
+
+    monkeypatch.setattr(workflow, "run_sub_workflow", run_sub_workflow)
+    run_stage = PipelineWorkflow.run_stage.__wrapped__
+    for resume in (True, False):
+        ctx = SendContext(sent=[], data={"idea": "An invoice tracker", "outputs": {}, "resume": resume})
+        completed = asyncio.run(run_stage(workflow, ctx, RunStageEvent(stage="market")))
+        assert completed.output == "report"
+
+    assert durations._durations["market"]["runs"] == 1
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import time
+
+import pytest
+from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
+
+from app.services import process_pool
+from app.services.budget import Budget, budget_scope, get_budget
+from app.services.process_pool import ProcessWorkflow, shutdown_process_pool
+from app.services.session_metrics import get_session_metrics
+
+
+class ProgressEvent(Event):
+    msg: str
+
+
+class SleepWorkflow(Workflow):
+    """Sleeps `seconds`, charges `tokens` to its budget and returns the process it ran in."""
+
+    @step()
+    async def sleep(self, ctx: Context, ev: StartEvent) -> StopEvent:
+        ctx.write_event_to_stream(ProgressEvent(msg="sleeping"))
+        await asyncio.sleep(ev.get("seconds", 0))
+        get_budget().charge(ev.get("tokens", 0))
+        if ev.get("fail"):
+            raise ValueError("no luck")
+        return StopEvent(result=os.getpid())
+
+
+def create_sleep_workflow(timeout: float = 10) -> Workflow:
+    return SleepWorkflow(timeout=timeout)
+
+
+@pytest.fixture
+def one_worker(monkeypatch):
+    # The worker reads the settings from the environment
+    monkeypatch.setenv("MODEL_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("SUB_WORKFLOW_PROCESSES", "1")
+    monkeypatch.setattr(process_pool, "SUB_WORKFLOW_PROCESSES", 1)
+    # Only the worker gets a share of the limits, the limits of the test process are left alone
+    monkeypatch.setattr(process_pool, "_split_limits", lambda: None)
+    yield
+    shutdown_process_pool()
+
+
+async def run_in_process(seconds: float = 0, **kwargs):
+    handler = ProcessWorkflow(create_sleep_workflow, timeout=30).run(seconds=seconds, **kwargs)
+    events = [event.msg async for event in handler.stream_events() if isinstance(event, ProgressEvent)]
+    return await handler, events
+
+
+def test_workers_run_several_sub_workflows_at_once(one_worker):
+    async def run():
+        # Starting the worker process takes a while
+        await run_in_process()
+        started_at = time.monotonic()
+        results = await asyncio.gather(*(run_in_process(seconds=1) for _ in range(4)))
+        assert time.monotonic() - started_at < 3
+        assert len({pid for pid, _ in results}) == 1
+        assert all(events == ["sleeping"] for _, events in results)
+
+    asyncio.run(run())
+
+
+def test_tokens_used_in_the_worker_are_charged_to_the_parent(one_worker):
+    async def run():
+        budget = Budget("run", session_id="test-process-pool-tokens", max_tokens=1000)
+        with budget_scope(budget):
+            await run_in_process(tokens=300)
+            with pytest.raises(ValueError, match="no luck"):
+                await run_in_process(tokens=200, fail=True)
+        assert budget.used_tokens == 500
+        assert get_session_metrics("test-process-pool-tokens").get("llm_tokens") == 500
+
+    asyncio.run(run())
@@ -0,0 +1,175 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse
+from llama_index.core.workflow import StartEvent
+
+from app.agents.ideator_inc_workflow import RESEARCH_STAGES, DraftOutlineSectionEvent, IdeatorIncWorkflow
+from app.services import research_artifacts
+from app.services.research_artifacts import ResearchArtifacts, fingerprint, get_session_searches, parse_refined_idea, render_idea, reuse_search
+from app.services.session_metrics import get_session_metrics
+from app.utils import paths
+from app.workflows.single import AgentRunResult
+
+IDEA = {
+    "problem_statement": "Freelancers lose track of invoices",
+    "product_idea": "An invoice tracker",
+    "target_users": "Freelancers",
+    "user_story": "As a freelancer I want reminders",
+    "how_it_works": "Connects to the bank",
+    "unique_value_proposition": "Automatic matching",
+}
+
+
+def test_parse_refined_idea():
+    assert parse_refined_idea(f"Research this idea: {render_idea(IDEA)}") is None
+    assert parse_refined_idea('Research this idea: {"product_idea": "An invoice tracker"}') == {"product_idea": "An invoice tracker"}
+
+
+def test_artifacts_are_reused_while_their_inputs_are_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setattr(research_artifacts, "RESEARCH_ARTIFACTS_DIR", str(tmp_path))
+    first_run = ResearchArtifacts("session")
+    first_run.put("Market Research", fingerprint("Market Research", "input"), "report", ["product_idea"])
+
+    second_run = ResearchArtifacts("session")
+    assert second_run.get("Market Research", fingerprint("Market Research", "input")) == "report"
+    assert second_run.get("Market Research", fingerprint("Market Research", "edited input")) is None
+    assert second_run.report() == {"reused": ["Market Research"], "recomputed": ["Market Research"]}
+
+
+def research_run(tmp_path, monkeypatch, outputs, failed=()):
+    """An ideator run whose research stages produced `outputs` and whose `failed` stages failed."""
+    monkeypatch.setattr(research_artifacts, "RESEARCH_ARTIFACTS_DIR", str(tmp_path))
+    workflow = IdeatorIncWorkflow(session_id="session")
+    ctx = SimpleNamespace(data={
+        "artifact_fingerprints": {stage: fingerprint(stage) for stage in RESEARCH_STAGES},
+        "post_production_idea": render_idea(IDEA),
+        "failed_workflows": [f"{stage} Analyst" for stage in failed],
+    })
+    for stage, (_, result_key) in RESEARCH_STAGES.items():
+        ctx.data[result_key] = outputs[stage]
+    workflow.set_post_production_fingerprint(ctx)
+    return workflow, ctx
+
+
+def test_post_production_depends_on_the_research_outputs(tmp_path, monkeypatch):
+    outputs = {stage: f"{stage} report" for stage in RESEARCH_STAGES}
+    workflow, ctx = research_run(tmp_path, monkeypatch, outputs)
+    workflow.save_artifact(ctx, "Executive Summary", "summary", workflow_name="Executive Summarizer")
+
+    workflow, ctx = research_run(tmp_path, monkeypatch, outputs)
+    assert workflow.reuse_artifact(ctx, "Executive Summary") == "summary"
+
+    # A stage recomputed with a different report invalidates the summary
+    workflow, ctx = research_run(tmp_path, monkeypatch, {**outputs, "Market Research": "new market report"})
+    assert workflow.reuse_artifact(ctx, "Executive Summary") is None
+
+
+def test_post_production_is_not_kept_when_a_stage_failed(tmp_path, monkeypatch):
+    outputs = {stage: f"{stage} report" for stage in RESEARCH_STAGES}
+    workflow, ctx = research_run(tmp_path, monkeypatch, outputs, failed=["Online Trends"])
+    workflow.save_artifact(ctx, "Executive Summary", "summary without trends", workflow_name="Executive Summarizer")
+    workflow.save_artifact(ctx, "Market Research", "market report", workflow_name="Market Research Analyst")
+    assert "Executive Summary" not in workflow.get_artifacts().artifacts
+    assert "Market Research" in workflow.get_artifacts().artifacts
+
+    # Once the stage is recomputed, the summary is redone
+    workflow, ctx = research_run(tmp_path, monkeypatch, outputs)
+    assert workflow.reuse_artifact(ctx, "Executive Summary") is None
+
+
+def test_post_production_fingerprint_is_unknown_until_the_research_is_in(tmp_path, monkeypatch):
+    monkeypatch.setattr(research_artifacts, "RESEARCH_ARTIFACTS_DIR", str(tmp_path))
+    workflow = IdeatorIncWorkflow(session_id="session")
+    ctx = SimpleNamespace(data={"artifact_fingerprints": {stage: fingerprint(stage) for stage in RESEARCH_STAGES}})
+    assert not workflow.is_artifact_current(ctx, "Executive Summary")
+    assert workflow.reuse_artifact(ctx, "Executive Summary") is None
+
+
+class StreamContext(SimpleNamespace):
+    def write_event_to_stream(self, event):
+        self.events.append(event)
+
+
+def test_a_failed_outline_draft_keeps_the_previous_one(tmp_path, monkeypatch):
+    monkeypatch.setattr(research_artifacts, "RESEARCH_ARTIFACTS_DIR", str(tmp_path))
+    monkeypatch.setattr(paths, "get_project_root", lambda: tmp_path)
+    workflow = IdeatorIncWorkflow(session_id="session")
+    ctx = StreamContext(events=[], data={"idea": "An invoice tracker", "draft_outline": "draft from Market Research", "outline_drafts_pending": 1})
+
+    async def run_sub_workflow(ctx, workflow, input, workflow_name="", **kwargs):
+        ctx.data.setdefault("failed_workflows", []).append(workflow_name)
+        return AgentRunResult(response=ChatResponse(message=ChatMessage(content=f"Error in {workflow_name}")), sources=[])
+
+    monkeypatch.setattr(workflow, "run_sub_workflow", run_sub_workflow)
+    draft = IdeatorIncWorkflow.draft_outline_section.__wrapped__
+    asyncio.run(draft(workflow, ctx, DraftOutlineSectionEvent(stage="Online Trends", input="trends"), outline_drafter=None))
+
+    assert ctx.data["draft_outline"] == "draft from Market Research"
+    assert ctx.data["outline_drafts_pending"] == 0
+    # The executive summary itself is not failed by its drafts
+    assert workflow.stage_status(ctx, "Executive Summarizer") == "completed"
+
+
+class SendContext(StreamContext):
+    def send_event(self, event):
+        self.sent.append(event)
+
+
+def test_stages_research_the_whole_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(research_artifacts, "RESEARCH_ARTIFACTS_DIR", str(tmp_path))
+    request = f"Research this idea and focus on Europe: {json.dumps(IDEA)}"
+    workflow = IdeatorIncWorkflow(session_id="session")
+
+    async def find_similar_research(ctx, idea):
+        return None
+
+    monkeypatch.setattr(workflow, "find_similar_research", find_similar_research)
+    ctx = SendContext(events=[], sent=[], data={})
+    asyncio.run(IdeatorIncWorkflow.start.__wrapped__(workflow, ctx, StartEvent(input=request)))
+
+    assert len(ctx.sent) == len(RESEARCH_STAGES)
+    assert all(event.input == request for event in ctx.sent)
+    # Each stage's output depends only on its fields of the idea
+    fingerprints = ctx.data["artifact_fingerprints"]
+    assert fingerprints["Market Research"] == fingerprint("Market Research", render_idea(IDEA, research_artifacts.STAGE_DEPENDENCIES["Market Research"]))
+
+
+def search_result(content: str) -> AgentRunResult:
+    return AgentRunResult(response=ChatResponse(message=ChatMessage(content=content)), sources=[])
+
+
+def test_searches_are_reused_by_the_next_runs_of_the_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(research_artifacts, "RESEARCH_ARTIFACTS_DIR", str(tmp_path))
+    searched = []
+
+    async def search(content):
+        searched.append(content)
+        return search_result(content)
+
+    async def search_all(contents):
+        return await asyncio.gather(*(search(content) for content in contents))
+
+    async def run():
+        session = "test-artifacts-searches"
+        first = await reuse_search(session, "Market Research", "Invoice  tools", lambda: search("market size"))
+        again = await reuse_search(session, "Market Research", "invoice tools", lambda: search("other market size"))
+        assert first.response.message.content == again.response.message.content == "market size"
+        # The same query of another stage is another search
+        await reuse_search(session, "Customer Insights", "invoice tools", lambda: search("pain points"))
+        web = await reuse_search(session, "Online Trends", "web: invoices", lambda: search_all(["general", "reddit"]))
+        assert [result.response.message.content for result in web] == ["general", "reddit"]
+        web = await reuse_search(session, "Online Trends", "web: invoices", lambda: search_all(["other"]))
+        assert [result.response.message.content for result in web] == ["general", "reddit"]
+
+    asyncio.run(run())
+    assert searched == ["market size", "pain points", "general", "reddit"]
+    metrics = get_session_metrics("test-artifacts-searches")
+    assert metrics.get("research_searches_reused") == 2 and metrics.get("research_searches_recomputed") == 3
+    assert [search["stage"] for search in get_session_searches("test-artifacts-searches")] == ["Market Research", "Customer Insights", "Online Trends"]
+
+    # Old searches are done again
+    monkeypatch.setattr(research_artifacts, "RESEARCH_REUSE_MAX_AGE_HOURS", 0)
+    again = asyncio.run(reuse_search("test-artifacts-searches", "Market Research", "invoice tools", lambda: search("new market size")))
+    assert again.response.message.content == "new market size"
@@ -0,0 +1,106 @@
+import asyncio
+
+from app.services.scheduler import Priority, Scheduler, scheduling
+
+
+async def hold(scheduler: Scheduler, session_id: str, order: list, kind: str = "llm", priority: Priority = Priority.BATCH, seconds: float = 0.01):
+    with scheduling(session_id, priority=priority):
+        async with scheduler.slot(kind):
+            order.append(session_id)
+            await asyncio.sleep(seconds)
+
+
+def test_sessions_share_the_slots_fairly():
+    async def run():
+        scheduler = Scheduler(max_concurrency=1)
+        order = []
+        # A busy session queues many calls before a second session queues a few
+        blocker = asyncio.create_task(hold(scheduler, "blocker", order, seconds=0.05))
+        await asyncio.sleep(0)
+        busy = [asyncio.create_task(hold(scheduler, "busy", order)) for _ in range(6)]
+        await asyncio.sleep(0)
+        light = [asyncio.create_task(hold(scheduler, "light", order)) for _ in range(2)]
+        await asyncio.gather(blocker, *busy, *light)
+        # The light session doesn't wait for all of the busy session's calls
+        served = order[1:]
+        assert served.index("light") <= 1
+        assert served[: 4].count("light") == 2
+
+    asyncio.run(run())
+
+
+def test_interactive_calls_go_first():
+    async def run():
+        scheduler = Scheduler(max_concurrency=1)
+        order = []
+        blocker = asyncio.create_task(hold(scheduler, "blocker", order, seconds=0.05))
+        await asyncio.sleep(0)
+        batch = [asyncio.create_task(hold(scheduler, "batch", order)) for _ in range(3)]
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(hold(scheduler, "interactive", order, priority=Priority.INTERACTIVE))
+        await asyncio.gather(blocker, *batch, interactive)
+        assert order[1] == "interactive"
+
+    asyncio.run(run())
+
+
+def test_concurrency_is_bounded():
+    async def run():
+        scheduler = Scheduler(max_concurrency=2)
+        running = 0
+        peak = 0
+
+        async def call(session_id: str):
+            nonlocal running, peak
+            with scheduling(session_id):
+                async with scheduler.slot():
+                    running += 1
+                    peak = max(peak, running)
+                    await asyncio.sleep(0.01)
+                    running -= 1
+
+        await asyncio.gather(*(call(f"session-{i % 3}") for i in range(10)))
+        assert peak == 2
+        assert scheduler.snapshot()["llm"]["running"] == 0
+
+    asyncio.run(run())
+
+
+def test_slow_tools_dont_hold_up_llm_calls():
+    async def run():
+        scheduler = Scheduler(max_concurrency=1, max_tool_concurrency=1)
+        order = []
+        read = asyncio.create_task(hold(scheduler, "reader", order, kind="tool", seconds=1.0))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(hold(scheduler, "llm", order, kind="llm"), timeout=0.5)
+        assert scheduler.snapshot()["tool"]["running"] == 1
+        read.cancel()
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiters_leave_the_queue():
+    async def run():
+        scheduler = Scheduler(max_concurrency=1)
+        order = []
+        blocker = asyncio.create_task(hold(scheduler, "blocker", order, seconds=0.05))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(scheduler, "cancelled", order))
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth() == 1
+        waiter.cancel()
+        await asyncio.gather(blocker, waiter, return_exceptions=True)
+        assert scheduler.queue_depth() == 0
+        await hold(scheduler, "next", order)
+        assert order == ["blocker", "next"]
+
+    asyncio.run(run())
+
+
+def test_limits_are_shared_between_processes(monkeypatch):
+    from app.services import scheduler as scheduler_module
+
+    monkeypatch.setattr(scheduler_module, "_scheduler", Scheduler(max_concurrency=16, max_tool_concurrency=16))
+    scheduler_module.share_scheduler_limits(1 / 4)
+    assert scheduler_module.get_scheduler().llm.max_concurrency == 4
+    assert scheduler_module.get_scheduler().tools.max_concurrency == 4
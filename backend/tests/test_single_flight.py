@@ -0,0 +1,131 @@
+import asyncio
+
+from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
+
+from app.services.cancellation import cancel_scope, track_workflow
+from app.services.session_metrics import get_session_metrics
+from app.services.single_flight import SingleFlight, run_id_for
+from app.utils import paths
+from app.utils.paths import adopt_published_file, get_session_data_path, publish_run_data, run_data_scope
+from app.workflows import stage_results
+from app.workflows.stage_results import file_url
+
+
+class ProgressEvent(Event):
+    msg: str
+
+
+class ResearchWorkflow(Workflow):
+    """Streams `steps` progress events, `seconds` apart, and writes its report to the session data."""
+
+    @step()
+    async def research(self, ctx: Context, ev: StartEvent) -> StopEvent:
+        for i in range(ev.get("steps", 3)):
+            ctx.write_event_to_stream(ProgressEvent(msg=f"step {i}"))
+            await asyncio.sleep(ev.get("seconds", 0.01))
+        report = get_session_data_path(ev.get("session_id")) / "report.txt"
+        report.parent.mkdir(parents=True, exist_ok=True)
+        report.write_text(ev.get("input"))
+        return StopEvent(result="done")
+
+
+def start_research(session_id: str, idea: str, started: list, **kwargs):
+    def start():
+        started.append(idea)
+        return track_workflow("research", ResearchWorkflow(timeout=10).run(input=idea, session_id=session_id, **kwargs))
+
+    return start
+
+
+async def collect(events) -> list:
+    return [event.msg async for event in events if isinstance(event, ProgressEvent)]
+
+
+def test_duplicate_submissions_attach_to_the_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "get_project_root", lambda: tmp_path)
+    session_id = "test-single-flight-attach"
+
+    async def run():
+        single_flight = SingleFlight()
+        started = []
+        with cancel_scope(session_id):
+            first, first_started = single_flight.join_or_start(session_id, "An invoice tracker", start_research(session_id, "An invoice tracker", started))
+        first_events = asyncio.create_task(collect(first.subscribe()))
+        await asyncio.sleep(0.015)
+        # The same idea, written differently, while the run is in flight
+        second, second_started = single_flight.join_or_start(session_id, "an  INVOICE tracker", start_research(session_id, "an  INVOICE tracker", started))
+        assert first_started and not second_started
+        assert second is first
+        assert await collect(second.subscribe()) == ["step 0", "step 1", "step 2"]
+        assert await first_events == ["step 0", "step 1", "step 2"]
+        assert await first.handler == "done"
+        assert started == ["An invoice tracker"]
+        assert get_session_metrics(session_id).get("duplicate_submissions") == 1
+        # Once the run is over, the idea starts a new run
+        _, started_again = single_flight.join_or_start(session_id, "An invoice tracker", start_research(session_id, "An invoice tracker", started))
+        assert started_again
+
+    asyncio.run(run())
+
+
+def test_the_last_client_leaving_cancels_the_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "get_project_root", lambda: tmp_path)
+    session_id = "test-single-flight-cancel"
+
+    async def run():
+        single_flight = SingleFlight()
+        with cancel_scope(session_id) as scope:
+            run, _ = single_flight.join_or_start(session_id, "idea", start_research(session_id, "idea", [], steps=100, seconds=0.1))
+        run.subscribe()
+        run.subscribe()
+        await asyncio.sleep(0.05)
+        await run.unsubscribe()
+        assert not scope.cancelled
+        await run.unsubscribe()
+        assert scope.cancelled
+        assert scope.report.reason == "all the clients disconnected"
+        assert single_flight.get(session_id, "idea") is None
+
+    asyncio.run(run())
+
+
+def test_runs_publish_their_files_when_done(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "get_project_root", lambda: tmp_path)
+    session_id = "test-single-flight-publish"
+
+    async def run():
+        single_flight = SingleFlight()
+        run, _ = single_flight.join_or_start(session_id, "idea", start_research(session_id, "idea", []))
+        await run.handler
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert (tmp_path / "data" / session_id / "report.txt").read_text() == "idea"
+    assert not (tmp_path / "data" / paths.RUNS_DIR / session_id / run_id_for(session_id, "idea")).exists()
+
+
+def test_reused_files_are_read_from_the_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "get_project_root", lambda: tmp_path)
+    published = tmp_path / "data" / "session" / "report.txt"
+    published.parent.mkdir(parents=True)
+    published.write_text("last run's report")
+
+    with run_data_scope("run"):
+        assert adopt_published_file("session", "report.txt")
+        assert (get_session_data_path("session") / "report.txt").read_text() == "last run's report"
+        assert not adopt_published_file("session", "missing.txt")
+
+
+def test_links_to_run_files_outlive_the_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "get_project_root", lambda: tmp_path)
+    monkeypatch.setattr(stage_results, "get_project_root", lambda: tmp_path)
+    monkeypatch.setenv("FILESERVER_URL_PREFIX", "http://localhost:8000/api/files")
+    with run_data_scope("run"):
+        report = get_session_data_path("session") / "report.md"
+    report.parent.mkdir(parents=True)
+    report.write_text("report")
+
+    url = file_url(report)
+    assert url == "http://localhost:8000/api/files/data/session/report.md"
+    publish_run_data("session", "run")
+    assert (tmp_path / url.removeprefix("http://localhost:8000/api/files/")).read_text() == "report"
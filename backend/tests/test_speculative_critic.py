@@ -0,0 +1,45 @@
+import pytest
+
+from app.services import speculative_critic
+from app.services.speculative_critic import record_skipped_critic_round, score_draft
+from app.services.session_metrics import get_session_metrics
+
+SECTIONS = ["Market Size", "Pricing Strategy"]
+
+DRAFT = """
+# Market size
+The invoicing market was worth $5B in 2024 (source: https://example.com/market)
+Freelancers sent 20% more invoices last year than before
+Q3 2024
+"""
+
+
+def test_drafts_are_scored_on_their_sections_and_citations():
+    draft_score = score_draft(DRAFT, SECTIONS)
+    assert draft_score.missing_sections == ["Pricing Strategy"]
+    # One of the two claims with numbers cites its source, the short line isn't a claim
+    assert draft_score.citation_coverage == 0.5
+    assert draft_score.score == pytest.approx(0.6 * 0.5 + 0.4 * 0.5)
+    assert "Pricing Strategy" in draft_score.feedback() and "50%" in draft_score.feedback()
+
+    # Reports that don't need citations are scored on their sections only
+    assert score_draft(DRAFT, SECTIONS, cited=False).score == 0.5
+    # Words of a section may be spread over the draft, half of them is enough
+    assert score_draft("Our pricing is simple", ["Pricing Strategy"]).missing_sections == []
+    assert score_draft("No numbers here", []).score == 1.0
+
+
+def test_only_drafts_over_the_threshold_skip_the_critic(monkeypatch):
+    complete = DRAFT + "## Pricing strategy\nSubscriptions of $10 a month are the norm (source: https://example.com/pricing)\n"
+    complete = complete.replace("before", "before [1]")
+    draft_score = score_draft(complete, SECTIONS)
+    assert draft_score.score == 1.0 and draft_score.feedback() == ""
+
+    monkeypatch.setattr(speculative_critic, "SPECULATIVE_CRITIC_THRESHOLD", 0.85)
+    assert draft_score.passes
+    assert not score_draft(DRAFT, SECTIONS).passes
+    monkeypatch.setattr(speculative_critic, "SPECULATIVE_CRITIC_THRESHOLD", 0.5)
+    assert score_draft(DRAFT, SECTIONS).passes
+
+    record_skipped_critic_round("test-speculative-critic")
+    assert get_session_metrics("test-speculative-critic").get("critic_rounds_skipped") == 1
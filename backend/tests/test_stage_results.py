@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+from app.agents.ideator_inc_workflow import RESEARCH_STAGES, STAGE_REPORT_FILES, IdeatorIncWorkflow
+from app.api.routers.vercel_response import VercelStreamResponse
+from app.utils import paths
+from app.utils.paths import RUNS_DIR, get_session_data_path, run_data_scope
+from app.workflows import stage_results
+from app.workflows.fan_in import FanIn
+from app.workflows.stage_results import file_url, stage_result
+
+
+class Report(BaseModel):
+    summary: str
+
+
+def use_project_root(monkeypatch, tmp_path):
+    monkeypatch.setattr(paths, "get_project_root", lambda: tmp_path)
+    monkeypatch.setattr(stage_results, "get_project_root", lambda: tmp_path)
+    monkeypatch.setenv("FILESERVER_URL_PREFIX", "http://files")
+
+
+def test_files_get_the_url_they_are_served_at(tmp_path, monkeypatch):
+    use_project_root(monkeypatch, tmp_path)
+
+    assert file_url(tmp_path / "data" / "session" / "report.md") == "http://files/data/session/report.md"
+    assert file_url(tmp_path / "output" / "podcast" / "episode.mp3") == "http://files/output/podcast/episode.mp3"
+    assert file_url(tmp_path / "secrets" / "key.txt") is None
+    # The files of a run in flight are linked where they will be once the run is published
+    with run_data_scope("run"):
+        assert get_session_data_path("session") == (tmp_path / "data" / RUNS_DIR / "session" / "run").resolve()
+        assert file_url(get_session_data_path("session") / "report.md") == "http://files/data/session/report.md"
+
+
+def test_stage_results_carry_their_output_and_existing_files(tmp_path, monkeypatch):
+    use_project_root(monkeypatch, tmp_path)
+    report_file = tmp_path / "data" / "session" / "report.md"
+    report_file.parent.mkdir(parents=True)
+    report_file.write_text("# Report")
+
+    event = stage_result(
+        "Market Research",
+        "the report",
+        workflow_name="Market Research Analyst",
+        output=Report(summary="big market"),
+        files=[report_file, tmp_path / "data" / "session" / "missing.md", tmp_path / "elsewhere.md"],
+    )
+    response = VercelStreamResponse._event_to_response(event)
+
+    assert response["type"] == "stage_result"
+    assert response["data"] == {
+        "stage": "Market Research",
+        "workflowName": "Market Research Analyst",
+        "status": "completed",
+        "text": "the report",
+        "outputType": "Report",
+        "output": {"summary": "big market"},
+        "artifacts": [{"name": "report.md", "url": "http://files/data/session/report.md"}],
+    }
+    failed = stage_result("Online Trends", "Error", status="failed").to_response()["data"]
+    assert failed["status"] == "failed" and failed["output"] is None and failed["artifacts"] == []
+
+
+def test_the_final_response_repeats_the_stage_reports(tmp_path, monkeypatch):
+    use_project_root(monkeypatch, tmp_path)
+    data_dir = tmp_path / "data" / "test-stage-results"
+    data_dir.mkdir(parents=True)
+    (data_dir / STAGE_REPORT_FILES["Market Research"]).write_text("# Market")
+    workflow = IdeatorIncWorkflow(session_id="test-stage-results")
+    ctx = SimpleNamespace(write_event_to_stream=lambda event: None, data={
+        "fan_ins": {name: FanIn(name=name, branches=[]) for name in ("research stages", "post production results")},
+        **{result_key: f"{stage} report" for stage, (_, result_key) in RESEARCH_STAGES.items()},
+    })
+
+    combine = IdeatorIncWorkflow.combine_post_production_results.__wrapped__
+    response = asyncio.run(combine(workflow, ctx, None)).result
+
+    # Clients that don't render the stage results still get the reports
+    assert all(f"{stage} report" in response for stage in RESEARCH_STAGES)
+    assert f"http://files/data/test-stage-results/{STAGE_REPORT_FILES['Market Research']}" in response
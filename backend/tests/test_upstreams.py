@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.services.upstreams import Upstream, UpstreamUnavailableError, is_upstream_failure
+
+
+def status_error(status_code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://upstream.test")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status_code, request=request))
+
+
+def call(upstream: Upstream, error: Exception | None = None, max_wait: float = 0.0):
+    with upstream.guard(max_wait=max_wait):
+        if error is not None:
+            raise error
+
+
+def test_burst_then_rejected_without_wait():
+    upstream = Upstream("test", "Test", rate_per_minute=60, max_concurrency=10, burst=2)
+    call(upstream)
+    call(upstream)
+    with pytest.raises(UpstreamUnavailableError, match="rate limit"):
+        call(upstream)
+
+
+def test_guard_waits_for_a_token():
+    # One token per 0.1s
+    upstream = Upstream("test", "Test", rate_per_minute=600, max_concurrency=10, burst=1)
+    call(upstream)
+    started = time.monotonic()
+    call(upstream, max_wait=2.0)
+    assert time.monotonic() - started < 1.0
+
+
+def test_concurrency_cap():
+    upstream = Upstream("test", "Test", rate_per_minute=600, max_concurrency=1, burst=10)
+    with upstream.guard(max_wait=0):
+        with pytest.raises(UpstreamUnavailableError, match="concurrent"):
+            call(upstream)
+    call(upstream)
+
+
+def test_circuit_opens_after_provider_failures():
+    upstream = Upstream("test", "Test", rate_per_minute=6000, max_concurrency=10, burst=100, failure_threshold=3)
+    for _ in range(3):
+        with pytest.raises(UpstreamUnavailableError, match="the call failed"):
+            call(upstream, status_error(503))
+    assert upstream.health()["state"] == Upstream.OPEN
+    with pytest.raises(UpstreamUnavailableError, match="too many recent failures"):
+        call(upstream, max_wait=5.0)
+
+
+def test_client_errors_dont_open_the_circuit():
+    upstream = Upstream("test", "Test", rate_per_minute=6000, max_concurrency=10, burst=100, failure_threshold=2)
+    for _ in range(5):
+        with pytest.raises(httpx.HTTPStatusError):
+            call(upstream, status_error(400))
+        with pytest.raises(ValueError):
+            call(upstream, ValueError("bad query"))
+    health = upstream.health()
+    assert health["state"] == Upstream.CLOSED
+    assert health["failures"] == 0
+    assert health["in_flight"] == 0
+
+
+def test_half_open_probe_closes_the_circuit():
+    upstream = Upstream("test", "Test", rate_per_minute=6000, max_concurrency=10, burst=100, failure_threshold=1, reset_timeout=0.1)
+    with pytest.raises(UpstreamUnavailableError):
+        call(upstream, httpx.ConnectError("refused"))
+    time.sleep(0.15)
+    call(upstream)
+    assert upstream.health()["state"] == Upstream.CLOSED
+
+
+def test_failed_probe_opens_the_circuit_again():
+    upstream = Upstream("test", "Test", rate_per_minute=6000, max_concurrency=10, burst=100, failure_threshold=1, reset_timeout=0.1)
+    with pytest.raises(UpstreamUnavailableError):
+        call(upstream, TimeoutError())
+    time.sleep(0.15)
+    with pytest.raises(UpstreamUnavailableError):
+        call(upstream, TimeoutError())
+    assert upstream.health()["state"] == Upstream.OPEN
+
+
+def test_cancellation_is_not_a_failure():
+    upstream = Upstream("test", "Test", rate_per_minute=6000, max_concurrency=10, burst=100, failure_threshold=1)
+
+    async def cancelled_call():
+        async with upstream.aguard(max_wait=0):
+            raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancelled_call())
+    health = upstream.health()
+    assert health["state"] == Upstream.CLOSED
+    assert health["in_flight"] == 0
+
+
+def test_is_upstream_failure():
+    assert is_upstream_failure(status_error(502))
+    assert is_upstream_failure(httpx.ReadTimeout("timeout"))
+    assert is_upstream_failure(ConnectionError())
+    assert not is_upstream_failure(status_error(404))
+    assert not is_upstream_failure(ValueError("bad query"))
+
+
+def test_limits_are_shared_between_processes():
+    upstream = Upstream("test", "Test", rate_per_minute=60, max_concurrency=8, burst=4)
+    upstream.limit_to_share(1 / 2)
+    assert (upstream.rate_per_minute, upstream.max_concurrency, upstream.burst) == (30, 4, 2)
+    # Shares are of the configured limits, not of the current ones
+    upstream.limit_to_share(1 / 2)
+    assert upstream.max_concurrency == 4
@@ -0,0 +1,11 @@
+from app.utils.urls import canonicalize_url
+
+
+def test_tracking_params_and_aliases_are_dropped():
+    assert canonicalize_url("http://old.reddit.com/r/SaaS/comments/abc/?utm_source=share&fbclid=1#top") == "https://reddit.com/r/SaaS/comments/abc"
+    assert canonicalize_url("https://youtu.be/xyz") == "https://youtube.com/watch?v=xyz"
+
+
+def test_params_that_change_the_content_are_kept():
+    assert canonicalize_url("https://github.com/org/repo/blob/main/README.md?ref=v2") != canonicalize_url("https://github.com/org/repo/blob/main/README.md")
+    assert "context=3" in canonicalize_url("https://www.reddit.com/r/SaaS/comments/abc/comment/def/?context=3")
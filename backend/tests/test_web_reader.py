@@ -0,0 +1,145 @@
+import asyncio
+
+from app.engine.tools import web_reader
+from app.services import research_artifacts
+from app.services.cancellation import cancel_scope, cancellable
+from app.services.fetch_registry import get_fetch_registry
+from app.services.scheduler import scheduling
+from app.services.session_metrics import get_session_metrics
+
+
+class Crawler:
+    """Stands in for the crawler, reads take `seconds` and everything that happens is logged."""
+
+    def __init__(self, log: list, seconds: float = 10):
+        self.log = log
+        self.seconds = seconds
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.log.append("closed")
+
+    async def read(self, crawler, url, instruction, provider, schema, api_key):
+        self.log.append(f"read {url}")
+        try:
+            await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.log.append(f"cancelled {url}")
+            raise
+        return web_reader.WebReaderResult(content=f"content of {url}", url=url, is_error=False)
+
+
+def use_crawler(monkeypatch, tmp_path, crawler: Crawler):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(research_artifacts, "RESEARCH_ARTIFACTS_DIR", str(tmp_path))
+    monkeypatch.setattr(web_reader, "_crawler", lambda: crawler)
+    monkeypatch.setattr(web_reader, "_read_with_crawler", crawler.read)
+
+
+def test_batch_reads_dedup_pages_of_the_session(tmp_path, monkeypatch):
+    log = []
+    use_crawler(monkeypatch, tmp_path, Crawler(log, seconds=0.01))
+
+    async def run():
+        urls = ["https://example.com/a", "https://example.com/a?utm_source=x", "https://example.com/b"]
+        result = await web_reader.read_webpages(urls, session_id="test-web-reader-dedup")
+        assert [page.content for page in result.results] == [
+            "content of https://example.com/a",
+            "content of https://example.com/a",
+            "content of https://example.com/b",
+        ]
+        # The same page under another url is read once, and is not read again by the next call
+        again = await web_reader.read_webpage("https://example.com/a", session_id="test-web-reader-dedup")
+        assert again.content == "content of https://example.com/a"
+        assert log.count("read https://example.com/a") == 1
+
+    asyncio.run(run())
+
+
+def test_cancelling_the_run_stops_the_reads_before_the_crawler_closes(tmp_path, monkeypatch):
+    log = []
+    use_crawler(monkeypatch, tmp_path, Crawler(log))
+    urls = ["https://example.com/a", "https://example.org/b"]
+
+    async def run():
+        async def tool_call():
+            with cancellable("tool", "read_webpages"):
+                await web_reader.read_webpages(urls, session_id="test-web-reader-cancel")
+
+        with cancel_scope("test-web-reader-cancel") as scope:
+            call = asyncio.create_task(tool_call())
+        await asyncio.sleep(0.05)
+        report = await scope.cancel("the client went away", timeout=1)
+
+        assert call.cancelled()
+        assert [item.name for item in report.cancelled] == ["read_webpages"]
+        assert not report.timed_out
+        assert log.index("closed") == len(log) - 1
+        assert {f"cancelled {url}" for url in urls} <= set(log)
+        # Nothing half read is left in the session registry
+        assert not get_fetch_registry("test-web-reader-cancel")._fetches
+
+    asyncio.run(run())
+
+
+def test_pages_read_by_earlier_runs_of_the_session_are_reused(tmp_path, monkeypatch):
+    log = []
+    use_crawler(monkeypatch, tmp_path, Crawler(log, seconds=0.01))
+
+    async def run():
+        await web_reader.read_webpages(["https://example.com/a"], session_id="test-web-reader-saved")
+        # A restart forgets the pages of the registry
+        get_fetch_registry("test-web-reader-saved")._fetches.clear()
+        again = await web_reader.read_webpage("https://example.com/a?utm_source=x", session_id="test-web-reader-saved")
+        assert again.content == "content of https://example.com/a"
+        assert again.url == "https://example.com/a?utm_source=x"
+
+    asyncio.run(run())
+    assert log.count("read https://example.com/a") == 1
+    assert get_session_metrics("test-web-reader-saved").get("research_pages_reused") == 1
+    assert research_artifacts.count_session_pages("test-web-reader-saved") == 1
+
+
+def test_reads_are_limited_per_domain_in_every_event_loop(monkeypatch):
+    monkeypatch.setattr(web_reader, "MAX_READS_PER_DOMAIN", 2)
+    reading = {"now": 0, "most": 0}
+
+    async def read(crawler, url, instruction, provider, schema, api_key):
+        reading["now"] += 1
+        reading["most"] = max(reading["most"], reading["now"])
+        await asyncio.sleep(0.01)
+        reading["now"] -= 1
+        return web_reader.WebReaderResult(content=url, url=url, is_error=False)
+
+    monkeypatch.setattr(web_reader, "_read_with_crawler", read)
+
+    async def run():
+        urls = [f"https://example.com/{page}" for page in range(5)]
+        await asyncio.gather(*(web_reader._pooled_read(None, url, "", "", None, "") for url in urls))
+        # The domain is forgotten once it isn't read anymore
+        assert not web_reader._get_read_pools().domains
+
+    # Each run has its own loop, the limits of the first one don't leak into the second
+    asyncio.run(run())
+    asyncio.run(run())
+    assert reading["most"] == 2
+
+
+def test_configured_tools_read_for_the_calling_session(monkeypatch):
+    calls = []
+
+    async def read_webpages(urls, provider, openai_api_key, session_id):
+        calls.append(session_id)
+
+    monkeypatch.setattr(web_reader, "read_webpages", read_webpages)
+    read_pages = web_reader.get_tools()[1]
+
+    async def run():
+        with scheduling("session-a"):
+            await read_pages.acall(urls=["https://example.com"])
+        await read_pages.acall(urls=["https://example.com"])
+
+    asyncio.run(run())
+    assert calls == ["session-a", None]
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from app.services import work_queue
+from app.services.budget import Budget, budget_scope, get_budget
+from app.services.work_queue import LocalWorkQueue, WorkTask, execute_task, run_on_worker, run_task, work
+
+
+async def double(value: int, seconds: float = 0) -> int:
+    await asyncio.sleep(seconds)
+    return value * 2
+
+
+async def fail(tokens: int = 0):
+    get_budget().charge(tokens)
+    raise ValueError("no luck")
+
+
+async def spend(tokens: int) -> int:
+    get_budget().charge(tokens)
+    return tokens
+
+
+def use_queue(monkeypatch) -> LocalWorkQueue:
+    queue = LocalWorkQueue()
+    monkeypatch.setattr(work_queue, "_queue", queue)
+    return queue
+
+
+def test_tasks_run_on_the_workers(monkeypatch):
+    queue = use_queue(monkeypatch)
+
+    async def run():
+        worker = asyncio.create_task(work(queue, concurrency=2))
+        try:
+            assert await asyncio.gather(run_on_worker(double, value=2), run_on_worker(double, value=3)) == [4, 6]
+            with pytest.raises(RuntimeError, match="no luck"):
+                await run_on_worker(fail)
+        finally:
+            worker.cancel()
+        # The messages of the finished tasks are dropped
+        assert not queue._messages
+
+    asyncio.run(run())
+
+
+def test_cancelled_tasks_stop_on_the_worker_and_are_forgotten(monkeypatch):
+    queue = use_queue(monkeypatch)
+
+    async def run():
+        worker = asyncio.create_task(work(queue))
+        call = asyncio.create_task(run_on_worker(double, value=2, seconds=10))
+        await asyncio.sleep(0.1)
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        # The worker sees the cancellation on its next check
+        await asyncio.sleep(1.2)
+        worker.cancel()
+        assert not queue._messages and not queue._cancelled
+
+        # Tasks cancelled before a worker took them aren't run
+        task = WorkTask(kind="function", target=f"{__name__}:double", kwargs={"value": 2})
+        await queue.cancel(task.id)
+        await execute_task(queue, task)
+        assert not queue._messages and not queue._cancelled
+
+    asyncio.run(run())
+
+
+def test_tasks_of_a_dead_worker_fail(monkeypatch):
+    queue = use_queue(monkeypatch)
+    monkeypatch.setattr(work_queue, "WORK_QUEUE_LEASE_SECONDS", 0.2)
+
+    async def run():
+        task = WorkTask(kind="function", target=f"{__name__}:double", kwargs={"value": 2})
+        waiting = asyncio.create_task(run_task(task))
+        # A worker takes the task and dies before it is done
+        assert (await queue.get_task(timeout=1)).id == task.id
+        await queue.publish(task.id, {"type": "started"})
+        with pytest.raises(RuntimeError, match="sent nothing"):
+            await asyncio.wait_for(waiting, timeout=2)
+        assert await queue.is_cancelled(task.id)
+
+    asyncio.run(run())
+
+
+def test_heartbeats_keep_long_tasks_alive(monkeypatch):
+    use_queue(monkeypatch)
+    monkeypatch.setattr(work_queue, "WORK_QUEUE_LEASE_SECONDS", 1.5)
+    monkeypatch.setattr(work_queue, "WORK_QUEUE_HEARTBEAT_SECONDS", 0.5)
+
+    async def run():
+        worker = asyncio.create_task(work(work_queue._queue))
+        try:
+            assert await run_on_worker(double, value=2, seconds=2.5) == 4
+        finally:
+            worker.cancel()
+
+    asyncio.run(run())
+
+
+def test_tokens_used_on_the_workers_are_charged_to_the_caller(monkeypatch):
+    queue = use_queue(monkeypatch)
+
+    async def run():
+        worker = asyncio.create_task(work(queue))
+        budget = Budget("run", session_id="test-work-queue-tokens", max_tokens=1000)
+        try:
+            with budget_scope(budget):
+                assert await run_on_worker(spend, tokens=300) == 300
+                with pytest.raises(RuntimeError, match="no luck"):
+                    await run_on_worker(fail, tokens=200)
+        finally:
+            worker.cancel()
+        assert budget.used_tokens == 500
+
+    asyncio.run(run())
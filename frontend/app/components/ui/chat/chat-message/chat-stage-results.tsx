@@ -0,0 +1,82 @@
+import { ChevronDown, ChevronRight, FileText } from "lucide-react";
+import { useState } from "react";
+import { Button } from "../../button";
+import {
+  Collapsible,
+  CollapsibleContent,
+  CollapsibleTrigger,
+} from "../../collapsible";
+import { StageResultData } from "../index";
+import Markdown from "./markdown";
+
+const STATUS_LABELS: Record<StageResultData["status"], string> = {
+  completed: "Done",
+  failed: "Failed",
+  reused: "Reused from the last run",
+};
+
+export function ChatStageResults({ data }: { data: StageResultData[] }) {
+  // A stage rerun after a failure replaces its earlier result
+  const latest = new Map<string, StageResultData>();
+  data.forEach((result) => latest.set(result.stage, result));
+  return (
+    <div className="space-y-2">
+      {Array.from(latest.values()).map((result) => (
+        <StageResult key={result.stage} result={result} />
+      ))}
+    </div>
+  );
+}
+
+function StageResult({ result }: { result: StageResultData }) {
+  const [isOpen, setIsOpen] = useState(false);
+
+  const StageIcon = isOpen ? (
+    <ChevronDown className="h-4 w-4" />
+  ) : (
+    <ChevronRight className="h-4 w-4" />
+  );
+
+  return (
+    <div
+      className={
+        result.status === "failed"
+          ? "border-l-2 border-red-400 pl-2"
+          : "border-l-2 border-green-400 pl-2"
+      }
+    >
+      <Collapsible open={isOpen} onOpenChange={setIsOpen}>
+        <CollapsibleTrigger asChild>
+          <Button variant="secondary" className="space-x-2">
+            <span>{result.stage}</span>
+            <span className="text-xs text-gray-500">
+              {STATUS_LABELS[result.status]}
+            </span>
+            {StageIcon}
+          </Button>
+        </CollapsibleTrigger>
+        <CollapsibleContent asChild>
+          <div className="mt-4 text-sm space-y-2">
+            {result.artifacts.length > 0 ? (
+              <div className="flex flex-wrap gap-2">
+                {result.artifacts.map((artifact) => (
+                  <a
+                    key={artifact.url}
+                    href={artifact.url}
+                    target="_blank"
+                    rel="noreferrer"
+                    className="flex items-center gap-1 text-blue-600 hover:underline"
+                  >
+                    <FileText className="h-4 w-4" />
+                    {artifact.name}
+                  </a>
+                ))}
+              </div>
+            ) : null}
+            <Markdown content={result.text} />
+          </div>
+        </CollapsibleContent>
+      </Collapsible>
+    </div>
+  );
+}
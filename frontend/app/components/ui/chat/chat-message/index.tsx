@@ -12,6 +12,7 @@ import {
   ImageData,
   MessageAnnotation,
   MessageAnnotationType,
+  StageResultData,
   SuggestedQuestionsData,
   ToolData,
   getAnnotationData,
@@ -23,6 +24,7 @@ import { ChatEvents } from "./chat-events";
 import { ChatFiles } from "./chat-files";
 import { ChatImage } from "./chat-image";
 import { ChatSources } from "./chat-sources";
+import { ChatStageResults } from "./chat-stage-results";
 import { SuggestedQuestions } from "./chat-suggestedQuestions";
 import ChatTools from "./chat-tools";
 import Markdown from "./markdown";
@@ -68,6 +70,10 @@ function ChatMessageContent({
     annotations,
     MessageAnnotationType.AGENT_EVENTS,
   );
+  const stageResultData = getAnnotationData<StageResultData>(
+    annotations,
+    MessageAnnotationType.STAGE_RESULT,
+  );
 
   const sourceData = getSourceAnnotationData(annotations);
 
@@ -114,6 +120,13 @@ function ChatMessageContent({
         <ChatTools data={toolData[0]} artifactVersion={artifactVersion} />
       ) : null,
     },
+    {
+      order: -0.5,
+      component:
+        stageResultData.length > 0 ? (
+          <ChatStageResults data={stageResultData} />
+        ) : null,
+    },
     {
       order: 0,
       component: <Markdown content={message.content} sources={sourceData[0]} />,
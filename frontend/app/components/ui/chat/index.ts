@@ -14,6 +14,7 @@ export enum MessageAnnotationType {
   TOOLS = "tools",
   SUGGESTED_QUESTIONS = "suggested_questions",
   AGENT_EVENTS = "agent",
+  STAGE_RESULT = "stage_result",
 }
 
 export type ImageData = {
@@ -63,6 +64,22 @@ export type AgentEventData = {
   text: string;
 };
 
+export type StageArtifact = {
+  name: string;
+  url: string;
+};
+
+// The output of a research stage, sent as soon as the stage finished
+export type StageResultData = {
+  stage: string;
+  workflowName: keyof typeof stores | null;
+  status: "completed" | "failed" | "reused";
+  text: string;
+  outputType: string | null; // e.g. "MarketAnalysis"
+  output: { [key: string]: JSONValue } | null;
+  artifacts: StageArtifact[];
+};
+
 export type ToolData = {
   toolCall: {
     id: string;
@@ -85,6 +102,7 @@ export type AnnotationData =
   | SourceData
   | EventData
   | AgentEventData
+  | StageResultData
   | ToolData
   | SuggestedQuestionsData;
 